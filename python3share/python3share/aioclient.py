@@ -0,0 +1,503 @@
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This library provides asyncio API for connecting to pythonshare
+# servers. It speaks the same protocol as python3share.client.
+
+"""python3share.aioclient - asyncio interface for pythonshare servers
+
+Example:
+
+conn = await python3share.aioclient.connect("localhost:8089")
+await conn.exec_in("myns", "import os")
+pid = await conn.eval_in("myns", "os.getpid()")
+await conn.close()
+"""
+
+import asyncio
+import collections
+import io
+import itertools
+import pickle
+import pickletools
+import struct
+import urllib.parse as _urlparse
+
+import python3share
+from python3share.messages import \
+    Exec, Exec_rv, Drop_ns, Ns_rv, Server_ctl, Server_ctl_rv, Data_info
+
+_READ_BLOCK_SIZE = 1024*64
+# StreamReader buffer limit. Large limit lets forwarding move large
+# blocks at a time.
+_STREAM_LIMIT = python3share._FORWARD_BLOCK_SIZE * 4
+
+# Argument lengths of pickle opcodes, indexed by opcode. Positive n
+# is a fixed length, negative n is an ArgumentDescriptor length code
+# or _PICKLE_TWO_LINES.
+_PICKLE_TWO_LINES = -100
+_PICKLE_ARG_N = {}
+for _opcode in pickletools.opcodes:
+    if _opcode.arg is None:
+        _PICKLE_ARG_N[ord(_opcode.code)] = 0
+    elif _opcode.arg.name == "stringnl_noescape_pair":
+        _PICKLE_ARG_N[ord(_opcode.code)] = _PICKLE_TWO_LINES
+    else:
+        _PICKLE_ARG_N[ord(_opcode.code)] = _opcode.arg.n
+del _opcode
+_PICKLE_LENGTH_PREFIX = {
+    pickletools.TAKEN_FROM_ARGUMENT1: (1, "<B"),
+    pickletools.TAKEN_FROM_ARGUMENT4: (4, "<i"),
+    pickletools.TAKEN_FROM_ARGUMENT4U: (4, "<I"),
+    pickletools.TAKEN_FROM_ARGUMENT8U: (8, "<Q")}
+_PICKLE_STOP = ord(pickle.STOP)
+
+def _scan_pickle(buf, pos):
+    """returns pair (end, pos). end is the offset after the STOP
+    opcode of the pickle in buf, or None if buf ends before it. pos
+    is the offset of the first opcode not scanned, scanning can
+    continue from there when more data has been received. Opcode
+    arguments are skipped without decoding them."""
+    buf_len = len(buf)
+    while pos < buf_len:
+        opcode = buf[pos]
+        arg_n = _PICKLE_ARG_N.get(opcode, None)
+        if arg_n is None:
+            return buf_len, pos # invalid pickle, loading reports it
+        if arg_n >= 0:
+            next_pos = pos + 1 + arg_n
+        elif arg_n in (pickletools.UP_TO_NEWLINE, _PICKLE_TWO_LINES):
+            next_pos = buf.find(b"\n", pos + 1) + 1
+            if next_pos and arg_n == _PICKLE_TWO_LINES:
+                next_pos = buf.find(b"\n", next_pos) + 1
+            if not next_pos:
+                break # newline not received yet
+        else:
+            prefix_len, prefix_fmt = _PICKLE_LENGTH_PREFIX[arg_n]
+            if pos + 1 + prefix_len > buf_len:
+                break
+            arg_len = struct.unpack_from(prefix_fmt, buf, pos + 1)[0]
+            if arg_len < 0:
+                return buf_len, pos # invalid pickle, loading reports it
+            next_pos = pos + 1 + prefix_len + arg_len
+        if next_pos > buf_len:
+            break # argument not received yet
+        pos = next_pos
+        if opcode == _PICKLE_STOP:
+            return pos, pos
+    return None, pos
+
+def _loads(data):
+    """returns unpickled message, or Unloadable on error"""
+    try:
+        return pickle.loads(data)
+    except pickle.UnpicklingError as e:
+        return python3share.messages.Unloadable(str(e))
+    except Exception as e:
+        return python3share.messages.Unloadable(
+            "load error %s: %s" % (type(e).__name__, e))
+
+class _MessageStream(object):
+    """Pickled messages over asyncio StreamReader and StreamWriter.
+
+    The protocol has no message length prefix: a message ends where
+    its pickle ends. Received bytes are buffered until the STOP
+    opcode of the pickle has been received.
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+        self._buf = bytearray()
+        # offset in self._buf where scanning for the end of the
+        # message continues
+        self._scan_pos = 0
+        # held when writing a message in many parts
+        self.send_lock = asyncio.Lock()
+
+    async def recv(self):
+        """returns the next message, raises EOFError on disconnect"""
+        while True:
+            end, self._scan_pos = _scan_pickle(self._buf, self._scan_pos)
+            if end is not None:
+                data = bytes(self._buf[:end])
+                del self._buf[:end]
+                self._scan_pos = 0
+                if end < python3share._SEND_OPT_MESSAGE_MIN:
+                    return _loads(data)
+                # do not block the event loop when unpickling a large
+                # message
+                return await asyncio.get_running_loop().run_in_executor(
+                    None, _loads, data)
+            self._buf += await self._read_more()
+
+    async def _read_more(self):
+        try:
+            data = await self._reader.read(
+                max(_READ_BLOCK_SIZE, len(self._buf)))
+        except OSError as e:
+            raise EOFError("socket.error: " + str(e))
+        if not data:
+            raise EOFError()
+        return data
+
+    async def read_exactly(self, length):
+        """returns next length bytes from the stream"""
+        if len(self._buf) >= length:
+            data = bytes(self._buf[:length])
+            del self._buf[:length]
+            return data
+        head, self._buf = self._buf, bytearray()
+        try:
+            data = await self._reader.readexactly(length - len(head))
+        except asyncio.IncompleteReadError:
+            raise EOFError()
+        except OSError as e:
+            raise EOFError("socket.error: " + str(e))
+        if head:
+            data = bytes(head) + data
+        return data
+
+    async def recv_reply(self):
+        """returns pair (request_id, payload message), see
+        python3share._recv_reply"""
+        msg = await self.recv()
+        if not isinstance(msg, Data_info):
+            return python3share.messages.request_id(msg), msg
+        rid = python3share.messages.request_id(msg)
+        data = io.BytesIO(await self.read_exactly(msg.data_length))
+        if msg.data_length < python3share._SEND_OPT_MESSAGE_MIN:
+            msg = python3share._decode_opt(msg, data)
+        else:
+            # do not block the event loop when decompressing and
+            # unpickling a large payload
+            msg = await asyncio.get_running_loop().run_in_executor(
+                None, python3share._decode_opt, msg, data)
+        if rid is None:
+            rid = python3share.messages.request_id(msg)
+        return rid, msg
+
+    async def forward(self, destination, data_length):
+        """forward data_length bytes to destination stream, returns
+        number of bytes sent. Reads everything from this stream even
+        if sending fails. Caller must hold destination.send_lock."""
+        bytes_sent = 0
+        bytes_read = 0
+        destination_ok = True
+        while bytes_read < data_length:
+            if self._buf:
+                block = self._buf[:data_length - bytes_read]
+                del self._buf[:len(block)]
+            else:
+                try:
+                    # returns what has been buffered, at most the limit
+                    block = await self._reader.read(
+                        min(_STREAM_LIMIT, data_length - bytes_read))
+                except OSError as e:
+                    raise EOFError("socket.error: " + str(e))
+                if not block:
+                    raise EOFError() # source run out of data
+            bytes_read += len(block)
+            if destination_ok:
+                try:
+                    destination.write(block)
+                    await destination.drain()
+                    bytes_sent += len(block)
+                except (OSError, EOFError):
+                    destination_ok = False
+                    # must still keep reading everything from the source
+        return bytes_sent
+
+    def write(self, data):
+        self._writer.write(data)
+
+    async def drain(self):
+        if self._writer.is_closing():
+            raise EOFError("connection closed")
+        try:
+            await self._writer.drain()
+        except OSError as e:
+            raise EOFError("socket.error: " + str(e))
+
+    async def send(self, msg):
+        """send one message. Many tasks may send at the same time, as
+        the message is written at once."""
+        async with self.send_lock:
+            self.write(pickle.dumps(msg, 2))
+        await self.drain()
+
+    def getpeername(self):
+        peername = self._writer.get_extra_info("peername")
+        if peername is None:
+            return ("unknown", "?")
+        return peername[:2]
+
+    async def close(self):
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except OSError:
+            pass
+
+async def _open_stream(host, port, password=None):
+    """returns _MessageStream to pythonshare server at host:port.
+    Raises AuthenticationError if password is not accepted."""
+    python3share._check_hook("before:client.socket.connect", {"host": host, "port": port})
+    reader, writer = await asyncio.open_connection(host, port,
+                                                   limit=_STREAM_LIMIT)
+    stream = _MessageStream(reader, writer)
+    if password:
+        # authenticate to server
+        await stream.send(password)
+        auth_rv = await stream.recv()
+        try:
+            auth_ok = auth_rv.success
+        except AttributeError:
+            auth_ok = False
+        if not auth_ok:
+            await stream.close()
+            raise python3share.AuthenticationError("Permission denied")
+    return stream
+
+async def _open_stream_hostspec(hostspec, password=None):
+    """returns pair (_MessageStream, namespace) to socket hostspec,
+    see connect. namespace is None if hostspec does not have it."""
+    if hostspec in python3share._PYTHONSHARE_HOSTSPECS:
+        hostspec = python3share._PYTHONSHARE_HOSTSPECS[hostspec]
+    if not "://" in hostspec:
+        hostspec = "socket://" + hostspec
+    scheme, netloc, path, _, _ = _urlparse.urlsplit(hostspec)
+    if scheme != "socket":
+        raise ValueError('invalid URI "%s", only socket:// is supported'
+                         % (hostspec,))
+    host, port, password, namespace = python3share._parse_socket_netloc(
+        netloc, path, password)
+    return await _open_stream(host, port, password), namespace
+
+async def connect(hostspec, password=None, namespace=None, codecs=None):
+    """Returns Connection to pythonshare server at hostspec.
+
+    Parameters are the same as in python3share.connect, except that
+    only socket:// hostspecs are supported.
+    """
+    stream, hostspec_namespace = await _open_stream_hostspec(hostspec, password)
+    if namespace == None:
+        namespace = hostspec_namespace or "default"
+    rv = Connection(stream, namespace, codecs)
+    rv.hostspec = hostspec
+    return rv
+
+async def open_connection(host, port, password=None, namespace="default",
+                          codecs=None):
+    """Returns Connection to pythonshare server at host:port."""
+    return Connection(await _open_stream(host, port, password), namespace,
+                      codecs)
+
+class Connection(object):
+    """asyncio connection to a Pythonshare server. Create with connect()
+    or open_connection().
+
+    Any number of tasks can send requests over the same connection
+    at the same time. Replies are read by a background task and
+    delivered to the task that is awaiting each of them.
+
+    Example: evaluate expressions in parallel on the server.
+
+    results = await asyncio.gather(
+        *[conn.eval_in("default", e, lock=False) for e in exprs])
+    """
+    def __init__(self, stream, namespace="default", codecs=None):
+        self._stream = stream
+        self.set_namespace(namespace)
+        if codecs is None:
+            codecs = python3share.default_codecs
+        self.set_codecs(codecs)
+        self._request_ids = itertools.count(1)
+        # request id -> (future, error message), in the order the
+        # requests were sent
+        self._pending = collections.OrderedDict()
+        self._reader_task = asyncio.get_running_loop().create_task(
+            self._read_replies())
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def make_local(self, rv):
+        if isinstance(rv, Exec_rv):
+            if rv.code_exc:
+                raise python3share.RemoteExecError(rv.code_exc)
+            elif rv.expr_exc:
+                raise python3share.RemoteEvalError(rv.expr_exc)
+            else:
+                rv = rv.expr_rv
+        return rv
+
+    async def _read_replies(self):
+        try:
+            while True:
+                rid, reply = await self._stream.recv_reply()
+                if rid in self._pending:
+                    future, _ = self._pending.pop(rid)
+                elif rid is None and self._pending:
+                    # old server: replies arrive in order of requests
+                    future, _ = self._pending.popitem(last=False)[1]
+                else:
+                    continue # reply to a request that nobody waits for
+                if not future.done():
+                    future.set_result(reply)
+        except EOFError:
+            pass
+        finally:
+            entries = list(self._pending.values())
+            self._pending.clear()
+            for future, errormsg in entries:
+                if not future.done():
+                    future.set_exception(python3share.PythonShareError(errormsg))
+
+    async def _request(self, msg, errormsg="No connection"):
+        """send request message, returns the reply"""
+        if self._reader_task.done():
+            raise python3share.PythonShareError(errormsg)
+        msg.request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg.request_id] = (future, errormsg)
+        try:
+            await self._stream.send(msg)
+        except (EOFError, OSError):
+            self._pending.pop(msg.request_id, None)
+            raise python3share.PythonShareError(errormsg)
+        return await future
+
+    async def exec_(self, code, **kwargs):
+        """Execute code in the default namespace.
+
+        See exec_in for optional parameters."""
+        return await self.exec_in(self._ns, code, **kwargs)
+
+    async def exec_in(self, namespace, code, expr=None, async_=False, lock=True):
+        """Execute code in a namespace.
+
+        Parameters and return values are the same as in
+        python3share.client.Connection.exec_in.
+        """
+        if namespace == None:
+            namespace = self.namespace()
+        python3share._check_hook("before:client.exec_in", {"code": code, "expr": expr, "namespace": namespace, "async_": async_, "lock": lock})
+        exec_msg = Exec(namespace, code, expr, async_=async_, lock=lock)
+        exec_msg.recv_caps = (python3share.messages.RECV_CAP_DATA_INFO |
+                              python3share.messages.RECV_CAP_COMPRESSION |
+                              python3share.messages.RECV_CAP_REQUEST_ID |
+                              self._codec_recv_caps)
+        return self.make_local(await self._request(
+            exec_msg, 'No connection to namespace "%s"' % (namespace,)))
+
+    async def eval_(self, expr, **kwargs):
+        """Evaluate expr in the default namespace.
+
+        See eval_in for optional parameters."""
+        return await self.eval_in(self._ns, expr, **kwargs)
+
+    async def eval_in(self, namespace, expr, async_=False, lock=True):
+        """Evaluate expr in a namespace.
+
+        Parameters and return values are the same as in
+        python3share.client.Connection.eval_in.
+        """
+        return await self.exec_in(namespace, "", expr, async_=async_, lock=lock)
+
+    async def read_rv(self, async_rv):
+        """Read return value of async call, see
+        python3share.client.Connection.read_rv."""
+        if isinstance(async_rv, str):
+            async_rv = eval(async_rv)
+        return await self.eval_in(async_rv.ns, "pythonshare_ns.read_rv(%s)" % (async_rv,))
+
+    async def poll_rvs(self, namespace=None):
+        """Poll available async return values from namespace."""
+        return await self.eval_in(namespace, "pythonshare_ns.poll_rvs()",
+                                  async_=False, lock=False)
+
+    async def drop_ns(self, namespace):
+        """Delete namespace from the remote peer
+
+        Returns True on success or raises an exception.
+        """
+        rv = await self._request(Drop_ns(namespace))
+        if isinstance(rv, Ns_rv) and rv.status:
+            return True
+        else:
+            raise python3share.PythonShareError(rv.errormsg)
+
+    async def unlock_ns(self, namespace):
+        """Unlock namespace on the remote peer
+
+        Returns True on success or raises an exception.
+        """
+        rv = await self._request(Server_ctl("unlock", namespace))
+        if isinstance(rv, Server_ctl_rv) and rv.status == 0:
+            return True
+        else:
+            raise python3share.PythonShareError(rv.message)
+
+    async def kill_server(self, namespace=None):
+        """Send server shutdown message"""
+        if namespace == None:
+            namespace = self.namespace()
+        # the reply, if any, is not waited for
+        await self._stream.send(Server_ctl("die", namespace))
+        return True
+
+    async def ls_local(self):
+        """List local namespaces on the server"""
+        return await self.eval_("pythonshare_ns.local_nss()")
+
+    async def ls_remote(self, **kwargs):
+        """List remote namespaces on the server"""
+        return await self.eval_("pythonshare_ns.remote_nss(%r)" % (kwargs,))
+
+    async def ns_type(self, ns):
+        return await self.eval_("pythonshare_ns.ns_type(%s)" % (repr(ns),))
+
+    async def close(self):
+        python3share._check_hook("before:client.socket.close", {"socket": self._stream._writer.get_extra_info("socket")})
+        await self._stream.close()
+        try:
+            await self._reader_task
+        except Exception:
+            pass
+
+    def namespace(self):
+        """Return default namespace"""
+        return self._ns
+
+    def set_namespace(self, ns):
+        """Set new default namespace"""
+        self._ns = ns
+
+    def codecs(self):
+        """Return codecs the server may use for return values"""
+        return list(self._codecs)
+
+    def set_codecs(self, codecs):
+        """Set codecs the server may use for return values, see
+        python3share.client.Connection.set_codecs"""
+        self._codec_recv_caps = python3share._codec_recv_caps(codecs)
+        self._codecs = list(codecs)
+
+    def getpeername(self):
+        return self._stream.getpeername()
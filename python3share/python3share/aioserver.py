@@ -0,0 +1,430 @@
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+# This library implements pythonshare server on asyncio. Connections
+# are served by one event loop thread, and code in namespaces is
+# executed in a bounded pool of worker threads. Namespaces are shared
+# with python3share.server.
+
+# pylint: disable=C0103,C0111,C0301,W0212,W0703
+
+import asyncio
+import concurrent.futures
+import os
+import pickle
+import socket
+import sys
+
+import python3share
+from python3share import aioclient, messages, server
+
+daemon_log = server.daemon_log
+
+_g_executor = None
+_g_shutdown = None # asyncio.Event, set when server is shutting down
+
+class Pythonshare_arns(object):
+    """Remote namespace behind an asyncio connection"""
+    def __init__(self, stream):
+        self.conn = stream
+        self.stream = stream
+        # held during request-reply to the remote namespace
+        self.lock = asyncio.Lock()
+
+async def _execute(func, *args):
+    """run func(*args) in the executor, returns its return value"""
+    return await asyncio.get_running_loop().run_in_executor(
+        _g_executor, func, *args)
+
+def _init_remote_namespace(ns, stream):
+    if ns in server._g_remote_namespaces:
+        raise ValueError('Remote namespace "%s" already registered' % (
+            ns,))
+    daemon_log('added remote namespace "%s", origin "%s"' % (
+        ns, stream.getpeername()))
+    server._g_remote_namespaces[ns] = Pythonshare_arns(stream)
+
+async def _drop_remote_namespace(ns):
+    daemon_log('drop remote namespace "%s"' % (ns,))
+    try:
+        rns = server._g_remote_namespaces.pop(ns)
+    except KeyError:
+        return # already dropped
+    await rns.stream.close()
+
+def _local_execute_and_encode(exec_msg, conn_id, peername):
+    """execute exec_msg in a local namespace, returns reply encoded to
+    pair (data_info, parts), see python3share._encode_opt"""
+    if messages.exec_batch(exec_msg) is not None:
+        exec_rv = server._local_execute_batch(exec_msg, conn_id)
+    else:
+        exec_rv = server._local_execute(exec_msg, conn_id)
+    return _encode_exec_rv(exec_rv, exec_msg, peername)
+
+def _encode_exec_rv(exec_rv, exec_msg, peername):
+    messages.set_request_id(exec_rv, exec_msg)
+    if server.opt_debug:
+        daemon_log("%s:%s <= %s" % (peername + (exec_rv,)))
+    try:
+        if exec_msg.recv_cap_data_info():
+            return python3share._encode_opt(exec_rv, exec_msg.recv_caps)
+        else:
+            return None, [pickle.dumps(exec_rv, 2)]
+    except (TypeError, ValueError, AttributeError,
+            pickle.PicklingError): # pickling rv fails
+        server._replace_unpicklable(exec_rv, exec_msg)
+        return None, [pickle.dumps(exec_rv, 2)]
+
+async def _send_encoded(encoded, to_client):
+    """send reply encoded by _encode_exec_rv, returns False if
+    connection to client is lost"""
+    data_info, parts = encoded
+    try:
+        async with to_client.send_lock:
+            if data_info is not None:
+                to_client.write(pickle.dumps(data_info, 2))
+            for part in parts:
+                to_client.write(part)
+            await to_client.drain()
+    except (EOFError, OSError):
+        return False
+    return True
+
+async def _local_execute_and_send(exec_msg, conn_id, to_client, peername):
+    """execute in the executor and send the reply, returns False if
+    connection to client is lost"""
+    encoded = await _execute(
+        _local_execute_and_encode, exec_msg, conn_id, peername)
+    return await _send_encoded(encoded, to_client)
+
+async def _remote_execute(ns, msg):
+    rns = server._g_remote_namespaces[ns]
+    async with rns.lock:
+        await rns.stream.send(msg)
+        # raises EOFError if disconnected, let it raise through.
+        return await rns.stream.recv()
+
+async def _remote_execute_and_forward(ns, exec_msg, to_client, peername):
+    """returns (forward_status, info), see
+    python3share.server._remote_execute_and_forward"""
+    client_supports_rv_info = exec_msg.recv_cap_data_info()
+    exec_msg.set_recv_cap_data_info(True)
+    rns = server._g_remote_namespaces[ns]
+    try:
+        async with rns.lock:
+            await rns.stream.send(exec_msg)
+            response = await rns.stream.recv()
+            if not isinstance(response, messages.Data_info):
+                # Got direct response without forward mode
+                return (None, response)
+            async with to_client.send_lock:
+                if client_supports_rv_info:
+                    messages.set_request_id(response, exec_msg)
+                    to_client.write(pickle.dumps(response, 2))
+                if server.opt_debug:
+                    daemon_log("%s:%s <= Exec_rv([forwarding %s B])" % (peername + (response.data_length,)))
+                forwarded_bytes = await rns.stream.forward(
+                    to_client, response.data_length)
+            if forwarded_bytes == response.data_length:
+                return (True, (forwarded_bytes, response.data_length))
+            else:
+                return (False, (forwarded_bytes, response.data_length))
+    finally:
+        exec_msg.set_recv_cap_data_info(client_supports_rv_info)
+
+async def _serve_exec(obj, conn_id, to_client, peername, whitelist_local,
+                      tasks):
+    """serve Exec message, returns False if connection to client
+    should be closed"""
+    ns = obj.namespace
+    if ns in server._g_remote_namespaces: # execute in remote namespace
+        try:
+            fwd_status, fwd_info = await _remote_execute_and_forward(
+                ns, obj, to_client, peername)
+        except EOFError:
+            daemon_log('connection lost to "%s"' % (ns,))
+            await _drop_remote_namespace(ns)
+            return False
+        if fwd_status == True:
+            if server.opt_debug:
+                daemon_log("%s:%s forwarded %s B" % (peername + (fwd_info[0],)))
+            return True
+        elif fwd_status == False:
+            if server.opt_debug:
+                daemon_log("%s:%s error after forwarding %s/%s B" % (peername + fwd_info))
+            return False
+        # nothing forwarded, send return value by normal means
+        return await _send_encoded(
+            _encode_exec_rv(fwd_info, obj, peername), to_client)
+    # execute in local namespace
+    if whitelist_local == None or ns in whitelist_local:
+        server._init_local_namespace(ns)
+    if getattr(obj, "async"):
+        # asynchronous execution, return handle (Async_rv)
+        server._g_async_rv_counter += 1
+        rvid = server.timestamp() + str(server._g_async_rv_counter)
+        exec_rv = messages.Async_rv(ns, rvid)
+        server._g_async_rvs[ns][rvid] = python3share.InProgress()
+        _g_executor.submit(server._local_async_execute, exec_rv, obj)
+        return await _send_encoded(
+            _encode_exec_rv(exec_rv, obj, peername), to_client)
+    elif not obj.lock and obj.recv_cap_request_id():
+        # client accepts replies out of order, keep serving while
+        # this is being executed
+        task = asyncio.get_running_loop().create_task(
+            _local_execute_and_send(obj, conn_id, to_client, peername))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return True
+    else:
+        return await _local_execute_and_send(obj, conn_id, to_client, peername)
+
+async def _serve_server_ctl(obj, to_client, peername):
+    """serve Server_ctl message, returns False if connection to client
+    should be closed"""
+    ns = obj.args[0]
+    if obj.command == "die":
+        if ns in server._g_remote_namespaces:
+            try:
+                rv = server._reply(await _remote_execute(ns, obj), obj)
+                if server.opt_debug:
+                    daemon_log("%s:%s <= %s" % (peername + (rv,)))
+                await to_client.send(rv)
+            except (EOFError, OSError): # connection lost
+                daemon_log('connection lost to "%s"' % (ns,))
+                await _drop_remote_namespace(ns)
+                return False
+            return True
+        server_ctl_rv = messages.Server_ctl_rv(0, "shutting down")
+        await to_client.send(server._reply(server_ctl_rv, obj))
+        _g_shutdown.set()
+        return False
+    elif obj.command == "unlock":
+        if ns in server._g_remote_namespaces:
+            try:
+                server_ctl_rv = await _remote_execute(ns, obj)
+            except (EOFError, OSError): # connection lost
+                daemon_log('connection lost to "%s"' % (ns,))
+                await _drop_remote_namespace(ns)
+                return False
+        elif ns in server._g_local_namespace_locks:
+            try:
+                server._g_local_namespace_locks[ns].release()
+                server_ctl_rv = messages.Server_ctl_rv(
+                    0, "%s unlocked" % (repr(ns),))
+            except RuntimeError:
+                server_ctl_rv = messages.Server_ctl_rv(
+                    1, "%s already unlocked" % (repr(ns),))
+        elif ns in server._g_local_namespaces:
+            server_ctl_rv = messages.Server_ctl_rv(
+                2, "namespace %s is not locked" % (repr(ns),))
+        else:
+            server_ctl_rv = messages.Server_ctl_rv(
+                -1, "unknown namespace %s" % (repr(ns),))
+        if server.opt_debug:
+            daemon_log("%s:%s <= %s" % (peername + (server_ctl_rv,)))
+        await to_client.send(server._reply(server_ctl_rv, obj))
+    return True
+
+async def _serve_connection(stream, conn_opts):
+    peername = stream.getpeername()
+    if server.opt_debug:
+        daemon_log("connected %s:%s" % peername)
+    conn_id = "%s-%s" % (server.timestamp(), id(stream))
+    whitelist_local = conn_opts.get("whitelist_local", None)
+    # out-of-order executions that are still running
+    tasks = set()
+    keep_stream = False
+    try:
+        if [k for k in conn_opts.keys() if k.startswith("password.")]:
+            # password authentication is required for this connection
+            try:
+                received_password = await stream.recv()
+            except Exception as e:
+                daemon_log('error receiving password: %r' % (e,))
+                return
+            auth_ok = server._password_ok(received_password, conn_opts)
+            if server.opt_debug:
+                daemon_log("%s:%s authentication %s" % (
+                    peername + (["failed", "ok"][auth_ok],)))
+            await stream.send(messages.Auth_rv(auth_ok))
+            if not auth_ok:
+                return
+        while True:
+            try:
+                obj = await stream.recv()
+                if server.opt_debug:
+                    daemon_log("%s:%s => %s" % (peername + (obj,)))
+            except EOFError:
+                break
+
+            if isinstance(obj, messages.Exec):
+                if not await _serve_exec(obj, conn_id, stream, peername,
+                                         whitelist_local, tasks):
+                    break
+
+            elif isinstance(obj, messages.Register_ns):
+                try:
+                    _init_remote_namespace(obj.ns, stream)
+                except Exception as e:
+                    await stream.send(server._reply(messages.Ns_rv(False, server.exception2string(sys.exc_info())), obj))
+                    continue
+                await stream.send(server._reply(messages.Ns_rv(True), obj))
+                # from this point on, this connection is reserved for
+                # sending remote namespace traffic.
+                keep_stream = True
+                return
+
+            elif isinstance(obj, messages.Drop_ns):
+                try:
+                    if obj.ns in server._g_local_namespaces:
+                        await _execute(server._drop_local_namespace, obj.ns)
+                    elif obj.ns in server._g_remote_namespaces:
+                        await _drop_remote_namespace(obj.ns)
+                    else:
+                        raise ValueError('Unknown namespace "%s"' % (obj.ns,))
+                    await stream.send(server._reply(messages.Ns_rv(True), obj))
+                except Exception as e:
+                    if server.opt_debug:
+                        daemon_log("namespace drop error: %s" % (e,))
+                    await stream.send(server._reply(messages.Ns_rv(False, server.exception2string(sys.exc_info())), obj))
+
+            elif isinstance(obj, messages.Request_ns):
+                ns = obj.ns
+                if (ns in server._g_remote_namespaces or
+                    ns in server._g_local_namespaces):
+                    server._register_exported_namespace(ns, stream)
+                    await stream.send(server._reply(messages.Ns_rv(True), obj))
+
+            elif isinstance(obj, messages.Server_ctl):
+                if not await _serve_server_ctl(obj, stream, peername):
+                    break
+
+            else:
+                daemon_log("unknown message type: %s in %s" % (type(obj), obj))
+                await stream.send(messages.Auth_rv(False))
+                break
+    except (EOFError, OSError):
+        pass
+    finally:
+        if not keep_stream:
+            if server.opt_debug:
+                daemon_log("disconnected %s:%s" % peername)
+            for task in list(tasks):
+                task.cancel()
+            await stream.close()
+            try:
+                await _execute(server._connection_lost, conn_id)
+            except RuntimeError:
+                pass # executor has been shut down
+
+            if conn_opts.get("kill-server-on-close", False):
+                _g_shutdown.set()
+
+async def _handle_connection(reader, writer, conn_opts):
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+    await _serve_connection(aioclient._MessageStream(reader, writer), conn_opts)
+
+async def _export_ns(ns, hostspec):
+    stream, _ = await aioclient._open_stream_hostspec(hostspec)
+    await stream.send(messages.Register_ns(ns))
+    rv = await stream.recv()
+    if not (isinstance(rv, messages.Ns_rv) and rv.status):
+        raise ValueError('Export namespace "%s" to "%s" failed'
+                         % (ns, hostspec))
+    server._register_exported_namespace(ns, stream)
+    asyncio.get_running_loop().create_task(
+        _serve_connection(stream, {"kill-server-on-close": True}))
+
+async def _import_ns(ns, hostspec):
+    if (ns in server._g_local_namespaces or
+        ns in server._g_remote_namespaces):
+        raise ValueError('Import failed, namespace "%s" already exists'
+                         % (ns,))
+    stream, _ = await aioclient._open_stream_hostspec(hostspec)
+    await stream.send(messages.Request_ns(ns))
+    rv = await stream.recv()
+    if not (isinstance(rv, messages.Ns_rv) and rv.status):
+        raise python3share.PythonShareError(rv.errormsg)
+    _init_remote_namespace(ns, stream)
+
+async def serve(host, port,
+                ns_init_import_export=[],
+                conn_opts={},
+                max_workers=None):
+    """Serve pythonshare connections at host:port until the server is
+    killed.
+
+    Parameters:
+
+      max_workers (integer, optional)
+              maximum number of threads that execute code in
+              namespaces. The default is the default of
+              concurrent.futures.ThreadPoolExecutor.
+
+    See python3share.server.start_server for other parameters.
+    """
+    global _g_executor, _g_shutdown
+    daemon_log("pid: %s" % (os.getpid(),))
+    _g_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="python3share-exec")
+    _g_shutdown = asyncio.Event()
+
+    # Initialise, import and export namespaces
+    for task, ns, arg in ns_init_import_export:
+        if task == "init":
+            server._init_local_namespace(ns, arg, force=True)
+        elif task == "export":
+            server._init_local_namespace(ns, None, force=True)
+            daemon_log('exporting "%s" to %s' % (ns, arg))
+            try:
+                await _export_ns(ns, arg)
+            except (OSError, EOFError) as e:
+                daemon_log('connecting to %s failed: %s' % (arg, e))
+                return
+        elif task == "import":
+            await _import_ns(ns, arg)
+
+    listener = await asyncio.start_server(
+        lambda reader, writer: _handle_connection(reader, writer, conn_opts),
+        host, port, reuse_address=True, backlog=1024,
+        limit=aioclient._STREAM_LIMIT)
+    for sock in listener.sockets:
+        daemon_log("listen: %s:%s" % sock.getsockname()[:2])
+    try:
+        await _g_shutdown.wait()
+        daemon_log("shutting down.")
+    finally:
+        listener.close()
+        for ns in sorted(server._g_remote_namespaces.keys()):
+            await _drop_remote_namespace(ns)
+        for ns in sorted(server._g_local_namespaces.keys()):
+            await _execute(server._drop_local_namespace, ns)
+        _g_executor.shutdown(wait=False)
+
+def start_server(host, port,
+                 ns_init_import_export=[],
+                 conn_opts={},
+                 max_workers=None):
+    """Start asyncio pythonshare server, returns when the server is
+    killed. See serve for parameters."""
+    asyncio.run(serve(host, port, ns_init_import_export, conn_opts,
+                      max_workers))
@@ -23,11 +23,15 @@
 """python3share.client - interface for executing code on pythonshare servers
 """
 
+import collections
+import concurrent.futures
+import itertools
 import socket
+import threading
 
 import python3share
 from python3share.messages import \
-    Exec, Exec_rv, Async_rv, Register_ns,\
+    Exec, Exec_batch, Exec_rv, Async_rv, Register_ns,\
     Request_ns, Drop_ns, Ns_rv, Server_ctl, Server_ctl_rv, Data_info
 from io import IOBase
 
@@ -49,9 +53,20 @@ class Connection(object):
     closing the connection:
 
     c.exec_in("goodbye", 'pythonshare_ns.exec_on_disconnect("code")')
+
+    Many threads can share the same connection. Requests are sent
+    without waiting for earlier replies, and every reply is delivered
+    to the thread that is waiting for it. Servers that support
+    request ids may send replies to lock=False calls out of order.
+    Replies from older servers arrive in order of the requests.
+
+    Example: evaluate expressions in parallel on the server.
+
+    futures = [c.eval_in_future("default", e, lock=False) for e in exprs]
+    results = [f.result() for f in futures]
     """
     def __init__(self, host_or_from_server, port_or_to_server,
-                 password=None, namespace="default"):
+                 password=None, namespace="default", codecs=None):
         """Connect to a pythonshare server
 
         The server is listening to connections at host:port, or it can be
@@ -74,8 +89,24 @@ class Connection(object):
           namespace (string, optional)
                   the default namespace that is used on eval_() and exec_().
                   The default is "default".
+
+          codecs (list of strings, optional)
+                  codecs the server may use for return values, see
+                  set_codecs(). The default is
+                  python3share.default_codecs.
         """
         self.set_namespace(namespace)
+        if codecs is None:
+            codecs = python3share.default_codecs
+        self.set_codecs(codecs)
+        self._request_ids = itertools.count(1)
+        # request id -> (future, make_local function, error message),
+        # in the order the requests were sent
+        self._pending = collections.OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader = None # None, "inline" or "thread"
+        self._batch_supported = None # unknown until the first batch
 
         if isinstance(host_or_from_server, str) and isinstance(port_or_to_server, int):
             host = host_or_from_server
@@ -119,6 +150,104 @@ class Connection(object):
                 rv = rv.expr_rv
         return rv
 
+    def _send_request(self, msg, make_local, errormsg):
+        """Send request message, returns Future of the reply"""
+        future = concurrent.futures.Future()
+        # Register and send under the same lock, so that the pending
+        # order is the sending order. Replies without request id are
+        # matched in this order.
+        with self._send_lock:
+            msg.request_id = next(self._request_ids)
+            with self._pending_lock:
+                self._pending[msg.request_id] = (future, make_local, errormsg)
+            try:
+                python3share._send(msg, self._to_server)
+            except Exception:
+                with self._pending_lock:
+                    self._pending.pop(msg.request_id, None)
+                raise
+        return future
+
+    def _start_reader(self):
+        """Start reader thread unless replies are already read"""
+        with self._pending_lock:
+            if self._reader is not None or not self._pending:
+                return
+            self._reader = "thread"
+        t = threading.Thread(target=self._read_replies,
+                             name="python3share-reader")
+        t.daemon = True
+        t.start()
+
+    def _read_replies(self, until_future=None):
+        """Read and dispatch replies until until_future is done or,
+        if not given, until there are no pending requests."""
+        try:
+            while True:
+                with self._pending_lock:
+                    if until_future is None and not self._pending:
+                        self._reader = None
+                        return
+                if until_future is not None and until_future.done():
+                    return
+                try:
+                    rid, reply = python3share._recv_reply(self._from_server)
+                except (EOFError, socket.error, ValueError) as e:
+                    self._fail_pending(e)
+                    return
+                self._dispatch(rid, reply)
+        except BaseException:
+            if until_future is None:
+                with self._pending_lock:
+                    self._reader = None
+            raise
+
+    def _dispatch(self, rid, reply):
+        with self._pending_lock:
+            if rid in self._pending:
+                entry = self._pending.pop(rid)
+            elif rid is None and self._pending:
+                # old server: replies arrive in order of requests
+                entry = self._pending.popitem(last=False)[1]
+            else:
+                return # reply to a request that nobody waits for
+        future, make_local, _ = entry
+        try:
+            future.set_result(make_local(reply))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _fail_pending(self, exc):
+        with self._pending_lock:
+            entries = list(self._pending.values())
+            self._pending.clear()
+            if self._reader == "thread":
+                self._reader = None
+        for future, _, errormsg in entries:
+            future.set_exception(python3share.PythonShareError(errormsg))
+
+    def _wait_reply(self, future):
+        """Return result of future, read replies while waiting if
+        nobody else is reading them"""
+        with self._pending_lock:
+            if self._reader is None:
+                self._reader = "inline"
+                inline = True
+            else:
+                inline = False
+        if inline:
+            try:
+                self._read_replies(until_future=future)
+            finally:
+                with self._pending_lock:
+                    self._reader = None
+                # let a thread read replies to remaining requests
+                self._start_reader()
+        return future.result()
+
+    def _request(self, msg, make_local=lambda reply: reply, errormsg="No connection"):
+        return self._wait_reply(self._send_request(msg, make_local, errormsg))
+
     def exec_(self, code, **kwargs):
         """Execute code in the default namespace.
 
@@ -156,18 +285,100 @@ class Connection(object):
         an exception in remote end, respectively.
 
         """
+        return self._wait_reply(self._exec_in_future(
+            namespace, code, expr, async_=async_, lock=lock))
+
+    def _exec_in_future(self, namespace, code, expr=None, async_=False, lock=True,
+                        make_local=None):
         if namespace == None:
             namespace = self.namespace()
         python3share._check_hook("before:client.exec_in", {"code": code, "expr": expr, "namespace": namespace, "async_": async_, "lock": lock})
+        return self._send_exec(
+            Exec(namespace, code, expr, async_=async_, lock=lock),
+            make_local or self.make_local)
+
+    def _send_exec(self, exec_msg, make_local):
+        exec_msg.recv_caps = (python3share.messages.RECV_CAP_COMPRESSION |
+                              python3share.messages.RECV_CAP_REQUEST_ID |
+                              self._codec_recv_caps)
+        errormsg = 'No connection to namespace "%s"' % (exec_msg.namespace,)
         try:
-            python3share._send(Exec(
-                namespace, code, expr, async_=async_, lock=lock,
-                recv_caps=python3share.messages.RECV_CAP_COMPRESSION), self._to_server)
-            response = python3share._recv_with_info(self._from_server)
-            return self.make_local(response)
-        except EOFError:
-            raise python3share.PythonShareError(
-                'No connection to namespace "%s"' % (namespace,))
+            return self._send_request(exec_msg, make_local, errormsg)
+        except (EOFError, socket.error, ValueError):
+            raise python3share.PythonShareError(errormsg)
+
+    def exec_in_future(self, namespace, code, expr=None, lock=True):
+        """Execute code in a namespace without waiting for the result.
+
+        Parameters are the same as in exec_in.
+
+        Returns concurrent.futures.Future. Its result() returns the
+        return value of expr or None, or raises RemoteExecError or
+        RemoteEvalError.
+        """
+        future = self._exec_in_future(namespace, code, expr, lock=lock)
+        self._start_reader()
+        return future
+
+    def eval_in_future(self, namespace, expr, lock=True):
+        """Evaluate expr in a namespace without waiting for the result.
+
+        Returns concurrent.futures.Future, see exec_in_future.
+        """
+        return self.exec_in_future(namespace, "", expr, lock=lock)
+
+    def batch(self, lock=True):
+        """Returns Batch for executing many codes and expressions in one
+        round trip.
+
+        Parameters:
+
+          lock (boolean, optional)
+                  lock each namespace from others until all
+                  consecutive operations in it have been executed.
+                  The default is True.
+
+        Example:
+
+        b = c.batch()
+        for hwnd in windows:
+            b.eval_in("win", "windowProperties(%s)" % (hwnd,))
+        properties = b.run()
+        """
+        return Batch(self, lock)
+
+    def _run_batch(self, groups, lock):
+        """Execute [(namespace, [(code, expr), ...]), ...], returns list
+        of Exec_rvs in the same order."""
+        raw = lambda reply: reply
+        if self._batch_supported == False:
+            futures = [[self._exec_in_future(ns, code, expr, lock=lock, make_local=raw)
+                        for code, expr in pairs]
+                       for ns, pairs in groups]
+        else:
+            futures = [self._send_exec(Exec_batch(ns, pairs, lock=lock), raw)
+                       for ns, pairs in groups]
+        exec_rvs = []
+        for (ns, pairs), future in zip(groups, futures):
+            if isinstance(future, list):
+                exec_rvs.extend(self._wait_reply(f) for f in future)
+                continue
+            rv = self._wait_reply(future)
+            if isinstance(rv, Exec_rv) and isinstance(rv.expr_rv, list):
+                self._batch_supported = True
+                exec_rvs.extend(rv.expr_rv)
+            elif isinstance(rv, Exec_rv) and rv.expr_rv is None and not (
+                    rv.code_exc or rv.expr_exc):
+                # server executed an empty Exec, it does not know batches
+                self._batch_supported = False
+                exec_rvs.extend(
+                    self._wait_reply(self._exec_in_future(
+                        ns, code, expr, lock=lock, make_local=raw))
+                    for code, expr in pairs)
+            else:
+                # the whole batch failed, for instance unknown namespace
+                exec_rvs.extend([rv] * len(pairs))
+        return exec_rvs
 
     def eval_(self, expr, **kwargs):
         """Evaluate expr in the default namespace.
@@ -236,8 +447,7 @@ class Connection(object):
         peer. (The remote peer accesses registered namespace through
         this connection object.)
         """
-        python3share._send(Register_ns(namespace), self._to_server)
-        rv = python3share._recv(self._from_server)
+        rv = self._request(Register_ns(namespace))
         if isinstance(rv, Ns_rv) and rv.status:
             return True
         else:
@@ -246,8 +456,7 @@ class Connection(object):
     def import_ns(self, namespace):
         """
         """
-        python3share._send(Request_ns(namespace), self._to_server)
-        rv = python3share._recv(self._from_server)
+        rv = self._request(Request_ns(namespace))
         if isinstance(rv, Ns_rv) and rv.status:
             return True
         else:
@@ -264,8 +473,7 @@ class Connection(object):
 
         Returns True on success or raises an exception.
         """
-        python3share._send(Drop_ns(namespace), self._to_server)
-        rv = python3share._recv(self._from_server)
+        rv = self._request(Drop_ns(namespace))
         if isinstance(rv, Ns_rv) and rv.status:
             return True
         else:
@@ -282,8 +490,7 @@ class Connection(object):
 
         Returns True on success or raises an exception.
         """
-        python3share._send(Server_ctl("unlock", namespace), self._to_server)
-        rv = python3share._recv(self._from_server)
+        rv = self._request(Server_ctl("unlock", namespace))
         if isinstance(rv, Server_ctl_rv) and rv.status == 0:
             return True
         else:
@@ -317,7 +524,9 @@ class Connection(object):
         """Send server shutdown message"""
         if namespace == None:
             namespace = self.namespace()
-        python3share._send(Server_ctl("die", namespace), self._to_server)
+        # the reply, if any, is not waited for
+        self._send_request(Server_ctl("die", namespace),
+                           lambda reply: reply, "No connection")
         return True
 
     def ls_local(self):
@@ -339,9 +548,97 @@ class Connection(object):
         """Set new default namespace"""
         self._ns = ns
 
+    def codecs(self):
+        """Return codecs the server may use for return values"""
+        return list(self._codecs)
+
+    def set_codecs(self, codecs):
+        """Set codecs the server may use for return values
+
+        Parameters:
+
+          codecs (list of strings)
+                  names from python3share.codecs(). Servers that do
+                  not support a codec ignore it. An empty list
+                  pickles return values with protocol 2.
+        """
+        self._codec_recv_caps = python3share._codec_recv_caps(codecs)
+        self._codecs = list(codecs)
+
     def getpeername(self):
         if self._s:
             return self._s.getpeername()
         else:
             return (getattr(self._to_server, "name", None),
                     getattr(self._from_server, "name", None))
+
+class Batch(object):
+    """Collects exec and eval operations for Connection to be executed
+    in one round trip. Create with Connection.batch().
+
+    Consecutive operations in the same namespace are sent in one
+    message, and executed in order while the namespace is locked once.
+
+    Batch can be used as a context manager that runs operations when
+    the block exits. Then results are available in the results
+    attribute.
+    """
+    def __init__(self, conn, lock=True):
+        self._conn = conn
+        self._lock = lock
+        self._ops = [] # (namespace, code, expr)
+        self.results = None
+
+    def __len__(self):
+        return len(self._ops)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+
+    def exec_(self, code, expr=None):
+        """Add execution of code in the default namespace"""
+        return self.exec_in(self._conn.namespace(), code, expr)
+
+    def exec_in(self, namespace, code, expr=None):
+        """Add execution of code, and evaluation of expr if given, in
+        a namespace. Returns index of the operation in results."""
+        if namespace == None:
+            namespace = self._conn.namespace()
+        self._ops.append((namespace, code, expr))
+        return len(self._ops) - 1
+
+    def eval_(self, expr):
+        """Add evaluation of expr in the default namespace"""
+        return self.exec_in(self._conn.namespace(), "", expr)
+
+    def eval_in(self, namespace, expr):
+        """Add evaluation of expr in a namespace"""
+        return self.exec_in(namespace, "", expr)
+
+    def run(self):
+        """Execute collected operations and clear the batch.
+
+        Returns list with a result for each operation in the order
+        they were added: return value of expr (None if not given), or
+        RemoteExecError or RemoteEvalError instance if the operation
+        raised an exception. Raises PythonShareError if connection
+        is lost.
+        """
+        ops, self._ops = self._ops, []
+        groups = []
+        for namespace, code, expr in ops:
+            if groups and groups[-1][0] == namespace:
+                groups[-1][1].append((code, expr))
+            else:
+                groups.append((namespace, [(code, expr)]))
+        self.results = []
+        for exec_rv in self._conn._run_batch(groups, self._lock):
+            try:
+                self.results.append(self._conn.make_local(exec_rv))
+            except (python3share.RemoteExecError, python3share.RemoteEvalError) as e:
+                self.results.append(e)
+        return self.results
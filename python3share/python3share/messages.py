@@ -18,10 +18,15 @@
 
 # This library defines message types for pythonshare client-server
 # messaging.
+import copyreg
 import zlib
 
 RECV_CAP_DATA_INFO = 1
 RECV_CAP_COMPRESSION = 1 << 1
+RECV_CAP_REQUEST_ID = 1 << 2 # replies may arrive out of order
+RECV_CAP_RAW_BYTES = 1 << 3 # bytes and bytearray rvs may be sent as raw data
+RECV_CAP_PICKLE5 = 1 << 4 # pickle protocol 5 with out-of-band buffers
+RECV_CAP_UPICKLE = 1 << 5 # upickle for rvs of built-in types
 
 MSG_STRING_FIELD_MAX_LEN = 1024
 
@@ -29,6 +34,20 @@ def crc(s):
     """returns crc32 as an 8-character hex for a string"""
     return hex(zlib.crc32(s.encode()) & 0xffffffff)[2:].zfill(8)
 
+def request_id(msg):
+    """returns request id of a request or a reply, None if not present"""
+    # Messages from old pythonshare peers do not have request ids.
+    return getattr(msg, "request_id", None)
+
+def set_request_id(reply, request):
+    """copy request id from request to reply"""
+    rid = request_id(request)
+    if rid is not None:
+        try:
+            reply.request_id = rid
+        except AttributeError:
+            pass # reply is not a message object
+
 class Unpicklable(object):
     def __init__(self, obj):
         self._string = str(obj)
@@ -53,13 +72,15 @@ class Auth_rv(object):
             repr(self.success), repr(self.errormsg))
 
 class Exec(object):
-    def __init__(self, namespace, code, expr, lock=True, async_=False, recv_caps=0):
+    def __init__(self, namespace, code, expr, lock=True, async_=False, recv_caps=0,
+                 request_id=None):
         self.namespace = namespace
         self.code = code
         self.expr = expr
         self.lock = lock
         setattr(self, 'async', async_)
         self.recv_caps = recv_caps # capabilities of the receiver of the Exec_rv
+        self.request_id = request_id # echoed in the reply
     def recv_cap_data_info(self):
         """returns True if Exec can be responded with Data_info+Exec_rv"""
         # If this class has been unpickled from old pythonshare connection,
@@ -73,18 +94,52 @@ class Exec(object):
             self.recv_caps = current_caps | RECV_CAP_DATA_INFO
         elif self.recv_cap_data_info(): # set to false
             self.recv_caps = current_caps - RECV_CAP_DATA_INFO
+    def recv_cap_request_id(self):
+        """returns True if Exec_rv can be sent out of order"""
+        return bool(self.recv_cap_data_info() & RECV_CAP_REQUEST_ID and
+                    request_id(self) is not None)
     def __str__(self):
         self.recv_cap_data_info() # make sure recv_caps exist
         return ('Exec(namespace=%r, code=%r, expr=%r, '
-                'lock=%r, async=%r, recv_caps=%r)' % (
+                'lock=%r, async=%r, recv_caps=%r, request_id=%r)' % (
                     self.namespace, self.code, self.expr,
-                    self.lock, getattr(self, "async"), self.recv_caps))
+                    self.lock, getattr(self, "async"), self.recv_caps,
+                    request_id(self)))
+
+class Exec_batch(Exec):
+    """Many code/expr executions in one namespace in one round trip.
+
+    batch is a list of (code, expr) pairs. They are executed in order,
+    and the namespace is locked only once for the whole batch. The
+    reply is Exec_rv whose expr_rv is a list of Exec_rvs, one for each
+    pair.
+
+    Exec_batch is pickled as Exec with a batch attribute. Servers
+    without batch support execute it as an empty Exec and reply
+    expr_rv None, which tells the client to send the pairs one by one.
+    """
+    def __init__(self, namespace, batch, lock=True, recv_caps=0, request_id=None):
+        Exec.__init__(self, namespace, "", None, lock=lock,
+                      recv_caps=recv_caps, request_id=request_id)
+        self.batch = batch
+    def __reduce_ex__(self, protocol):
+        return (copyreg._reconstructor, (Exec, object, None), self.__dict__)
+    def __str__(self):
+        return ('Exec_batch(namespace=%r, batch=%r, lock=%r, recv_caps=%r, '
+                'request_id=%r)' % (
+                    self.namespace, self.batch, self.lock, self.recv_caps,
+                    request_id(self)))
+
+def exec_batch(exec_msg):
+    """returns list of (code, expr) pairs if exec_msg is Exec_batch"""
+    return getattr(exec_msg, "batch", None)
 
 class Exec_rv(object):
-    def __init__(self, code_exc, expr_exc, expr_rv):
+    def __init__(self, code_exc, expr_exc, expr_rv, request_id=None):
         self.code_exc = code_exc
         self.expr_exc = expr_exc
         self.expr_rv = expr_rv
+        self.request_id = request_id
     def __str__(self):
         rv = self.expr_rv
         if not MSG_STRING_FIELD_MAX_LEN is None and isinstance(rv, str):
@@ -98,14 +153,24 @@ class Exec_rv(object):
 # Data_info messages precede large data transmissions (for example
 # before large Exec_rv:s) to allow hubs and senders/receivers optimize
 # their behavior.
+#
+# buffers lists (length, writable) pairs of pickle protocol 5
+# out-of-band buffers. They follow the pickle in the data, and
+# data_length includes them.
 class Data_info(object):
-    def __init__(self, data_type, data_length, data_format):
+    def __init__(self, data_type, data_length, data_format, buffers=None):
         self.data_type = data_type
         self.data_length = data_length
         self.data_format = data_format
+        if buffers:
+            self.buffers = buffers
     def __str__(self):
-        return 'Data_info(data_type=%r, data_length=%r, data_format=%r)' % (
-            self.data_type, self.data_length, self.data_format)
+        if getattr(self, "buffers", None):
+            buffers_str = ", buffers=%r" % (self.buffers,)
+        else:
+            buffers_str = ""
+        return 'Data_info(data_type=%r, data_length=%r, data_format=%r%s)' % (
+            self.data_type, self.data_length, self.data_format, buffers_str)
 
 class Async_rv(object):
     def __init__(self, ns=None, rvid=None):
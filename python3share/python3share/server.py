@@ -322,6 +322,27 @@ def _local_execute(exec_msg, conn_id=None):
     else:
         return messages.Exec_rv(code_exc, expr_exc, expr_rv)
 
+def _local_execute_batch(exec_msg, conn_id=None):
+    """execute (code, expr) pairs of Exec_batch, lock the namespace
+    only once"""
+    ns = exec_msg.namespace
+    if not ns in _g_local_namespaces:
+        code_exc = expr_exc = "no local namespace %s" % (ns,)
+        return messages.Exec_rv(code_exc, expr_exc, None)
+    lock = _g_local_namespace_locks[ns]
+    if exec_msg.lock:
+        lock.acquire()
+    try:
+        rvs = [_local_execute(messages.Exec(ns, code, expr, lock=False), conn_id)
+               for code, expr in messages.exec_batch(exec_msg)]
+    finally:
+        if exec_msg.lock:
+            try:
+                lock.release()
+            except _thread.error:
+                pass # already unlocked namespace
+    return messages.Exec_rv(None, None, rvs)
+
 def _local_async_execute(async_rv, exec_msg):
     exec_rv = _local_execute(exec_msg)
     _g_async_rvs[exec_msg.namespace][async_rv.rvid] = exec_rv
@@ -363,7 +384,9 @@ def _remote_execute_and_forward(ns, exec_msg, to_client, peername=None):
             return (None, response)
         python3share._acquire_send_lock(to_client)
         if client_supports_rv_info:
-            # send data_info to client
+            # send data_info to client, tagged with client's request
+            # id as the forwarded payload is not unpickled here
+            messages.set_request_id(response, exec_msg)
             python3share._send(response, to_client, acquire_send_lock=False)
         try:
             if opt_debug and peername:
@@ -382,6 +405,63 @@ def _remote_execute_and_forward(ns, exec_msg, to_client, peername=None):
         exec_msg.set_recv_cap_data_info(client_supports_rv_info)
         python3share._release_recv_lock(from_remote)
 
+def _reply(reply, request):
+    """returns reply tagged with the request id of request"""
+    messages.set_request_id(reply, request)
+    return reply
+
+def _replace_unpicklable(exec_rv, exec_msg):
+    """replace unpicklable expr_rv of exec_rv with Unpicklable. Only
+    failing results of a batch reply are replaced."""
+    if (messages.exec_batch(exec_msg) is not None and
+            isinstance(exec_rv.expr_rv, list)):
+        for item_rv in exec_rv.expr_rv:
+            try:
+                pickle.dumps(item_rv.expr_rv, 2)
+            except (TypeError, ValueError, AttributeError,
+                    pickle.PicklingError):
+                item_rv.expr_rv = messages.Unpicklable(item_rv.expr_rv)
+    else:
+        exec_rv.expr_rv = messages.Unpicklable(exec_rv.expr_rv)
+
+def _send_exec_rv(exec_rv, exec_msg, to_client, peername):
+    """send reply to Exec, returns False if connection to client is lost"""
+    messages.set_request_id(exec_rv, exec_msg)
+    if opt_debug:
+        daemon_log("%s:%s <= %s" % (peername + (exec_rv,)))
+    try:
+        try:
+            if exec_msg.recv_cap_data_info():
+                info = python3share._send_opt(exec_rv, to_client, exec_msg.recv_caps)
+                if info:
+                    sent_info = " %s B, format:%s" % (
+                        info.data_length, info.data_format)
+                else:
+                    sent_info = ""
+            else:
+                python3share._send(exec_rv, to_client)
+                sent_info = ""
+            if opt_debug:
+                daemon_log("%s:%s sent%s" % (peername + (sent_info,)))
+        except (EOFError, socket.error):
+            return False
+    except (TypeError, ValueError, AttributeError,
+            pickle.PicklingError): # pickling rv fails
+        _replace_unpicklable(exec_rv, exec_msg)
+        try:
+            python3share._send(exec_rv, to_client)
+        except (EOFError, socket.error):
+            return False
+    return True
+
+def _local_execute_and_send(exec_msg, conn_id, to_client, peername):
+    """execute and reply without blocking the serving thread"""
+    if messages.exec_batch(exec_msg) is not None:
+        exec_rv = _local_execute_batch(exec_msg, conn_id)
+    else:
+        exec_rv = _local_execute(exec_msg, conn_id)
+    _send_exec_rv(exec_rv, exec_msg, to_client, peername)
+
 def _connection_lost(conn_id, *closables):
     if closables:
         python3share._close(*closables)
@@ -394,6 +474,22 @@ def _connection_lost(conn_id, *closables):
     except KeyError:
         pass
 
+def _password_ok(received_password, conn_opts):
+    """returns True if received_password matches any password in
+    conn_opts"""
+    passwords = [k for k in conn_opts.keys() if k.startswith("password.")]
+    for password_type in passwords:
+        algorithm = password_type.split(".")[1]
+        if type(received_password) == str:
+            if (algorithm == "plaintext" and
+                received_password == conn_opts[password_type]):
+                return True
+            elif (hasattr(hashlib, algorithm) and
+                  getattr(hashlib, algorithm)(received_password).hexdigest() ==
+                  conn_opts[password_type]):
+                return True
+    return False
+
 def _serve_connection(conn, conn_opts):
     global _g_async_rv_counter
     global _g_server_shutdown
@@ -420,16 +516,7 @@ def _serve_connection(conn, conn_opts):
         except Exception as e:
             daemon_log('error receiving password: %r' % (e,))
             received_password = None
-        for password_type in passwords:
-            algorithm = password_type.split(".")[1]
-            if type(received_password) == str:
-                if (algorithm == "plaintext" and
-                    received_password == conn_opts[password_type]):
-                    auth_ok = True
-                elif (hasattr(hashlib, algorithm) and
-                      getattr(hashlib, algorithm)(received_password).hexdigest() ==
-                      conn_opts[password_type]):
-                    auth_ok = True
+        auth_ok = _password_ok(received_password, conn_opts)
         try:
             if auth_ok:
                 python3share._send(messages.Auth_rv(True), to_client)
@@ -458,13 +545,13 @@ def _serve_connection(conn, conn_opts):
         if isinstance(obj, messages.Register_ns):
             try:
                 _init_remote_namespace(obj.ns, conn, to_client, from_client)
-                python3share._send(messages.Ns_rv(True), to_client)
+                python3share._send(_reply(messages.Ns_rv(True), obj), to_client)
                 # from this point on, this connection is reserved for
                 # sending remote namespace traffic. The connection will be
                 # used by other threads, this thread stops here.
                 return
             except Exception as e:
-                python3share._send(messages.Ns_rv(False, exception2string(sys.exc_info())), to_client)
+                python3share._send(_reply(messages.Ns_rv(False, exception2string(sys.exc_info())), obj), to_client)
 
         elif isinstance(obj, messages.Drop_ns):
             try:
@@ -474,18 +561,18 @@ def _serve_connection(conn, conn_opts):
                     _drop_remote_namespace(obj.ns)
                 else:
                     raise ValueError('Unknown namespace "%s"' % (obj.ns,))
-                python3share._send(messages.Ns_rv(True), to_client)
+                python3share._send(_reply(messages.Ns_rv(True), obj), to_client)
             except Exception as e:
                 if opt_debug:
                     daemon_log("namespace drop error: %s" % (e,))
-                python3share._send(messages.Ns_rv(False, exception2string(sys.exc_info())), to_client)
+                python3share._send(_reply(messages.Ns_rv(False, exception2string(sys.exc_info())), obj), to_client)
 
         elif isinstance(obj, messages.Request_ns):
             ns = obj.ns
             if (ns in _g_remote_namespaces or
                 ns in _g_local_namespaces):
                 _register_exported_namespace(ns, conn)
-                python3share._send(messages.Ns_rv(True), to_client)
+                python3share._send(_reply(messages.Ns_rv(True), obj), to_client)
                 # from this point on, this connection is reserved for
                 # receiving executions on requested namespace. This
                 # thread starts serving the connection.
@@ -523,41 +610,27 @@ def _serve_connection(conn, conn_opts):
                     exec_rv = messages.Async_rv(ns, rvid)
                     _g_async_rvs[ns][rvid] = python3share.InProgress()
                     _thread.start_new_thread(_local_async_execute, (exec_rv, obj))
+                elif not obj.lock and obj.recv_cap_request_id():
+                    # client accepts replies out of order, keep
+                    # serving while this is being executed
+                    exec_rv = None
+                    _thread.start_new_thread(_local_execute_and_send,
+                                             (obj, conn_id, to_client, peername))
+                elif messages.exec_batch(obj) is not None:
+                    exec_rv = _local_execute_batch(obj, conn_id)
                 else:
                     # synchronous execution, return true return value
                     exec_rv = _local_execute(obj, conn_id)
             if not exec_rv is None:
-                if opt_debug:
-                    daemon_log("%s:%s <= %s" % (peername + (exec_rv,)))
-                try:
-                    try:
-                        if obj.recv_cap_data_info():
-                            info = python3share._send_opt(exec_rv, to_client, obj.recv_caps)
-                            if info:
-                                sent_info = " %s B, format:%s" % (
-                                    info.data_length, info.data_format)
-                            else:
-                                sent_info = ""
-                        else:
-                            python3share._send(exec_rv, to_client)
-                            sent_info = ""
-                        if opt_debug:
-                            daemon_log("%s:%s sent%s" % (peername + (sent_info,)))
-                    except (EOFError, socket.error):
-                        break
-                except (TypeError, ValueError, pickle.PicklingError): # pickling rv fails
-                    exec_rv.expr_rv = messages.Unpicklable(exec_rv.expr_rv)
-                    try:
-                        python3share._send(exec_rv, to_client)
-                    except (EOFError, socket.error):
-                        break
+                if not _send_exec_rv(exec_rv, obj, to_client, peername):
+                    break
 
         elif isinstance(obj, messages.Server_ctl):
             if obj.command == "die":
                 ns = obj.args[0]
                 if ns in _g_remote_namespaces:
                     try:
-                        rv = _remote_execute(ns, obj)
+                        rv = _reply(_remote_execute(ns, obj), obj)
                         if opt_debug:
                             daemon_log("%s:%s <= %s" % (peername + (rv,)))
                         python3share._send(rv, to_client)
@@ -568,7 +641,7 @@ def _serve_connection(conn, conn_opts):
                 else:
                     _g_server_shutdown = True
                     server_ctl_rv = messages.Server_ctl_rv(0, "shutting down")
-                    python3share._send(server_ctl_rv, to_client)
+                    python3share._send(_reply(server_ctl_rv, obj), to_client)
                     if _g_wake_server_function:
                         _g_wake_server_function()
                     break
@@ -599,7 +672,7 @@ def _serve_connection(conn, conn_opts):
                             -1, "unknown namespace %s" % (repr(ns),))
                     if opt_debug:
                         daemon_log("%s:%s <= %s" % (peername + (server_ctl_rv,)))
-                    python3share._send(server_ctl_rv, to_client)
+                    python3share._send(_reply(server_ctl_rv, obj), to_client)
                 except Exception as e:
                     if opt_debug:
                         daemon_log("Exception in handling %s: %s" % (obj, e))
@@ -713,7 +786,7 @@ def start_server(host, port,
 
 def start_daemon(host="localhost", port=8089, debug=False,
                  log_fd=None, ns_init_import_export=[], conn_opts={},
-                 debug_limit=None):
+                 debug_limit=None, use_asyncio=False, max_workers=None):
     global opt_log_fd, opt_debug, opt_debug_limit
     opt_log_fd = log_fd
     opt_debug = debug
@@ -762,4 +835,9 @@ def start_daemon(host="localhost", port=8089, debug=False,
     else:
         listen_stdin = True
 
-    start_server(host, port, ns_init_import_export, conn_opts, listen_stdin)
+    if use_asyncio and isinstance(port, int):
+        from python3share import aioserver
+        aioserver.start_server(host, port, ns_init_import_export, conn_opts,
+                               max_workers)
+    else:
+        start_server(host, port, ns_init_import_export, conn_opts, listen_stdin)
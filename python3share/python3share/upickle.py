@@ -18,6 +18,7 @@
 
 # This library provides size-optimized (de)serializer for Python built-in types.
 
+import math
 import struct
 
 def _size_val_data(i):
@@ -78,6 +79,30 @@ def _count(b, bs):
             count = struct.unpack('<Q', len_s)[0]
     return count, data_used
 
+def supports(ds):
+    """Returns True if loads(dumps(ds)) restores ds exactly: only
+    None, bool, int, float, bytes, str, set, tuple, list and dict
+    are supported, ints must fit in 64 bits and floats in 32 bits."""
+    ds_type = type(ds)
+    if ds_type in (type(None), bool, bytes, str):
+        return True
+    elif ds_type is int:
+        return -2**63 <= ds <= 2**63-1
+    elif ds_type is float:
+        try:
+            if struct.unpack('<f', struct.pack('<f', ds))[0] != ds:
+                return False
+        except OverflowError:
+            return False
+        # -0.0 would be loaded as 0.0
+        return ds != 0.0 or math.copysign(1.0, ds) > 0
+    elif ds_type in (set, tuple, list):
+        return all(supports(ds_elt) for ds_elt in ds)
+    elif ds_type is dict:
+        return all(supports(ds_key) and supports(ds_value)
+                   for ds_key, ds_value in ds.items())
+    return False
+
 def dumps(ds):
     # 0000 0000 reserved
     # -- NoneType
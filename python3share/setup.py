@@ -11,6 +11,9 @@ setup(name         = 'python3share',
       scripts      = ['python3share-client', 'python3share-server'],
       package_data = {'python3share': ['__init__.py',
                                       'client.py',
+                                      'aioclient.py',
+                                      'aioserver.py',
                                       'messages.py',
-                                      'server.py']}
+                                      'server.py',
+                                      'upickle.py']}
 )
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Measure asyncio server with many idle connections
+
+Usage: aio_idle_connections.py [CONNECTIONS [PORT]]
+
+Starts python3share-server --asyncio from the parent directory, opens
+CONNECTIONS (default 2000) idle connections to it, and prints the
+thread count of the server process and the time of eval round trips
+through python3share.aioclient while the connections are open.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+import python3share.aioclient
+
+def thread_count(pid):
+    try:
+        for line in open("/proc/%s/status" % (pid,)):
+            if line.startswith("Threads:"):
+                return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+async def connect(port, timeout=10.0):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return await python3share.aioclient.connect(
+                "127.0.0.1:%s" % (port,))
+        except OSError:
+            if time.time() > end_time:
+                raise
+            await asyncio.sleep(0.1)
+
+async def measure(server, connections, port):
+    conn = await connect(port)
+    await conn.exec_("x = 0")
+    idle = []
+    for _ in range(connections):
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        idle.append(writer)
+    # let the server accept everything
+    await conn.eval_("x")
+
+    start = time.time()
+    for i in range(100):
+        await conn.eval_("x + %s" % (i,))
+    sequential_time = time.time() - start
+
+    start = time.time()
+    await asyncio.gather(*[conn.eval_("x + %s" % (i,)) for i in range(100)])
+    gathered_time = time.time() - start
+
+    print("idle connections:       %s" % (len(idle),))
+    print("server threads:         %s" % (thread_count(server.pid),))
+    print("100 sequential evals:   %.3f s" % (sequential_time,))
+    print("100 gathered evals:     %.3f s" % (gathered_time,))
+    for writer in idle:
+        writer.close()
+    await conn.close()
+
+def main(connections, port):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(PS_DIR, "python3share-server"),
+         "-d", "--asyncio", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    try:
+        asyncio.run(measure(server, connections, port))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    connections = 2000
+    port = 18766
+    if len(sys.argv) > 1:
+        connections = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    main(connections, port)
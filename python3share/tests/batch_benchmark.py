@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Compare unbatched and batched eval round trips over loopback
+
+Usage: batch_benchmark.py [CALLS [PORT]]
+
+Starts python3share-server from the parent directory, evaluates CALLS
+(default 1000) small expressions one by one and then in a single
+batch, and prints the timings.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+
+def connect(port, timeout=10.0):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return python3share.connect("127.0.0.1:%s" % (port,))
+        except Exception:
+            if time.time() > end_time:
+                raise
+            time.sleep(0.1)
+
+def main(calls, port):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(PS_DIR, "python3share-server"),
+         "-d", "-p", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    try:
+        conn = connect(port)
+        conn.exec_("x = 0")
+
+        start = time.time()
+        unbatched = [conn.eval_("x + %s" % (i,)) for i in range(calls)]
+        unbatched_time = time.time() - start
+
+        start = time.time()
+        with conn.batch() as b:
+            for i in range(calls):
+                b.eval_("x + %s" % (i,))
+        batched = b.results
+        batched_time = time.time() - start
+
+        conn.close()
+        if unbatched != batched:
+            raise Exception("batched results differ from unbatched")
+        print("%s evals unbatched: %.3f s (%.1f us/call)" % (
+            calls, unbatched_time, unbatched_time / calls * 1e6))
+        print("%s evals batched:   %.3f s (%.1f us/call)" % (
+            calls, batched_time, batched_time / calls * 1e6))
+        print("speedup:            %.1fx" % (unbatched_time / batched_time,))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    calls = 1000
+    port = 18765
+    if len(sys.argv) > 1:
+        calls = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        port = int(sys.argv[2])
+    main(calls, port)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Measure throughput of large Exec_rvs directly and through a hub
+
+Usage: forward_benchmark.py [--asyncio] [MB [ROUNDS [PORT]]]
+
+Starts a hub server and a worker server that exports namespace
+"worker" to the hub. Evaluates a random MB megabyte
+(default 5, 10 and 25) bytes object ROUNDS times (default 5) directly
+from the worker and through the hub, and prints the throughput when
+return values are pickled with protocol 2 and when they are sent with
+the default codecs. Random data is not compressed on the way. Throughput of the hub
+forwarding step alone is measured in this process. With --asyncio the hub is
+python3share.aioserver.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+
+def connect(hostspec, timeout=10.0):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return python3share.connect(hostspec)
+        except Exception:
+            if time.time() > end_time:
+                raise
+            time.sleep(0.1)
+
+def start_server(module, port, ns_init_import_export=[]):
+    """start server without debug mode in the foreground, because debug
+    logging of large return values would dominate the measurement"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = PS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    code = ("import python3share.%s as server; "
+            "server.start_server('127.0.0.1', %s, %r)" % (
+                module, port, ns_init_import_export))
+    if module == "server":
+        code = code[:-1] + ", listen_stdin=False)"
+    return subprocess.Popen([sys.executable, "-c", code], env=env)
+
+def measure(conn, namespace, size, rounds):
+    conn.exec_in(namespace, "import os; blob = os.urandom(%s)" % (size,))
+    start = time.time()
+    for _ in range(rounds):
+        if len(conn.eval_in(namespace, "blob")) != size:
+            raise Exception("wrong size")
+    return size * rounds / (time.time() - start) / 1024.0 / 1024.0
+
+def measure_forward(size, rounds):
+    """measure python3share._forward alone, as used by a hub, between
+    local socket pairs"""
+    exec_rv = python3share.messages.Exec_rv(None, None, os.urandom(size))
+    data_info, parts = python3share._encode_opt(exec_rv, 0)
+    data = parts[0]
+    from_remote, remote = socket.socketpair()
+    to_client, client = socket.socketpair()
+    def send_rounds():
+        for _ in range(rounds):
+            remote.sendall(data)
+    def recv_rounds():
+        buf = bytearray(python3share._FORWARD_BLOCK_SIZE)
+        left = len(data) * rounds
+        while left > 0:
+            left -= client.recv_into(buf, min(len(buf), left))
+    threads = [threading.Thread(target=send_rounds),
+               threading.Thread(target=recv_rounds)]
+    for t in threads:
+        t.start()
+    source = from_remote.makefile("rb")
+    destination = to_client.makefile("wb")
+    start = time.time()
+    for _ in range(rounds):
+        python3share._forward(source, destination, len(data))
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    python3share._close(source, destination, from_remote, remote,
+                        to_client, client)
+    return len(data) * rounds / elapsed / 1024.0 / 1024.0
+
+def main(hub_module, sizes_mb, rounds, port):
+    hub_spec = "127.0.0.1:%s" % (port,)
+    hub = start_server(hub_module, port)
+    workers = []
+    try:
+        hub_conn = connect(hub_spec)
+        worker = start_server("server", port + 1,
+                              [("export", "worker", hub_spec)])
+        workers.append(worker)
+        worker_conn = connect("127.0.0.1:%s" % (port + 1,))
+        while not "worker" in hub_conn.ls_remote():
+            time.sleep(0.1)
+        for size_mb in sizes_mb:
+            size = int(size_mb * 1024 * 1024)
+            print("%5s MB Exec_rv: hub forwarding alone %7.1f MB/s" % (
+                size_mb, measure_forward(size, rounds)))
+            for codecs in ([], python3share.default_codecs):
+                worker_conn.set_codecs(codecs)
+                hub_conn.set_codecs(codecs)
+                direct = measure(worker_conn, "worker", size, rounds)
+                forwarded = measure(hub_conn, "worker", size, rounds)
+                print("    codecs %-16s direct %7.1f MB/s, through hub %7.1f MB/s" % (
+                    ",".join(codecs) or "-", direct, forwarded))
+        hub_conn.close()
+        worker_conn.close()
+    finally:
+        for p in [hub] + workers:
+            p.terminate()
+            p.wait()
+
+if __name__ == "__main__":
+    hub_module = "server"
+    args = sys.argv[1:]
+    if args and args[0] == "--asyncio":
+        hub_module = "aioserver"
+        args = args[1:]
+    sizes_mb = [5, 10, 25]
+    rounds = 5
+    port = 18767
+    if len(args) > 0:
+        sizes_mb = [float(args[0])]
+    if len(args) > 1:
+        rounds = int(args[1])
+    if len(args) > 2:
+        port = int(args[2])
+    main(hub_module, sizes_mb, rounds, port)
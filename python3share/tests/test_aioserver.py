@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Tests for python3share.aioserver and python3share.aioclient
+
+Usage: test_aioserver.py [unittest options]
+
+Starts python3share.aioserver from the parent directory on port 18768.
+"""
+
+import asyncio
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+import python3share.aioclient
+
+PORT = 18768
+TIMEOUT = 10.0
+
+def connect(port, timeout=TIMEOUT):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return python3share.connect("127.0.0.1:%s" % (port,))
+        except Exception:
+            if time.time() > end_time:
+                raise
+            time.sleep(0.1)
+
+loads = []
+
+def count_load(value):
+    loads.append(value)
+    return value
+
+class CountedLoad(object):
+    """unpickles to value, appends value to loads on every load"""
+    def __init__(self, value):
+        self.value = value
+    def __reduce__(self):
+        return (count_load, (self.value,))
+
+class MessageStreamTest(unittest.TestCase):
+    def recv_all(self, data, piece_size):
+        async def recv():
+            reader = asyncio.StreamReader()
+            stream = python3share.aioclient._MessageStream(reader, None)
+            async def feed():
+                for start in range(0, len(data), piece_size):
+                    reader.feed_data(data[start:start + piece_size])
+                    await asyncio.sleep(0)
+                reader.feed_eof()
+            feeder = asyncio.ensure_future(feed())
+            msgs = []
+            try:
+                while True:
+                    msgs.append(await stream.recv())
+            except EOFError:
+                pass
+            await feeder
+            return msgs
+        return asyncio.run(asyncio.wait_for(recv(), TIMEOUT))
+
+    def test_large_message_unpickled_once(self):
+        del loads[:]
+        msg = [list(range(i, i + 100)) for i in range(5000)]
+        msg.append(CountedLoad("large"))
+        data = (pickle.dumps(msg, 2) +
+                pickle.dumps(CountedLoad("small"), 2) +
+                pickle.dumps(("x" * 300000, 42), 4))
+        for piece_size in (1000, 65536, len(data)):
+            del loads[:]
+            msgs = self.recv_all(data, piece_size)
+            self.assertEqual(msgs, [msg[:-1] + ["large"], "small",
+                                    ("x" * 300000, 42)])
+            self.assertEqual(loads, ["large", "small"])
+
+    def test_invalid_message(self):
+        msgs = self.recv_all(b"\xff" + pickle.dumps(1, 2), 10)
+        self.assertEqual(len(msgs), 1)
+        self.assertIsInstance(msgs[0], python3share.messages.Unloadable)
+
+class AioServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = PS_DIR + os.pathsep + env.get("PYTHONPATH", "")
+        cls.server = subprocess.Popen(
+            [sys.executable, "-c",
+             "import python3share.aioserver as server; "
+             "server.start_server('127.0.0.1', %s, [])" % (PORT,)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+        connect(PORT).close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, TIMEOUT))
+
+    def test_request_sent_in_pieces(self):
+        # The server must not wait for more data than the sender sends
+        # after the first attempt to unpickle a partial message.
+        for size, pieces in ((100000, (70000,)),
+                             (300000, (65536, 150000, 250000))):
+            data = pickle.dumps(python3share.messages.Exec(
+                "default", None, "len(%r)" % ("p" * size,)), 2)
+            s = socket.create_connection(("127.0.0.1", PORT))
+            s.settimeout(TIMEOUT)
+            start = 0
+            for end in pieces + (len(data),):
+                s.sendall(data[start:end])
+                start = end
+                time.sleep(0.2)
+            rv = python3share._recv(s.makefile("rb"))
+            s.close()
+            self.assertEqual(rv.expr_rv, size)
+
+    def test_large_requests(self):
+        async def evals():
+            conn = await python3share.aioclient.connect(
+                "127.0.0.1:%s" % (PORT,))
+            try:
+                return [await conn.eval_("len(%r)" % ("a" * size,))
+                        for size in (100000, 300000, 5000000)]
+            finally:
+                await conn.close()
+        self.assertEqual(self.run_async(evals()), [100000, 300000, 5000000])
+
+    def test_large_request_from_sync_client(self):
+        results = []
+        def evals():
+            conn = connect(PORT)
+            results.append(conn.eval_("len(%r)" % ("b" * 300000,)))
+            with conn.batch() as b:
+                for i in range(20000):
+                    b.eval_("%s + 1" % (i,))
+            results.append(b.results == list(range(1, 20001)))
+            conn.close()
+        t = threading.Thread(target=evals)
+        t.daemon = True
+        t.start()
+        t.join(TIMEOUT)
+        self.assertFalse(t.is_alive(), "server did not reply")
+        self.assertEqual(results, [300000, True])
+
+    def test_pipelined_large_and_small_requests(self):
+        async def evals():
+            conn = await python3share.aioclient.connect(
+                "127.0.0.1:%s" % (PORT,))
+            try:
+                return await asyncio.gather(*[
+                    conn.eval_("len(%r)" % ("c" * size,), lock=False)
+                    for size in (10, 400000, 20, 200000, 30)])
+            finally:
+                await conn.close()
+        self.assertEqual(self.run_async(evals()),
+                         [10, 400000, 20, 200000, 30])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Tests for pipelined and multiplexed python3share.client.Connection
+
+Usage: test_client.py [unittest options]
+
+Starts python3share servers from the parent directory on ports
+18770-18773. Interoperability with an earlier python3share release is
+tested if PYTHON3SHARE_BASELINE is the directory that contains its
+python3share package.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+from python3share.messages import Exec_rv
+
+TIMEOUT = 10.0
+BASELINE_DIR = os.environ.get("PYTHON3SHARE_BASELINE", None)
+
+SERVER_MODULES = {
+    "threaded": "import python3share.server as server; "
+                "server.start_server('127.0.0.1', %s, [], listen_stdin=False)",
+    "aio": "import python3share.aioserver as server; "
+           "server.start_server('127.0.0.1', %s, [])"}
+
+def start_server(kind, port, ps_dir=PS_DIR):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ps_dir + os.pathsep + env.get("PYTHONPATH", "")
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_MODULES[kind] % (port,)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    connect(port).close()
+    return server
+
+def connect(port, timeout=TIMEOUT):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return python3share.connect("127.0.0.1:%s" % (port,))
+        except Exception:
+            if time.time() > end_time:
+                raise
+            time.sleep(0.1)
+
+def wait_until(condition, timeout=TIMEOUT):
+    end_time = time.time() + timeout
+    while not condition():
+        if time.time() > end_time:
+            return False
+        time.sleep(0.01)
+    return True
+
+class ClientTest(object):
+    """Tests run against every server kind"""
+    server_kind = None
+    port = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = start_server(cls.server_kind, cls.port)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.terminate()
+        cls.server.wait()
+
+    def setUp(self):
+        self.conn = connect(self.port)
+        self.conn.exec_("import time")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_out_of_order_replies(self):
+        slow = self.conn.eval_in_future(
+            "default", "time.sleep(1.0) or 'slow'", lock=False)
+        fast = self.conn.eval_in_future("default", "'fast'", lock=False)
+        self.assertEqual(fast.result(TIMEOUT), "fast")
+        self.assertFalse(slow.done())
+        self.assertEqual(self.conn.eval_("'sync'", lock=False), "sync")
+        self.assertFalse(slow.done())
+        self.assertEqual(slow.result(TIMEOUT), "slow")
+
+    def test_many_futures(self):
+        futures = [self.conn.eval_in_future(
+            "default", "time.sleep(%s) or %s" % ((i % 3) / 10.0, i), lock=False)
+                   for i in range(30)]
+        self.assertEqual([f.result(TIMEOUT) for f in futures], list(range(30)))
+        self.assertTrue(wait_until(lambda: self.conn._reader is None))
+
+    def test_inline_reader_dispatches_other_replies(self):
+        results = []
+        t = threading.Thread(target=lambda: results.append(self.conn.eval_in(
+            "default", "time.sleep(1.0) or 'inline'", lock=False)))
+        t.start()
+        self.assertTrue(wait_until(lambda: self.conn._reader == "inline"))
+        future = self.conn.eval_in_future("default", "'future'", lock=False)
+        # no reader thread is started, the inline reader reads the reply
+        self.assertEqual(self.conn._reader, "inline")
+        self.assertEqual(future.result(TIMEOUT), "future")
+        t.join(TIMEOUT)
+        self.assertEqual(results, ["inline"])
+
+    def test_inline_reader_hands_off_to_thread(self):
+        results = []
+        t = threading.Thread(target=lambda: results.append(self.conn.eval_in(
+            "default", "time.sleep(0.3) or 'inline'", lock=False)))
+        t.start()
+        self.assertTrue(wait_until(lambda: self.conn._reader == "inline"))
+        future = self.conn.eval_in_future(
+            "default", "time.sleep(1.0) or 'future'", lock=False)
+        t.join(TIMEOUT)
+        self.assertEqual(results, ["inline"])
+        # the inline reader returned, a thread reads the remaining reply
+        self.assertEqual(future.result(TIMEOUT), "future")
+        self.assertTrue(wait_until(lambda: self.conn._reader is None))
+
+    def test_sync_call_while_reader_thread_runs(self):
+        future = self.conn.eval_in_future(
+            "default", "time.sleep(0.5) or 'future'", lock=False)
+        self.assertEqual(self.conn._reader, "thread")
+        self.assertEqual(self.conn.eval_("1 + 1", lock=False), 2)
+        self.assertEqual(future.result(TIMEOUT), "future")
+        self.assertTrue(wait_until(lambda: self.conn._reader is None))
+        # replies are read inline again
+        self.assertEqual(self.conn.eval_("2 + 2"), 4)
+
+    def test_batch_with_unpicklable_results(self):
+        self.conn.exec_("import threading")
+        b = self.conn.batch()
+        b.eval_("1 + 1")
+        b.eval_("threading.Lock()")
+        b.eval_("'ok'")
+        b.eval_("(lambda: lambda: 0)()")
+        b.eval_("1 / 0")
+        results = b.run()
+        self.assertEqual(results[0], 2)
+        self.assertIsInstance(results[1], python3share.messages.Unpicklable)
+        self.assertIn("lock", str(results[1]))
+        self.assertEqual(results[2], "ok")
+        self.assertIsInstance(results[3], python3share.messages.Unpicklable)
+        self.assertIsInstance(results[4], python3share.RemoteEvalError)
+        # unpicklable result of a single eval
+        self.assertIsInstance(self.conn.eval_("threading.Lock()"),
+                              python3share.messages.Unpicklable)
+
+class ThreadedServerClientTest(ClientTest, unittest.TestCase):
+    server_kind = "threaded"
+    port = 18770
+
+class AioServerClientTest(ClientTest, unittest.TestCase):
+    server_kind = "aio"
+    port = 18771
+
+class FakeServer(threading.Thread):
+    """Server that reads requests and replies like old python3share
+    servers: in order and without request ids"""
+    def __init__(self, requests, disconnect=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.requests = requests
+        self.disconnect = disconnect
+        self.received = []
+        server_sock, self.client_sock = socket.socketpair()
+        self.from_client = server_sock.makefile("rb")
+        self.to_client = server_sock.makefile("wb")
+        self.server_sock = server_sock
+
+    def connection(self):
+        return python3share.client.Connection(
+            self.client_sock.makefile("rb"), self.client_sock.makefile("wb"))
+
+    def run(self):
+        for _ in range(self.requests):
+            self.received.append(python3share._recv(self.from_client))
+        if self.disconnect:
+            self.to_client.close()
+            self.from_client.close()
+            self.server_sock.shutdown(socket.SHUT_RDWR)
+            self.server_sock.close()
+            return
+        for request in self.received:
+            python3share._send(Exec_rv(None, None, "reply:" + request.expr),
+                               self.to_client)
+
+class OldServerTest(unittest.TestCase):
+    def test_untagged_replies_in_request_order(self):
+        server = FakeServer(4)
+        server.start()
+        conn = server.connection()
+        futures = [conn.eval_in_future("default", expr, lock=False)
+                   for expr in ("a", "b", "c")]
+        self.assertEqual(conn.eval_("d", lock=False), "reply:d")
+        self.assertEqual([f.result(TIMEOUT) for f in futures],
+                         ["reply:a", "reply:b", "reply:c"])
+        self.assertTrue(all(r.request_id for r in server.received))
+
+    def test_disconnect_fails_pending_requests(self):
+        server = FakeServer(3, disconnect=True)
+        server.start()
+        conn = server.connection()
+        futures = [conn.eval_in_future("ns%s" % (i,), "1", lock=False)
+                   for i in range(3)]
+        for i, future in enumerate(futures):
+            with self.assertRaises(python3share.PythonShareError) as cm:
+                future.result(TIMEOUT)
+            self.assertEqual(str(cm.exception),
+                             'No connection to namespace "ns%s"' % (i,))
+        self.assertEqual(conn._pending, {})
+        self.assertTrue(wait_until(lambda: conn._reader is None))
+        with self.assertRaises(python3share.PythonShareError):
+            conn.eval_("1")
+
+@unittest.skipUnless(BASELINE_DIR, "PYTHON3SHARE_BASELINE not set")
+class BaselineInteropTest(unittest.TestCase):
+    def test_new_client_baseline_server(self):
+        for kind, port in (("threaded", 18772), ("aio", 18773)):
+            if (kind == "aio" and not os.path.exists(
+                    os.path.join(BASELINE_DIR, "python3share", "aioserver.py"))):
+                continue
+            server = start_server(kind, port, BASELINE_DIR)
+            try:
+                conn = connect(port)
+                conn.exec_("import time")
+                futures = [conn.eval_in_future(
+                    "default", "time.sleep(%s) or %s" % ((3 - i) / 10.0, i),
+                    lock=False) for i in range(3)]
+                self.assertEqual(conn.eval_("b'x' * 100000", lock=False),
+                                 b"x" * 100000)
+                self.assertEqual([f.result(TIMEOUT) for f in futures],
+                                 [0, 1, 2])
+                b = conn.batch()
+                for i in range(5):
+                    b.eval_("%s * 2" % (i,))
+                self.assertEqual(b.run(), [0, 2, 4, 6, 8])
+                conn.close()
+            finally:
+                server.terminate()
+                server.wait()
+
+    def test_baseline_client_new_server(self):
+        for kind, port in (("threaded", 18772), ("aio", 18773)):
+            server = start_server(kind, port)
+            try:
+                env = dict(os.environ)
+                env["PYTHONPATH"] = BASELINE_DIR
+                output = subprocess.check_output(
+                    [sys.executable, "-c",
+                     "import python3share; "
+                     "c = python3share.connect('127.0.0.1:%s'); "
+                     "c.exec_('import time'); "
+                     "print(c.eval_('time.sleep(0.1) or 42', lock=False), "
+                     "len(c.eval_('b\"y\" * 1000000')), "
+                     "c.eval_('[1, 2.5, None]'))" % (port,)],
+                    env=env, timeout=TIMEOUT)
+                self.assertEqual(output.split(), [b"42", b"1000000",
+                                                  b"[1,", b"2.5,", b"None]"])
+            finally:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    unittest.main()
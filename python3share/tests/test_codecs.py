@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Tests for python3share return value codecs and upickle
+
+Usage: test_codecs.py [unittest options]
+
+Starts python3share servers from the parent directory on ports
+18780-18783. A new client behind an old hub is tested if
+PYTHON3SHARE_BASELINE is the directory that contains the python3share
+package of an earlier release.
+"""
+
+import io
+import math
+import os
+import pickle
+import subprocess
+import sys
+import time
+import unittest
+
+PS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PS_DIR)
+
+import python3share
+from python3share import messages, upickle
+
+TIMEOUT = 10.0
+BASELINE_DIR = os.environ.get("PYTHON3SHARE_BASELINE", None)
+
+ALL_CAPS = (messages.RECV_CAP_DATA_INFO | messages.RECV_CAP_COMPRESSION |
+            messages.RECV_CAP_REQUEST_ID |
+            python3share._codec_recv_caps(python3share.codecs()))
+
+def start_server(module, port, ns_init_import_export=[], ps_dir=PS_DIR):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ps_dir + os.pathsep + env.get("PYTHONPATH", "")
+    code = ("import python3share.%s as server; "
+            "server.start_server('127.0.0.1', %s, %r)" % (
+                module, port, ns_init_import_export))
+    if module == "server":
+        code = code[:-1] + ", listen_stdin=False)"
+    server = subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=env)
+    connect(port).close()
+    return server
+
+def connect(port, codecs=None, timeout=TIMEOUT):
+    end_time = time.time() + timeout
+    while True:
+        try:
+            return python3share.connect("127.0.0.1:%s" % (port,),
+                                        codecs=codecs)
+        except Exception:
+            if time.time() > end_time:
+                raise
+            time.sleep(0.1)
+
+class ZeroCopyByteArray(bytearray):
+    """bytearray that protocol 5 pickles out-of-band"""
+    def __reduce_ex__(self, protocol):
+        if protocol >= 5:
+            return type(self)._reconstruct, (pickle.PickleBuffer(self),), None
+        return type(self)._reconstruct, (bytearray(self),)
+
+    @classmethod
+    def _reconstruct(cls, obj):
+        with memoryview(obj) as m:
+            obj = m.obj
+            if type(obj) is cls:
+                return obj
+            return cls(obj)
+
+def round_trip(expr_rv, recv_caps=ALL_CAPS):
+    """returns (data format or None, received Exec_rv) of expr_rv sent
+    to a receiver with recv_caps"""
+    exec_rv = messages.Exec_rv(None, None, expr_rv, request_id=7)
+    stream = io.BytesIO()
+    python3share._send_opt(exec_rv, stream, recv_caps)
+    stream.seek(0)
+    first = pickle.load(stream)
+    stream.seek(0)
+    rid, received = python3share._recv_reply(stream)
+    assert rid == 7, rid
+    assert stream.read() == b"", "data left in stream"
+    if isinstance(first, messages.Data_info):
+        return first.data_format, received
+    return None, received
+
+class EncodeDecodeTest(unittest.TestCase):
+    def assertRoundTrip(self, expr_rv, codec_info, recv_caps=ALL_CAPS):
+        data_format, received = round_trip(expr_rv, recv_caps)
+        self.assertIsInstance(received, messages.Exec_rv)
+        self.assertEqual(received.expr_rv, expr_rv)
+        self.assertIs(type(received.expr_rv), type(expr_rv))
+        if codec_info is None:
+            self.assertIsNone(data_format)
+        else:
+            self.assertIn(codec_info, data_format.split(","))
+        return data_format
+
+    def test_raw(self):
+        data = os.urandom(5000)
+        fmt = self.assertRoundTrip(data, "raw")
+        self.assertIn("no_compression", fmt)
+        # small bytes are pickled
+        self.assertRoundTrip(b"x" * 100, None)
+
+    def test_raw_bytearray(self):
+        data_format, received = round_trip(bytearray(os.urandom(5000)))
+        self.assertEqual(data_format.split(",")[1:3], ["raw", "bytearray"])
+        self.assertIs(type(received.expr_rv), bytearray)
+        received.expr_rv[0] = 0 # writable
+
+    def test_compressed_raw(self):
+        for data in (b"abc" * 100000, bytearray(b"abc" * 100000)):
+            fmt = self.assertRoundTrip(data, "raw")
+            self.assertIn("compressed(300000)", fmt)
+        # random data does not compress
+        fmt = self.assertRoundTrip(os.urandom(300000), "raw")
+        self.assertIn("no_compression", fmt)
+
+    def test_raw_not_advertised(self):
+        caps = ALL_CAPS & ~(messages.RECV_CAP_RAW_BYTES |
+                            messages.RECV_CAP_UPICKLE)
+        self.assertRoundTrip(os.urandom(5000), None, caps)
+        self.assertRoundTrip(os.urandom(5000), None, 0)
+
+    @unittest.skipUnless(python3share._PICKLE5, "pickle protocol 5 missing")
+    def test_pickle5_out_of_band_buffers(self):
+        expr_rv = {"big": ZeroCopyByteArray(os.urandom(5000)),
+                   "small": ZeroCopyByteArray(b"y" * 10),
+                   "bytes": os.urandom(5000)}
+        data_info, parts = python3share._encode_opt(
+            messages.Exec_rv(None, None, expr_rv), ALL_CAPS)
+        # only the large buffer goes out-of-band
+        self.assertEqual(data_info.buffers, [(5000, True)])
+        self.assertEqual(len(parts), 2)
+        self.assertRoundTrip(expr_rv, "pickled5")
+        received = round_trip(expr_rv)[1].expr_rv
+        self.assertIs(type(received["big"]), ZeroCopyByteArray)
+        self.assertIs(type(received["bytes"]), bytes)
+        # read-only buffers stay read-only
+        expr_rv = {"big": pickle.PickleBuffer(os.urandom(5000))}
+        data_info, parts = python3share._encode_opt(
+            messages.Exec_rv(None, None, expr_rv), ALL_CAPS)
+        self.assertEqual(data_info.buffers, [(5000, False)])
+
+    @unittest.skipUnless(python3share._PICKLE5, "pickle protocol 5 missing")
+    def test_pickle5_in_band(self):
+        self.assertRoundTrip(["x" * 200000, 0.1], "pickled5")
+        self.assertRoundTrip([1, 2, 3], None)
+
+    def test_upickle(self):
+        expr_rv = [(i, "item", i % 2 == 0, 2.5, None) for i in range(1000)]
+        self.assertRoundTrip(expr_rv, "upickled")
+        # not used if pickle is smaller
+        self.assertRoundTrip(list(range(2000)), None)
+        # upickle is opt-in
+        caps = ALL_CAPS & ~messages.RECV_CAP_UPICKLE
+        self.assertRoundTrip(expr_rv, None, caps)
+
+    def test_upickle_not_used_if_lossy(self):
+        for expr_rv in ([0.1] * 2000,
+                        [-0.0] * 2000,
+                        [2**63] * 2000,
+                        [float("nan")] * 2000,
+                        [object.__new__(messages.Async_rv)] * 2000):
+            data_format, received = round_trip(expr_rv)
+            self.assertNotIn("upickled", (data_format or "").split(","))
+
+class UpickleTest(unittest.TestCase):
+    def test_supports(self):
+        for value in (None, True, False, 0, -1, 2**63 - 1, -2**63,
+                      0.0, 1.5, -2.25, float("inf"), float("-inf"),
+                      b"", b"bytes", "", "str",
+                      [1, (2, 3.5), {"a": {b"b"}}], set(), {}):
+            self.assertTrue(upickle.supports(value), repr(value))
+            self.assertEqual(upickle.loads(upickle.dumps(value)), value)
+
+    def test_does_not_support(self):
+        for value in (2**63, -2**63 - 1, 0.1, -0.0, float("nan"), 1e39,
+                      1j, bytearray(b"x"), frozenset([1]), object(),
+                      [1, 0.1], (1, -0.0), {"a": 2**64}, {0.1: 1}):
+            self.assertFalse(upickle.supports(value), repr(value))
+
+    def test_negative_zero_is_lossy(self):
+        restored = upickle.loads(upickle.dumps(-0.0))
+        self.assertEqual(math.copysign(1.0, restored), 1.0)
+
+class ServerCodecTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [start_server("server", 18780),
+                       start_server("aioserver", 18781)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for server in cls.servers:
+            server.terminate()
+            server.wait()
+
+    def test_codecs(self):
+        exprs = ["bytes(range(256)) * 20",
+                 "bytearray(range(256)) * 20",
+                 "b'abc' * 100000",
+                 "{'big': bytearray(range(256)) * 20, 'n': 1}",
+                 "[{'id': i, 'f': 2.5} for i in range(5000)]",
+                 "[0.1, -0.0, 2**70]"]
+        for port in (18780, 18781):
+            reference = connect(port, codecs=[])
+            expected = [reference.eval_(expr) for expr in exprs]
+            for codecs in ([], ["raw"], ["pickle5"], ["upickle"],
+                           python3share.codecs()):
+                if "pickle5" in codecs and not python3share._PICKLE5:
+                    continue
+                conn = connect(port, codecs=codecs)
+                rvs = [conn.eval_(expr) for expr in exprs]
+                for rv, exp in zip(rvs, expected):
+                    self.assertEqual(rv, exp, (port, codecs))
+                    self.assertIs(type(rv), type(exp))
+                conn.close()
+            reference.close()
+
+@unittest.skipUnless(BASELINE_DIR, "PYTHON3SHARE_BASELINE not set")
+class OldHubTest(unittest.TestCase):
+    def test_new_client_behind_old_hub(self):
+        hub_spec = "127.0.0.1:18782"
+        hub = start_server("server", 18782, ps_dir=BASELINE_DIR)
+        worker = None
+        try:
+            worker = start_server("server", 18783,
+                                  [("export", "worker", hub_spec)])
+            conn = connect(18782)
+            end_time = time.time() + TIMEOUT
+            while not "worker" in conn.ls_remote():
+                self.assertLess(time.time(), end_time, "worker not exported")
+                time.sleep(0.1)
+            direct = connect(18783, codecs=[])
+            for expr in ("bytes(range(256)) * 20",
+                         "bytearray(b'abc' * 100000)",
+                         "{'big': bytearray(range(256)) * 20, 'small': b'x'}",
+                         "[(i, 'item', 2.5, None) for i in range(1000)]",
+                         "[0.1, -0.0, 2**70]"):
+                expected = direct.eval_in("worker", expr)
+                for codecs in (python3share.codecs(), []):
+                    conn.set_codecs(codecs)
+                    rv = conn.eval_in("worker", expr)
+                    self.assertEqual(rv, expected, (expr, codecs))
+                    self.assertIs(type(rv), type(expected))
+            direct.close()
+            conn.close()
+        finally:
+            for server in (hub, worker):
+                if server:
+                    server.terminate()
+                    server.wait()
+
+if __name__ == "__main__":
+    unittest.main()
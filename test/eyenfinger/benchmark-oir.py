@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2016, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Benchmark eye4graphics OIR search modes.
+
+Usage: benchmark-oir.py [SCREENSHOT ICON [ROUNDS]]
+
+Without parameters screenshot2.png and screenshot2-icon.png are
+enlarged to 400 % to get a large screenshot.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import eyenfinger
+import fmbtgti
+
+def bench(screenshot, icon, rounds, **oirArgs):
+    engine = fmbtgti._Eye4GraphicsOirEngine()
+    found = None
+    elapsed = []
+    for _ in xrange(rounds):
+        # add screenshot on every round, results are cached per
+        # screenshot
+        ss = fmbtgti.Screenshot(screenshot)
+        engine.addScreenshot(ss)
+        startTime = time.time()
+        found = [i.bbox() for i in engine.findBitmap(ss, icon, **oirArgs)]
+        elapsed.append(time.time() - startTime)
+        engine.removeScreenshot(ss)
+    return min(elapsed), found
+
+if __name__ == "__main__":
+    tmpdir = tempfile.mkdtemp(prefix="benchmark-oir.")
+    try:
+        if len(sys.argv) > 2:
+            screenshot, icon = sys.argv[1:3]
+        else:
+            testdir = os.path.dirname(os.path.abspath(__file__))
+            screenshot = os.path.join(tmpdir, "screenshot.png")
+            icon = os.path.join(tmpdir, "icon.png")
+            eyenfinger.convertImage(os.path.join(testdir, "screenshot2.png"),
+                                    ["-resize", "400%"], screenshot)
+            eyenfinger.convertImage(os.path.join(testdir, "screenshot2-icon.png"),
+                                    ["-resize", "400%"], icon)
+        if len(sys.argv) > 3:
+            rounds = int(sys.argv[3])
+        else:
+            rounds = 3
+        print "screenshot: %s %s" % (screenshot, eyenfinger.imageSize(screenshot))
+        print "icon:       %s %s" % (icon, eyenfinger.imageSize(icon))
+        for oirArgs in [{"colorMatch": 1.0}, {"colorMatch": 0.9},
+                        {"colorMatch": 0.9, "scale": 1.1}]:
+            results = {}
+            for searchMode in ["exhaustive", "pyramid"]:
+                results[searchMode] = bench(screenshot, icon, rounds,
+                                            searchMode=searchMode, **oirArgs)
+            exhaustiveTime, exhaustiveFound = results["exhaustive"]
+            pyramidTime, pyramidFound = results["pyramid"]
+            print "%s:" % (", ".join(["%s=%s" % (k, v) for k, v in sorted(oirArgs.items())]),)
+            print "    exhaustive: %8.3f s found: %s" % (exhaustiveTime, exhaustiveFound)
+            print "    pyramid:    %8.3f s found: %s" % (pyramidTime, pyramidFound)
+            print "    speedup:    %8.1f x, same results: %s" % (
+                exhaustiveTime / max(pyramidTime, 1e-6),
+                exhaustiveFound == pyramidFound)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
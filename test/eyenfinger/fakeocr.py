@@ -0,0 +1,59 @@
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms and conditions of the GNU Lesser General Public
+# License, version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St - Fifth Floor, Boston, MA
+# 02110-1301 USA.
+
+"""Fake OCR for testing eyenfinger and fmbtgti OCR without tesseract
+
+FakeOcr replaces eyenfinger._readWords, which runs tesseract on an
+area of an image, with a function that returns the words of a page
+that are completely inside the area.
+"""
+
+import threading
+import eyenfinger
+
+def grid(width, height, wordSize=(30, 10), step=(37, 23)):
+    """Returns list of (text, bbox) of words placed on a grid. Words
+    cross tile seams at various offsets."""
+    rv = []
+    for top in xrange(0, height - wordSize[1] + 1, step[1]):
+        for left in xrange(0, width - wordSize[0] + 1, step[0]):
+            rv.append(("w%s" % (len(rv),),
+                       (left, top, left + wordSize[0], top + wordSize[1])))
+    return rv
+
+class FakeOcr(object):
+    def __init__(self, page):
+        self.page = page # list of (text, bbox)
+        self.reads = [] # areas that have been read
+        self._lock = threading.Lock()
+
+    def install(self):
+        eyenfinger._readWords = self.readWords
+
+    def readWords(self, origImage, origSize, area, preprocess,
+                  ocrPageSegModes, lang, configfile, readImage, outputBase):
+        with self._lock:
+            self.reads.append(area)
+        left, top, right, bottom = area
+        words = {}
+        for wordNumber, (text, bbox) in enumerate(self.page):
+            if (left <= bbox[0] and bbox[2] <= right and
+                top <= bbox[1] and bbox[3] <= bottom):
+                words.setdefault(text, []).append(eyenfinger._newOcrWord(
+                    "word_1_%s" % (wordNumber + 1,), bbox, text, 90.0,
+                    None, None))
+        return words
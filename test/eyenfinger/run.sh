@@ -76,3 +76,435 @@ ti.refreshScreenshot("screenshot2-icon.png")
 print ti.verifyBitmap("screenshot2.png")' 2>&1 | grep -q False && {
     testpassed
 } ) || testpassed
+
+teststep "eye4graphics: pyramid search finds the same bitmap"
+( python -c '
+import fmbtgti
+ti=fmbtgti.GUITestInterface()
+ti.refreshScreenshot("screenshot2.png")
+exhaustive = [i.bbox() for i in ti.screenshot().findItemsByBitmap("screenshot2-icon.png")]
+pyramid = [i.bbox() for i in ti.screenshot().findItemsByBitmap("screenshot2-icon.png", searchMode="pyramid")]
+print exhaustive == pyramid and exhaustive != []' 2>&1 | tee -a $LOGFILE | grep -q True && {
+    testpassed
+} ) || testfailed
+
+teststep "eye4graphics: damage tracking reuses previous results"
+DAMAGEDIR=$(mktemp -d /tmp/fmbt.test.eyenfinger.XXXXXX)
+python -c '
+import fmbtgti
+import subprocess
+changedSearches = []
+findIconChanged = fmbtgti._Eye4GraphicsOirEngine._findIconChanged
+def countingFindIconChanged(self, *args):
+    changedSearches.append(args[2])
+    return findIconChanged(self, *args)
+fmbtgti._Eye4GraphicsOirEngine._findIconChanged = countingFindIconChanged
+icon = "screenshot2-icon.png"
+def bboxes(screenshot, searchMode):
+    return [i.bbox() for i in screenshot.findItemsByBitmap(icon, searchMode=searchMode)]
+reference = fmbtgti.GUITestInterface()
+reference.refreshScreenshot("screenshot2.png")
+left, top, _, _ = bboxes(reference.screenshot(), "exhaustive")[0]
+def draw(rectangle, filename):
+    subprocess.check_call(["convert", "screenshot2.png", "-fill", "red",
+                           "-draw", "rectangle %s,%s,%s,%s" % rectangle,
+                           "'$DAMAGEDIR'/" + filename])
+    return "'$DAMAGEDIR'/" + filename
+screenshots = ["screenshot2.png", "screenshot2.png",
+               draw((0, 0, 20, 20), "corner.png"),
+               draw((left, top, left + 5, top + 5), "icon.png"),
+               "screenshot2.png"]
+iface = fmbtgti.GUITestInterface()
+iface.setConnection(fmbtgti.SimulatedGUITestConnection(screenshots))
+iface.setScreenshotDir("'$DAMAGEDIR'")
+iface.setScreenshotDamageTracking(True)
+for screenshot in screenshots:
+    iface.refreshScreenshot()
+    reference.refreshScreenshot(screenshot)
+    for searchMode in ["exhaustive", "pyramid"]:
+        found = bboxes(iface.screenshot(), searchMode)
+        expected = bboxes(reference.screenshot(), searchMode)
+        assert found == expected, (screenshot, searchMode, found, expected)
+# every screenshot after the first one reused previous results
+assert len(changedSearches) == 2 * (len(screenshots) - 1), changedSearches
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+rm -rf $DAMAGEDIR
+
+teststep "eyenfinger tesseract options detected once"
+FAKEBIN=$(mktemp -d /tmp/fmbt.test.eyenfinger.XXXXXX)
+cat > $FAKEBIN/tesseract <<EOF_TESSERACT
+#!/bin/bash
+# Fake tesseract that takes only "--psm" and does not write TSV
+echo "\$@" >> $FAKEBIN/calls
+if [ "\$5" == "-psm" ]; then
+    echo "Error, unknown command line argument '-psm'" >&2
+    exit 1
+fi
+sleep 0.2
+echo "<div class='ocr_page' title='bbox 0 0 10 10'></div>" > "\$2.hocr"
+EOF_TESSERACT
+chmod a+x $FAKEBIN/tesseract
+PATH=$FAKEBIN:$PATH python -c '
+import os
+import threading
+import eyenfinger
+outputs = []
+def read(i):
+    outputs.append(eyenfinger._tesseractCli(
+        "image.png", "eng", 3, None, "'$FAKEBIN'/out%s" % (i,)))
+threads = [threading.Thread(target=read, args=(i,)) for i in range(8)]
+for t in threads: t.start()
+for t in threads: t.join()
+assert len(outputs) == 8 and len(set(outputs)) == 1, outputs
+assert "ocr_page" in outputs[0], outputs[0]
+calls = file("'$FAKEBIN'/calls").read().splitlines()
+assert len([c for c in calls if " -psm " in c]) == 1, calls
+assert len([c for c in calls if c.endswith(" tsv")]) == 2, calls
+assert len(calls) == 10, calls
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+rm -rf $FAKEBIN
+
+teststep "eyenfinger splits OCR areas to tiles"
+python -c '
+import random
+import eyenfinger
+def area(b):
+    return max(0, b[2] - b[0]) * max(0, b[3] - b[1])
+def intersection(a, b):
+    return (max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3]))
+tiles = eyenfinger.ocrTiles([(0, 0, 1000, 500)], tileSize=300, overlap=20)
+assert len(tiles) == 8, tiles
+assert tiles[0] == ((0, 0, 270, 270), (0, 0, 250, 250)), tiles[0]
+assert tiles[5] == ((230, 230, 520, 500), (250, 250, 500, 500)), tiles[5]
+assert eyenfinger.ocrTiles([(10, 20, 110, 70)], tileSize=300, overlap=20) == [
+    ((10, 20, 110, 70), (10, 20, 110, 70))]
+rnd = random.Random(1)
+for _ in xrange(200):
+    left, top = rnd.randrange(500), rnd.randrange(500)
+    bounds = (left, top, left + rnd.randrange(1, 2000), top + rnd.randrange(1, 2000))
+    tileSize, overlap = rnd.randrange(10, 900), rnd.randrange(0, 100)
+    tiles = eyenfinger.ocrTiles([bounds], tileSize, overlap)
+    cores = [core for _, core in tiles]
+    # cores cover the area without overlapping
+    assert sum([area(c) for c in cores]) == area(bounds), (bounds, tiles)
+    for i, a in enumerate(cores):
+        assert a[2] - a[0] <= tileSize and a[3] - a[1] <= tileSize, (bounds, a)
+        for b in cores[i+1:]:
+            assert area(intersection(a, b)) == 0, (bounds, a, b)
+    # tiles extend cores by overlap within the area
+    for tile, core in tiles:
+        assert tile == intersection(bounds, (core[0] - overlap, core[1] - overlap,
+                                             core[2] + overlap, core[3] + overlap))
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger reports words on tile seams once"
+python -c '
+import eyenfinger
+import fakeocr
+ocr = fakeocr.FakeOcr(fakeocr.grid(1000, 500))
+ocr.install()
+eyenfinger.imageSize = lambda filename: (1000, 500)
+def found(words):
+    rv = sorted([(text, w[2]) for text in words for w in words[text]])
+    assert len(rv) == len(set(rv)), "word reported twice"
+    return rv
+def inside(bbox, areas):
+    return [a for a in areas if a[0] <= bbox[0] and bbox[2] <= a[2] and
+                                a[1] <= bbox[1] and bbox[3] <= a[3]]
+words = eyenfinger.iReadTiles("page.png", tileSize=300, overlap=40)
+assert found(words) == sorted(ocr.page), found(words)
+assert len(ocr.reads) == 8, ocr.reads
+cores = [core for _, core in eyenfinger.ocrTiles([(0, 0, 1000, 500)], 300, 40)]
+seamWords = [bbox for _, bbox in ocr.page if not inside(bbox, cores)]
+assert len(seamWords) > 20, seamWords
+# word ids keep reading order within tiles
+for text in words:
+    wid = words[text][0][0]
+    assert wid.startswith("word_") and len(wid.split("_")) == 4, wid
+# words in overlapping areas are reported once
+areas = [(0, 0, 600, 300), (300, 0, 1000, 300), (100, 100, 200, 200)]
+words = eyenfinger.iReadTiles("page.png", areas, tileSize=300, overlap=40)
+assert found(words) == sorted([(t, b) for t, b in ocr.page if inside(b, areas)])
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger tiled OCR finds the same items as full OCR"
+python -c '
+import eyenfinger
+import fmbtgti
+import fakeocr
+ocr = fakeocr.FakeOcr(fakeocr.grid(477, 296))
+ocr.install()
+eyenfinger._g_ocrTileSize = 100
+ti = fmbtgti.GUITestInterface()
+ti.refreshScreenshot("screenshot2.png")
+def find(**ocrArgs):
+    return [[i.bbox() for i in ti.screenshot().findItemsByOcr(text, **ocrArgs)]
+            for text, _ in ocr.page]
+full = find()
+assert ocr.reads == [(0, 0, 477, 296)] * len(ocr.reads), ocr.reads
+assert full == [[bbox] for _, bbox in ocr.page], full
+del ocr.reads[:]
+assert find(ocrMode="tiled") == full
+tiles = set([tile for tile, _ in eyenfinger.ocrTiles([(0, 0, 477, 296)])])
+assert set(ocr.reads) == tiles, ocr.reads
+# only words in ocrRegions are found
+region = ti.screenshot().findItemsByOcr("w0")[0]
+regionFound = find(ocrMode="tiled", ocrRegions=[region, (100, 100, 200, 150)])
+assert regionFound == [[bbox] if (bbox == region.bbox() or
+                                  (100 <= bbox[0] and bbox[2] <= 200 and
+                                   100 <= bbox[1] and bbox[3] <= 150)) else []
+                       for _, bbox in ocr.page], regionFound
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger OCR passes are shared by many texts"
+python -c '
+import fmbtgti
+import fakeocr
+ocr = fakeocr.FakeOcr(fakeocr.grid(477, 296))
+ocr.install()
+ti = fmbtgti.GUITestInterface()
+ti.refreshScreenshot("screenshot2.png")
+ti.verifyOcrText("w0")
+readsPerPass = len(ocr.reads) # one read for each preprocess filter
+assert readsPerPass > 0
+# match does not affect OCR, area is normalized
+del ocr.reads[:]
+assert ti.verifyOcrTexts(["w1", "w2", ("w3", {"match": 0.5}),
+                          ("w4", {"area": [0.0, 0.0, 1.0, 1.0]}), "x"]) == {
+    "w1": True, "w2": True, "w3": True, "w4": True, "x": False}
+assert len(ocr.reads) == 0, ocr.reads
+assert ti.screenshot().findItemsByOcr("w5", area=[0.0, 0.0, 1.0, 1.0])
+assert len(ocr.reads) == 0, ocr.reads
+# each different pass is run once
+ti.refreshScreenshot("screenshot2.png")
+found = ti.screenshot().findItemsByOcrMany(
+    ["w0", ("w1", {"area": (0, 0, 100, 50)}), ("w13", {"area": [0, 0, 100, 50]}),
+     ("w20", {"area": [0, 0, 100, 50]}), "w20",
+     ("w2", {"ocrMode": "tiled"}), ("w30", {"ocrMode": "tiled", "match": 0.9})])
+assert len(ocr.reads) == 3 * readsPerPass, ocr.reads
+assert [(0, 0, 100, 50)] * readsPerPass == [r for r in ocr.reads if r != (0, 0, 477, 296)]
+assert dict((text, [i.bbox() for i in items]) for text, items in found.items()) == {
+    "w0": [(0, 0, 30, 10)], "w1": [(37, 0, 67, 10)], "w13": [(0, 23, 30, 33)],
+    "w20": [(259, 23, 289, 33)], # the last query of w20 is not limited to the area
+    "w2": [(74, 0, 104, 10)], "w30": [(148, 46, 178, 56)]}, found
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger parses hOCR words"
+python -c '
+import eyenfinger
+items = list(eyenfinger.iterOcrItems(file("ocr.hocr").read()))
+assert items[0] == ("page", (640, 480)), items[0]
+words = [item for itemType, item in items[1:]]
+assert [t for t, _ in items[1:]] == ["word"] * 5, items
+assert words == [
+    ("word_1_1", (35.0, 30.0), (10, 20, 60, 40)),
+    ("word_1_2", (95.0, 30.0), (70, 20, 120, 40)),
+    ("word_1_3", (155.0, 30.5), (130, 21, 180, 40)),
+    ("word_1_4", (25.0, 51.0), (10, 42, 40, 60)),
+    ("word_1_5", (430.0, 420.0), (400, 400, 460, 440))], words
+assert [w.text for w in words] == ["File", "Edit", "Tom&Jerry\x27s", "OK", "Edit"]
+assert [w.confidence for w in words] == [91.0, 87.5, 12.0, None, 95.0]
+assert [w.lineId for w in words] == ["line_1_1"] * 3 + ["line_1_2", "line_1_3"]
+assert [w.blockId for w in words] == ["block_1_1"] * 4 + ["block_1_2"]
+pageSize, wordDict = eyenfinger._ocrWords(file("ocr.hocr").read())
+assert pageSize == (640, 480)
+assert sorted(wordDict.keys()) == ["Edit", "File", "OK", "Tom&Jerry\x27s"]
+assert wordDict["Edit"] == [words[1], words[4]], wordDict["Edit"]
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger parses ALTO words"
+python -c '
+import eyenfinger
+items = list(eyenfinger.iterOcrItems(file("ocr.alto").read()))
+assert items[0] == ("page", (640, 480)), items[0]
+words = [item for itemType, item in items[1:]]
+assert words == [
+    ("word_1_1", (35.0, 30.0), (10, 20, 60, 40)),
+    ("word_1_2", (95.0, 30.0), (70, 20, 120, 40)),
+    ("word_1_3", (430.0, 420.0), (400, 400, 460, 440))], words
+assert [w.text for w in words] == ["File", "Tom&Jerry", "Edit"]
+assert [w.confidence for w in words] == [91.0, 87.5, None]
+assert [w.lineId for w in words] == ["line_0", "line_0", "line_1"]
+assert [w.blockId for w in words] == ["block_0", "block_0", "block_1"]
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger parses TSV words"
+python -c '
+import eyenfinger
+items = list(eyenfinger.iterOcrItems(file("ocr.tsv").read()))
+assert items[0] == ("page", (640, 480)), items[0]
+words = [item for itemType, item in items[1:]]
+assert words == [
+    ("word_1_1_1_1", (35.0, 30.0), (10, 20, 60, 40)),
+    ("word_1_1_1_2", (95.0, 30.0), (70, 20, 120, 40)),
+    ("word_1_1_2_1", (25.0, 51.0), (10, 42, 40, 60)),
+    ("word_1_1_2_2", (65.0, 51.0), (50, 42, 80, 60)),
+    ("word_2_1_1_1", (430.0, 420.0), (400, 400, 460, 440))], words
+assert [w.text for w in words] == ["File", "Save", "", "OK", "Edit"]
+assert [w.confidence for w in words] == [91.0, 87.5, None, 12.0, 95.0]
+assert [w.lineId for w in words] == ["line_1_1_1"] * 2 + ["line_1_1_2"] * 2 + ["line_2_1_1"]
+assert [w.blockId for w in words] == ["block_1"] * 4 + ["block_2"]
+# TSV without a text column and an empty document
+assert list(eyenfinger.iterOcrWords(
+    "level\tpage_num\n5\t1\t1\t1\t1\t1\t1\t2\t3\t4\t50")) == [
+    ("word_1_1_1_1", (2.5, 4.0), (1, 2, 4, 6))]
+assert list(eyenfinger.iterOcrItems("level\tpage_num\n")) == []
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger parses TSV without header from libtesseract"
+python -c '
+import ctypes
+import eyenfinger
+tsv = file("ocr.tsv").read()
+headerless = tsv.split("\n", 1)[1]
+assert not headerless.startswith("level"), headerless
+class FakeLibtesseract(object):
+    # returns TSV like TessBaseAPIGetTsvText
+    def __init__(self):
+        self.texts = []
+    def __getattr__(self, name):
+        return lambda *args: 0
+    def TessBaseAPIGetTsvText(self, handle, page):
+        self.texts.append(ctypes.create_string_buffer(headerless))
+        return ctypes.addressof(self.texts[-1])
+eyenfinger.libtesseract = FakeLibtesseract()
+output = eyenfinger._TesseractWorkers(1).read((2, 2, "\0" * 12), "eng", None, [3])[0]
+assert output == headerless, output
+assert list(eyenfinger.iterOcrItems(output)) == list(eyenfinger.iterOcrItems(tsv))
+pageSize, words = eyenfinger._ocrWords(output)
+assert pageSize == (640, 480), pageSize
+assert sorted(words.keys()) == ["", "Edit", "File", "OK", "Save"], words.keys()
+assert words["OK"][0].confidence == 12.0, words["OK"]
+assert list(eyenfinger.iterOcrItems("")) == []
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger OCR index orders equal scores by confidence"
+python -c '
+import eyenfinger
+def word(wid, bbox, text, confidence):
+    return eyenfinger._newOcrWord(wid, bbox, text, confidence, None, None)
+A, B, C, D, E = [(x, 0, x + 10, 10) for x in (0, 20, 40, 60, 80)]
+words = {"Edit": [word("word_1_1", A, "Edit", 87.5),
+                  word("word_1_2", B, "Edit", 95.0),
+                  word("word_1_3", C, "Edit", None),
+                  word("word_1_4", D, "Edit", 40.0)],
+         "Exit": [word("word_1_5", E, "Exit", 99.0)]}
+# equal scores: words without confidence first, most confident last
+found = eyenfinger.OcrIndex(words).findText("Edit", 0.7)
+assert found == [(0.75, "Exit", E), (1.0, "Edit", C), (1.0, "Edit", D),
+                 (1.0, "Edit", A), (1.0, "Edit", B)], found
+# plain (wordid, middle, bbox) tuples have no confidence
+plain = dict((k, [tuple(w) for w in v]) for k, v in words.items())
+found = eyenfinger.OcrIndex(plain).findText("Edit", 0.9)
+assert found == [(1.0, "Edit", bbox) for bbox in (A, B, C, D)], found
+# multi-word texts are ordered by mean confidence of their words
+words = {"Save": [word("word_2_1", A, "Save", 10.0),
+                  word("word_4_1", C, "Save", 80.0)],
+         "As": [word("word_2_2", B, "As", 20.0),
+                word("word_4_2", D, "As", 90.0)]}
+found = eyenfinger.OcrIndex(words).findText("Save As", 1.0)
+assert found == [(1.0, "Save As", (0, 0, 30, 10)),
+                 (1.0, "Save As", (40, 0, 70, 10))], found
+# confidences of parsed words are used
+for ocrFile in ["ocr.hocr", "ocr.alto"]:
+    found = eyenfinger.findText("Edit", eyenfinger._ocrWords(file(ocrFile).read())[1], 1.0)
+    assert [bbox for _, _, bbox in found] == {
+        "ocr.hocr": [(70, 20, 120, 40), (400, 400, 460, 440)],
+        "ocr.alto": [(400, 400, 460, 440)]}[ocrFile], found
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger OCR index finds the same texts as linear search"
+python -c '
+import random
+import eyenfinger
+rnd = random.Random(1)
+def mutate(s):
+    # edit s like OCR errors do, close matches included
+    s = list(s)
+    for _ in xrange(rnd.choice([0, 1, 1, 2, 3])):
+        op = rnd.choice(["insert", "delete", "substitute", "close"])
+        i = rnd.randrange(len(s) + 1)
+        if op == "insert" or not s:
+            s.insert(i, rnd.choice("abeilI1"))
+        elif op == "delete":
+            del s[i % len(s)]
+        elif op == "substitute":
+            s[i % len(s)] = rnd.choice("abeilI1")
+        else:
+            s[i % len(s)] = rnd.choice("1lI")
+    return "".join(s)
+vocabulary = ["".join(rnd.choice("abcdeilI1") for _ in xrange(rnd.randrange(1, 10)))
+              for _ in xrange(60)] + ["Settings", "Sett1ngs", "OK", "0K", "I"]
+words = {}
+for i in xrange(200):
+    word = rnd.choice(vocabulary)
+    x, y = rnd.randrange(500), rnd.randrange(500)
+    wid = "word_%s_%s" % (rnd.randrange(1, 4), i)
+    words.setdefault(word, []).append((wid, (x + 5.0, y + 5.0), (x, y, x + 10, y + 10)))
+wordsById = sorted([([int(n) for n in wid[5:].split("_")], word, bbox)
+                    for word in words for wid, _, bbox in words[word]])
+def linearFindText(text, match):
+    # findText before OcrIndex: score every window of words
+    count = len(text.split())
+    if count == 0:
+        if match == 0.0:
+            return [(0.0, w[1], w[2]) for w in wordsById]
+        return []
+    norm_text = " ".join(text.split())
+    scored = []
+    for i in xrange(len(wordsById) - count + 1):
+        window = wordsById[i:i+count]
+        t = " ".join([w[1] for w in window])
+        scored.append((eyenfinger._score(t, norm_text), t,
+                       (min([w[2][0] for w in window]), min([w[2][1] for w in window]),
+                        max([w[2][2] for w in window]), max([w[2][3] for w in window]))))
+    scored.sort()
+    return [s for s in scored if s[0] >= match]
+def linearFindWord(word):
+    return max([(eyenfinger._score(w, word), w) for w in words])
+queries = ["", " ", "Settings", "0K ", "I", "zzzzzzzzzz", "Settings  OK"]
+for _ in xrange(40):
+    start = rnd.randrange(len(wordsById))
+    text = " ".join([w[1] for w in wordsById[start:start + rnd.choice([1, 1, 2, 3])]])
+    queries.append(rnd.choice([text, mutate(text)]))
+matches = [-1, 0.0, 0.5, 0.75, 0.8, 0.9, 1.0]
+for match in matches:
+    expected = [linearFindText(q, match) for q in queries]
+    assert eyenfinger.findTexts(queries, words, match) == expected, match
+    index = eyenfinger.OcrIndex(words)
+    for query, exp in zip(queries, expected):
+        assert index.findText(query, match) == exp, (query, match)
+        assert eyenfinger.findText(query, words, match) == exp, (query, match)
+for query in queries:
+    assert eyenfinger.findWord(query, words) == linearFindWord(query), query
+# candidates include every string that scores at least match
+strings = sorted(words.keys())
+textIndex = eyenfinger._TextIndex(strings)
+for query in queries + vocabulary:
+    for match in matches:
+        candidates = set(textIndex.candidates(query, match))
+        for i, s in enumerate(strings):
+            if eyenfinger._score(s, query) >= match:
+                assert i in candidates, (s, query, match)
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "eyenfinger OCR index follows changed words"
+python -c '
+import eyenfinger
+A, B, C = [(x, 0, x + 10, 10) for x in (0, 20, 40)]
+def ocrWord(wid, bbox):
+    return (wid, ((bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0), bbox)
+words = {"Edit": [ocrWord("word_1_1", A)]}
+assert eyenfinger.findText("Edit", words, 1.0) == [(1.0, "Edit", A)]
+index = eyenfinger.ocrIndex(words)
+assert eyenfinger.ocrIndex(words) is index # unchanged words reuse index
+words["Edit"].append(ocrWord("word_1_2", B))
+assert eyenfinger.findText("Edit", words, 1.0) == [(1.0, "Edit", A), (1.0, "Edit", B)]
+words["Exit"] = [ocrWord("word_1_3", C)]
+assert eyenfinger.findWord("Exit", words) == (1.0, "Exit")
+assert eyenfinger.findText("Exit", words, 1.0) == [(1.0, "Exit", C)]
+del words["Edit"]
+assert eyenfinger.findText("Edit", words, 1.0) == []
+words["Exit"][0] = ocrWord("word_1_3", A)
+assert eyenfinger.findText("Exit", words, 1.0) == [(1.0, "Exit", A)]
+' >>$LOGFILE 2>&1 && testpassed || testfailed
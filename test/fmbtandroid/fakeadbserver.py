@@ -0,0 +1,184 @@
+#!/usr/bin/env python2
+#
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2016, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms and conditions of the GNU Lesser General Public
+# License, version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St - Fifth Floor, Boston, MA
+# 02110-1301 USA.
+
+"""Fake adb server for testing fmbtandroid adb socket transport
+
+Usage: python fakeadbserver.py [options]
+
+Options:
+  -p, --port=PORT
+          listen to PORT on localhost. The default is 15037.
+
+  -s, --serial=SERIAL
+          serial number of the fake device. The default is
+          "fake-device".
+
+  -r, --root=DIR
+          files pushed to the fake device are stored under DIR,
+          shell commands are run in DIR. The default is ".".
+
+  -l, --legacy
+          do not support shell v2 protocol.
+
+Shell and exec commands are run on the host.
+"""
+
+import getopt
+import os
+import socket
+import struct
+import subprocess
+import sys
+import thread
+
+opt_port = 15037
+opt_serial = "fake-device"
+opt_root = "."
+opt_legacy = False
+
+def recvAll(conn, length):
+    data = []
+    while length > 0:
+        chunk = conn.recv(length)
+        if not chunk:
+            raise EOFError()
+        data.append(chunk)
+        length -= len(chunk)
+    return "".join(data)
+
+def recvRequest(conn):
+    return recvAll(conn, int(recvAll(conn, 4), 16))
+
+def fail(conn, msg):
+    conn.sendall("FAIL%04x%s" % (len(msg), msg))
+
+def localPath(remotePath):
+    return os.path.join(opt_root, remotePath.lstrip("/").replace("/", "_"))
+
+def shellV2(conn, cmd):
+    p = subprocess.Popen(cmd, shell=True, cwd=opt_root,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    for packetId, data in ((1, out), (2, err)):
+        if data:
+            conn.sendall(struct.pack("<BI", packetId, len(data)) + data)
+    conn.sendall(struct.pack("<BI", 3, 1) + chr(p.returncode & 0xff))
+
+def execOut(conn, cmd):
+    p = subprocess.Popen(cmd, shell=True, cwd=opt_root,
+                         stdout=subprocess.PIPE)
+    while True:
+        data = p.stdout.read(65536)
+        if not data:
+            break
+        conn.sendall(data)
+    p.wait()
+
+def shellLegacy(conn, cmd):
+    p = subprocess.Popen(cmd, shell=True, cwd=opt_root,
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    conn.sendall(p.communicate()[0])
+
+def sync(conn):
+    while True:
+        syncId, length = struct.unpack("<4sI", recvAll(conn, 8))
+        if syncId == "QUIT":
+            return
+        elif syncId == "RECV":
+            path = localPath(recvAll(conn, length))
+            try:
+                data = file(path, "rb").read()
+            except IOError, e:
+                msg = "remote object '%s' does not exist" % (path,)
+                conn.sendall("FAIL" + struct.pack("<I", len(msg)) + msg)
+                return
+            for offset in xrange(0, len(data), 65536):
+                chunk = data[offset:offset + 65536]
+                conn.sendall("DATA" + struct.pack("<I", len(chunk)) + chunk)
+            conn.sendall("DONE" + struct.pack("<I", 0))
+        elif syncId == "SEND":
+            path, mode = recvAll(conn, length).rsplit(",", 1)
+            chunks = []
+            while True:
+                chunkId, length = struct.unpack("<4sI", recvAll(conn, 8))
+                if chunkId == "DONE":
+                    break
+                chunks.append(recvAll(conn, length))
+            file(localPath(path), "wb").write("".join(chunks))
+            conn.sendall("OKAY" + struct.pack("<I", 0))
+        else:
+            return
+
+def serve(conn):
+    try:
+        request = recvRequest(conn)
+        if request == "host-serial:%s:features" % (opt_serial,):
+            if opt_legacy:
+                features = "cmd"
+            else:
+                features = "cmd,shell_v2"
+            conn.sendall("OKAY%04x%s" % (len(features), features))
+            return
+        if request != "host:transport:%s" % (opt_serial,):
+            fail(conn, "device '%s' not found" % (request.split(":")[-1],))
+            return
+        conn.sendall("OKAY")
+        request = recvRequest(conn)
+        if request.startswith("shell,v2,raw:") and not opt_legacy:
+            conn.sendall("OKAY")
+            shellV2(conn, request.split(":", 1)[1])
+        elif request.startswith("shell:"):
+            conn.sendall("OKAY")
+            shellLegacy(conn, request.split(":", 1)[1])
+        elif request.startswith("exec:"):
+            conn.sendall("OKAY")
+            execOut(conn, request.split(":", 1)[1])
+        elif request == "sync:":
+            conn.sendall("OKAY")
+            sync(conn)
+        else:
+            fail(conn, "unknown service")
+    except (EOFError, socket.error):
+        pass
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    opts, remainder = getopt.getopt(
+        sys.argv[1:], "hp:s:r:l",
+        ["help", "port=", "serial=", "root=", "legacy"])
+    for opt, arg in opts:
+        if opt in ["-h", "--help"]:
+            print __doc__
+            sys.exit(0)
+        elif opt in ["-p", "--port"]:
+            opt_port = int(arg)
+        elif opt in ["-s", "--serial"]:
+            opt_serial = arg
+        elif opt in ["-r", "--root"]:
+            opt_root = arg
+        elif opt in ["-l", "--legacy"]:
+            opt_legacy = True
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", opt_port))
+    server.listen(16)
+    while True:
+        conn, _ = server.accept()
+        thread.start_new_thread(serve, (conn,))
@@ -0,0 +1,293 @@
+#!/bin/bash
+
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2016, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+# Tests for fmbtandroid without a device
+
+##########################################
+# Setup test environment
+
+cd "$(dirname "$0")"
+LOGFILE=/tmp/fmbt.test.fmbtandroid.log
+rm -f $LOGFILE
+
+if [ "$1" != "installed" ]; then
+    export PATH=../../src:../../utils:$PATH
+    export LD_LIBRARY_PATH=$(dirname $(find ../.. -name eye4graphics.so | head -n 1)):$LD_LIBRARY_PATH
+    export PYTHONPATH=../../utils:$PYTHONPATH
+fi
+
+source ../functions.sh
+
+DEVICEDIR=$(mktemp -d /tmp/fmbt.test.fmbtandroid.XXXXXX)
+python fakeadbserver.py --port 15037 --root $DEVICEDIR >>$LOGFILE 2>&1 &
+FAKEADB_PID=$!
+python fakeadbserver.py --port 15038 --root $DEVICEDIR --legacy >>$LOGFILE 2>&1 &
+FAKEADB_LEGACY_PID=$!
+trap "kill $FAKEADB_PID $FAKEADB_LEGACY_PID; rm -rf $DEVICEDIR" EXIT
+sleep 1
+
+##########################################
+# Run the test
+
+teststep "fmbtandroid adb socket shell"
+python -c '
+import fmbtandroid
+t = fmbtandroid._AdbSocketTransport("fake-device", 15037)
+assert "shell_v2" in t.features(), t.features()
+assert t.run(["shell", "echo", "hello"]) == (0, "hello\n", ""), "echo"
+assert t.run(["shell", "echo err >&2; exit 3"]) == (3, "", "err\n"), "stderr and exit status"
+assert t.run(["shell", "sleep 5"], timeout=0.5)[0] == 124, "timeout"
+legacy = fmbtandroid._AdbSocketTransport("fake-device", 15038)
+assert legacy.run(["shell", "echo err >&2; exit 3"]) == (0, "err\n", ""), "legacy shell"
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid adb socket push and pull"
+python -c '
+import fmbtandroid
+t = fmbtandroid._AdbSocketTransport("fake-device", 15037)
+data = "".join([chr(i % 256) for i in xrange(200000)])
+file("'$DEVICEDIR'/local.bin", "wb").write(data)
+assert t.run(["push", "'$DEVICEDIR'/local.bin", "/sdcard/remote.bin"])[0] == 0, "push"
+assert t.run(["pull", "/sdcard/remote.bin", "'$DEVICEDIR'/pulled.bin"])[0] == 0, "pull"
+assert file("'$DEVICEDIR'/pulled.bin", "rb").read() == data, "pulled data differs"
+assert t.run(["pull", "/sdcard/remote.bin", "'$DEVICEDIR'/pulled.bin"])[0] == 0, "pull on pooled connection"
+assert t.run(["pull", "/sdcard/missing", "'$DEVICEDIR'/missing"])[0] == 1, "pull missing file"
+assert t.run(["pull", "/sdcard/remote.bin", "'$DEVICEDIR'/pulled.bin"])[0] == 0, "pull after failure"
+t.close()
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid adb socket exec-out"
+python -c '
+import fmbtandroid
+t = fmbtandroid._AdbSocketTransport("fake-device", 15037)
+data = "".join([chr(i % 251) for i in xrange(300000)])
+file("'$DEVICEDIR'/screen.raw", "wb").write(data)
+buf = bytearray(1000)
+length = t.execOut("cat screen.raw", buf)
+assert length == len(data), "length %s" % (length,)
+assert str(buffer(buf, 0, length)) == data, "exec-out data differs"
+bufSize = len(buf)
+assert t.execOut("head -c 100 screen.raw", buf) == 100, "short output"
+assert len(buf) == bufSize and buf[:100] == data[:100], "buffer not reused"
+length = t.execOut("gzip -1 < screen.raw", buf)
+assert fmbtandroid._decompressGzip(buffer(buf, 0, length), 1024) == data, "gzip"
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid adb socket errors"
+python -c '
+import fmbtandroid
+for transport, command in [
+        (fmbtandroid._AdbSocketTransport("no-device", 15037), ["shell", "true"]),
+        (fmbtandroid._AdbSocketTransport("fake-device", 15039), ["shell", "true"]),
+        (fmbtandroid._AdbSocketTransport("fake-device", 15037), ["reboot"])]:
+    try:
+        transport.run(command)
+        raise AssertionError("_AdbSocketError expected: %s" % (command,))
+    except fmbtandroid._AdbSocketError:
+        pass
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid view diff moves each subtree once"
+python -c '
+import fmbtandroid
+def node(name, children=""):
+    return ("<node index=\"0\" text=\"%s\" resource-id=\"pkg:id/%s\" "
+            "class=\"android.widget.%s\" content-desc=\"\" "
+            "bounds=\"[0,0][10,10]\">%s</node>" % (name, name, name, children))
+def dump(tree):
+    return ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\" ?>"
+            "<hierarchy rotation=\"0\">%s</hierarchy>" % (tree,))
+displayToScreen = lambda x, y: (x, y)
+for previous, current, reused in [
+        (node("root", node("A", node("B")) + node("X")),
+         node("root", node("A", node("B")) + node("X", node("B"))),
+         ["A", "B"]),
+        (node("root", node("A", node("B")) + node("C")),
+         node("root", node("Y", node("B")) + node("A", node("B"))),
+         ["B"])]:
+    v1 = fmbtandroid.View("'$DEVICEDIR'", "serial", dump(previous), displayToScreen)
+    v2 = fmbtandroid.View("'$DEVICEDIR'", "serial", dump(current), displayToScreen,
+                          previousView=v1)
+    items = v2.viewItems()
+    assert len(set([id(i) for i in items])) == len(items), "item twice in view"
+    for item in items:
+        for child in item.children():
+            assert child.parent() is item, "parent of %s" % (child.id(),)
+        if item.parent():
+            assert [c for c in item.parent().children() if c is item], \
+                "%s missing from children of its parent" % (item.id(),)
+    assert [i.id() for i in items if i in v1.viewItems()] == \
+        ["id/" + name for name in reused], "reused items"
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid view items pickle"
+python -c '
+import pickle
+import fmbtandroid
+dump = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\" ?>"
+        "<hierarchy rotation=\"0\">"
+        "<node index=\"0\" text=\"\" resource-id=\"pkg:id/root\" "
+        "class=\"android.widget.FrameLayout\" content-desc=\"\" "
+        "bounds=\"[0,0][100,200]\">"
+        "<node index=\"0\" text=\"Hello\" resource-id=\"pkg:id/hello\" "
+        "class=\"android.widget.TextView\" content-desc=\"greeting\" "
+        "bounds=\"[10,20][30,40]\"/>"
+        "</node></hierarchy>")
+view = fmbtandroid.View("'$DEVICEDIR'", "serial", dump,
+                        displayToScreen=lambda x, y: (2 * x, 2 * y))
+for protocol in (0, 2):
+    # nothing has been computed yet in the first round
+    items = view.viewItems()
+    unpickled = pickle.loads(pickle.dumps(items, protocol))
+    for item, copy in zip(items, unpickled):
+        assert copy.id() == item.id(), (copy.id(), item.id())
+        assert copy.text() == item.text(), (copy.text(), item.text())
+        assert copy.visible() == item.visible() == True
+        assert copy.bbox() == item.bbox(), (copy.bbox(), item.bbox())
+        assert copy.content_desc() == item.content_desc()
+    assert unpickled[1].bbox() == (20, 40, 60, 80), unpickled[1].bbox()
+    assert unpickled[1].parent() is unpickled[0], "parent"
+    assert unpickled[0].children() == [unpickled[1]], "children"
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid view parser builds the item tree"
+python -c '
+import xml.etree.ElementTree
+import fmbtandroid
+dump = """<?xml version="1.0" encoding="UTF-8" standalone="yes" ?>
+<hierarchy rotation="0">
+ <node index="0" text="" resource-id="pkg:id/root" class="android.widget.FrameLayout" bounds="[0,0][100,200]">
+  <node index="0" text="no id, children go to root" class="android.widget.LinearLayout" bounds="[0,0][100,100]">
+   <node index="0" text="A &amp; B" resource-id="pkg:id/a" class="android.widget.TextView" bounds="[0,0][50,50]"/>
+   <node index="1" text="\xc3\xa4\xc3\xb6" resource-id="" class="android.widget.TextView" bounds="[50,0][100,50]">
+    <node index="0" text="deep" resource-id="pkg:id/deep" class="android.view.View" bounds="[50,0][60,10]"/>
+   </node>
+  </node>
+  <node index="1" text="no bounds" resource-id="pkg:id/nobounds" class="android.widget.Button">
+   <node index="0" text="" resource-id="pkg:id/orphan" class="android.widget.Button" bounds="[0,100][10,110]"/>
+  </node>
+  <node index="2" text="same" resource-id="pkg:id/same" class="android.widget.Button" bounds="[0,150][10,160]"/>
+  <node index="3" text="same" resource-id="pkg:id/same" class="android.widget.Button" bounds="[0,150][10,160]"/>
+ </node>
+</hierarchy>
+"""
+def expected(elt, parent, indent, results):
+    # reference: items of nodes with resource-id and bounds, children
+    # of other nodes belong to their closest ancestor item
+    if "resource-id" in elt.attrib and "bounds" in elt.attrib:
+        item = (elt.attrib["class"], elt.attrib["resource-id"].split(":", 1)[-1],
+                indent, dict(elt.attrib), parent)
+        results.append(item)
+        parent = len(results) - 1
+    for child in elt:
+        expected(child, parent, indent + 1, results)
+    return results
+reference = expected(xml.etree.ElementTree.fromstring(dump), None, 0, [])
+view = fmbtandroid.View("'$DEVICEDIR'", "serial", dump)
+items = view.viewItems()
+index = dict((id(item), i) for i, item in enumerate(items))
+parsed = [(i.className(), i.code(), i.indent(), i.properties(),
+           index.get(id(i.parent()), None)) for i in items]
+assert parsed == reference, "\n%s\n!=\n%s" % (parsed, reference)
+for i, item in enumerate(items):
+    assert [index[id(c)] for c in item.children()] == \
+        [j for j, r in enumerate(reference) if r[4] == i], "children of %s" % (i,)
+assert items[1].text() == "A & B", items[1].text()
+assert items[2].text() == u"\xe4\xf6", repr(items[2].text())
+assert view.findItemsByText("same") == items[-2:]
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid view item fields are computed lazily"
+python -c '
+import fmbtandroid
+scale = lambda x, y: (2 * x, 3 * y)
+props = {"resource-id": "pkg:id/ok", "text": "OK", "class": "android.widget.Button",
+         "bounds": "[10,20][30,40]"}
+item = fmbtandroid.ViewItem("android.widget.Button", "id/ok", 1, props, None, "",
+                            "dump", scale)
+assert not item._propsComputed and item._bbox == None, "computed too early"
+assert (item.id(), item.text(), item.visible()) == ("id/ok", "OK", True)
+assert item.bbox() == (20, 60, 60, 120), item.bbox()
+assert item.coords() == (40, 90), item.coords()
+# window service dump: coordinates relative to parents, scrolling
+parent = fmbtandroid.ViewItem(
+    "android.widget.ScrollView", "41", 0,
+    {"mID": "id/scroll", "layout:mLeft": "5", "layout:mTop": "100",
+     "scrolling:mScrollX": "0", "scrolling:mScrollY": "40",
+     "layout:getHeight()": "500", "layout:getWidth()": "200",
+     "getVisibility()": "VISIBLE"}, None, "", "dump", scale)
+child = fmbtandroid.ViewItem(
+    "android.widget.TextView", "42", 1,
+    {"mID": "id/label", "text:mText": "Label",
+     "layout:mLeft": "10", "layout:mTop": "60",
+     "layout:getHeight()": "20", "layout:getWidth()": "30",
+     "getVisibility()": "GONE"}, parent, "", "dump", scale)
+parent.addChild(child)
+assert (child.id(), child.text(), child.visible()) == ("id/label", "Label", False)
+assert not child.visibleBranch(), "visibleBranch"
+assert child.bbox() == (30, 360, 90, 420), child.bbox()
+noText = fmbtandroid.ViewItem("android.view.View", "43", 0, {}, None, "",
+                              "dump", scale)
+assert (noText.id(), noText.text(), noText.visible()) == (None, None, False)
+try:
+    noText.bbox()
+    assert False, "bbox without layout fields"
+except ValueError:
+    pass
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtandroid view diff reuses unchanged subtrees"
+python -c '
+import fmbtandroid
+def node(name, children="", text=""):
+    return ("<node index=\"0\" text=\"%s\" resource-id=\"pkg:id/%s\" "
+            "class=\"android.widget.%s\" content-desc=\"\" "
+            "bounds=\"[0,0][10,10]\">%s</node>" % (text, name, name, children))
+def dump(tree):
+    return ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\" ?>"
+            "<hierarchy rotation=\"0\">%s</hierarchy>" % (tree,))
+def structure(view):
+    return [(i.id(), i.text(), i.parent() and i.parent().id(),
+             [c.id() for c in i.children()]) for i in view.viewItems()]
+displayToScreen = lambda x, y: (x, y)
+def view(tree, previousView=None, displayToScreen=displayToScreen):
+    return fmbtandroid.View("'$DEVICEDIR'", "serial", dump(tree), displayToScreen,
+                            previousView=previousView)
+tree = node("root", node("A", node("B") + node("C")) + node("D", node("E")))
+v1 = view(tree)
+v2 = view(tree, v1)
+assert [i for i in v2.viewItems() if not i in v1.viewItems()] == [], "not reused"
+assert v2.viewItems()[0] is v1.viewItems()[0]
+# E changes: its ancestors are new, the subtree of A is reused
+changed = node("root", node("A", node("B") + node("C")) + node("D", node("E", text="new")))
+v3 = view(changed, v2)
+assert structure(v3) == structure(view(changed)), "differs from fresh parse"
+reused = [i.id() for i in v3.viewItems() if i in v2.viewItems()]
+assert reused == ["id/A", "id/B", "id/C"], reused
+assert v3.findItemsById("id/A")[0].parent() is v3.viewItems()[0], "parent of A"
+assert v3.findItemsByText("new")[0].id() == "id/E"
+# nothing is reused with another coordinate conversion
+v4 = view(changed, v3, displayToScreen=lambda x, y: (x, y))
+assert [i for i in v4.viewItems() if i in v3.viewItems()] == [], "reused"
+# identical subtrees at the same depth are not reused
+twins = node("root", node("A", node("B")) + node("A", node("B")))
+v5 = view(twins, view(twins))
+assert len(v5.viewItems()) == 5 and len(set(v5.viewItems())) == 5
+assert structure(v5) == structure(view(twins))
+' >>$LOGFILE 2>&1 && testpassed || testfailed
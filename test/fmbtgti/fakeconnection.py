@@ -0,0 +1,61 @@
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms and conditions of the GNU Lesser General Public
+# License, version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St - Fifth Floor, Boston, MA
+# 02110-1301 USA.
+
+"""Fake GUITestConnection for testing fmbtgti without a device
+
+Screenshots are stored under the directory in SCREENSHOTDIR
+environment variable.
+"""
+
+import os
+import threading
+import time
+import fmbtgti
+
+class FakeConnection(fmbtgti.GUITestConnection):
+    """Serves 2x2 RGB screenshots, records overlapping captures"""
+    def __init__(self, captureTime=0.01, frames=None):
+        self.captureTime = captureTime
+        self.frames = frames # max. number of screenshots, None: unlimited
+        self.captures = 0
+        self.capturing = 0
+        self.overlaps = 0
+        self._lock = threading.Lock()
+    def recvScreenshotRaw(self):
+        with self._lock:
+            if self.frames != None and self.captures >= self.frames:
+                return None
+            self.capturing += 1
+            if self.capturing > 1:
+                self.overlaps += 1
+        time.sleep(self.captureTime)
+        with self._lock:
+            self.capturing -= 1
+            self.captures += 1
+            n = self.captures
+        return (2, 2, "RGB", bytes(bytearray([n % 256] * 12)))
+    def recvScreenshot(self, filename):
+        return False
+
+def interface(conn, iface=None):
+    """Sets up iface, a new GUITestInterface by default, for conn"""
+    if iface == None:
+        iface = fmbtgti.GUITestInterface()
+    iface.setConnection(conn)
+    iface.setScreenshotDir(os.environ["SCREENSHOTDIR"])
+    iface.setScreenshotInMemory(True)
+    return iface
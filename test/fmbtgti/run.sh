@@ -0,0 +1,309 @@
+#!/bin/bash
+
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU Lesser General Public License,
+# version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Lesser General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin St - Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+# Tests for fmbtgti with fake connections
+
+##########################################
+# Setup test environment
+
+cd "$(dirname "$0")"
+LOGFILE=/tmp/fmbt.test.fmbtgti.log
+rm -f $LOGFILE
+
+if [ "$1" != "installed" ]; then
+    export PATH=../../src:../../utils:$PATH
+    export PYTHONPATH=../../utils:../../pythonshare:$PYTHONPATH
+fi
+
+source ../functions.sh
+
+SCREENSHOTDIR=$(mktemp -d /tmp/fmbt.test.fmbtgti.XXXXXX)
+export SCREENSHOTDIR
+trap "rm -rf $SCREENSHOTDIR" EXIT
+
+##########################################
+# Run the test
+
+teststep "fmbtgti screenshot capture serializes captures"
+python -c '
+from fakeconnection import *
+conn = FakeConnection()
+iface = interface(conn)
+iface.setScreenshotCapture(True, captureDelay=0.0)
+try:
+    for i in range(20):
+        # rotated and synchronous captures run in this thread
+        iface._captureScreenshot()
+finally:
+    iface.setScreenshotCapture(False)
+assert conn.captures > 20, conn.captures
+assert conn.overlaps == 0, "%s overlapping captures" % (conn.overlaps,)
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti wait evaluates every frame once"
+python -c '
+import time
+from fakeconnection import *
+conn = FakeConnection(captureTime=0.05)
+iface = interface(conn)
+iface.setScreenshotCapture(True)
+seen = []
+def waitFunc():
+    s = iface.screenshot()
+    if s != None:
+        seen.append(s)
+    return len(seen) >= 5
+# Frames get equal capture times on clocks with coarse resolution.
+realTime = time.time
+time.time = lambda: 1000.0
+try:
+    assert iface.wait(iface.refreshScreenshot, waitFunc, waitTime=5.0), "waitFunc never returned True"
+finally:
+    time.time = realTime
+    iface.setScreenshotCapture(False)
+assert len(set(id(s) for s in seen)) == len(seen), "a frame evaluated twice"
+numbers = [s._frameNumber for s in seen]
+assert numbers == sorted(numbers), numbers
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti wait on android device with background capture"
+python -c '
+import fmbtandroid
+from fakeconnection import *
+class FakeAndroidConnection(FakeConnection):
+    def recvScreenSize(self):
+        return (2, 2)
+conn = FakeAndroidConnection(captureTime=0.05)
+device = interface(conn, fmbtandroid.Device(connect=False, rotateScreenshot=0))
+device.setScreenshotCapture(True)
+seen = []
+def waitFunc():
+    if device.screenshot() != None:
+        seen.append(device.screenshot()._frameNumber)
+    return len(seen) >= 3
+try:
+    assert device.wait(device.refreshScreenshot, waitFunc, waitTime=5.0), "waitFunc never returned True"
+finally:
+    device.setScreenshotCapture(False)
+assert seen == sorted(set(seen)), seen
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti wait for a frame ends at waitTime"
+python -c '
+import time
+from fakeconnection import *
+conn = FakeConnection(frames=1)
+iface = interface(conn)
+iface.setScreenshotCapture(True)
+try:
+    iface.refreshScreenshot()
+    startTime = time.time()
+    assert not iface.wait(iface.refreshScreenshot, lambda: False, waitTime=1.0), "wait returned True"
+    elapsed = time.time() - startTime
+finally:
+    iface.setScreenshotCapture(False)
+assert elapsed < 3.0, "wait took %.1f s" % (elapsed,)
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti registered engines do not keep interfaces alive"
+python -c '
+import gc
+import weakref
+import fmbtgti
+class Engine(fmbtgti.OcrEngine, fmbtgti.OirEngine):
+    pass
+engine = Engine()
+ocrIndex, oirIndex = engine.register()
+assert engine.register() == [ocrIndex, oirIndex]
+iface = fmbtgti.GUITestInterface(ocrEngine=ocrIndex, oirEngine=oirIndex)
+assert iface.ocrEngine() is engine and iface.oirEngine() is engine
+engine.iface = iface # engine refers to the interface that uses it
+ifaceRef = weakref.ref(iface)
+del engine, iface
+gc.collect()
+assert ifaceRef() == None, "registered engine kept interface alive"
+for kwargs in ({"ocrEngine": ocrIndex}, {"oirEngine": oirIndex}):
+    try:
+        fmbtgti.GUITestInterface(**kwargs)
+    except ValueError:
+        pass
+    else:
+        assert False, "collected engine was used: %s" % (kwargs,)
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti view index keeps large items outside the grid"
+python -c '
+import fmbtgti
+large = fmbtgti.GUIItem("large", (0, 0, 1000, 1000), None)
+wide = fmbtgti.GUIItem("wide", (0, 10, 1000, 20), None)
+small = fmbtgti.GUIItem("small", (5, 5, 25, 25), None)
+index = fmbtgti.ViewIndex([large, small, wide], {}, cellSize=10)
+assert index.findByPos((500, 500)) == [large], "large not found by pos"
+index._buildGrid()
+assert index._largeItems == [large, wide], index._largeItems
+for cellItems in index._grid.values():
+    assert not large in cellItems and not wide in cellItems, "large in grid"
+assert len(index._grid) == 9, sorted(index._grid.keys())
+assert index.findByPos((15, 15)) == [large, small, wide]
+assert index.findByPos((15, 30)) == [large]
+assert index.findByPos((2000, 15)) == []
+assert index.findInRegion((0, 0, 30, 30)) == [small]
+assert index.findInRegion((0, 0, 1000, 1000)) == [large, small, wide]
+assert index.findInRegion((0, 0, 1000, 999)) == [small, wide]
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti view index searches across cell boundaries"
+python -c '
+import random
+import fmbtgti
+rnd = random.Random(4)
+items = []
+for i in range(400):
+    left, top = rnd.randrange(-100, 600), rnd.randrange(-100, 600)
+    if i % 4 == 0:
+        left, top = left // 32 * 32, top // 32 * 32
+    right = left + rnd.choice([0, 1, 31, 32, 33, 64, rnd.randrange(200)])
+    bottom = top + rnd.choice([0, 1, 31, 32, 33, 64, rnd.randrange(200)])
+    items.append(fmbtgti.GUIItem(str(i), (left, top, right, bottom), None))
+index = fmbtgti.ViewIndex(items, {}, cellSize=32)
+def inside(i, x, y):
+    return i.bbox()[0] <= x <= i.bbox()[2] and i.bbox()[1] <= y <= i.bbox()[3]
+def within(i, l, t, r, b):
+    return l <= i.bbox()[0] <= i.bbox()[2] <= r and t <= i.bbox()[1] <= i.bbox()[3] <= b
+for _ in range(1000):
+    x, y = rnd.randrange(-120, 820), rnd.randrange(-120, 820)
+    if rnd.random() < 0.3:
+        x, y = x // 32 * 32 + rnd.choice([-1, 0]), y // 32 * 32 + rnd.choice([-1, 0])
+    assert index.findByPos((x, y)) == [i for i in items if inside(i, x, y)], (x, y)
+    l, t = x, y
+    r, b = l + rnd.randrange(0, 300), t + rnd.randrange(0, 300)
+    assert index.findInRegion((l, t, r, b)) == \
+        [i for i in items if within(i, l, t, r, b)], (l, t, r, b)
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti view index matches android view scans"
+python -c '
+import cgi
+import fmbtandroid
+import viewdata
+data = viewdata.items()
+children = viewdata.children(data)
+def node(item):
+    return ("<node index=\"0\" text=\"%s\" resource-id=\"pkg:id/%s\" class=\"%s\" "
+            "content-desc=\"%s\" bounds=\"[%s,%s][%s,%s]\">%s</node>" % (
+                (cgi.escape(item["text"], True), item["automationId"],
+                 item["className"], item["text"][:3]) + item["bbox"] +
+                ("".join(node(c) for c in children.get(item["id"], [])),)))
+dump = ("<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\" ?>"
+        "<hierarchy rotation=\"0\">%s</hierarchy>" % (node(data[0]),))
+view = fmbtandroid.View("'$SCREENSHOTDIR'", "serial", dump,
+                        intCoords=lambda pos: (int(pos[0]), int(pos[1])))
+assert len(view.viewItems()) == len(data), len(view.viewItems())
+scan = view.findItems
+def searches():
+    for text in set([i["text"] for i in data] + ["Ok", "item 1", "missing"]):
+        yield ("text %r" % (text,), view.findItemsByText(text),
+               scan(lambda i: i.text() == text))
+        yield ("partial text %r" % (text,), view.findItemsByText(text, partial=True),
+               scan(lambda i: i.text() != None and i.text().find(text) != -1))
+        yield ("content-desc %r" % (text,), view.findItemsByContentDesc(text),
+               scan(lambda i: i.content_desc() == text))
+    for aid in set(["id/" + i["automationId"] for i in data] + ["id/missing"]):
+        yield ("id %r" % (aid,), view.findItemsById(aid),
+               scan(lambda i: i.id() == aid))
+        yield ("id %r, count 2" % (aid,), view.findItemsById(aid, count=2),
+               scan(lambda i: i.id() == aid)[:2])
+    for cls in ["Button", "ImageButton", "Text", "Missing"]:
+        yield ("class %r" % (cls,), view.findItemsByClass(cls),
+               scan(lambda i: i.className().find(cls) != -1))
+        yield ("exact class %r" % (cls,), view.findItemsByClass(cls, partial=False),
+               scan(lambda i: i.className() == cls))
+viewdata.compareSearches(view, searches())
+viewdata.compareSearches(view, viewdata.geometrySearches(view))
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti view index matches windows view scans"
+python -c '
+import fmbtwindows
+import viewdata
+data = viewdata.items()
+view = fmbtwindows.View("dump", [
+    {"hash": str(i["id"]), "parent": str(i["parent"]), "ClassName": i["className"],
+     "Name": i["text"], "AutomationId": i["automationId"],
+     "BoundingRectangle": "%s;%s;%s;%s" % (
+         i["bbox"][0], i["bbox"][1],
+         i["bbox"][2] - i["bbox"][0], i["bbox"][3] - i["bbox"][1])}
+    for i in data])
+scan = view.findItems
+def searches():
+    for text in set([i["text"] for i in data] + ["Ok", "item 1", "missing"]):
+        yield ("text %r" % (text,), view.findItemsByText(text),
+               scan(lambda i: text == i._text))
+        yield ("partial text %r" % (text,), view.findItemsByText(text, partial=True),
+               scan(lambda i: text in i._text))
+    for itemId in [1, 2, 250, 501, "aid1", "aid49", "missing"]:
+        yield ("id %r" % (itemId,), view.findItemsById(itemId),
+               scan(lambda i: (itemId == i._itemId or
+                               itemId == i.properties().get("AutomationId", None))))
+    for cls in ["Button", "ImageButton", "Text", "Missing"]:
+        yield ("class %r" % (cls,), view.findItemsByClass(cls),
+               scan(lambda i: cls == i._className))
+        yield ("partial class %r" % (cls,), view.findItemsByClass(cls, partial=True),
+               scan(lambda i: cls in i._className))
+viewdata.compareSearches(view, searches())
+viewdata.compareSearches(view, viewdata.geometrySearches(view))
+' >>$LOGFILE 2>&1 && testpassed || testfailed
+
+teststep "fmbtgti view index matches x11 view scans"
+python -c '
+import sys
+try:
+    import fmbtx11
+except OSError, e: # X libraries missing
+    print e
+    sys.exit(77)
+import viewdata
+data = viewdata.items()
+view = fmbtx11.View("dump", [
+    {"id": i["id"], "parent": i["parent"] or None, "class": i["className"],
+     "text": i["text"], "name": i["text"], "AutomationId": i["automationId"],
+     "bbox": i["bbox"]}
+    for i in data])
+scan = view.findItems
+def searches():
+    for text in set([i["text"] or i["className"] for i in data] + ["Ok", "missing"]):
+        yield ("text %r" % (text,), view.findItemsByText(text),
+               scan(lambda i: text == i._text))
+    for itemId in [1, 2, 250, 501, "aid1", "aid49", "missing"]:
+        yield ("id %r" % (itemId,), view.findItemsById(itemId),
+               scan(lambda i: (itemId == i._itemId or
+                               itemId == i.properties().get("AutomationId", None))))
+    for cls in ["Button", "ImageButton", "Text", "Missing"]:
+        yield ("class %r" % (cls,), view.findItemsByClass(cls),
+               scan(lambda i: cls == i._className))
+        yield ("partial class %r" % (cls,), view.findItemsByClass(cls, partial=True),
+               scan(lambda i: cls in i._className))
+viewdata.compareSearches(view, searches())
+viewdata.compareSearches(view, viewdata.geometrySearches(view))
+' >>$LOGFILE 2>&1
+case $? in
+    0) testpassed;;
+    77) testskipped;;
+    *) testfailed;;
+esac
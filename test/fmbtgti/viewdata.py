@@ -0,0 +1,118 @@
+# fMBT, free Model Based Testing tool
+# Copyright (c) 2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms and conditions of the GNU Lesser General Public
+# License, version 2.1, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St - Fifth Floor, Boston, MA
+# 02110-1301 USA.
+
+"""Synthetic view data for testing view searches
+
+items() returns a tree of items whose bounding boxes are of all
+sizes, cross grid cell boundaries and end exactly on them. Texts,
+ids and class names repeat. positions() and regions() return
+search arguments that hit and miss the items.
+"""
+
+import random
+
+SCREEN = (1080, 1920)
+CELL = 64
+
+def _coord(rnd, limit):
+    if rnd.random() < 0.2:
+        # exactly on a cell boundary
+        return min(limit, rnd.randrange(0, limit // CELL + 1) * CELL)
+    return rnd.randrange(0, limit)
+
+def _bbox(rnd):
+    kind = rnd.random()
+    if kind < 0.05:
+        return (0, 0) + SCREEN # large, kept outside the grid
+    left = _coord(rnd, SCREEN[0])
+    top = _coord(rnd, SCREEN[1])
+    if kind < 0.1:
+        return (left, top, left, top) # empty
+    if kind < 0.3:
+        width, height = rnd.randrange(1, 600), rnd.randrange(1, 900)
+    else:
+        width, height = rnd.randrange(1, 150), rnd.randrange(1, 150)
+    return (left, top,
+            min(SCREEN[0], left + width), min(SCREEN[1], top + height))
+
+def items(count=500, seed=1):
+    """Returns list of dictionaries with keys id, parent (0 for the
+    root), className, text, automationId and bbox. Parents are
+    listed before their children."""
+    rnd = random.Random(seed)
+    rv = [{"id": 1, "parent": 0, "className": "Root", "text": "root",
+           "automationId": "root", "bbox": (0, 0) + SCREEN}]
+    for itemId in xrange(2, count + 1):
+        rv.append({
+            "id": itemId,
+            "parent": rnd.choice(rv)["id"],
+            "className": rnd.choice(["Button", "TextView", "ListView",
+                                     "ImageButton", "EditText"]),
+            "text": rnd.choice(["OK", "Cancel", "Okay", "Settings",
+                                "item %s" % (rnd.randrange(20),), ""]),
+            "automationId": "aid%s" % (rnd.randrange(50),),
+            "bbox": _bbox(rnd)})
+    return rv
+
+def positions(count=300, seed=2):
+    rnd = random.Random(seed)
+    return ([(_coord(rnd, SCREEN[0]), _coord(rnd, SCREEN[1]))
+             for _ in xrange(count)] +
+            [(0, 0), SCREEN, (CELL, CELL), (CELL - 1, CELL)])
+
+def regions(count=300, seed=3):
+    rnd = random.Random(seed)
+    rv = [(0, 0) + SCREEN, (0, 0, CELL, CELL), (CELL, CELL, 2 * CELL, 2 * CELL)]
+    for _ in xrange(count):
+        left, top = _coord(rnd, SCREEN[0]), _coord(rnd, SCREEN[1])
+        rv.append((left, top,
+                   left + rnd.randrange(0, 700), top + rnd.randrange(0, 900)))
+    return rv
+
+def children(itemList):
+    """Returns dictionary item id -> list of child items"""
+    rv = {}
+    for item in itemList:
+        rv.setdefault(item["parent"], []).append(item)
+    return rv
+
+def byArea(items):
+    """Sorts items like findItemsByPos and findItemsInRegion"""
+    return [i for _, i in sorted(
+        [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i)
+         for i in items])]
+
+def compareSearches(view, searches):
+    """Asserts that every (description, found items, items found by
+    a comparator scan) in searches found the same items in the
+    same order"""
+    for description, found, expected in searches:
+        assert found == expected, "%s: %s != %s" % (
+            description, [i.bbox() for i in found],
+            [i.bbox() for i in expected])
+
+def geometrySearches(view):
+    scan = view.findItems
+    for x, y in positions():
+        yield ("pos %s" % ((x, y),), view.findItemsByPos((x, y)),
+               byArea(scan(lambda i: (i.bbox()[0] <= x <= i.bbox()[2] and
+                                      i.bbox()[1] <= y <= i.bbox()[3]))))
+    for l, t, r, b in regions():
+        yield ("region %s" % ((l, t, r, b),),
+               view.findItemsInRegion((l, t, r, b)),
+               byArea(scan(lambda i: (l <= i.bbox()[0] <= i.bbox()[2] <= r and
+                                      t <= i.bbox()[1] <= i.bbox()[3] <= b))))
@@ -28,6 +28,12 @@
 
 #include "eye4graphics.h"
 
+#if defined(__MINGW32__) || defined(_MSC_VER)
+#include <windows.h>
+#else
+#include <pthread.h>
+#endif
+
 #define COLORS 64
 
 #define INCOMPARABLE -1
@@ -78,6 +84,36 @@ public:
 };
 
 static std::map<Search_id, bool, Search_id_less_comparator> imagePixels;
+
+/*
+ * imagePixels and reading pixels of an image are protected by a
+ * mutex so that icons can be searched in parallel threads.
+ */
+class ImagePixelsLock {
+public:
+#if defined(__MINGW32__) || defined(_MSC_VER)
+    ImagePixelsLock() { EnterCriticalSection(mutex()); }
+    ~ImagePixelsLock() { LeaveCriticalSection(mutex()); }
+private:
+    static CRITICAL_SECTION* mutex() {
+        static struct CriticalSection {
+            CriticalSection() { InitializeCriticalSection(&cs); }
+            CRITICAL_SECTION cs;
+        } criticalSection;
+        return &criticalSection.cs;
+    }
+#else
+    ImagePixelsLock() { pthread_mutex_lock(&mutex); }
+    ~ImagePixelsLock() { pthread_mutex_unlock(&mutex); }
+private:
+    static pthread_mutex_t mutex;
+#endif
+};
+
+#if !defined(__MINGW32__) && !defined(_MSC_VER)
+pthread_mutex_t ImagePixelsLock::mutex = PTHREAD_MUTEX_INITIALIZER;
+#endif
+
 typedef std::map<Search_id, bool, Search_id_less_comparator>::iterator ImagePixelsIterator;
 typedef std::vector<BoundingBox>::const_iterator BoundingBoxConstIterator;
 
@@ -368,17 +404,20 @@ static int iconsearch(std::vector<BoundingBox>& retval,
                         static_cast<void*>(needle),
                         threshold, colorMatch, opacityLimit, searchArea);
 
-    ImagePixelsIterator it;
-    if ((it = imagePixels.find(search_id)) != imagePixels.end()) {
-        hay_pixel = it->first.hay_pixel;
-        nee_pixel = it->first.nee_pixel;
-    } else {
-        hay_pixel = getPixels(haystack, searchArea.left, searchArea.top, hayx, hayy);
-        nee_pixel = getPixels(needle, 0, 0, neex, neey);
+    {
+        ImagePixelsLock lock;
+        ImagePixelsIterator it;
+        if ((it = imagePixels.find(search_id)) != imagePixels.end()) {
+            hay_pixel = it->first.hay_pixel;
+            nee_pixel = it->first.nee_pixel;
+        } else {
+            hay_pixel = getPixels(haystack, searchArea.left, searchArea.top, hayx, hayy);
+            nee_pixel = getPixels(needle, 0, 0, neex, neey);
 
-        search_id.hay_pixel = hay_pixel;
-        search_id.nee_pixel = nee_pixel;
-        imagePixels[search_id] = true;
+            search_id.hay_pixel = hay_pixel;
+            search_id.nee_pixel = nee_pixel;
+            imagePixels[search_id] = true;
+        }
     }
 
     if (threshold == 0) {
@@ -580,6 +619,114 @@ int findNextColor(BoundingBox* bbox,
     return 0;
 }
 
+static int findGroupRoot(std::vector<int> &parent, int label)
+{
+    while (parent[label] != label) {
+        parent[label] = parent[parent[label]];
+        label = parent[label];
+    }
+    return label;
+}
+
+int findColorGroups(BoundingBox* bboxes,
+                    const int maxBboxes,
+                    void* image,
+                    const rgb888* color,
+                    const double colorMatch,
+                    const double opacityLimit,
+                    const int invertMatch,
+                    const BoundingBox* searchArea)
+{
+    PixelPacket needle;
+    Image* im = static_cast<Image*>(image);
+    const int xsize = im->columns;
+    const int ysize = im->rows;
+    const int left = searchArea->left > 0 ? searchArea->left : 0;
+    const int top = searchArea->top > 0 ? searchArea->top : 0;
+    const int right = searchArea->right < xsize ? searchArea->right : xsize;
+    const int bottom = searchArea->bottom < ysize ? searchArea->bottom : ysize;
+    if (right <= left || bottom <= top) return 0;
+
+    const PixelPacket* hay_pixel_p = getPixels(im, 0, 0, xsize, ysize);
+    if (!hay_pixel_p) return -1;
+
+    const int colorDiff = 256 - (256 * colorMatch);
+    const unsigned char skipTransparency = 255 * opacityLimit;
+    needle.red = color->red;
+    needle.green = color->green;
+    needle.blue = color->blue;
+
+    /* First pass: label matching pixels, merge labels of pixels
+     * that are adjacent to the left or above. Labels are created in
+     * raster order and the smaller label is always kept as the root,
+     * so the root of a group is created at the first pixel of the
+     * group. */
+    const int width = right - left;
+    std::vector<int> labels(width * (bottom - top), -1);
+    std::vector<int> parent;
+    std::vector<BoundingBox> groups;
+    for (int y = top; y < bottom; y++) {
+        int* row = &labels[(y - top) * width];
+        int* rowAbove = y > top ? row - width : NULL;
+        for (int x = left; x < right; x++) {
+            const PixelPacket* hay_pixel = hay_pixel_p + y * xsize + x;
+            const bool match = same_color(
+                &needle, hay_pixel,
+                colorDiff, skipTransparency);
+            if (match == (invertMatch != 0)) continue;
+            const int i = x - left;
+            const int labelLeft = i > 0 ? row[i - 1] : -1;
+            const int labelAbove = rowAbove ? rowAbove[i] : -1;
+            int label;
+            if (labelLeft == -1 && labelAbove == -1) {
+                label = parent.size();
+                parent.push_back(label);
+                BoundingBox group;
+                group.left = group.right = x;
+                group.top = group.bottom = y;
+                group.error = ((((int) hay_pixel->red & 0xff) << 16) +
+                               (((int) hay_pixel->green & 0xff) << 8) +
+                               ((int) hay_pixel->blue & 0xff));
+                groups.push_back(group);
+            } else if (labelLeft == -1) {
+                label = labelAbove;
+            } else if (labelAbove == -1) {
+                label = labelLeft;
+            } else {
+                const int rootLeft = findGroupRoot(parent, labelLeft);
+                const int rootAbove = findGroupRoot(parent, labelAbove);
+                if (rootLeft < rootAbove) parent[rootAbove] = rootLeft;
+                else parent[rootLeft] = rootAbove;
+                label = labelLeft;
+            }
+            row[i] = label;
+        }
+    }
+
+    /* Second pass: grow bounding boxes of group roots to cover all
+     * pixels of the groups. Top is already correct, groups are
+     * created at their topmost row. */
+    for (int y = top; y < bottom; y++) {
+        const int* row = &labels[(y - top) * width];
+        for (int i = 0; i < width; i++) {
+            if (row[i] == -1) continue;
+            BoundingBox &group = groups[findGroupRoot(parent, row[i])];
+            const int x = left + i;
+            if (x < group.left) group.left = x;
+            if (x > group.right) group.right = x;
+            if (y > group.bottom) group.bottom = y;
+        }
+    }
+
+    int groupCount = 0;
+    for (size_t label = 0; label < parent.size(); label++) {
+        if (parent[label] != (int)label) continue;
+        if (groupCount < maxBboxes) bboxes[groupCount] = groups[label];
+        groupCount++;
+    }
+    return groupCount;
+}
+
 int findNextIcon(BoundingBox* bbox,
                  void* image,
                  void* icon,
@@ -804,10 +951,31 @@ int openedImageIsBlank(void* image)
     return 1;
 }
 
+int openedImagePixels(void* image, char* rgb888)
+{
+    Image* im = static_cast<Image*>(image);
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    MagickBooleanType ok = ExportImagePixels(
+        im, 0, 0, im->columns, im->rows, "RGB", CharPixel,
+        rgb888, exception);
+    exception = DestroyExceptionInfo(exception);
+    return ok == MagickTrue ? 0 : 1;
+}
+
 void* openBlob(const void* blob, const char* pixelorder, int x, int y)
 {
-    // Image* image = new Image(x,y,pixelorder,CharPixel,blob);
-    Image* image = NULL;
+    Image* image;
+    ExceptionInfo *exception;
+    if (blob == NULL || pixelorder == NULL || x <= 0 || y <= 0)
+        return NULL;
+    exception = AcquireExceptionInfo();
+    image = ConstituteImage(x, y, pixelorder, CharPixel, blob, exception);
+    if (image == NULL) {
+        char* debug = getenv("EYE4GRAPHICS_DEBUG");
+        if (debug != NULL)
+            CatchException(exception);
+    }
+    DestroyExceptionInfo(exception);
     return static_cast<void*>(image);
 }
 
@@ -843,6 +1011,7 @@ PixelPacket* getPixels(Image* image, size_t x1, size_t y1, size_t x2, size_t y2)
 
 void closeImage(void* image)
 {
+    ImagePixelsLock lock;
     ImagePixelsIterator it = imagePixels.begin();
     while (it != imagePixels.end()) {
         if (it->first.haystack == image ||
@@ -857,6 +1026,141 @@ void closeImage(void* image)
         DestroyImage(static_cast<Image*>(image));
 }
 
+int saveImage(void* image, const char* imagefile)
+{
+    Image* im = static_cast<Image*>(image);
+    ImageInfo *image_info;
+    MagickBooleanType status;
+    if (im == NULL || imagefile == NULL || strlen(imagefile) >= MaxTextExtent)
+        return -1;
+    image_info = CloneImageInfo((ImageInfo *) NULL);
+    strcpy(image_info->filename, imagefile);
+    strcpy(im->filename, imagefile);
+    status = WriteImage(image_info, im);
+    if (status == MagickFalse) {
+        char* debug = getenv("EYE4GRAPHICS_DEBUG");
+        if (debug != NULL)
+            CatchException(&im->exception);
+    }
+    DestroyImageInfo(image_info);
+    return status == MagickTrue ? 0 : -1;
+}
+
+int imageThreshold(void* image, const double threshold)
+{
+    Image* im = static_cast<Image*>(image);
+    return BilevelImage(im, threshold * QuantumRange) == MagickTrue ? 0 : -1;
+}
+
+int imageGrayscale(void* image)
+{
+    Image* im = static_cast<Image*>(image);
+    return TransformImageColorspace(im, GRAYColorspace) == MagickTrue ? 0 : -1;
+}
+
+int imageDepth(void* image, const int depth)
+{
+    Image* im = static_cast<Image*>(image);
+    return SetImageDepth(im, depth) == MagickTrue ? 0 : -1;
+}
+
+int imageNegate(void* image)
+{
+    Image* im = static_cast<Image*>(image);
+    return NegateImage(im, MagickFalse) == MagickTrue ? 0 : -1;
+}
+
+int imageLevel(void* image, const double black, const double white,
+               const double gamma)
+{
+    Image* im = static_cast<Image*>(image);
+    return LevelImageChannel(im, DefaultChannels,
+                             black * QuantumRange, white * QuantumRange,
+                             gamma) == MagickTrue ? 0 : -1;
+}
+
+static void* newImageDone(Image* image, ExceptionInfo* exception)
+{
+    if (image == NULL) {
+        char* debug = getenv("EYE4GRAPHICS_DEBUG");
+        if (debug != NULL)
+            CatchException(exception);
+    }
+    DestroyExceptionInfo(exception);
+    return static_cast<void*>(image);
+}
+
+void* imageCrop(void* image, const int x, const int y,
+                const int width, const int height)
+{
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    RectangleInfo geometry;
+    Image* cropped;
+    geometry.x = x;
+    geometry.y = y;
+    geometry.width = width;
+    geometry.height = height;
+    cropped = CropImage(static_cast<Image*>(image), &geometry, exception);
+    if (cropped != NULL) {
+        // +repage
+        cropped->page.width = 0;
+        cropped->page.height = 0;
+        cropped->page.x = 0;
+        cropped->page.y = 0;
+    }
+    return newImageDone(cropped, exception);
+}
+
+void* imageRotate(void* image, const double degrees)
+{
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    return newImageDone(
+        RotateImage(static_cast<Image*>(image), degrees, exception),
+        exception);
+}
+
+void* imageResize(void* image, const int width, const int height,
+                  const char* filter)
+{
+    FilterTypes filterType = UndefinedFilter;
+    if (width <= 0 || height <= 0)
+        return NULL;
+    if (filter != NULL && filter[0] != '\0') {
+        ssize_t option = ParseCommandOption(MagickFilterOptions,
+                                            MagickFalse, filter);
+        if (option < 0)
+            return NULL;
+        filterType = static_cast<FilterTypes>(option);
+    }
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    return newImageDone(
+        ResizeImage(static_cast<Image*>(image), width, height,
+                    filterType, 1.0, exception),
+        exception);
+}
+
+void* imageSharpen(void* image, const double radius, const double sigma)
+{
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    return newImageDone(
+        SharpenImage(static_cast<Image*>(image), radius, sigma, exception),
+        exception);
+}
+
+void* imageFlip(void* image)
+{
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    return newImageDone(
+        FlipImage(static_cast<Image*>(image), exception), exception);
+}
+
+void* imageFlop(void* image)
+{
+    ExceptionInfo *exception = AcquireExceptionInfo();
+    return newImageDone(
+        FlopImage(static_cast<Image*>(image), exception), exception);
+}
+
 int bgrx2rgb(char* data, int width, int height)
 {
     int has_nonblack_pixels = 0;
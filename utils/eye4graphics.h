@@ -92,6 +92,39 @@ extern "C" {
                       const int invertMatch,
                       const BoundingBox* searchArea);
 
+    /*
+     * findColorGroups
+     *
+     * Parameters:
+     *   - bboxes (out) - bounding boxes of groups of adjacent pixels
+     *                    that match the color, in the order of the
+     *                    first pixels of the groups. error field of a
+     *                    bounding box is the color of the first pixel
+     *                    (0xRRGGBB).
+     *   - maxBboxes    - max. number of bounding boxes written to bboxes.
+     *   - image        - opened image
+     *   - color        - color to be searched for.
+     *   - colorMatch   - 0.0 - 1.0, required color match.
+     *   - opacityLimit - skip comparing pixels with opacity < opacityLimit
+     *   - invertMatch  - if non-zero, group pixels that do not match the
+     *                    color.
+     *   - searchArea   - bounding box of area in the image to be searched.
+     *
+     * Return value:
+     *   number of groups found, may be greater than maxBboxes.
+     *   -1 on error.
+     */
+
+    EXPORT
+    int findColorGroups(BoundingBox* bboxes,
+                        const int maxBboxes,
+                        void* image,
+                        const rgb888* color,
+                        const double colorMatch,
+                        const double opacityLimit,
+                        const int invertMatch,
+                        const BoundingBox* searchArea);
+
     /*
      * findSingleIcon
      *
@@ -220,15 +253,110 @@ extern "C" {
     EXPORT
     int openedImageIsBlank(void* image);
 
+    /*
+     * openedImagePixels - copy pixels of opened image
+     *
+     * Parameters:
+     *   - image        - opened image
+     *   - rgb888 (out) - buffer of width * height * 3 bytes
+     *
+     * Return value:
+     *    0: success
+     *    1: error
+     */
+    EXPORT
+    int openedImagePixels(void* image, char* rgb888);
+
     EXPORT
     void* openImage(const char* imagefile);
 
+    /*
+     * openBlob - open raw pixel data as an image
+     *
+     * Parameters:
+     *   - blob         - pixel data, 8 bits per channel
+     *   - pixelorder   - order of channels in a pixel, for instance
+     *                    "RGB", "RGBA" or "BGRP" (P skips a padding byte)
+     *   - x, y         - width and height of the image
+     *
+     * Pixel data is copied, blob can be freed after the call.
+     *
+     * Return value:
+     *    opened image or NULL on error. Close with closeImage.
+     */
     EXPORT
     void* openBlob(const void* blob, const char* pixelorder, int x, int y);
 
     EXPORT
     void closeImage(void* image);
 
+    /*
+     * saveImage - write opened image to a file
+     *
+     * File format is chosen by the extension of imagefile.
+     *
+     * Return value:
+     *    0: success
+     *   -1: writing failed
+     */
+    EXPORT
+    int saveImage(void* image, const char* imagefile);
+
+    /*
+     * In-place image operations, the same as ImageMagick convert
+     * options -threshold, -colorspace gray, -depth, -negate and -level.
+     * threshold, black and white are given in range 0.0 - 1.0.
+     *
+     * Return value:
+     *    0: success
+     *   -1: operation failed
+     */
+    EXPORT
+    int imageThreshold(void* image, const double threshold);
+
+    EXPORT
+    int imageGrayscale(void* image);
+
+    EXPORT
+    int imageDepth(void* image, const int depth);
+
+    EXPORT
+    int imageNegate(void* image);
+
+    EXPORT
+    int imageLevel(void* image, const double black, const double white,
+                   const double gamma);
+
+    /*
+     * Image operations that create a new image, the same as
+     * ImageMagick convert options -crop (with +repage), -rotate,
+     * -resize, -sharpen, -flip and -flop. The original image is
+     * not modified. filter is an ImageMagick filter name (like
+     * "Mitchell") or NULL for the default filter.
+     *
+     * Return value:
+     *    new image or NULL on error. Close with closeImage.
+     */
+    EXPORT
+    void* imageCrop(void* image, const int x, const int y,
+                    const int width, const int height);
+
+    EXPORT
+    void* imageRotate(void* image, const double degrees);
+
+    EXPORT
+    void* imageResize(void* image, const int width, const int height,
+                      const char* filter);
+
+    EXPORT
+    void* imageSharpen(void* image, const double radius, const double sigma);
+
+    EXPORT
+    void* imageFlip(void* image);
+
+    EXPORT
+    void* imageFlop(void* image);
+
     /*
      * bgrx2rgb - convert 4-bytes-per-pixel bitmap data (BGRx) to RGB.
      *
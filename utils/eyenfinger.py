@@ -84,6 +84,9 @@ import ctypes
 import platform
 import struct
 import warnings
+import collections
+import hashlib
+import threading
 
 import fmbt_config
 
@@ -105,6 +108,38 @@ _g_lastWindow = None
 
 _g_tesseractPSM = "-psm"
 
+# Output format requested from the tesseract executable. TSV is the
+# fastest to parse, hOCR is used if tesseract does not support TSV.
+_g_tesseractOutputFormat = "tsv"
+
+# The page segmentation mode option and the output format are detected
+# by the first successful tesseract run, see _tesseractCli.
+_g_tesseractCliDetected = False
+_g_tesseractCliLock = threading.Lock()
+
+_g_tesseractVersion = None
+
+# OCR results are cached by the hash of preprocessed pixels and OCR
+# parameters. Memory cache is enabled by default, disk cache (shared
+# by processes) must be enabled with setOcrCacheDir().
+_g_ocrCacheSize = 16 * 1024 * 1024
+_g_ocrCacheDirSize = 256 * 1024 * 1024
+
+# Max number of resident tesseract instances used through libtesseract.
+# Page segmentation modes are read in parallel by separate instances.
+_g_tesseractMaxWorkers = 4
+
+# Tiled OCR splits areas to tiles of at most this size (pixels), the
+# tiles overlap so that words on tile seams are read completely at
+# least in one tile.
+_g_ocrTileSize = 800
+_g_ocrTileOverlap = 48
+try:
+    import multiprocessing
+    _g_ocrTileThreads = multiprocessing.cpu_count()
+except (ImportError, NotImplementedError):
+    _g_ocrTileThreads = 2
+
 _g_defaultClickDryRun = False
 _g_defaultDelayedDrawing = False
 _g_defaultIconMatch = 1.0
@@ -227,6 +262,32 @@ try:
     else:
         raise ImportError("%s cannot load eye4graphics%s" % (__file__, _suffix))
 
+    eye4graphics.openImage.argtypes = [ctypes.c_char_p]
+    eye4graphics.openImage.restype = ctypes.c_void_p
+    eye4graphics.closeImage.argtypes = [ctypes.c_void_p]
+    eye4graphics.openedImageDimensions.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    eye4graphics.openedImagePixels.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    eye4graphics.saveImage.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    eye4graphics.imageThreshold.argtypes = [ctypes.c_void_p, ctypes.c_double]
+    eye4graphics.imageGrayscale.argtypes = [ctypes.c_void_p]
+    eye4graphics.imageDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    eye4graphics.imageNegate.argtypes = [ctypes.c_void_p]
+    eye4graphics.imageLevel.argtypes = [
+        ctypes.c_void_p, ctypes.c_double, ctypes.c_double, ctypes.c_double]
+    eye4graphics.imageCrop.argtypes = [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int]
+    eye4graphics.imageRotate.argtypes = [ctypes.c_void_p, ctypes.c_double]
+    eye4graphics.imageResize.argtypes = [
+        ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_char_p]
+    eye4graphics.imageSharpen.argtypes = [
+        ctypes.c_void_p, ctypes.c_double, ctypes.c_double]
+    eye4graphics.imageFlip.argtypes = [ctypes.c_void_p]
+    eye4graphics.imageFlop.argtypes = [ctypes.c_void_p]
+    for _f in (eye4graphics.imageCrop, eye4graphics.imageRotate,
+               eye4graphics.imageResize, eye4graphics.imageSharpen,
+               eye4graphics.imageFlip, eye4graphics.imageFlop):
+        _f.restype = ctypes.c_void_p
+
     class Bbox(ctypes.Structure):
         _fields_ = [("left", ctypes.c_int32),
                     ("top", ctypes.c_int32),
@@ -238,6 +299,49 @@ except Exception, e:
     eye4graphics = None
     _log('Loading icon recognition library failed: "%s".' % (e,))
 
+try:
+    import ctypes.util
+    for _libname in ["libtesseract.so.5", "libtesseract.so.4",
+                     "libtesseract.so.3", ctypes.util.find_library("tesseract")]:
+        if not _libname:
+            continue
+        try:
+            libtesseract = ctypes.CDLL(_libname)
+            break
+        except OSError:
+            pass
+    else:
+        raise ImportError("cannot load libtesseract")
+    libtesseract.TessVersion.restype = ctypes.c_char_p
+    libtesseract.TessBaseAPICreate.restype = ctypes.c_void_p
+    libtesseract.TessBaseAPIInit1.argtypes = [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int,
+        ctypes.c_void_p, ctypes.c_int]
+    libtesseract.TessBaseAPIInit1.restype = ctypes.c_int
+    libtesseract.TessBaseAPISetPageSegMode.argtypes = [
+        ctypes.c_void_p, ctypes.c_int]
+    libtesseract.TessBaseAPISetImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int,
+        ctypes.c_int, ctypes.c_int]
+    libtesseract.TessBaseAPISetSourceResolution.argtypes = [
+        ctypes.c_void_p, ctypes.c_int]
+    libtesseract.TessBaseAPIGetHOCRText.argtypes = [
+        ctypes.c_void_p, ctypes.c_int]
+    libtesseract.TessBaseAPIGetHOCRText.restype = ctypes.c_void_p
+    try:
+        # TSV output is available in Tesseract 3.05 and later
+        libtesseract.TessBaseAPIGetTsvText.argtypes = [
+            ctypes.c_void_p, ctypes.c_int]
+        libtesseract.TessBaseAPIGetTsvText.restype = ctypes.c_void_p
+    except AttributeError:
+        pass
+    libtesseract.TessDeleteText.argtypes = [ctypes.c_void_p]
+    libtesseract.TessBaseAPIEnd.argtypes = [ctypes.c_void_p]
+    libtesseract.TessBaseAPIDelete.argtypes = [ctypes.c_void_p]
+except Exception, e:
+    libtesseract = None
+    _log('Loading libtesseract failed, using tesseract executable: "%s".' % (e,))
+
 # See struct input_event in /usr/include/linux/input.h
 if platform.architecture()[0] == "32bit":
     _InputEventStructSpec = 'IIHHi'
@@ -294,19 +398,24 @@ atexit.register(_exitHandler)
 
 def _runcmd(cmd):
     global _g_last_runcmd_error
+    exit_status, output, _g_last_runcmd_error = _runcmdWithError(cmd)
+    return exit_status, output
+
+def _runcmdWithError(cmd):
+    """
+    Returns (exit status, stdout, stderr) of cmd. Unlike _runcmd,
+    this does not touch globals and can be called from any thread.
+    """
     p = subprocess.Popen(cmd, shell=isinstance(cmd, basestring),
                          stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output = p.stdout.read()
-    exit_status = p.wait()
-    _g_last_runcmd_error = p.stderr.read()
+    output, error = p.communicate()
+    exit_status = p.returncode
     if exit_status != 0:
         _log("runcmd: %s" % (cmd,))
         _log("exit status: " + str(exit_status))
         _log("stdout: " + output)
-        _log("stderr: " + _g_last_runcmd_error)
-    else:
-        p.stderr.read()
-    return exit_status, output
+        _log("stderr: " + error)
+    return exit_status, output, error
 
 def _runDrawCmd(inputfilename, cmd, outputfilename):
     if not _g_defaultDelayedDrawing:
@@ -333,6 +442,187 @@ def _runDrawCmd(inputfilename, cmd, outputfilename):
     _log("delayed drawing: %s" % (delayedCmd,))
     return (0, "")
 
+def _parsePercent(s):
+    """
+    Returns "60%" as 0.6, None if s is not a percentage.
+    """
+    if not s.endswith("%"):
+        return None
+    return float(s.rstrip("%")) / 100.0
+
+def _parseImageOps(convertArgs):
+    """
+    Parse ImageMagick convert options to image operations that can be
+    executed in-process with eye4graphics.
+
+    Returns list of operations, or None if there are unsupported options.
+    """
+    ops = []
+    filterName = None
+    args = list(convertArgs)
+    try:
+        while args:
+            opt = args.pop(0)
+            if opt == "+repage":
+                continue # every cropped image is repaged
+            elif opt in ["-flip", "-flop", "-negate"]:
+                ops.append((opt[1:],))
+            elif opt == "-colorspace" and args[0].lower() in ["gray", "grey"]:
+                args.pop(0)
+                ops.append(("grayscale",))
+            elif opt == "-type" and args[0].lower() == "grayscale":
+                args.pop(0)
+                ops.append(("grayscale",))
+            elif opt == "-threshold":
+                threshold = _parsePercent(args.pop(0))
+                if threshold == None:
+                    return None
+                ops.append(("threshold", threshold))
+            elif opt == "-depth":
+                ops.append(("depth", int(args.pop(0))))
+            elif opt == "-rotate":
+                ops.append(("rotate", float(args.pop(0))))
+            elif opt == "-crop":
+                m = re.match("^([0-9]+)x([0-9]+)([+-][0-9]+)([+-][0-9]+)$", args.pop(0))
+                if not m:
+                    return None
+                width, height, x, y = [int(g) for g in m.groups()]
+                ops.append(("crop", x, y, width, height))
+            elif opt == "-filter":
+                filterName = args.pop(0)
+            elif opt == "-resize":
+                geometry = args.pop(0)
+                m = re.match("^([0-9]*)x([0-9]*)(!?)$", geometry)
+                if m and (m.group(1) or m.group(2)):
+                    width = m.group(1) and int(m.group(1)) or None
+                    height = m.group(2) and int(m.group(2)) or None
+                    ops.append(("resize", width, height, m.group(3) == "!",
+                                 filterName))
+                elif re.match("^[0-9]+(\.[0-9]*)?%$", geometry):
+                    ops.append(("resizepercent", _parsePercent(geometry),
+                                 filterName))
+                else:
+                    return None
+            elif opt == "-sharpen":
+                radiusSigma = args.pop(0).split("x")
+                if len(radiusSigma) == 1:
+                    radiusSigma.append("1.0")
+                radius, sigma = [float(v) for v in radiusSigma]
+                ops.append(("sharpen", radius, sigma))
+            elif opt == "-level":
+                levels = args.pop(0).split(",")
+                if len(levels) == 2:
+                    levels.append("1.0")
+                if len(levels) != 3 or not "%" in levels[0] or not "%" in levels[1]:
+                    return None
+                ops.append(("level",
+                            float(levels[0].rstrip("%")) / 100.0,
+                            float(levels[1].rstrip("%")) / 100.0,
+                            float(levels[2])))
+            else:
+                return None
+    except (IndexError, ValueError):
+        return None
+    return ops
+
+def _applyImageOps(image, ops):
+    """
+    Execute image operations parsed by _parseImageOps on opened
+    image. The image is either modified in-place or closed and
+    replaced by a new image.
+
+    Returns the resulting image. On error the image is closed and
+    EyenfingerError is raised.
+    """
+    for op in ops:
+        name, args = op[0], op[1:]
+        newImage = None
+        if name in ["threshold", "grayscale", "depth", "negate", "level"]:
+            func = {"threshold": eye4graphics.imageThreshold,
+                    "grayscale": eye4graphics.imageGrayscale,
+                    "depth": eye4graphics.imageDepth,
+                    "negate": eye4graphics.imageNegate,
+                    "level": eye4graphics.imageLevel}[name]
+            if func(image, *args) == 0:
+                continue
+        elif name in ["resize", "resizepercent"]:
+            struct_bbox = Bbox(0, 0, 0, 0, 0)
+            eye4graphics.openedImageDimensions(ctypes.byref(struct_bbox), image)
+            origWidth, origHeight = struct_bbox.right, struct_bbox.bottom
+            if name == "resizepercent":
+                scale, filterName = args
+                width = int(round(origWidth * scale))
+                height = int(round(origHeight * scale))
+            else:
+                width, height, exact, filterName = args
+                if width == None:
+                    width = int(round(origWidth * float(height) / origHeight))
+                elif height == None:
+                    height = int(round(origHeight * float(width) / origWidth))
+                elif not exact:
+                    scale = min(float(width) / origWidth,
+                                float(height) / origHeight)
+                    width = int(round(origWidth * scale))
+                    height = int(round(origHeight * scale))
+            newImage = eye4graphics.imageResize(
+                image, max(1, width), max(1, height), filterName)
+        else:
+            func = {"crop": eye4graphics.imageCrop,
+                    "rotate": eye4graphics.imageRotate,
+                    "sharpen": eye4graphics.imageSharpen,
+                    "flip": eye4graphics.imageFlip,
+                    "flop": eye4graphics.imageFlop}[name]
+            newImage = func(image, *args)
+        eye4graphics.closeImage(image)
+        if not newImage:
+            raise EyenfingerError("image operation %s%s failed" % (name, args))
+        image = newImage
+    return image
+
+def convertImage(srcFilename, convertArgs, dstFilename):
+    """
+    Convert image like ImageMagick convert. Supported options are
+    executed in-process with eye4graphics, others by running convert.
+
+    Parameters:
+        srcFilename  source image.
+        convertArgs  list or string of convert options.
+        dstFilename  resulting image.
+
+    Supported options: -threshold N%, -colorspace gray, -type
+    grayscale, -depth, -negate, -level B%,W%[,G], -crop WxH+X+Y,
+    +repage, -rotate, -filter, -resize WxH, Wx, xH, WxH! or N%,
+    -sharpen, -flip and -flop.
+
+    Returns pair (exit status, output) as if convert was executed.
+    """
+    return _convertImage(srcFilename, convertArgs, dstFilename)[:2]
+
+def _convertImage(srcFilename, convertArgs, dstFilename):
+    """
+    convertImage that returns (exit status, output, error).
+    """
+    if isinstance(convertArgs, basestring):
+        convertArgs = shlex.split(convertArgs)
+    if eye4graphics:
+        ops = _parseImageOps(convertArgs)
+    else:
+        ops = None
+    if ops != None:
+        image = eye4graphics.openImage(srcFilename)
+        if image:
+            try:
+                image = _applyImageOps(image, ops)
+            except EyenfingerError, e:
+                _log("in-process convert failed: %s" % (e,))
+            else:
+                status = eye4graphics.saveImage(image, dstFilename)
+                eye4graphics.closeImage(image)
+                if status == 0:
+                    return 0, "", ""
+    return _runcmdWithError([fmbt_config.imagemagick_convert, srcFilename] +
+                            convertArgs + [dstFilename])
+
 def _safeForShell(s):
     # convert all non-ascii and bad chars to _
     try: s = unicode(s, "utf-8")
@@ -476,6 +766,704 @@ def imageSize(imageFilename):
         return None, None
     return struct_bbox.right, struct_bbox.bottom
 
+class _OcrCache(object):
+    """
+    Size-bounded cache of hOCR results in memory and, optionally, in a
+    directory that can be shared by many processes. Least recently
+    used results are evicted first.
+    """
+    def __init__(self, size, directory=None, directorySize=None):
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict() # key -> OCR output
+        self._memoryUsage = 0
+        self._size = size
+        self._directory = directory
+        self._directorySize = directorySize
+        self._hits = 0
+        self._diskHits = 0
+        self._misses = 0
+
+    def enabled(self):
+        return self._size > 0 or self._directory != None
+
+    def _diskFilename(self, key):
+        return os.path.join(self._directory, key + ".ocr")
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._hits += 1
+                # move to the most recently used end
+                hocr = self._memory.pop(key)
+                self._memory[key] = hocr
+                return hocr
+        if self._directory != None:
+            try:
+                filename = self._diskFilename(key)
+                hocr = file(filename, "rb").read()
+                os.utime(filename, None) # used recently
+            except (IOError, OSError):
+                hocr = None
+            if hocr != None:
+                with self._lock:
+                    self._hits += 1
+                    self._diskHits += 1
+                self._putMemory(key, hocr)
+                return hocr
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key, hocr):
+        self._putMemory(key, hocr)
+        if self._directory != None:
+            self._putDisk(key, hocr)
+
+    def _putMemory(self, key, hocr):
+        with self._lock:
+            if len(hocr) > self._size:
+                return
+            if key in self._memory:
+                self._memoryUsage -= len(self._memory.pop(key))
+            self._memory[key] = hocr
+            self._memoryUsage += len(hocr)
+            self._shrinkMemory(self._size)
+
+    def _shrinkMemory(self, size):
+        while self._memoryUsage > size:
+            _, hocr = self._memory.popitem(last=False)
+            self._memoryUsage -= len(hocr)
+
+    def _putDisk(self, key, hocr):
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+            fd, tmpFilename = tempfile.mkstemp(
+                dir=self._directory, suffix=".tmp")
+            os.write(fd, hocr)
+            os.close(fd)
+            try:
+                # rename is atomic, other processes never see
+                # partially written results.
+                os.rename(tmpFilename, self._diskFilename(key))
+            except OSError:
+                os.remove(tmpFilename)
+            self._shrinkDisk(self._directorySize)
+        except (IOError, OSError), e:
+            _log("writing OCR cache to %s failed: %s" % (self._directory, e))
+
+    def _shrinkDisk(self, size):
+        entries = []
+        usage = 0
+        for name in os.listdir(self._directory):
+            if not name.endswith(".ocr"):
+                continue
+            filename = os.path.join(self._directory, name)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue # removed by another process
+            entries.append((st.st_mtime, st.st_size, filename))
+            usage += st.st_size
+        entries.sort()
+        for _, fileSize, filename in entries:
+            if usage <= size:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            usage -= fileSize
+
+    def clear(self):
+        with self._lock:
+            self._shrinkMemory(0)
+            self._hits = 0
+            self._diskHits = 0
+            self._misses = 0
+        if self._directory != None and os.path.isdir(self._directory):
+            self._shrinkDisk(0)
+
+    def setSize(self, size):
+        with self._lock:
+            self._size = size
+            self._shrinkMemory(size)
+
+    def setDirectory(self, directory, directorySize):
+        self._directory = directory
+        self._directorySize = directorySize
+        if directory != None and os.path.isdir(directory):
+            self._shrinkDisk(directorySize)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self._hits,
+                    "diskHits": self._diskHits,
+                    "misses": self._misses,
+                    "results": len(self._memory),
+                    "usage": self._memoryUsage,
+                    "size": self._size,
+                    "directory": self._directory,
+                    "directorySize": self._directorySize}
+
+_g_ocrCache = _OcrCache(_g_ocrCacheSize, None, _g_ocrCacheDirSize)
+
+def setOcrCacheSize(size):
+    """
+    Set the memory budget of the OCR result cache.
+
+    Parameters:
+        size         estimated maximum memory usage in bytes of
+                     cached hOCR results. 0 disables the memory cache.
+                     The default is 16 MB.
+    """
+    _g_ocrCache.setSize(int(size))
+
+def setOcrCacheDir(directory, size=_g_ocrCacheDirSize):
+    """
+    Store OCR results in the directory, too. Many processes can share
+    the same directory, and results survive over test runs.
+
+    Parameters:
+        directory    directory for cached results, None disables the
+                     disk cache. The default is None.
+
+        size         maximum disk usage in bytes. Least recently used
+                     results are removed when the size is
+                     exceeded. The default is 256 MB.
+    """
+    _g_ocrCache.setDirectory(directory, int(size))
+
+def clearOcrCache():
+    """
+    Remove all cached OCR results and reset cache statistics.
+    """
+    _g_ocrCache.clear()
+
+def ocrCacheStats():
+    """
+    Returns OCR result cache statistics in a dictionary with keys
+    "hits", "diskHits", "misses", "results", "usage", "size",
+    "directory" and "directorySize".
+    """
+    return _g_ocrCache.stats()
+
+class _TesseractWorkers(object):
+    """
+    Pool of resident tesseract instances (libtesseract API handles).
+    Language models are loaded only when an instance is created,
+    instead of every time the tesseract executable is run. Instances
+    are initialised for certain lang and configfile, and idle ones
+    are reused for the same parameters.
+    """
+    _OEM_DEFAULT = 3
+    _SOURCE_RESOLUTION = 70 # tesseract executable defaults to this
+
+    def __init__(self, maxWorkers):
+        self._maxWorkers = maxWorkers
+        self._workerCount = 0
+        self._idle = [] # [((lang, configs), handle), ...], latest last
+        self._available = threading.Condition(threading.Lock())
+
+    def enabled(self):
+        return libtesseract != None and self._maxWorkers > 0
+
+    def maxWorkers(self):
+        return self._maxWorkers
+
+    def setMaxWorkers(self, maxWorkers):
+        with self._available:
+            self._maxWorkers = maxWorkers
+            while self._workerCount > max(maxWorkers, 0) and self._idle:
+                self._deleteHandle(self._idle.pop(0)[1])
+            self._available.notifyAll()
+
+    def version(self):
+        return libtesseract.TessVersion()
+
+    def _newHandle(self, lang, configs):
+        handle = libtesseract.TessBaseAPICreate()
+        configArray = (ctypes.c_char_p * len(configs))(*configs)
+        if libtesseract.TessBaseAPIInit1(
+                handle, None, lang, self._OEM_DEFAULT,
+                configArray, len(configs)) != 0:
+            libtesseract.TessBaseAPIDelete(handle)
+            raise NoOCRResults('Initializing tesseract failed, lang="%s", configfile=%s'
+                               % (lang, configs))
+        return handle
+
+    def _deleteHandle(self, handle):
+        libtesseract.TessBaseAPIEnd(handle)
+        libtesseract.TessBaseAPIDelete(handle)
+        self._workerCount -= 1
+
+    def _acquire(self, key):
+        with self._available:
+            while True:
+                for index in xrange(len(self._idle) - 1, -1, -1):
+                    if self._idle[index][0] == key:
+                        return self._idle.pop(index)[1]
+                if self._workerCount < self._maxWorkers:
+                    break
+                if self._idle:
+                    # replace the least recently used idle instance
+                    self._deleteHandle(self._idle.pop(0)[1])
+                    break
+                self._available.wait()
+            self._workerCount += 1
+        try:
+            return self._newHandle(*key)
+        except:
+            with self._available:
+                self._workerCount -= 1
+                self._available.notify()
+            raise
+
+    def _release(self, key, handle):
+        with self._available:
+            if self._workerCount > self._maxWorkers:
+                self._deleteHandle(handle)
+            else:
+                self._idle.append((key, handle))
+            self._available.notify()
+
+    def _read(self, key, imagePixels, psm):
+        width, height, pixels = imagePixels
+        handle = self._acquire(key)
+        try:
+            libtesseract.TessBaseAPISetPageSegMode(handle, psm)
+            libtesseract.TessBaseAPISetImage(
+                handle, pixels, width, height, 3, width * 3)
+            libtesseract.TessBaseAPISetSourceResolution(
+                handle, self._SOURCE_RESOLUTION)
+            if hasattr(libtesseract, "TessBaseAPIGetTsvText"):
+                text_p = libtesseract.TessBaseAPIGetTsvText(handle, 0)
+            else:
+                text_p = libtesseract.TessBaseAPIGetHOCRText(handle, 0)
+            if not text_p:
+                raise NoOCRResults("Tesseract did not return OCR results (psm %s)" % (psm,))
+            try:
+                return ctypes.string_at(text_p)
+            finally:
+                libtesseract.TessDeleteText(text_p)
+        finally:
+            self._release(key, handle)
+
+    def read(self, imagePixels, lang, configfile, psms):
+        """
+        Returns list of OCR outputs (TSV, or hOCR if TSV is not
+        supported), one for each page segmentation mode in
+        psms. Modes are read in parallel.
+        """
+        if isinstance(configfile, basestring):
+            configs = (configfile,)
+        elif isinstance(configfile, list) or isinstance(configfile, tuple):
+            configs = tuple(configfile)
+        else:
+            configs = ()
+        key = (lang, configs)
+        if len(psms) == 1:
+            return [self._read(key, imagePixels, psms[0])]
+        results = [None] * len(psms)
+        errors = []
+        def read(index):
+            try:
+                results[index] = self._read(key, imagePixels, psms[index])
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=read, args=(index,))
+                   for index in xrange(len(psms))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return results
+
+_g_tesseractWorkers = _TesseractWorkers(_g_tesseractMaxWorkers)
+
+def setTesseractWorkers(maxWorkers):
+    """
+    Set the maximum number of resident tesseract instances.
+
+    Parameters:
+        maxWorkers   max number of libtesseract instances kept
+                     loaded. 0 runs the tesseract executable for
+                     each OCR instead. The default is 4.
+
+    Resident instances are used only if libtesseract is found.
+    """
+    _g_tesseractWorkers.setMaxWorkers(int(maxWorkers))
+
+def tesseractWorkers():
+    """
+    Returns the maximum number of resident tesseract instances, or
+    0 if the tesseract executable is used for OCR.
+    """
+    if not _g_tesseractWorkers.enabled():
+        return 0
+    return _g_tesseractWorkers.maxWorkers()
+
+def _imagePixels(imageFilename):
+    """
+    Returns (width, height, rgb888 pixel data) of the image, or None
+    if the image cannot be read.
+    """
+    if eye4graphics == None:
+        return None
+    image = eye4graphics.openImage(imageFilename)
+    if not image:
+        return None
+    try:
+        struct_bbox = Bbox(0, 0, 0, 0, 0)
+        eye4graphics.openedImageDimensions(ctypes.byref(struct_bbox), image)
+        pixels = ctypes.create_string_buffer(
+            struct_bbox.right * struct_bbox.bottom * 3)
+        if eye4graphics.openedImagePixels(image, pixels) != 0:
+            return None
+        return (struct_bbox.right, struct_bbox.bottom, pixels.raw)
+    finally:
+        eye4graphics.closeImage(image)
+
+def _pixelDigest(imagePixels):
+    """
+    Returns a hash of dimensions and pixels returned by _imagePixels.
+    """
+    width, height, pixels = imagePixels
+    digest = hashlib.sha1("%sx%s\n" % (width, height))
+    digest.update(pixels)
+    return digest.hexdigest()
+
+def _tesseractCli(imageFilename, lang, psm, configfile,
+                  outputBase=SCREENSHOT_FILENAME):
+    """
+    Run tesseract executable on the image, returns TSV output, or
+    hOCR output if tesseract does not support TSV.
+    """
+    if not _g_tesseractCliDetected:
+        # Parallel reads (iReadTiles) wait until the first run has
+        # detected the options.
+        with _g_tesseractCliLock:
+            if not _g_tesseractCliDetected:
+                return _tesseractCliDetect(imageFilename, lang, psm,
+                                           configfile, outputBase)
+    exit_status, error = _runTesseract(imageFilename, lang, psm,
+                                       configfile, outputBase)
+    if exit_status != 0:
+        raise NoOCRResults("Tesseract returned exit status (%s): %s"
+                           % (exit_status, error))
+    return _tesseractOutput(outputBase)
+
+def _tesseractCliDetect(imageFilename, lang, psm, configfile, outputBase):
+    """
+    Run tesseract executable like _tesseractCli, fall back to options
+    and output formats that older tesseract versions support.
+    """
+    global _g_tesseractPSM
+    global _g_tesseractOutputFormat
+    global _g_tesseractCliDetected
+    exit_status, error = _runTesseract(imageFilename, lang, psm,
+                                       configfile, outputBase)
+    if (exit_status == 1 and "'-psm'" in error
+        and _g_tesseractPSM == "-psm"):
+        # Tesseract versions up to 4.x.x beta take "-psm", but
+        # from some point on they want "--psm". Detect the error
+        # due to wrong format and switch to another, if needed.
+        _g_tesseractPSM = "--psm"
+        exit_status, error = _runTesseract(imageFilename, lang, psm,
+                                           configfile, outputBase)
+    if (exit_status != 0 and _g_tesseractOutputFormat == "tsv"
+        and "tsv" in error):
+        # Tesseract older than 3.05 does not have the tsv config.
+        _g_tesseractOutputFormat = "hocr"
+        exit_status, error = _runTesseract(imageFilename, lang, psm,
+                                           configfile, outputBase)
+    if (exit_status == 0 and _g_tesseractOutputFormat == "tsv"
+        and not os.access(outputBase + ".tsv", os.R_OK)):
+        # Unknown configs are ignored by some tesseract versions,
+        # fall back to hOCR for good.
+        _g_tesseractOutputFormat = "hocr"
+        exit_status, error = _runTesseract(imageFilename, lang, psm,
+                                           configfile, outputBase)
+    if exit_status != 0:
+        raise NoOCRResults("Tesseract returned exit status (%s): %s"
+                           % (exit_status, error))
+    _g_tesseractCliDetected = True
+    return _tesseractOutput(outputBase)
+
+def _runTesseract(imageFilename, lang, psm, configfile, outputBase):
+    """
+    Run tesseract executable with detected options, returns
+    (exit status, error).
+    """
+    tesseract_cmd = ["tesseract", imageFilename, outputBase,
+                     "-l", lang, _g_tesseractPSM, str(psm)]
+    if isinstance(configfile, basestring):
+        tesseract_cmd += [configfile]
+    elif isinstance(configfile, list) or isinstance(configfile, tuple):
+        tesseract_cmd += configfile
+    tesseract_cmd.append(_g_tesseractOutputFormat)
+    exit_status, _, error = _runcmdWithError(tesseract_cmd)
+    return exit_status, error
+
+def _tesseractOutput(outputBase):
+    if _g_tesseractOutputFormat == "tsv":
+        if not os.access(outputBase + ".tsv", os.R_OK):
+            raise NoOCRResults("TSV output missing from tesseract.\n")
+        return file(outputBase + ".tsv").read()
+
+    hocr_filename = outputBase + ".html" # Tesseract 3.02
+
+    if not os.access(hocr_filename, os.R_OK):
+        hocr_filename = outputBase + ".hocr" # Tesseract 3.03
+        if not os.access(hocr_filename, os.R_OK):
+            raise NoOCRResults("HOCR output missing. Tesseract OCR 3.02 or greater required.\n")
+    return file(hocr_filename).read()
+
+def _tesseractVersionString():
+    global _g_tesseractVersion
+    if _g_tesseractWorkers.enabled():
+        return _g_tesseractWorkers.version()
+    if _g_tesseractVersion == None:
+        try:
+            _, output, error = _runcmdWithError(["tesseract", "--version"])
+            # old versions print version to stderr
+            _g_tesseractVersion = (output + error).strip().split("\n")[0]
+        except OSError:
+            _g_tesseractVersion = ""
+    return _g_tesseractVersion
+
+def _readWords(origImage, (orig_width, orig_height), (x1, y1, x2, y2),
+               preprocess, ocrPageSegModes, lang, configfile,
+               readImage, outputBase):
+    """
+    OCR area (x1, y1, x2, y2) of origImage. readImage is the filename
+    of the preprocessed image, tesseract executable writes its output
+    to outputBase + ".tsv" or ".hocr". Returns dictionary word ->
+    [OcrWord, ...] with coordinates in origImage.
+    """
+    # convert to text
+    if (x1, y1, x2, y2) == (0, 0, orig_width, orig_height):
+        croparea = []
+        wordXOffset = 0
+        wordYOffset = 0
+    else:
+        croparea = ["-crop", "%sx%s+%s+%s" % (x2-x1, y2-y1, x1, y1), "+repage"]
+        wordXOffset = x1
+        wordYOffset = y1
+        # rescale possible resize preprocessing parameter
+        resize_m = re.search('-resize ([0-9]+)x([0-9]*)', preprocess)
+        if resize_m:
+            origXResize = int(resize_m.group(1))
+            newXResize = int(origXResize/float(orig_width) * (x2-x1))
+            preprocess = (preprocess[:resize_m.start()] +
+                          ("-resize %sx" % (newXResize,)) +
+                          preprocess[resize_m.end():])
+    # the preprocessed image is the same for all page segmentation modes
+    exit_status, output, error = _convertImage(
+        origImage, croparea + shlex.split(preprocess), readImage)
+    if exit_status != 0:
+        raise NoOCRResults("Convert returned exit status (%s): %s"
+                           % (exit_status, error))
+
+    if _g_ocrCache.enabled() or _g_tesseractWorkers.enabled():
+        imagePixels = _imagePixels(readImage)
+    else:
+        imagePixels = None
+
+    # OCR results for each page segmentation mode, read from the
+    # cache or by tesseract workers running in parallel.
+    outputs = {}
+    cacheKeys = {}
+    if imagePixels != None and _g_ocrCache.enabled():
+        pixelDigest = _pixelDigest(imagePixels)
+        for psm in ocrPageSegModes:
+            cacheKeys[psm] = hashlib.sha1(repr(
+                (pixelDigest, lang, psm, configfile,
+                 _tesseractVersionString()))).hexdigest()
+            output = _g_ocrCache.get(cacheKeys[psm])
+            if output != None:
+                outputs[psm] = output
+    unreadPsms = [psm for psm in ocrPageSegModes if not psm in outputs]
+    if imagePixels != None and unreadPsms and _g_tesseractWorkers.enabled():
+        for psm, output in zip(unreadPsms, _g_tesseractWorkers.read(
+                imagePixels, lang, configfile, unreadPsms)):
+            outputs[psm] = output
+            if psm in cacheKeys:
+                _g_ocrCache.put(cacheKeys[psm], output)
+
+    words = {}
+    pageSize = None
+    for psm in ocrPageSegModes:
+        if psm in outputs:
+            output = outputs[psm]
+        else:
+            output = _tesseractCli(readImage, lang, psm, configfile,
+                                   outputBase)
+            if psm in cacheKeys:
+                _g_ocrCache.put(cacheKeys[psm], output)
+        # store every word and its coordinates
+        pageSize, psmWords = _ocrWords(output)
+        words.update(psmWords)
+
+    # convert word coordinates to the unscaled pixmap
+    if not pageSize:
+        raise NoOCRResults("Could not read page size from OCR results of %s" % (readImage,))
+
+    scaled_width, scaled_height = float(pageSize[0]) / (float(x2-x1)/orig_width), float(pageSize[1]) / (float(y2-y1)/orig_height)
+
+    for word in sorted(words.keys()):
+        for appearance, ocrWord in enumerate(words[word]):
+            wordid, middle, bbox = ocrWord
+            words[word][appearance] = ocrWord.moved(
+                (int(middle[0]/scaled_width * orig_width) + wordXOffset,
+                 int(middle[1]/scaled_height * orig_height) + wordYOffset),
+                (int(bbox[0]/scaled_width * orig_width) + wordXOffset,
+                 int(bbox[1]/scaled_height * orig_height) + wordYOffset,
+                 int(bbox[2]/scaled_width * orig_width) + wordXOffset,
+                 int(bbox[3]/scaled_height * orig_height) + wordYOffset))
+            _log('found "' + word + '": (' + str(bbox[0]) + ', ' + str(bbox[1]) + ')')
+    return words
+
+def ocrTiles(areas, tileSize=None, overlap=None):
+    """
+    Split areas to overlapping tiles.
+
+    Parameters:
+        areas        list of (left, top, right, bottom) areas in pixels.
+
+        tileSize     maximum width and height of a tile without
+                     overlap. The default is 800.
+
+        overlap      number of pixels by which neighbour tiles overlap.
+                     The default is 48.
+
+    Returns list of pairs (tile, core), where tile is an area to be
+    read and core is the part of the tile for which the tile is
+    responsible. Cores of tiles of an area do not overlap.
+    """
+    if tileSize == None:
+        tileSize = _g_ocrTileSize
+    if overlap == None:
+        overlap = _g_ocrTileOverlap
+    def split(start, end):
+        count = max(1, int(math.ceil((end - start) / float(tileSize))))
+        step = (end - start) / float(count)
+        return [(start + int(round(i * step)), start + int(round((i + 1) * step)))
+                for i in xrange(count)]
+    tiles = []
+    for left, top, right, bottom in areas:
+        for coreTop, coreBottom in split(top, bottom):
+            for coreLeft, coreRight in split(left, right):
+                tiles.append(((max(left, coreLeft - overlap),
+                               max(top, coreTop - overlap),
+                               min(right, coreRight + overlap),
+                               min(bottom, coreBottom + overlap)),
+                              (coreLeft, coreTop, coreRight, coreBottom)))
+    return tiles
+
+def _bboxOverlap(bbox1, bbox2):
+    """
+    Returns intersection area / smaller area of two bounding boxes.
+    """
+    width = min(bbox1[2], bbox2[2]) - max(bbox1[0], bbox2[0])
+    height = min(bbox1[3], bbox2[3]) - max(bbox1[1], bbox2[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    smaller = min((bbox1[2] - bbox1[0]) * (bbox1[3] - bbox1[1]),
+                  (bbox2[2] - bbox2[0]) * (bbox2[3] - bbox2[1]))
+    return width * height / float(max(1, smaller))
+
+def iReadTiles(source, areas=None, preprocess=None, ocrPageSegModes=(3,), lang="eng", configfile=None, tileSize=None, overlap=None, threads=None):
+    """
+    Read areas of the image with OCR in overlapping tiles that are
+    recognized in parallel. Does not change words read with iRead.
+
+    Parameters:
+        source       name of the image file.
+
+        areas        list of (left, top, right, bottom) areas in
+                     pixels. The default is the whole image.
+
+        preprocess, ocrPageSegModes, lang, configfile
+                     see iRead.
+
+        tileSize, overlap
+                     see ocrTiles.
+
+        threads      max number of tiles read in parallel. The
+                     default is the number of CPUs.
+
+    Returns dictionary word -> [OcrWord, ...]. Words
+    on tile seams are reported only once, by the tile whose core
+    contains the middle of the word. Word ids are prefixed by tile
+    numbers so that words of a tile stay in reading order.
+    """
+    width, height = imageSize(source)
+    if width == None:
+        raise EyenfingerError('Cannot read image "%s"' % (source,))
+    if areas == None:
+        areas = [(0, 0, width, height)]
+    if preprocess == None:
+        preprocess = _g_preprocess
+    if threads == None:
+        threads = _g_ocrTileThreads
+    tiles = [(tile, core) for tile, core in ocrTiles(areas, tileSize, overlap)
+             if tile[2] > tile[0] and tile[3] > tile[1]]
+    tileWords = [None] * len(tiles)
+    errors = []
+    nextTile = [0]
+    lock = threading.Lock()
+    def readTiles():
+        while not errors:
+            with lock:
+                tileIndex = nextTile[0]
+                nextTile[0] += 1
+            if tileIndex >= len(tiles):
+                return
+            fd, readImage = tempfile.mkstemp(
+                dir=_g_tempdir, prefix="tile-", suffix=".png")
+            os.close(fd)
+            try:
+                tileWords[tileIndex] = _readWords(
+                    source, (width, height), tiles[tileIndex][0],
+                    preprocess, ocrPageSegModes, lang, configfile,
+                    readImage, readImage[:-4])
+            except Exception, e:
+                errors.append(e)
+            finally:
+                for filename in (readImage, readImage[:-4] + ".tsv",
+                                 readImage[:-4] + ".hocr",
+                                 readImage[:-4] + ".html"):
+                    if os.access(filename, os.F_OK):
+                        os.remove(filename)
+    workers = [threading.Thread(target=readTiles)
+               for _ in xrange(max(1, min(threads, len(tiles))))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+    # merge words of tiles
+    words = {}
+    for tileIndex, (tile, core) in enumerate(tiles):
+        for word, appearances in tileWords[tileIndex].iteritems():
+            for ocrWord in appearances:
+                wordid, middle, bbox = ocrWord
+                if not (core[0] <= middle[0] < core[2] and
+                        core[1] <= middle[1] < core[3]):
+                    continue # belongs to a neighbour tile
+                if [b for _, _, b in words.get(word, [])
+                    if _bboxOverlap(b, bbox) > 0.5]:
+                    continue # found already from overlapping area
+                words.setdefault(word, []).append(ocrWord.moved(
+                    middle, bbox,
+                    "word_%s_%s" % (tileIndex + 1, wordid[5:])))
+    return words
+
 def iRead(windowId = None, source = None, preprocess = None, ocr=None, capture=None, ocrArea=(0, 0, 1.0, 1.0), ocrPageSegModes=(3,), lang="eng", configfile=None):
     """
     DEPRECATED - use fmbtx11.Screen.refreshScreenshot instead.
@@ -524,7 +1512,6 @@ def iRead(windowId = None, source = None, preprocess = None, ocr=None, capture=N
     global _g_words
     global _g_readImage
     global _g_origImage
-    global _g_tesseractPSM
 
     _g_words = None
     _g_readImage = None
@@ -539,11 +1526,12 @@ def iRead(windowId = None, source = None, preprocess = None, ocr=None, capture=N
         # take a screenshot
         import fmbtx11
         fmbtx11.Screen().refreshScreenshot().save(SCREENSHOT_FILENAME + ".png")
-        _runcmd("%s %s.png -crop %sx%s+%s+%s +repage '%s'" %
-               (fmbt_config.imagemagick_convert, SCREENSHOT_FILENAME,
-                _g_windowSizes[_g_lastWindow][0], _g_windowSizes[_g_lastWindow][1],
-                _g_windowOffsets[_g_lastWindow][0], _g_windowOffsets[_g_lastWindow][1],
-                SCREENSHOT_FILENAME))
+        convertImage(SCREENSHOT_FILENAME + ".png",
+                     ["-crop", "%sx%s+%s+%s" % (
+                         _g_windowSizes[_g_lastWindow][0], _g_windowSizes[_g_lastWindow][1],
+                         _g_windowOffsets[_g_lastWindow][0], _g_windowOffsets[_g_lastWindow][1]),
+                      "+repage"],
+                     SCREENSHOT_FILENAME)
         source = SCREENSHOT_FILENAME
     else:
         iUseImageAsWindow(source)
@@ -566,84 +1554,10 @@ def iRead(windowId = None, source = None, preprocess = None, ocr=None, capture=N
     if preprocess == None:
         preprocess = _g_preprocess
 
-    # convert to text
     _g_readImage = _g_origImage + "-pp.png"
-    if ocrArea == (0, 0, 1.0, 1.0):
-        croparea = []
-        wordXOffset = 0
-        wordYOffset = 0
-    else:
-        croparea = ["-crop", "%sx%s+%s+%s" % (x2-x1, y2-y1, x1, y1), "+repage"]
-        wordXOffset = x1
-        wordYOffset = y1
-        # rescale possible resize preprocessing parameter
-        resize_m = re.search('-resize ([0-9]+)x([0-9]*)', preprocess)
-        if resize_m:
-            origXResize = int(resize_m.group(1))
-            newXResize = int(origXResize/float(orig_width) * (x2-x1))
-            preprocess = (preprocess[:resize_m.start()] +
-                          ("-resize %sx" % (newXResize,)) +
-                          preprocess[resize_m.end():])
-    _g_words = {}
-    for psm in ocrPageSegModes:
-        convert_cmd = ([fmbt_config.imagemagick_convert, _g_origImage] +
-                       croparea +
-                       shlex.split(preprocess) +
-                       [_g_readImage])
-        tesseract_cmd = ["tesseract", _g_readImage, SCREENSHOT_FILENAME,
-                         "-l", lang, _g_tesseractPSM, str(psm), "hocr"]
-        if isinstance(configfile, basestring):
-            tesseract_cmd += [configfile]
-        elif isinstance(configfile, list) or isinstance(configfile, tuple):
-            tesseract_cmd += configfile
-        exit_status, output = _runcmd(convert_cmd)
-        if exit_status != 0:
-            raise NoOCRResults("Convert returned exit status (%s): %s"
-                               % (exit_status, _g_last_runcmd_error))
-
-        exit_status, output = _runcmd(tesseract_cmd)
-        if (exit_status == 1 and "'-psm'" in _g_last_runcmd_error
-            and _g_tesseractPSM == "-psm"):
-            # Tesseract versions up to 4.x.x beta take "-psm", but
-            # from some point on they want "--psm". Detect the error
-            # due to wrong format and switch to another, if needed.
-            _g_tesseractPSM = "--psm"
-            tesseract_cmd[tesseract_cmd.index("-psm")] = _g_tesseractPSM
-            exit_status, output = _runcmd(tesseract_cmd)
-        if exit_status != 0:
-            raise NoOCRResults("Tesseract returned exit status (%s): %s"
-                               % (exit_status, _g_last_runcmd_error))
-
-        hocr_filename = SCREENSHOT_FILENAME + ".html" # Tesseract 3.02
-
-        if not os.access(hocr_filename, os.R_OK):
-            hocr_filename = SCREENSHOT_FILENAME + ".hocr" # Tesseract 3.03
-            if not os.access(hocr_filename, os.R_OK):
-                raise NoOCRResults("HOCR output missing. Tesseract OCR 3.02 or greater required.\n")
-
-        # store every word and its coordinates
-        _g_words.update(_hocr2words(file(hocr_filename).read()))
-
-    # convert word coordinates to the unscaled pixmap
-    try:
-        ocr_page_line = [line for line in file(hocr_filename).readlines() if "class='ocr_page'" in line][0]
-    except IndexError:
-        raise NoOCRResults("Could not read ocr_page class information from %s" % (hocr_filename,))
-
-    scaled_width, scaled_height = re.findall('bbox 0 0 ([0-9]+)\s*([0-9]+)', ocr_page_line)[0]
-    scaled_width, scaled_height = float(scaled_width) / (float(x2-x1)/orig_width), float(scaled_height) / (float(y2-y1)/orig_height)
-
-    for word in sorted(_g_words.keys()):
-        for appearance, (wordid, middle, bbox) in enumerate(_g_words[word]):
-            _g_words[word][appearance] = \
-                (wordid,
-                 (int(middle[0]/scaled_width * orig_width) + wordXOffset,
-                  int(middle[1]/scaled_height * orig_height) + wordYOffset),
-                 (int(bbox[0]/scaled_width * orig_width) + wordXOffset,
-                  int(bbox[1]/scaled_height * orig_height) + wordYOffset,
-                  int(bbox[2]/scaled_width * orig_width) + wordXOffset,
-                  int(bbox[3]/scaled_height * orig_height) + wordYOffset))
-            _log('found "' + word + '": (' + str(bbox[0]) + ', ' + str(bbox[1]) + ')')
+    _g_words = _readWords(_g_origImage, (orig_width, orig_height),
+                          (x1, y1, x2, y2), preprocess, ocrPageSegModes,
+                          lang, configfile, _g_readImage, SCREENSHOT_FILENAME)
     if capture:
         drawWords(_g_origImage, capture, _g_words, _g_words)
     return sorted(_g_words.keys())
@@ -1451,66 +2365,215 @@ def findWord(word, detected_words = None, appearance=1):
         if _g_words == None:
             raise NoOCRResults()
 
-    scored_words = []
-    for w in detected_words:
-        scored_words.append((_score(w, word), w))
-    scored_words.sort()
-
-    if len(scored_words) == 0:
+    if len(detected_words) == 0:
         raise BadMatch("No words found.")
 
-    return scored_words[-1]
+    return ocrIndex(detected_words).findWord(word)
 
 def findText(text, detected_words = None, match=-1):
-    def biggerBox(bbox_list):
-        left, top, right, bottom = bbox_list[0]
-        for l, t, r, b in bbox_list[1:]:
-            left = min(left, l)
-            top = min(top, t)
-            right = max(right, r)
-            bottom = max(bottom, b)
-        return (left, top, right, bottom)
-    words = text.split()
-    word_count = len(words)
-    detected_texts = [] # strings of <word_count> words
+    """
+    Returns list of (score, detected-text, bbox) tuples of texts with
+    at least the given match score, sorted by score.
+    """
+    return findTexts([text], detected_words, match)[0]
 
+def findTexts(texts, detected_words = None, match=-1):
+    """
+    Returns list of findText results, one for each text in texts.
+    Detected words are indexed only once for all texts.
+    """
     if detected_words == None:
         detected_words = _g_words
         if _g_words == None:
             raise NoOCRResults()
+    return ocrIndex(detected_words).findTexts(texts, match)
 
-    # sort by numeric word id
-    words_by_id = []
-    for word in detected_words:
-        for wid, middle, bbox in detected_words[word]:
-            # change word id from "word_2_42" to (2, 42)
-            int_wid = [int(n) for n in wid[5:].split("_")]
-            words_by_id.append(
-                (int_wid, word, bbox))
-    words_by_id.sort()
-
-    scored_texts = []
-    if word_count > 0:
-        for i in xrange(len(words_by_id)-word_count+1):
-            detected_texts.append(
-                (" ".join([w[1] for w in words_by_id[i:i+word_count]]),
-                 biggerBox([w[2] for w in words_by_id[i:i+word_count]])))
-
-        norm_text = " ".join(words) # normalize whitespace
-        for t in detected_texts:
-            scored_texts.append((_score(t[0], norm_text), t[0], t[1]))
-        scored_texts.sort()
-    elif match == 0.0:
-        # text == "", match == 0 => every word is a match
-        for w in words_by_id:
-            detected_texts.append((w[1], w[2]))
-        scored_texts = [(0.0, t[0], t[1]) for t in detected_texts]
-    else:
-        # text == "", match != 0 => no hits
-        detected_texts = []
-        scored_texts = []
+# Characters that look similar in OCR, see _score
+_g_closeMatchClasses = {'1': 'l', 'I': 'l'}
 
-    return [st for st in scored_texts if st[0] >= match]
+def _closeMatchNormalize(s):
+    return "".join([_g_closeMatchClasses.get(c, c) for c in s])
+
+def _trigrams(s):
+    """
+    Returns dictionary trigram -> count of padded string s.
+    """
+    padded = "\0\0" + _closeMatchNormalize(s) + "\0\0"
+    rv = {}
+    for i in xrange(len(padded) - 2):
+        trigram = padded[i:i+3]
+        rv[trigram] = rv.get(trigram, 0) + 1
+    return rv
+
+class _TextIndex(object):
+    """
+    Trigram index of strings. Strings within edit distance k from a
+    query of length n share at least max(n, len(string)) + 2 - 3*k
+    padded trigrams with the query, other strings need not be scored.
+    """
+    def __init__(self, strings):
+        self._strings = strings
+        self._trigrams = {} # trigram -> [(string index, count), ...]
+        self._lengths = {} # length -> [string index, ...]
+        for index, string in enumerate(strings):
+            for trigram, count in _trigrams(string).iteritems():
+                self._trigrams.setdefault(trigram, []).append((index, count))
+            self._lengths.setdefault(len(string), []).append(index)
+
+    def candidates(self, query, match):
+        """
+        Returns indexes of strings that may score at least match.
+        """
+        if match <= 0 or not query:
+            # _score of every string against "" is 1.0
+            return range(len(self._strings))
+        shared = {}
+        for trigram, queryCount in _trigrams(query).iteritems():
+            for index, count in self._trigrams.get(trigram, ()):
+                shared[index] = shared.get(index, 0) + min(queryCount, count)
+        rv = []
+        queryLen = len(query)
+        for length, indexes in self._lengths.iteritems():
+            maxLen = max(queryLen, length)
+            # score = 1 - distance / maxLen >= match
+            maxDistance = int(math.floor((1 - match) * maxLen + 1e-9))
+            if abs(queryLen - length) > maxDistance:
+                continue
+            minShared = maxLen + 2 - 3 * maxDistance
+            if minShared <= 0:
+                rv.extend(indexes)
+            else:
+                rv.extend([i for i in indexes if shared.get(i, 0) >= minShared])
+        return rv
+
+class OcrIndex(object):
+    """
+    Index of words detected by OCR. Texts and words are searched for
+    with findText(s) and findWord. Only texts that share enough
+    trigrams with the searched text are scored. Texts with equal
+    scores are ordered by mean OCR confidence of their words.
+    """
+    def __init__(self, detected_words):
+        self._words = detected_words.keys()
+        self._wordIndex = None
+        # sort by numeric word id
+        self._wordsById = []
+        for word in detected_words:
+            for ocrWord in detected_words[word]:
+                wid, middle, bbox = ocrWord
+                # change word id from "word_2_42" to (2, 42)
+                int_wid = [int(n) for n in wid[5:].split("_")]
+                confidence = getattr(ocrWord, "confidence", None)
+                if confidence == None:
+                    confidence = -1
+                self._wordsById.append(
+                    (int_wid, word, bbox, confidence))
+        self._wordsById.sort()
+        self._windows = {} # word count -> (texts, bboxes, confidences, _TextIndex)
+
+    def _textWindows(self, word_count):
+        """
+        Returns texts of word_count consecutive words, their bounding
+        boxes, mean confidences, and their index.
+        """
+        if not word_count in self._windows:
+            texts = []
+            bboxes = []
+            confidences = []
+            for i in xrange(len(self._wordsById)-word_count+1):
+                window = self._wordsById[i:i+word_count]
+                texts.append(" ".join([w[1] for w in window]))
+                bboxes.append((min([w[2][0] for w in window]),
+                               min([w[2][1] for w in window]),
+                               max([w[2][2] for w in window]),
+                               max([w[2][3] for w in window])))
+                confidences.append(sum([w[3] for w in window]) / float(word_count))
+            self._windows[word_count] = (texts, bboxes, confidences,
+                                         _TextIndex(texts))
+        return self._windows[word_count]
+
+    def findWord(self, word):
+        """
+        Returns pair (score, detected-word) of the best matching word.
+        """
+        if self._wordIndex == None:
+            self._wordIndex = _TextIndex(self._words)
+        best = None
+        # try strict match first, fall back to scoring every word
+        for match in (0.5, -1):
+            for i in self._wordIndex.candidates(word, match):
+                scored = (_score(self._words[i], word), self._words[i])
+                if best == None or scored > best:
+                    best = scored
+            if best != None and best[0] >= match:
+                break
+        return best
+
+    def findText(self, text, match=-1):
+        return self.findTexts([text], match)[0]
+
+    def findTexts(self, texts, match=-1):
+        """
+        Returns list of [(score, detected-text, bbox), ...] lists,
+        one for each text in texts.
+        """
+        rv = []
+        for text in texts:
+            words = text.split()
+            word_count = len(words)
+            if word_count > 0:
+                norm_text = " ".join(words) # normalize whitespace
+                detected_texts, bboxes, confidences, index = \
+                    self._textWindows(word_count)
+                scored_texts = []
+                for i in index.candidates(norm_text, match):
+                    scored_texts.append((_score(detected_texts[i], norm_text),
+                                         confidences[i],
+                                         detected_texts[i], bboxes[i]))
+                scored_texts.sort()
+                scored_texts = [(st[0], st[2], st[3]) for st in scored_texts]
+            elif match == 0.0:
+                # text == "", match == 0 => every word is a match
+                scored_texts = [(0.0, w[1], w[2]) for w in self._wordsById]
+            else:
+                # text == "", match != 0 => no hits
+                scored_texts = []
+            rv.append([st for st in scored_texts if st[0] >= match])
+        return rv
+
+# Indexes of recently searched OCR results, detected words dictionary
+# object -> (words, snapshot, OcrIndex). Words dictionaries are kept
+# referenced to keep their ids unique. Snapshot is a shallow copy of
+# the words when they were indexed, words dictionaries and their lists
+# may be modified later.
+_g_ocrIndexes = collections.OrderedDict()
+_g_ocrIndexesLock = threading.Lock()
+_g_ocrIndexesMax = 16
+
+def _ocrWordsSnapshot(detected_words):
+    return dict((word, list(appearances))
+                for word, appearances in detected_words.iteritems())
+
+def ocrIndex(detected_words):
+    """
+    Returns OcrIndex of detected words. Indexes of recently used
+    words dictionaries are reused if the words have not been changed
+    since indexing.
+    """
+    key = id(detected_words)
+    with _g_ocrIndexesLock:
+        if key in _g_ocrIndexes:
+            words, snapshot, index = _g_ocrIndexes.pop(key)
+            if snapshot == detected_words:
+                _g_ocrIndexes[key] = (words, snapshot, index)
+                return index
+    snapshot = _ocrWordsSnapshot(detected_words)
+    index = OcrIndex(snapshot)
+    with _g_ocrIndexesLock:
+        _g_ocrIndexes[key] = (detected_words, snapshot, index)
+        while len(_g_ocrIndexes) > _g_ocrIndexesMax:
+            _g_ocrIndexes.popitem(last=False)
+    return index
 
 def _score(w1, w2):
     closeMatch = {
@@ -1546,24 +2609,228 @@ def _score(w1, w2):
         return m[j][i]
     return 1 - (levenshteinDistance(w1, w2) / float(max(len(w1),len(w2))))
 
-def _hocr2words(hocr):
+class OcrWord(tuple):
+    """
+    Word recognized by OCR. OcrWord is a (wordid, middle, bbox) tuple
+    like the items in the dictionaries returned by iRead, with extra
+    attributes:
+
+        text         recognized text.
+
+        confidence   word confidence in range 0.0 - 100.0, or None if
+                     not available.
+
+        lineId       id of the text line of the word, or None.
+
+        blockId      id of the text block of the word, or None.
+    """
+    def __new__(cls, wordid, middle, bbox, text="", confidence=None,
+                lineId=None, blockId=None):
+        self = tuple.__new__(cls, (wordid, middle, bbox))
+        self.text = text
+        self.confidence = confidence
+        self.lineId = lineId
+        self.blockId = blockId
+        return self
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.text, self.confidence,
+                              self.lineId, self.blockId)
+
+    def moved(self, middle, bbox, wordid=None):
+        """
+        Returns a copy of the word with new coordinates.
+        """
+        if wordid == None:
+            wordid = self[0]
+        return OcrWord(wordid, middle, bbox, self.text, self.confidence,
+                       self.lineId, self.blockId)
+
+def _newOcrWord(wordid, bbox, text, confidence, lineId, blockId):
+    left, top, right, bottom = bbox
+    return OcrWord(wordid, ((left + right) / 2.0, (top + bottom) / 2.0),
+                   bbox, text, confidence, lineId, blockId)
+
+_g_ocrEntity = re.compile('&(#?)([0-9A-Za-z]+);')
+
+def _decodeEntity(m):
+    if m.group(1):
+        try:
+            code = int(m.group(2))
+        except ValueError:
+            return m.group(0)
+    else:
+        code = htmlentitydefs.name2codepoint.get(m.group(2), 128)
+    if code < 128:
+        return chr(code)
+    return m.group(0)
+
+def _decodeEntities(s):
+    if "&" in s:
+        return _g_ocrEntity.sub(_decodeEntity, s)
+    return s
+
+_g_ocrTsvRow = re.compile('[0-9]+\t[0-9]+\t')
+_g_ocrTag = re.compile('<(/?)([A-Za-z:]+)([^>]*)>')
+_g_ocrAttr = re.compile('([A-Za-z:_]+)=(?:"([^"]*)"|\'([^\']*)\')')
+_g_hocrBbox = re.compile('bbox ([0-9]+) ([0-9]+) ([0-9]+) ([0-9]+)')
+_g_hocrWconf = re.compile('x_wconf ([0-9.]+)')
+_g_hocrBlockClasses = set(["ocr_carea", "ocrx_block"])
+_g_hocrLineClasses = set(["ocr_line", "ocrx_line", "ocr_textfloat",
+                          "ocr_header", "ocr_caption"])
+_g_hocrWordClasses = set(["ocrx_word", "ocr_word"])
+
+def _ocrAttrs(attrString):
+    return dict((name, dq or sq)
+                for name, dq, sq in _g_ocrAttr.findall(attrString))
+
+def _iterHocr(hocr):
+    lineId = None
+    blockId = None
+    pos = 0
+    while True:
+        m = _g_ocrTag.search(hocr, pos)
+        if not m:
+            return
+        pos = m.end()
+        if m.group(1) or not "class=" in m.group(3):
+            continue
+        attrs = _ocrAttrs(m.group(3))
+        cls = attrs.get("class", "")
+        if cls == "ocr_page":
+            bbox_m = _g_hocrBbox.search(attrs.get("title", ""))
+            if bbox_m:
+                yield "page", (int(bbox_m.group(3)), int(bbox_m.group(4)))
+        elif cls in _g_hocrBlockClasses:
+            blockId = attrs.get("id", None)
+        elif cls in _g_hocrLineClasses:
+            lineId = attrs.get("id", None)
+        elif cls in _g_hocrWordClasses:
+            end = hocr.find("</span>", pos)
+            if end == -1:
+                return
+            title = attrs.get("title", "")
+            bbox_m = _g_hocrBbox.search(title)
+            if bbox_m:
+                wconf_m = _g_hocrWconf.search(title)
+                if wconf_m:
+                    confidence = float(wconf_m.group(1))
+                else:
+                    confidence = None
+                yield "word", _newOcrWord(
+                    attrs.get("id", ""),
+                    tuple([int(n) for n in bbox_m.groups()]),
+                    _decodeEntities(_g_ocrTag.sub("", hocr[pos:end])),
+                    confidence, lineId, blockId)
+            pos = end + len("</span>")
+
+def _iterAlto(alto):
+    lineId = None
+    blockId = None
+    wordCount = 0
+    for m in _g_ocrTag.finditer(alto):
+        if m.group(1):
+            continue
+        tag = m.group(2).split(":")[-1]
+        if tag == "String":
+            attrs = _ocrAttrs(m.group(3))
+            wordCount += 1
+            left = int(float(attrs.get("HPOS", 0)))
+            top = int(float(attrs.get("VPOS", 0)))
+            right = left + int(float(attrs.get("WIDTH", 0)))
+            bottom = top + int(float(attrs.get("HEIGHT", 0)))
+            if "WC" in attrs:
+                confidence = float(attrs["WC"]) * 100
+            else:
+                confidence = None
+            yield "word", _newOcrWord(
+                "word_1_%s" % (wordCount,),
+                (left, top, right, bottom),
+                _decodeEntities(attrs.get("CONTENT", "")),
+                confidence, lineId, blockId)
+        elif tag == "TextLine":
+            lineId = _ocrAttrs(m.group(3)).get("ID", None)
+        elif tag == "TextBlock":
+            blockId = _ocrAttrs(m.group(3)).get("ID", None)
+        elif tag == "Page":
+            attrs = _ocrAttrs(m.group(3))
+            yield "page", (int(float(attrs.get("WIDTH", 0))),
+                           int(float(attrs.get("HEIGHT", 0))))
+
+def _iterTsv(tsv):
+    # columns: level page_num block_num par_num line_num word_num
+    #          left top width height conf text
+    lines = tsv.splitlines()
+    if lines and lines[0].startswith("level\t"):
+        # tesseract prints the header, libtesseract does not
+        del lines[0]
+    for line in lines:
+        fields = line.split("\t", 11)
+        if len(fields) < 11:
+            continue
+        level = fields[0]
+        if level == "5":
+            block, par, lineNum, wordNum = fields[2:6]
+            left, top, width, height = [int(n) for n in fields[6:10]]
+            confidence = float(fields[10])
+            if confidence < 0:
+                confidence = None
+            if len(fields) == 12:
+                text = fields[11]
+            else:
+                text = ""
+            yield "word", _newOcrWord(
+                "word_%s_%s_%s_%s" % (block, par, lineNum, wordNum),
+                (left, top, left + width, top + height),
+                text, confidence,
+                "line_%s_%s_%s" % (block, par, lineNum),
+                "block_%s" % (block,))
+        elif level == "1":
+            left, top, width, height = [int(n) for n in fields[6:10]]
+            yield "page", (left + width, top + height)
+
+def iterOcrItems(ocrOutput):
+    """
+    Parse tesseract hOCR, ALTO or TSV output in a single pass. The
+    format is detected from the content.
+
+    Yields pairs ("page", (width, height)) and ("word", OcrWord) in
+    the order they appear in ocrOutput.
+    """
+    if ocrOutput.startswith("level\t") or _g_ocrTsvRow.match(ocrOutput):
+        return _iterTsv(ocrOutput)
+    elif "<alto" in ocrOutput[:1024]:
+        return _iterAlto(ocrOutput)
+    else:
+        return _iterHocr(ocrOutput)
+
+def iterOcrWords(ocrOutput):
+    """
+    Yields OcrWords from tesseract hOCR, ALTO or TSV output.
+    """
+    for itemType, item in iterOcrItems(ocrOutput):
+        if itemType == "word":
+            yield item
+
+def _ocrWords(ocrOutput):
+    """
+    Returns pair (pageSize, words), where words is a dictionary
+    word -> [OcrWord, ...]. pageSize is None if not found.
+    """
+    pageSize = None
     rv = {}
-    hocr = hocr.replace("<strong>","").replace("</strong>","").replace("<em>","").replace("</em>","")
-    hocr.replace("&#39;", "'")
-    for name, code in htmlentitydefs.name2codepoint.iteritems():
-        if code < 128:
-            hocr = hocr.replace('&' + name + ';', chr(code))
-    ocr_word = re.compile('''<span class=['"]ocrx?_word["'] id=['"]([^']*)["'] title=['"]bbox ([0-9]+) ([0-9]+) ([0-9]+) ([0-9]+)["';][^>]*>([^<]*)</span>''')
-    for word_id, bbox_left, bbox_top, bbox_right, bbox_bottom, word in ocr_word.findall(hocr):
-        bbox_left, bbox_top, bbox_right, bbox_bottom = \
-            int(bbox_left), int(bbox_top), int(bbox_right), int(bbox_bottom)
-        if not word in rv:
-            rv[word] = []
-        middle_x = (bbox_right + bbox_left) / 2.0
-        middle_y = (bbox_top + bbox_bottom) / 2.0
-        rv[word].append((word_id, (middle_x, middle_y),
-                         (bbox_left, bbox_top, bbox_right, bbox_bottom)))
-    return rv
+    for itemType, item in iterOcrItems(ocrOutput):
+        if itemType == "word":
+            if item.text in rv:
+                rv[item.text].append(item)
+            else:
+                rv[item.text] = [item]
+        elif pageSize == None:
+            pageSize = item
+    return pageSize, rv
+
+def _hocr2words(hocr):
+    return _ocrWords(hocr)[1]
 
 def _getScreenSize():
     global _g_screenSize
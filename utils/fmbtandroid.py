@@ -170,6 +170,7 @@ window = Launcher
 import base64
 import commands
 import gzip
+import hashlib
 import math
 import os
 import random
@@ -180,10 +181,16 @@ import StringIO
 import struct
 import subprocess
 import tempfile
+import threading
 import time
 import uu
+import zlib
 
 import xml.etree.ElementTree
+try:
+    import xml.etree.cElementTree as _ElementTree
+except ImportError:
+    _ElementTree = xml.etree.ElementTree
 
 import fmbt
 import fmbtgti
@@ -191,6 +198,10 @@ try:
     import fmbtpng
 except ImportError:
     fmbtpng = None
+try:
+    import lz4.frame as _lz4frame
+except ImportError:
+    _lz4frame = None
 
 ROTATION_0 = 0
 ROTATION_90 = 1
@@ -254,6 +265,11 @@ def _run(command, expectedExitStatus=None, timeout=None):
 
     exitStatus = p.returncode
 
+    _checkExitStatus(command, exitStatus, out, err, expectedExitStatus)
+
+    return (exitStatus, out, err)
+
+def _checkExitStatus(command, exitStatus, out, err, expectedExitStatus):
     if expectedExitStatus != None:
         if ((type(expectedExitStatus) in [list, tuple] and
              not exitStatus in expectedExitStatus) or
@@ -267,8 +283,6 @@ def _run(command, expectedExitStatus=None, timeout=None):
             else:
                 raise FMBTAndroidRunError(msg)
 
-    return (exitStatus, out, err)
-
 _g_keyNames = set((
     "0", "1", "2", "3", "3D_MODE", "4", "5", "6", "7",
     "8", "9", "A", "ALT_LEFT", "ALT_RIGHT", "APOSTROPHE",
@@ -314,6 +328,32 @@ _g_keyNames = set((
 
 sortItems = fmbtgti.sortItems
 
+# adb server address, commands are sent to the server through
+# its socket when possible (see _AdbSocketTransport).
+_g_adbServerHost = "127.0.0.1"
+_g_adbServerPort = 5037
+# Max number of idle sync service connections kept open per device
+_g_adbSyncPoolSize = 2
+_ADB_SYNC_DATA_MAX = 64 * 1024
+_ADB_SHELL_STDOUT = 1
+_ADB_SHELL_STDERR = 2
+_ADB_SHELL_EXIT = 3
+# Initial size of the buffer that receives streamed screencap output
+_g_screencapBufferSize = 4 * 1024 * 1024
+
+def _decompressLz4(data, sizeHint):
+    return _lz4frame.decompress(data)
+
+def _decompressGzip(data, sizeHint):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS, sizeHint)
+
+# Compressors for streamed screencap output in the order of
+# preference: (name, on-device command, decompress function).
+# A compressor is used only if it works on the device.
+_g_screencapCompressors = [("gzip", "gzip -1", _decompressGzip)]
+if _lz4frame != None:
+    _g_screencapCompressors.insert(0, ("lz4", "lz4 -1 -c", _decompressLz4))
+
 _g_listDevicesCommand = [_g_adbExecutable, "devices"]
 def listSerialNumbers(adbPort=None):
     """
@@ -443,6 +483,7 @@ class Device(fmbtgti.GUITestInterface):
         self._monkeyOptions = monkeyOptions
         self._lastConnectionSettings = {}
         self._uiautomatorDump = uiautomatorDump
+        self._viewDiff = False
 
         self._conf = Ini()
 
@@ -1020,7 +1061,8 @@ class Device(fmbtgti.GUITestInterface):
             _adapterLog("reconnect failed: %s" % (e,))
             return False
 
-    def refreshScreenshot(self, forcedScreenshot=None, rotate=None):
+    def refreshScreenshot(self, forcedScreenshot=None, rotate=None, maxAge=None,
+                          newerThan=None, timeout=None):
         # convert Android display/user rotation to degrees
         if rotate in ROTATIONS:
             rotate = ROTATION_DEGS[rotate]
@@ -1033,8 +1075,12 @@ class Device(fmbtgti.GUITestInterface):
                 else:
                     drot = None
                 if drot != None:
-                    return self.refreshScreenshot(forcedScreenshot, rotate=-drot)
-        rv = fmbtgti.GUITestInterface.refreshScreenshot(self, forcedScreenshot, rotate)
+                    return self.refreshScreenshot(forcedScreenshot, rotate=-drot,
+                                                  maxAge=maxAge,
+                                                  newerThan=newerThan,
+                                                  timeout=timeout)
+        rv = fmbtgti.GUITestInterface.refreshScreenshot(
+            self, forcedScreenshot, rotate, maxAge, newerThan, timeout)
         if rv:
             if not forcedScreenshot:
                 self._screenSize = self.existingConnection().recvScreenSize()
@@ -1093,7 +1139,11 @@ class Device(fmbtgti.GUITestInterface):
                     raise
             if dump != None:
                 viewDir = os.path.dirname(self._newScreenshotFilepath())
-                view = View(viewDir, self.serialNumber, dump, displayToScreen, self.itemOnScreen, self.intCoords)
+                if self._viewDiff:
+                    previousView = self._lastView
+                else:
+                    previousView = None
+                view = View(viewDir, self.serialNumber, dump, displayToScreen, self.itemOnScreen, self.intCoords, previousView)
             else:
                 _adapterLog("refreshView window dump reading failed")
                 view = None
@@ -1275,6 +1325,23 @@ class Device(fmbtgti.GUITestInterface):
         else:
             return False
 
+    def setViewDiff(self, viewDiff):
+        """
+        Enable or disable reusing unchanged parts of the previous
+        View on refreshView()
+
+        Parameters:
+
+          viewDiff (boolean):
+                  If True, subtrees of uiautomator dumps that are
+                  identical to ones in the previous View are not
+                  recreated. Their ViewItems are moved from the
+                  previous View to the new one, so items of the
+                  previous View should not be used anymore. The
+                  default is False.
+        """
+        self._viewDiff = viewDiff
+
     def shell(self, shellCommand, timeout=None):
         """
         Execute shellCommand in adb shell.
@@ -1585,6 +1652,13 @@ class Device(fmbtgti.GUITestInterface):
         """
         return self._lastView
 
+    def viewDiff(self):
+        """
+        Returns whether or not refreshView() reuses unchanged parts
+        of the previous View.
+        """
+        return self._viewDiff
+
     def waitAnyText(self, listOfTexts, partial=False, uiautomatorDump=False, **waitKwArgs):
         """
         Wait until any of texts is on the screen.
@@ -1794,6 +1868,9 @@ class ViewItem(fmbtgti.GUIItem):
     """
     ViewItem holds the information of a single GUI element.
     """
+    __slots__ = ("_p", "_parent", "_className", "_code", "_indent",
+                 "_children", "_rawProps", "_displayToScreen",
+                 "_id", "_text", "_visible", "_propsComputed", "_subtreeKey")
     _boundsRegEx = re.compile(r'\[([0-9]+),([0-9]+)\]\[([0-9]+),([0-9]+)\]')
     def __init__(self, className, code, indent, properties, parent, rawProps, dumpFilename, displayToScreen):
         self._p = properties
@@ -1802,28 +1879,50 @@ class ViewItem(fmbtgti.GUIItem):
         self._code = code
         self._indent = indent
         self._children = []
-        self._parentsVisible = True
-        if "resource-id" in self._p:
-            self._id = self._p["resource-id"].split(":", 1)[-1]
-        else:
-            self._id = self.property("mID")
         self._rawProps = ""
+        self._displayToScreen = displayToScreen
+        # id, text, visibility and bbox are computed when first needed
+        self._id = None
+        self._text = None
+        self._visible = None
+        self._propsComputed = False
+        self._subtreeKey = None # see View._parseUIAutomatorDump
         if not "bounds" in self._p:
             if not "scrolling:mScrollX" in self._p:
                 self._p["scrolling:mScrollX"] = 0
                 self._p["scrolling:mScrollY"] = 0
-            self._visible = self._p.get("getVisibility()", "") == "VISIBLE"
-            if "text:mText" in self._p:
-                self._text = self._p["text:mText"]
-            else:
-                self._text = None
+        fmbtgti.GUIItem.__init__(self, className, None, dumpFilename)
+    def __getstate__(self):
+        # displayToScreen may be a lambda or a bound method that
+        # cannot be pickled. Compute everything that needs it.
+        if not self._propsComputed:
+            self._computeProps()
+        try:
+            self.bbox()
+        except ValueError:
+            pass # bbox() raises the same error after unpickling
+        state = fmbtgti.GUIItem.__getstate__(self)
+        state["_displayToScreen"] = None
+        return state
+    def _computeProps(self):
+        p = self._p
+        if "resource-id" in p:
+            self._id = p["resource-id"].split(":", 1)[-1]
         else:
+            self._id = p.get("mID", None)
+        if "bounds" in p:
+            self._text = p["text"]
             self._visible = True
-            self._text = self._p["text"]
-        fmbtgti.GUIItem.__init__(self, className, self._calculateBbox(displayToScreen), dumpFilename)
+        else:
+            self._text = p.get("text:mText", None)
+            self._visible = p.get("getVisibility()", "") == "VISIBLE"
+        self._propsComputed = True
     def addChild(self, child):
-        child._parentsVisible = self.visibleBranch()
         self._children.append(child)
+    def bbox(self):
+        if self._bbox == None:
+            self._bbox = self._calculateBbox(self._displayToScreen)
+        return self._bbox
     def _calculateBbox(self, displayToScreen):
         if "bounds" in self._p:
             try:
@@ -1859,7 +1958,10 @@ class ViewItem(fmbtgti.GUIItem):
     def className(self):  return self._className
     def code(self):       return self._code
     def indent(self):     return self._indent
-    def id(self):         return self._id
+    def id(self):
+        if not self._propsComputed:
+            self._computeProps()
+        return self._id
     def parent(self):     return self._parent
     def properties(self): return self._p
     def property(self, propertyName):
@@ -1867,8 +1969,15 @@ class ViewItem(fmbtgti.GUIItem):
     def visibleBranch(self):
         """Returns True if this item and all items containing this are visible
         up to the root node"""
-        return self._parentsVisible and self.visible()
+        item = self
+        while item:
+            if not item.visible():
+                return False
+            item = item._parent
+        return True
     def text(self):
+        if not self._propsComputed:
+            self._computeProps()
         return self._text
     def content_desc(self):
         if "content-desc" in self._p:
@@ -1878,6 +1987,8 @@ class ViewItem(fmbtgti.GUIItem):
         else:
             return None
     def visible(self):
+        if not self._propsComputed:
+            self._computeProps()
         return self._visible
     def dump(self):
         p = self._p
@@ -1908,10 +2019,12 @@ class View(object):
     for ViewItems based on their properties.
     """
     def __init__(self, screenshotDir, serialNumber, dump, displayToScreen=None,
-                 itemOnScreen=None, intCoords=None):
+                 itemOnScreen=None, intCoords=None, previousView=None):
         self.screenshotDir = screenshotDir
         self.serialNumber = serialNumber
         self._viewItems = []
+        self._subtreeItems = {} # (depth, subtree hash) -> ViewItem
+        self._index = None # fmbtgti.ViewIndex, built when first needed
         self._errors = []
         self._lineRegEx = re.compile("(?P<indent>\s*)(?P<class>[\w.$]+)@(?P<id>[0-9A-Fa-f]{4,8} )(?P<properties>.*)")
         self._olderAndroidLineRegEx = re.compile("(?P<indent>\s*)(?P<class>[\w.$]+)@(?P<id>\w)(?P<properties>.*)")
@@ -1921,6 +2034,7 @@ class View(object):
         file(self._rawDumpFilename, "wb").write(self._dump)
         if displayToScreen == None:
             displayToScreen = lambda x, y: (x, y)
+        self._displayToScreen = displayToScreen
         if itemOnScreen == None:
             itemOnScreen = lambda item: True
         self._itemOnScreen = itemOnScreen
@@ -1929,7 +2043,7 @@ class View(object):
         self._intCoords = intCoords
         try:
             if dump.startswith("<?xm"):
-                self._parseUIAutomatorDump(dump, self._rawDumpFilename, displayToScreen)
+                self._parseUIAutomatorDump(dump, self._rawDumpFilename, displayToScreen, previousView)
             else:
                 self._parseDump(dump, self._rawDumpFilename, displayToScreen)
         except Exception, e:
@@ -1969,6 +2083,33 @@ class View(object):
     def filename(self):
         return self._rawDumpFilename
 
+    def index(self):
+        """
+        Returns fmbtgti.ViewIndex of all items in the view. Searches
+        from all items (no searchRootItem or searchItems) use the
+        index.
+        """
+        if self._index == None:
+            self._index = fmbtgti.ViewIndex(self._viewItems, {
+                "text": ViewItem.text,
+                "id": ViewItem.id,
+                "class": ViewItem.className,
+                "content-desc": ViewItem.content_desc})
+        return self._index
+
+    def _findIndexedItems(self, items, count, onScreen):
+        """
+        Returns items found from the index, limited like in findItems.
+        """
+        foundItems = []
+        if count == 0: return foundItems
+        for i in items:
+            if not onScreen or i.visibleBranch() and self._itemOnScreen(i):
+                foundItems.append(i)
+                if count > 0 and len(foundItems) >= count:
+                    break
+        return foundItems
+
     def findItems(self, comparator, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
         """
         Returns list of ViewItems to which comparator returns True.
@@ -2023,6 +2164,13 @@ class View(object):
         """
         Returns list of ViewItems with given text.
         """
+        if searchRootItem == None and searchItems == None:
+            if partial:
+                items = self.index().findMatching(
+                    "text", lambda t: t != None and t.find(text) != -1)
+            else:
+                items = self.index().find("text", text)
+            return self._findIndexedItems(items, count, onScreen)
         if partial:
             c = lambda item: item.text().find(text) != -1 if item.text() != None else False
         else:
@@ -2033,6 +2181,9 @@ class View(object):
         """
         Returns list of ViewItems with given id.
         """
+        if searchRootItem == None and searchItems == None:
+            return self._findIndexedItems(
+                self.index().find("id", id), count, onScreen)
         c = lambda item: item.id() == id
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
@@ -2040,6 +2191,13 @@ class View(object):
         """
         Returns list of ViewItems with given class.
         """
+        if searchRootItem == None and searchItems == None:
+            if partial:
+                items = self.index().findMatching(
+                    "class", lambda c: c.find(className) != -1)
+            else:
+                items = self.index().find("class", className)
+            return self._findIndexedItems(items, count, onScreen)
         if partial: c = lambda item: item.className().find(className) != -1
         else: c = lambda item: item.className() == className
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
@@ -2056,6 +2214,14 @@ class View(object):
         Returns list of ViewItems with given content-desc.
         Works on uiautomatorDumps only.
         """
+        if searchRootItem == None and searchItems == None:
+            if partial:
+                items = self.index().findMatching(
+                    "content-desc",
+                    lambda c: c != None and c.find(content_desc) != -1)
+            else:
+                items = self.index().find("content-desc", content_desc)
+            return self._findIndexedItems(items, count, onScreen)
         if partial:
             c = lambda item: item.content_desc().find(content_desc) != -1
         else:
@@ -2083,8 +2249,12 @@ class View(object):
         or may not be from the same branch in the widget hierarchy.
         """
         x, y = self._intCoords(pos)
-        c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
-        items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
+        if searchRootItem == None and searchItems == None:
+            items = self._findIndexedItems(
+                self.index().findByPos((x, y)), count, onScreen)
+        else:
+            c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
         # sort from smallest to greatest area
         area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
         return [i for _, i in sorted(area_items)]
@@ -2105,10 +2275,15 @@ class View(object):
         """
         left, top = self._intCoords((bbox[0], bbox[1]))
         right, bottom = self._intCoords((bbox[2], bbox[3]))
-        c = lambda item: (left <= item.bbox()[0] <= item.bbox()[2] <= right and
-                          top <= item.bbox()[1] <= item.bbox()[3] <= bottom)
-        items = self.findItems(c, count=count, searchRootItem=searchRootItem,
-                               searchItems=searchItems, onScreen=onScreen)
+        if searchRootItem == None and searchItems == None:
+            items = self._findIndexedItems(
+                self.index().findInRegion((left, top, right, bottom)),
+                count, onScreen)
+        else:
+            c = lambda item: (left <= item.bbox()[0] <= item.bbox()[2] <= right and
+                              top <= item.bbox()[1] <= item.bbox()[3] <= bottom)
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem,
+                                   searchItems=searchItems, onScreen=onScreen)
         area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
         return [i for _, i in sorted(area_items)]
 
@@ -2124,39 +2299,120 @@ class View(object):
         """
         shutil.copy(self._rawDumpFilename, fileOrDirName)
 
-    def _parseUIAutomatorDump(self, dump, rawDumpFilename, displayToScreen):
+    def _parseUIAutomatorDump(self, dump, rawDumpFilename, displayToScreen, previousView=None):
         """
         Process XML output from "uiautomator dump" and create
         a tree of ViewItems.
+
+        The dump is read incrementally into flat node records with a
+        hash of each subtree, then ViewItems are created for
+        them. If previousView is given, subtrees identical to those
+        in previousView are not recreated: their ViewItems are moved
+        to this View.
         """
-        def add_elt(elt, parent, indent, results):
-            if ("resource-id" in elt.attrib and
-                "bounds" in elt.attrib):
-                try:
-                    vi = ViewItem(elt.attrib["class"],
-                                  elt.attrib["resource-id"].split(":", 1)[-1],
-                                  indent,
-                                  elt.attrib,
-                                  parent,
-                                  "",
-                                  self._rawDumpFilename,
-                                  displayToScreen)
-                    results.append(vi)
-                    if parent:
-                        parent.addChild(self._viewItems[-1])
-                except Exception, e:
-                    adapterlog("parseUIAutomatorDump error: %s" % (e,))
-                    vi = parent
+        if (previousView != None and
+            previousView._displayToScreen == displayToScreen):
+            # each item can be moved only once
+            reusable = dict(previousView._subtreeItems)
+        else:
+            reusable = {}
+        self._viewItems = []
+        self._subtreeItems = {}
+        duplicateKeys = set()
+
+        # node: [attributes, depth, parent node index, end index, hash]
+        nodes = []
+        stack = []
+        childHashes = [[]]
+        for event, elt in _ElementTree.iterparse(rawDumpFilename, ("start", "end")):
+            if event == "start":
+                if stack:
+                    parentIndex = stack[-1]
+                else:
+                    parentIndex = -1
+                nodes.append([elt.attrib, len(stack), parentIndex, None, None])
+                stack.append(len(nodes) - 1)
+                childHashes.append([])
+            else:
+                node = nodes[stack.pop()]
+                node[3] = len(nodes)
+                node[4] = hash((elt.tag, tuple(sorted(elt.attrib.iteritems())),
+                                tuple(childHashes.pop())))
+                childHashes[-1].append(node[4])
+                # children are not needed anymore, attributes are
+                del elt[:]
+
+        # items[i] is the item of node i, or of its closest ancestor
+        # that has an item
+        items = [None] * len(nodes)
+        nodeIndex = 0
+        while nodeIndex < len(nodes):
+            attrib, depth, parentIndex, endIndex, subtreeHash = nodes[nodeIndex]
+            if parentIndex >= 0:
+                parent = items[parentIndex]
             else:
+                parent = None
+            if not ("resource-id" in attrib and "bounds" in attrib):
+                items[nodeIndex] = parent
+                nodeIndex += 1
+                continue
+            key = (depth, subtreeHash)
+            vi = reusable.pop(key, None)
+            if vi != None:
+                # items containing vi in previousView cannot be moved
+                # anymore, their subtrees are not whole
+                ancestor = vi._parent
+                while ancestor != None:
+                    if reusable.get(ancestor._subtreeKey, None) is ancestor:
+                        del reusable[ancestor._subtreeKey]
+                    ancestor = ancestor._parent
+                vi._parent = parent
+                if parent:
+                    parent.addChild(vi)
+                self._addReusedSubtree(vi, duplicateKeys, reusable)
+                nodeIndex = endIndex # skip nodes of the reused subtree
+                continue
+            try:
+                vi = ViewItem(attrib["class"],
+                              attrib["resource-id"].split(":", 1)[-1],
+                              depth,
+                              attrib,
+                              parent,
+                              "",
+                              self._rawDumpFilename,
+                              displayToScreen)
+                vi._subtreeKey = key
+                self._addSubtreeKey(key, vi, duplicateKeys)
+                self._viewItems.append(vi)
+                if parent:
+                    parent.addChild(vi)
+            except Exception, e:
+                _adapterLog("parseUIAutomatorDump error: %s" % (e,))
                 vi = parent
-            for child in elt.getchildren():
-                add_elt(child, vi, indent + 1, results)
-        self._viewItems = []
-        tree = xml.etree.ElementTree.parse(rawDumpFilename)
-        root = tree.getroot()
-        add_elt(root, None, 0, self._viewItems)
+            items[nodeIndex] = vi
+            nodeIndex += 1
         return self._viewItems
 
+    def _addSubtreeKey(self, key, viewItem, duplicateKeys):
+        # identical subtrees at the same depth cannot be told apart,
+        # they are not reused
+        if key in duplicateKeys:
+            return
+        if key in self._subtreeItems:
+            del self._subtreeItems[key]
+            duplicateKeys.add(key)
+        else:
+            self._subtreeItems[key] = viewItem
+
+    def _addReusedSubtree(self, viewItem, duplicateKeys, reusable):
+        self._viewItems.append(viewItem)
+        self._addSubtreeKey(viewItem._subtreeKey, viewItem, duplicateKeys)
+        for child in viewItem.children():
+            # child has been moved with its parent
+            if reusable.get(child._subtreeKey, None) is child:
+                del reusable[child._subtreeKey]
+            self._addReusedSubtree(child, duplicateKeys, reusable)
+
     def _parseDump(self, dump, rawDumpFilename, displayToScreen):
         """
         Process the raw window service dump data and create a tree of
@@ -2257,6 +2513,7 @@ class View(object):
 
             try:
                 vi = ViewItem(matcher.group("class"), matcher.group("id"), indent, properties, parent, matcher.group("properties"), self._rawDumpFilename, displayToScreen)
+                vi.bbox() # invalid layout fields raise an exception
                 self._viewItems.append(vi)
                 if parent:
                     parent.addChild(self._viewItems[-1])
@@ -2270,6 +2527,323 @@ class View(object):
         return 'View(items=%s, dump="%s")' % (
             len(self._viewItems), self._rawDumpFilename)
 
+class _AdbSocketTransport(object):
+    """
+    Runs adb commands by talking to the adb server directly through
+    its local TCP socket instead of launching an adb client process
+    for every command.
+
+    Supported commands are "shell" (shell v2 protocol with separate
+    stdout, stderr and exit status, if the device supports it),
+    "pull" and "push". run() raises _AdbSocketError on other
+    commands and on any transport failure, so that the caller can
+    fall back to the adb executable.
+
+    Every shell command needs a socket of its own, because the adb
+    server closes the socket when the service exits. Sync service
+    connections used by push and pull are kept open and reused.
+
+    execOut() streams raw output of a command like "adb exec-out"
+    into a buffer given by the caller.
+    """
+    def __init__(self, serialNumber, adbPort=None, host=None):
+        self._serialNumber = serialNumber
+        if adbPort == None:
+            adbPort = int(os.getenv("ANDROID_ADB_SERVER_PORT",
+                                    _g_adbServerPort))
+        if host == None:
+            host = os.getenv("ANDROID_ADB_SERVER_ADDRESS", _g_adbServerHost)
+        self._address = (host, int(adbPort))
+        self._features = None
+        self._syncPool = [] # idle sync service sockets
+        self._syncPoolLock = threading.Lock()
+
+    def close(self):
+        with self._syncPoolLock:
+            syncSockets, self._syncPool = self._syncPool, []
+        for s in syncSockets:
+            try:
+                s.sendall("QUIT" + struct.pack("<I", 0))
+                s.close()
+            except socket.error:
+                pass
+
+    def _connect(self, timeout):
+        try:
+            s = socket.create_connection(self._address, timeout)
+        except socket.error, e:
+            raise _AdbSocketError("cannot connect to adb server at %s:%s: %s" %
+                                  (self._address + (e,)))
+        s.settimeout(timeout)
+        return s
+
+    def _request(self, s, request):
+        """
+        Send a request to adb server, raise _AdbSocketError if it
+        is not accepted.
+        """
+        s.sendall("%04x%s" % (len(request), request))
+        status = _recvAll(s, 4)
+        if status == "OKAY":
+            return
+        elif status == "FAIL":
+            length = int(_recvAll(s, 4), 16)
+            raise _AdbSocketError('adb server: "%s" failed: %s' %
+                                  (request, _recvAll(s, length)))
+        else:
+            raise _AdbSocketError('adb server: unexpected response to "%s": %r' %
+                                  (request, status))
+
+    def _transport(self, timeout):
+        s = self._connect(timeout)
+        try:
+            self._request(s, "host:transport:%s" % (self._serialNumber,))
+        except:
+            s.close()
+            raise
+        return s
+
+    def features(self):
+        """
+        Returns set of adb features supported by both the server and
+        the device, for instance "shell_v2".
+        """
+        if self._features == None:
+            s = self._connect(_SHORT_TIMEOUT)
+            try:
+                self._request(s, "host-serial:%s:features" % (self._serialNumber,))
+                length = int(_recvAll(s, 4), 16)
+                self._features = set(_recvAll(s, length).split(","))
+            finally:
+                s.close()
+        return self._features
+
+    def supports(self, adbCommand):
+        """
+        Returns True if adbCommand can be run through the socket.
+        """
+        if not type(adbCommand) in [list, tuple] or len(adbCommand) == 0:
+            return False
+        command, args = adbCommand[0], adbCommand[1:]
+        return ((command == "shell" and len(args) > 0) or
+                (command in ["pull", "push"] and len(args) == 2))
+
+    def run(self, adbCommand, timeout=None):
+        """
+        Run adb command. Returns (exitStatus, stdout, stderr). If the
+        command does not finish within timeout seconds, exitStatus
+        is 124 like with timeout(1).
+        """
+        if not self.supports(adbCommand):
+            raise _AdbSocketError("command not supported: %s" % (adbCommand,))
+        command, args = adbCommand[0], list(adbCommand[1:])
+        if timeout != None:
+            endTime = time.time() + timeout
+        else:
+            endTime = None
+        try:
+            if command == "shell":
+                return self._shell(" ".join(args), endTime)
+            elif command == "pull":
+                return self._pull(args[0], args[1], endTime)
+            else:
+                return self._push(args[0], args[1], endTime)
+        except socket.timeout:
+            return (124, "", "timeout")
+        except socket.error, e:
+            raise _AdbSocketError("adb socket error: %s" % (e,))
+
+    def _shell(self, shellCommand, endTime):
+        shellV2 = "shell_v2" in self.features()
+        s = self._transport(_timeLeft(endTime))
+        try:
+            if shellV2:
+                self._request(s, "shell,v2,raw:%s" % (shellCommand,))
+                return self._recvShellV2(s, endTime)
+            else:
+                self._request(s, "shell:%s" % (shellCommand,))
+                out = []
+                while True:
+                    s.settimeout(_timeLeft(endTime))
+                    data = s.recv(65536)
+                    if not data:
+                        break
+                    out.append(data)
+                # legacy shell protocol does not deliver exit status
+                return (0, "".join(out), "")
+        finally:
+            s.close()
+
+    def _recvShellV2(self, s, endTime):
+        out, err = [], []
+        exitStatus = None
+        while True:
+            s.settimeout(_timeLeft(endTime))
+            header = _recvAll(s, 5, allowEof=True)
+            if not header:
+                break
+            packetId, length = struct.unpack("<BI", header)
+            data = _recvAll(s, length)
+            if packetId == _ADB_SHELL_STDOUT:
+                out.append(data)
+            elif packetId == _ADB_SHELL_STDERR:
+                err.append(data)
+            elif packetId == _ADB_SHELL_EXIT and data:
+                exitStatus = ord(data[0])
+                break
+        if exitStatus == None:
+            raise _AdbSocketError("shell connection closed without exit status")
+        return (exitStatus, "".join(out), "".join(err))
+
+    def execOut(self, command, buf, timeout=None):
+        """
+        Run command using the exec service that passes its output as
+        is, without pty or shell protocol framing. The output is read
+        directly into bytearray buf, which is extended if needed. Reuse
+        the same buf in consecutive calls to avoid reallocations.
+
+        Returns number of bytes read to buf. Raises socket.timeout on
+        timeout and _AdbSocketError on other errors.
+        """
+        if timeout != None:
+            endTime = time.time() + timeout
+        else:
+            endTime = None
+        s = self._transport(_timeLeft(endTime))
+        try:
+            self._request(s, "exec:%s" % (command,))
+            length = 0
+            while True:
+                if length == len(buf):
+                    buf.extend(bytearray(max(length, _ADB_SYNC_DATA_MAX)))
+                s.settimeout(_timeLeft(endTime))
+                received = s.recv_into(memoryview(buf)[length:])
+                if received == 0:
+                    return length
+                length += received
+        except socket.timeout:
+            raise
+        except socket.error, e:
+            raise _AdbSocketError("adb socket error: %s" % (e,))
+        finally:
+            s.close()
+
+    def _syncAcquire(self, endTime):
+        with self._syncPoolLock:
+            if self._syncPool:
+                return self._syncPool.pop()
+        s = self._transport(_timeLeft(endTime))
+        try:
+            self._request(s, "sync:")
+        except:
+            s.close()
+            raise
+        return s
+
+    def _syncRelease(self, s):
+        with self._syncPoolLock:
+            if len(self._syncPool) < _g_adbSyncPoolSize:
+                self._syncPool.append(s)
+                return
+        s.close()
+
+    def _syncCall(self, endTime, function):
+        """
+        Call function(syncSocket). A pooled connection may have been
+        closed by the server, in that case retry once with a new one.
+        """
+        for attempt in (0, 1):
+            s = self._syncAcquire(endTime)
+            try:
+                s.settimeout(_timeLeft(endTime))
+                rv = function(s)
+            except (_AdbSocketError, socket.timeout):
+                s.close()
+                raise
+            except socket.error:
+                s.close()
+                if attempt == 1:
+                    raise
+                continue
+            if rv[0] == 0:
+                self._syncRelease(s)
+            else:
+                # the server ends sync service after a failure
+                s.close()
+            return rv
+
+    def _pull(self, remoteFilename, localFilename, endTime):
+        def pull(s):
+            s.sendall("RECV" + struct.pack("<I", len(remoteFilename)) +
+                      remoteFilename)
+            chunks = []
+            while True:
+                s.settimeout(_timeLeft(endTime))
+                chunkId, length = struct.unpack("<4sI", _recvAll(s, 8))
+                if chunkId == "DATA":
+                    chunks.append(_recvAll(s, length))
+                elif chunkId == "DONE":
+                    return (0, "".join(chunks), "")
+                elif chunkId == "FAIL":
+                    return (1, "", "adb: error: %s" % (_recvAll(s, length),))
+                else:
+                    raise _AdbSocketError("unexpected sync response %r" % (chunkId,))
+        status, data, err = self._syncCall(endTime, pull)
+        if status == 0:
+            if os.path.isdir(localFilename):
+                localFilename = os.path.join(
+                    localFilename, os.path.basename(remoteFilename))
+            file(localFilename, "wb").write(data)
+            data = ""
+        return (status, data, err)
+
+    def _push(self, localFilename, remoteFilename, endTime):
+        try:
+            data = file(localFilename, "rb").read()
+            mode = os.stat(localFilename).st_mode & 0777
+        except IOError, e:
+            return (1, "", "adb: error: %s" % (e,))
+        def push(s):
+            path = "%s,%d" % (remoteFilename, mode)
+            request = ["SEND" + struct.pack("<I", len(path)) + path]
+            for offset in xrange(0, len(data), _ADB_SYNC_DATA_MAX):
+                chunk = data[offset:offset + _ADB_SYNC_DATA_MAX]
+                request.append("DATA" + struct.pack("<I", len(chunk)) + chunk)
+            request.append("DONE" + struct.pack("<I", int(time.time())))
+            s.sendall("".join(request))
+            responseId, length = struct.unpack("<4sI", _recvAll(s, 8))
+            if responseId == "OKAY":
+                return (0, "", "")
+            elif responseId == "FAIL":
+                return (1, "", "adb: error: %s" % (_recvAll(s, length),))
+            else:
+                raise _AdbSocketError("unexpected sync response %r" % (responseId,))
+        return self._syncCall(endTime, push)
+
+def _timeLeft(endTime):
+    """
+    Returns seconds left to endTime, None if there is no end time.
+    """
+    if endTime == None:
+        return None
+    left = endTime - time.time()
+    if left <= 0:
+        raise socket.timeout("timed out")
+    return left
+
+def _recvAll(s, length, allowEof=False):
+    data = []
+    received = 0
+    while received < length:
+        chunk = s.recv(length - received)
+        if not chunk:
+            if allowEof and received == 0:
+                return ""
+            raise _AdbSocketError("adb server closed connection")
+        data.append(chunk)
+        received += len(chunk)
+    return "".join(data)
+
 class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
     """
     Connection to the Android Device being tested.
@@ -2291,6 +2865,18 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
         self._monkeyOptions = kwArgs.pop("monkeyOptions", [])
         self._screencapArgs = kwArgs.pop("screencapArgs", [])
         self._screencapFormat = kwArgs.pop("screencapFormat", "raw")
+        self.setScreencapCompression(
+            kwArgs.pop("screencapCompression", "auto"))
+        if kwArgs.pop("adbSocket", True):
+            self._adbSocket = _AdbSocketTransport(
+                self._serialNumber, self._adbPort)
+        else:
+            self._adbSocket = None
+        self._screenChecksum = None # md5 of the latest raw screencap
+        self._screencapStream = None # True/False: exec-out works or not
+        self._screencapBuffer = None # receives streamed screencap output
+        self._screencapRawSize = _g_screencapBufferSize
+        self._shellSupportsMd5sum = None
         self.setScreenToDisplayCoords(
             kwArgs.pop("screenToDisplay", lambda x, y: (x, y)))
         self.setDisplayToScreenCoords(
@@ -2315,6 +2901,8 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
         except: pass
         try: self._emulatorSocket.close()
         except: pass
+        try: self._adbSocket.close()
+        except: pass
 
     def settings(self):
         """Returns restorable property values"""
@@ -2325,6 +2913,8 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
             "monkeyOptions": self._monkeyOptions,
             "screencapArgs": self._screencapArgs,
             "screencapFormat": self._screencapFormat,
+            "screencapCompression": self._screencapCompression,
+            "adbSocket": self._adbSocket != None,
             "screenToDisplay": self._screenToDisplay,
             "displayToScreen": self._displayToScreen,
         }
@@ -2346,6 +2936,18 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
             expect = None
         else:
             expect = expectedExitStatus
+        if (self._adbSocket != None and (expect != None or timeout != None)
+            and self._adbSocket.supports(adbCommand)):
+            # synchronous commands go through adb server socket,
+            # the adb executable is used if that fails.
+            try:
+                exitStatus, out, err = self._adbSocket.run(adbCommand, timeout)
+            except _AdbSocketError, e:
+                _adapterLog("adb socket failed, running adb: %s" % (e,))
+            else:
+                _checkExitStatus(["adb", "-s", self._serialNumber] + list(adbCommand),
+                                 exitStatus, out, err, expect)
+                return (exitStatus, out, err)
         if self._adbPort:
             adbPortArgs = ["-P", str(self._adbPort)]
         else:
@@ -2979,6 +3581,25 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
         else:
             self._screencapFormat = fmt
 
+    def setScreencapCompression(self, compression):
+        """
+        Set compression of raw screenshots streamed from the device.
+
+        Parameters:
+          compression (string):
+                  "auto" - use the best compression supported by
+                           both the device and the host (the default).
+                  "lz4"  - use lz4 if supported, requires lz4 python
+                           module on host.
+                  "gzip" - use gzip if supported.
+                  "none" - stream uncompressed screenshots. This is
+                           often fastest with emulators.
+        """
+        if not compression in ("auto", "lz4", "gzip", "none"):
+            raise ValueError('invalid compression "%s"' % (compression,))
+        self._screencapCompression = compression
+        self._screencapCompressor = None # detect on next screenshot
+
     def setScreencapArgs(self, args):
         """
         Set screencap tool arguments.
@@ -3007,73 +3628,229 @@ class _AndroidDeviceConnection(fmbtgti.GUITestConnection):
         """
         return self._screencapArgs[:] # return a copy
 
-    def recvScreenshot(self, filename, retry=2, retryDelay=1.0):
+    def _recvScreencapRaw(self):
         """
-        Capture a screenshot and copy the image file to given path or
-        system temp folder.
+        Capture a screenshot in raw format. The output of screencap
+        is streamed from the device, or pulled through a temporary
+        file if streaming is not supported.
 
-        Returns True on success, otherwise False.
+        Returns (width, height, depth, colorspace, data) on success,
+        False if the device did not give a screenshot, and None if
+        the raw format is not supported.
+        """
+        data = self._recvScreencapStream()
+        if data == None:
+            data = self._recvScreencapPull()
+        return self._unpackScreencapRaw(data)
+
+    def _detectScreencapCompressor(self):
+        """
+        Returns (name, command, decompress) of the first compressor
+        allowed by screencap compression setting that works on the
+        device, or False if streamed screenshots are not compressed.
+        """
+        if self._screencapCompressor == None:
+            self._screencapCompressor = False
+            buf = bytearray(64)
+            for compressor in _g_screencapCompressors:
+                name, compressCommand, decompress = compressor
+                if not self._screencapCompression in ("auto", name):
+                    continue
+                try:
+                    length = self._adbSocket.execOut(
+                        "echo fmbt | %s" % (compressCommand,),
+                        buf, timeout=_SHORT_TIMEOUT)
+                    works = decompress(buffer(buf, 0, length), 16) == "fmbt\n"
+                except Exception:
+                    works = False
+                if works:
+                    self._screencapCompressor = compressor
+                    break
+            _adapterLog("screencap compression: %s" % (
+                (self._screencapCompressor or ("none",))[0],))
+        return self._screencapCompressor
+
+    def _recvScreencapStream(self):
+        """
+        Stream screencap output through the adb server socket (like
+        "adb exec-out") directly into a reusable buffer. If possible,
+        the output is compressed on the device.
+
+        Returns the output, or None if streaming is not supported.
         """
         _screenshotTimeout = 60
-        if self._screencapFormat != "png" and fmbtpng != None:
-            # EXPERIMENTAL: PNG encoding moved from device to host
-            remotefile = '/sdcard/fmbtandroid-s.raw'
-            cmd = ['shell', 'screencap %s | gzip -3 > %s' % (
-                ' '.join(self._screencapArgs), remotefile)]
-            status, out, err = self._runAdb(cmd, [0, 124], timeout=_screenshotTimeout)
-            if status != 0:
+        if self._adbSocket == None or self._screencapStream == False:
+            return None
+        compressor = self._detectScreencapCompressor()
+        command = "screencap %s 2>/dev/null" % (' '.join(self._screencapArgs),)
+        if compressor:
+            name, compressCommand, decompress = compressor
+            command += " | %s" % (compressCommand,)
+        if self._screencapBuffer == None:
+            self._screencapBuffer = bytearray(_g_screencapBufferSize)
+        try:
+            length = self._adbSocket.execOut(
+                command, self._screencapBuffer, timeout=_screenshotTimeout)
+        except socket.timeout:
+            errmsg = "screenshot timeout: exec '%s'" % (command,)
+            _adapterLog(errmsg)
+            raise FMBTAndroidError(errmsg)
+        except _AdbSocketError, e:
+            if self._screencapStream == None:
+                # never worked, do not try again
+                self._screencapStream = False
+            _adapterLog("streaming screencap failed, pulling file instead: %s" % (e,))
+            return None
+        self._screencapStream = True
+        data = buffer(self._screencapBuffer, 0, length)
+        if compressor:
+            try:
+                data = decompress(data, self._screencapRawSize)
+            except Exception, e:
+                msg = "decompressing %s screencap output failed: %s" % (name, e)
+                _adapterLog(msg)
+                raise FMBTAndroidError(msg)
+            self._screencapRawSize = len(data)
+        return data
+
+    def _recvScreencapPull(self):
+        """
+        Save gzipped screencap output on the device, pull it through a
+        temporary file and return the output.
+        """
+        _screenshotTimeout = 60
+        remotefile = '/sdcard/fmbtandroid-s.raw'
+        cmd = ['shell', 'screencap %s | gzip -3 > %s' % (
+            ' '.join(self._screencapArgs), remotefile)]
+        status, out, err = self._runAdb(cmd, [0, 124], timeout=_screenshotTimeout)
+        if status != 0:
+            errmsg = "screenshot timeout: command='adb %s' status=%s, stdout=%s, stderr=%s" % (
+                " ".join(cmd), status, out, err)
+            _adapterLog(errmsg)
+            raise FMBTAndroidError(errmsg)
+        fd, rawFilename = tempfile.mkstemp(prefix="fmbtandroid-screencap-")
+        os.close(fd)
+        try:
+            cmd = ['pull', remotefile, rawFilename]
+            status, out, err = self._runAdb(cmd, [0, 1, 124], timeout=_screenshotTimeout)
+            if status == 124:
                 errmsg = "screenshot timeout: command='adb %s' status=%s, stdout=%s, stderr=%s" % (
                     " ".join(cmd), status, out, err)
             else:
-                cmd = ['pull', remotefile, filename + ".raw"]
-                status, out, err = self._runAdb(cmd, [0, 1, 124], timeout=_screenshotTimeout)
-                if status == 124:
-                    errmsg = "screenshot timeout: command='adb %s' status=%s, stdout=%s, stderr=%s" % (
-                        " ".join(cmd), status, out, err)
-                else:
-                    errmsg = "screenshot 'adb %s' failed, exit status %s" % (" ".join(cmd), status)
+                errmsg = "screenshot 'adb %s' failed, exit status %s" % (" ".join(cmd), status)
             if status != 0:
                 _adapterLog(errmsg)
                 raise FMBTAndroidError(errmsg)
             try:
-                data = gzip.open(filename + ".raw").read()
+                return gzip.open(rawFilename).read()
             except Exception, e:
                 msg = 'reading screenshot from "%s" failed: %s' % (
-                    filename + ".raw", e)
+                    rawFilename, e)
                 _adapterLog(msg)
                 raise FMBTAndroidError(msg)
-            os.unlink(filename + ".raw")
+        finally:
+            if os.access(rawFilename, os.F_OK):
+                os.remove(rawFilename)
 
-            if len(data) < 256:
-                msg = "Too small screenshot: %s bytes, skip unpack." % (
-                    len(data),)
-                _adapterLog(msg)
-                # This is not an error, it's ok to DRM to prevent a screenshot
+    def _unpackScreencapRaw(self, data):
+        """
+        Returns (width, height, depth, colorspace, pixeldata) from raw
+        screencap output, see _recvScreencapRaw.
+        """
+        if len(data) < 256:
+            msg = "Too small screenshot: %s bytes, skip unpack." % (
+                len(data),)
+            _adapterLog(msg)
+            # This is not an error, it's ok to DRM to prevent a screenshot
+            return False
+        try:
+            width, height, fmt = struct.unpack("<LLL", data[:12])
+        except struct.error, e:
+            msg = ("error unpacking screenshot data (%s bytes): %s" %
+                   (len(data), e))
+            _adapterLog(msg)
+            raise FMBTAndroidError(msg)
+        if isinstance(self._screencapFormat, tuple):
+            depth, colorspace = self._screencapFormat
+        elif fmt == 1:
+            depth, colorspace = 8, "RGBA"
+        elif fmt == 2:
+            depth, colorspace = 8, "RGB_"
+        elif fmt == 3:
+            depth, colorspace = 8, "RGB"
+        elif fmt == 5:
+            depth, colorspace = 8, "BGR_" # ignore alpha
+        else:
+            _adapterLog("unsupported screencap raw format %s" % (fmt,))
+            return None
+        self._screenChecksum = hashlib.md5(data).hexdigest()
+        # slicing copies pixels out of a reused stream buffer
+        return (width, height, depth, colorspace, data[12:])
+
+    def _screencapChecksum(self):
+        """
+        Returns md5 checksum of raw screencap output calculated on the
+        device, or None if md5sum is not available on the device.
+        """
+        status, out, _ = self._runAdb(
+            ['shell', 'screencap %s | md5sum' % (' '.join(self._screencapArgs),)],
+            [0, 1, 124, 127], timeout=_SHORT_TIMEOUT)
+        checksum = out.strip().split(" ", 1)[0]
+        if status != 0 or len(checksum) != 32:
+            _adapterLog("on-device screencap checksum not available: %s" % (out,))
+            self._shellSupportsMd5sum = False
+            return None
+        self._shellSupportsMd5sum = True
+        return checksum
+
+    def recvScreenUpdated(self, waitTime, pollDelay):
+        """
+        Poll md5 checksum of the screen on the device and compare it
+        to the checksum of the latest raw screenshot. Only 32 bytes
+        are transferred per poll instead of the whole screenshot.
+        """
+        if (self._screenChecksum == None or
+            self._shellSupportsMd5sum == False):
+            return None
+        endTime = time.time() + waitTime
+        while True:
+            checksum = self._screencapChecksum()
+            if checksum == None:
+                return None
+            if checksum != self._screenChecksum:
+                return True
+            if time.time() + pollDelay > endTime:
                 return False
-            try:
-                width, height, fmt = struct.unpack("<LLL", data[:12])
-            except struct.error, e:
-                msg = ("error unpacking screenshot data (%s bytes): %s" %
-                       (len(data), e))
-                _adapterLog(msg)
-                raise FMBTAndroidError(msg)
-            if isinstance(self._screencapFormat, tuple):
-                depth, colorspace = self._screencapFormat
-            elif fmt == 1:
-                depth, colorspace = 8, "RGBA"
-            elif fmt == 2:
-                depth, colorspace = 8, "RGB_"
-            elif fmt == 3:
-                depth, colorspace = 8, "RGB"
-            elif fmt == 5:
-                depth, colorspace = 8, "BGR_" # ignore alpha
-            else:
-                _adapterLog("unsupported screencap raw format %s" % (fmt,))
-                depth, colorspace = None, None
+            time.sleep(pollDelay)
 
-            if depth != None:
+    def recvScreenshotRaw(self):
+        if self._screencapFormat == "png":
+            return None
+        raw = self._recvScreencapRaw()
+        if not raw:
+            return None
+        width, height, depth, colorspace, data = raw
+        if depth != 8:
+            return None
+        return (width, height, colorspace, data)
+
+    def recvScreenshot(self, filename, retry=2, retryDelay=1.0):
+        """
+        Capture a screenshot and copy the image file to given path or
+        system temp folder.
+
+        Returns True on success, otherwise False.
+        """
+        _screenshotTimeout = 60
+        if self._screencapFormat != "png" and fmbtpng != None:
+            # EXPERIMENTAL: PNG encoding moved from device to host
+            raw = self._recvScreencapRaw()
+            if raw == False:
+                return False
+            elif raw != None:
+                width, height, depth, colorspace, data = raw
                 file(filename, "wb").write(fmbtpng.raw2png(
-                    data[12:], width, height, depth, colorspace))
+                    data, width, height, depth, colorspace))
                 return True
             else:
                 # fallback to slower screenshot method
@@ -3241,3 +4018,4 @@ class FMBTAndroidRunError(FMBTAndroidError): pass
 class AndroidConnectionError(FMBTAndroidError, fmbtgti.ConnectionError): pass
 class AndroidConnectionLost(AndroidConnectionError): pass
 class AndroidDeviceNotFound(AndroidConnectionError): pass
+class _AdbSocketError(FMBTAndroidError): pass
@@ -97,10 +97,10 @@ information about which of the alternatives actually matched.
 """
 
 import cgi
+import collections
 import ctypes
 import datetime
 import distutils.sysconfig
-import gc
 import glob
 import inspect
 import math
@@ -110,9 +110,11 @@ import shlex
 import shutil
 import subprocess
 import sys
+import threading
 import time
 import traceback
 import types
+import weakref
 
 import fmbt
 import fmbt_config
@@ -128,6 +130,8 @@ _OCRPAGESEGMODES = [3]
 
 _g_defaultOcrEngine = None # optical character recognition engine
 _g_defaultOirEngine = None # optical image recognition engine
+# Weak references to registered engines. Engines are kept alive by
+# their users, like GUITestInterface instances and default engines.
 _g_ocrEngines = []
 _g_oirEngines = []
 
@@ -193,7 +197,43 @@ def _convert(srcFile, convertArgs, dstFile):
         os.access(srcFile, os.R_OK) and
         os.stat(srcFile).st_mtime < os.stat(dstFile).st_mtime):
         return # cached file is up-to-date
-    subprocess.call([fmbt_config.imagemagick_convert, srcFile] + convertArgs + [dstFile])
+    # supported options are executed in-process, others by convert
+    eyenfinger.convertImage(srcFile, convertArgs, dstFile)
+
+def _parallelMap(func, items, threads):
+    """
+    Returns [func(item) for item in items]. func is called in at most
+    threads parallel threads. If func raises an exception, the first
+    exception is raised.
+    """
+    if threads <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    nextIndex = [0]
+    indexLock = threading.Lock()
+    def worker():
+        while True:
+            with indexLock:
+                if nextIndex[0] >= len(items) or errors:
+                    return
+                index = nextIndex[0]
+                nextIndex[0] += 1
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                errors.append(sys.exc_info())
+                return
+    workers = [threading.Thread(target=worker)
+               for _ in xrange(min(threads, len(items)))]
+    for w in workers:
+        w.daemon = True
+        w.start()
+    for w in workers:
+        w.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
 
 def _ppFilename(origFilename, preprocess):
     return origFilename + ".fmbtoir.cache." + re.sub("[^a-zA-Z0-9.]", "", preprocess) + ".png"
@@ -211,6 +251,23 @@ def _boxOnRegion((x1, y1, x2, y2), (minX, minY, maxX, maxY), partial=True):
         return (x1 < x2 and ((minX <= x1 <= maxX) and (minX <= x2 <= maxX)) and
                 y1 < y2 and ((minY <= y1 <= maxY) and (minY <= y2 <= maxY)))
 
+def _boxesIntersect((left1, top1, right1, bottom1),
+                    (left2, top2, right2, bottom2)):
+    return (left1 < right2 and left2 < right1 and
+            top1 < bottom2 and top2 < bottom1)
+
+def _boxesOverlap(bbox, (itemLeft, itemTop, itemRight, itemBottom)):
+    """
+    Returns True if bounding boxes of found bitmaps overlap so that
+    the latter cannot be accepted if overlapping is not allowed.
+    """
+    if ((itemLeft <= bbox[0] <= itemRight or itemLeft <= bbox[2] <= itemRight) and
+        (itemTop <= bbox[1] <= itemBottom or itemTop <= bbox[3] <= itemBottom)):
+        if ((itemLeft < bbox[0] < itemRight or itemLeft < bbox[2] < itemRight) or
+            (itemTop < bbox[1] < itemBottom or itemTop < bbox[3] < itemBottom)):
+            return True
+    return False
+
 def _edgeDistanceInDirection((x, y), (width, height), direction):
     x, y = _intCoords((x, y), (width, height))
 
@@ -275,8 +332,30 @@ for _dirname in _libpath:
             ctypes.c_void_p,
             ctypes.c_void_p,
             ctypes.c_int]
+        eye4graphics.findColorGroups.restype = ctypes.c_int
+        eye4graphics.findColorGroups.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_int,
+            ctypes.c_void_p,
+            ctypes.c_void_p,
+            ctypes.c_double,
+            ctypes.c_double,
+            ctypes.c_int,
+            ctypes.c_void_p]
         eye4graphics.openImage.argtypes = [ctypes.c_char_p]
         eye4graphics.openImage.restype = ctypes.c_void_p
+        eye4graphics.openBlob.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_char_p,
+            ctypes.c_int,
+            ctypes.c_int]
+        eye4graphics.openBlob.restype = ctypes.c_void_p
+        eye4graphics.imageResize.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_char_p]
+        eye4graphics.imageResize.restype = ctypes.c_void_p
         eye4graphics.openedImageIsBlank.argtypes = [ctypes.c_void_p]
         eye4graphics.openedImageIsBlank.restype = ctypes.c_int
         eye4graphics.openedImageDimensions.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
@@ -303,11 +382,134 @@ def _e4gOpenImage(filename):
     else:
         return image
 
+# Default memory budget of decoded reference bitmaps in OIR engine
+_g_bitmapCacheSize = 64 * 1024 * 1024
+
+# Bitmaps are searched for from downscaled screenshots in
+# searchMode="pyramid" only if the downscaled bitmap is at least this
+# many pixels wide and high.
+_g_pyramidMinBitmapSize = 8
+
+# Pyramid search accepts candidates with looser colorMatch on
+# downscaled images, they are verified on full scale images.
+_g_pyramidColorMatchSlack = 0.1
+
+# Screenshot damage tracking compares screenshots in blocks of this
+# size. If more than the maximum number of blocks have changed, all
+# bitmaps are searched again from the whole screenshot.
+_g_damageBlockSize = 32
+_g_damageMaxBlocks = 256
+
+# Initial number of bounding boxes reserved for findItemsByColor
+# groups when the number of items is not limited.
+_g_colorGroupBboxes = 1024
+
+# ViewIndex grid cell size in pixels. Items that would cover more
+# cells than the maximum are checked on every positional query.
+_g_viewIndexCellSize = 64
+_g_viewIndexMaxCells = 64
+
+# Background screenshot capturing: max. seconds refreshScreenshot
+# waits for a fresh frame before capturing one itself, and seconds
+# to wait before retrying when the connection gave no screenshot.
+_g_captureFrameTimeout = 60.0
+_g_captureRetryDelay = 0.5
+
+# Default number of parallel bitmap searches in OIR engine
+try:
+    import multiprocessing
+    _g_oirThreads = multiprocessing.cpu_count()
+except (ImportError, NotImplementedError):
+    _g_oirThreads = 1
+
+# Raw image formats (see fmbtpng.raw2png) to pixel orders of openBlob
+_g_rawFormatPixelOrder = {
+    "RGB": "RGB",
+    "RGBA": "RGBA",
+    "RGB_": "RGBP",
+    "BGR": "BGR",
+    "BGR_": "BGRP"
+}
+
+def _e4gOpenBlob(rawImage):
+    width, height, fmt, data = rawImage
+    fmt = fmt.upper()
+    if fmt == "RGB565":
+        rgbData = ctypes.create_string_buffer(width * height * 3)
+        eye4graphics.rgb5652rgb(data, width, height, rgbData)
+        data, fmt = rgbData, "RGB"
+    if not fmt in _g_rawFormatPixelOrder:
+        raise ValueError('Unsupported raw image format "%s"' % (fmt,))
+    image = eye4graphics.openBlob(data, _g_rawFormatPixelOrder[fmt],
+                                  width, height)
+    if not image:
+        raise IOError('Cannot open %sx%s %s image data' % (width, height, fmt))
+    else:
+        return image
+
+def _e4gDownscale(e4gImage, factor):
+    width, height = _e4gImageDimensions(e4gImage)
+    # Box filter averages factor x factor pixels
+    image = eye4graphics.imageResize(e4gImage,
+                                     max(1, width / factor),
+                                     max(1, height / factor),
+                                     "Box")
+    if not image:
+        raise IOError('Cannot downscale %sx%s image by %s' % (width, height, factor))
+    else:
+        return image
+
 def _e4gImageDimensions(e4gImage):
     struct_bbox = _Bbox(0, 0, 0, 0, 0)
     eye4graphics.openedImageDimensions(ctypes.byref(struct_bbox), e4gImage)
     return (struct_bbox.right, struct_bbox.bottom)
 
+def _e4gChangedRegions(e4gImageA, e4gImageB, blockSize, maxBlocks):
+    """
+    Returns list of (left, top, right, bottom) regions that differ in
+    opened images of the same size. Regions consist of blockSize x
+    blockSize pixel blocks. Returns None if image sizes differ or
+    more than maxBlocks blocks have changed.
+    """
+    width, height = _e4gImageDimensions(e4gImageA)
+    if (width, height) != _e4gImageDimensions(e4gImageB):
+        return None
+    changedBlocks = set()
+    bbox = _Bbox(-1, 0, 0, 0, 0)
+    while eye4graphics.findNextDiff(
+            ctypes.byref(bbox),
+            ctypes.c_void_p(e4gImageA),
+            ctypes.c_void_p(e4gImageB),
+            ctypes.c_double(1.0), # colorMatch
+            ctypes.c_double(1.0), # opacityLimit
+            None, None, 1) == 1:
+        blockX, blockY = bbox.left / blockSize, bbox.top / blockSize
+        changedBlocks.add((blockX, blockY))
+        if len(changedBlocks) > maxBlocks:
+            return None
+        # continue from the next block on the same row
+        bbox.left = min((blockX + 1) * blockSize, width) - 1
+    # join horizontally adjacent blocks, then regions of equal width
+    # on adjacent block rows.
+    regions = []
+    for blockX, blockY in sorted(changedBlocks, key=lambda b: (b[1], b[0])):
+        if regions and regions[-1][1] == blockY and regions[-1][2] == blockX:
+            regions[-1][2] = blockX + 1
+        else:
+            regions.append([blockX, blockY, blockX + 1, blockY + 1])
+    joined = []
+    for region in regions:
+        for prev in joined:
+            if (prev[0] == region[0] and prev[2] == region[2] and
+                prev[3] == region[1]):
+                prev[3] = region[3]
+                break
+        else:
+            joined.append(region)
+    return [(left * blockSize, top * blockSize,
+             min(right * blockSize, width), min(bottom * blockSize, height))
+            for left, top, right, bottom in joined]
+
 def _e4gImageIsBlank(filename):
     e4gImage = _e4gOpenImage(filename)
     rv = (eye4graphics.openedImageIsBlank(e4gImage) == 1)
@@ -372,6 +574,20 @@ class GUITestConnection(object):
         Saves screenshot from the GUI under test to given filename.
         """
         raise NotImplementedError('recvScreenshot("%s") needed but not implemented.' % (filename,))
+    def recvScreenshotRaw(self):
+        """
+        Returns screenshot from the GUI under test as raw pixel data
+        in tuple (width, height, format, data), where format is one
+        of "RGB", "RGBA", "RGB_", "BGR", "BGR_" and "RGB565" (see
+        fmbtpng.raw2png) with 8 bits per color channel, and data is a
+        string.
+
+        Implementing this method is optional. If not implemented, the
+        method returns None, and recvScreenshot is used instead. Raw
+        screenshots are used only if in-memory screenshots are enabled
+        (see GUITestInterface.setScreenshotInMemory).
+        """
+        return None
     def recvScreenUpdated(self, waitTime, pollDelay):
         """
         Wait until the screen has been updated, but no longer than the
@@ -478,6 +694,11 @@ class OrEngine(object):
         Returns the index with which the engine was registered to the
         list of OCR or OIR engines. If this instance implements both
         OCR and OIR engines, returns pair (OCR index, OIR index).
+
+        The lists refer to engines weakly. An engine can be used by
+        its index as long as it is referenced elsewhere, for instance
+        by the caller, a GUITestInterface instance or as the default
+        engine.
         """
         # Allow a single engine implement both OCR and OIR engine
         # interfaces. Therefore, it must be possible to call
@@ -489,16 +710,12 @@ class OrEngine(object):
         engineIndexes = []
 
         if isinstance(self, OcrEngine):
-            if not self in _g_ocrEngines:
-                _g_ocrEngines.append(self)
-            engineIndexes.append(_g_ocrEngines.index(self))
+            engineIndexes.append(_registerEngine(_g_ocrEngines, self))
             if defaultOcr:
                 _g_defaultOcrEngine = self
 
         if isinstance(self, OirEngine):
-            if not self in _g_oirEngines:
-                _g_oirEngines.append(self)
-            engineIndexes.append(_g_oirEngines.index(self))
+            engineIndexes.append(_registerEngine(_g_oirEngines, self))
             if defaultOir:
                 _g_defaultOirEngine = self
 
@@ -507,6 +724,28 @@ class OrEngine(object):
         else:
             return engineIndexes
 
+def _registerEngine(engines, engine):
+    """
+    Returns the index of engine in engines list of weak references,
+    adds the engine to the list if it is not there.
+    """
+    for index, engineRef in enumerate(engines):
+        if engineRef() is engine:
+            return index
+    engines.append(weakref.ref(engine))
+    return len(engines) - 1
+
+def _registeredEngine(engines, index):
+    """
+    Returns engine registered with index to engines list of weak
+    references.
+    """
+    engine = engines[index]()
+    if engine == None:
+        raise ValueError('Engine %s has been registered but it is not '
+                         'referenced anymore.' % (index,))
+    return engine
+
 class OcrEngine(OrEngine):
     """
     This is an abstract interface for OCR engines that can be plugged
@@ -581,7 +820,7 @@ class OcrEngine(OrEngine):
         except KeyError:
             raise KeyError('screenshot "%s" does not have findTextDefaults. '
                            'If OcrEngine.addScreenshot() is overridden, it '
-                           '*must* call parent\'s addScreenshot.' % (screenshot.filename(),))
+                           '*must* call parent\'s addScreenshot.' % (screenshot.filename(save=False),))
 
     def _removeScreenshot(self, screenshot):
         pass
@@ -645,6 +884,83 @@ class OcrEngine(OrEngine):
         ocrArgs = self.__ocrArgs(screenshot, **kwargs)
         return self._findText(screenshot, text, **ocrArgs)
 
+    def findTexts(self, screenshot, listOfTexts, **kwargs):
+        """
+        Return list of lists of fmbtgti.GUIItems, one list for each
+        text in listOfTexts. Engines can search for all texts at once.
+        """
+        ocrArgs = self.__ocrArgs(screenshot, **kwargs)
+        return self._findTexts(screenshot, list(listOfTexts), **ocrArgs)
+
+    def findTextsMany(self, screenshot, queries):
+        """
+        Find texts with differing arguments.
+
+        Parameters:
+
+          screenshot (fmbtgti.Screenshot)
+                  screenshot to be searched from.
+
+          queries (list of (key, text, kwargs) tuples)
+                  key identifies the query in results, text is
+                  searched for with findText arguments in kwargs
+                  dictionary.
+
+        Queries are grouped by OCR pass (see _ocrPassKey) so that
+        each pass is run only once, and queries with identical
+        arguments are searched for with one _findTexts call.
+
+        Returns dictionary key -> list of fmbtgti.GUIItems.
+        """
+        passOrder = []
+        passes = {} # pass key -> (findArgs key order, findArgs key -> (ocrArgs, queries))
+        for index, (key, text, kwargs) in enumerate(queries):
+            ocrArgs = self.__ocrArgs(screenshot, **kwargs)
+            passKey = self._ocrPassKey(screenshot, ocrArgs)
+            argsKey = repr(sorted(ocrArgs.items()))
+            if not passKey in passes:
+                passOrder.append(passKey)
+                passes[passKey] = ([], {})
+            argsOrder, groups = passes[passKey]
+            if not argsKey in groups:
+                argsOrder.append(argsKey)
+                groups[argsKey] = (ocrArgs, [])
+            groups[argsKey][1].append((index, text))
+        results = [None] * len(queries)
+        for passKey in passOrder:
+            argsOrder, groups = passes[passKey]
+            for argsKey in argsOrder:
+                ocrArgs, indexesAndTexts = groups[argsKey]
+                found = self._findTexts(
+                    screenshot, [text for _, text in indexesAndTexts], **ocrArgs)
+                for (index, _), items in zip(indexesAndTexts, found):
+                    results[index] = items
+        # the last query of a key determines the result
+        return dict((query[0], items) for query, items in zip(queries, results))
+
+    def _ocrPassKey(self, screenshot, ocrArgs):
+        """
+        Returns a hashable key that identifies the OCR pass needed
+        for finding texts with ocrArgs. Queries with equal keys are
+        served by the same OCR results. Override this if some
+        arguments, like minimum match score, do not affect the
+        recognition. By default every set of arguments is a pass of
+        its own.
+        """
+        return repr(sorted(ocrArgs.items()))
+
+    def _findTexts(self, screenshot, listOfTexts, **kwargs):
+        """
+        Find appearances of many texts from the screenshot. Override
+        this if the engine can search for many texts more efficiently
+        than one by one. Parameters are the same as in _findText,
+        except for listOfTexts.
+
+        Return list of lists of fmbtgti.GUIItems.
+        """
+        return [self._findText(screenshot, text, **kwargs)
+                for text in listOfTexts]
+
     def _findText(self, screenshot, text, **kwargs):
         """
         Find appearances of text from the screenshot.
@@ -712,6 +1028,20 @@ class _EyenfingerOcrEngine(OcrEngine):
       configfile (string, optional):
               Tesseract configuration file.
 
+      ocrMode (string, optional):
+              "full" reads the area at once. "tiled" splits the area,
+              or ocrRegions, to overlapping tiles that are read in
+              parallel. Words on tile seams are reported only
+              once. Tiled mode is faster on large screenshots and
+              when only small regions need to be read. The default
+              is "full".
+
+      ocrRegions (list, optional):
+              regions to be read in "tiled" mode. Regions are
+              (left, top, right, bottom) tuples like area, or
+              items with bbox() method, for instance GUIItems or
+              ViewItems. The default is None, that is, read the area.
+
 
     Example: limit recognized characters to hexadecimals by creating file
     "hexchars" with content
@@ -727,7 +1057,7 @@ class _EyenfingerOcrEngine(OcrEngine):
         dut.ocrEngine().setFindTextDefaults(configfile="hexchars")
     """
     class _OcrResults(object):
-        __slots__ = ("filename", "screenSize", "pagesegmodes", "preprocess", "area", "words", "lang", "configfile")
+        __slots__ = ("filename", "screenSize", "pagesegmodes", "preprocess", "area", "words", "lang", "configfile", "ocrMode", "ocrRegions", "passArgs")
         def __init__(self, filename, screenSize):
             self.filename = filename
             self.screenSize = screenSize
@@ -737,6 +1067,9 @@ class _EyenfingerOcrEngine(OcrEngine):
             self.words = None
             self.lang = None
             self.configfile = None
+            self.ocrMode = None
+            self.ocrRegions = None
+            self.passArgs = None
 
     def __init__(self, *args, **engineDefaults):
         engineDefaults["area"] = engineDefaults.get("area", (0.0, 0.0, 1.0, 1.0))
@@ -745,9 +1078,78 @@ class _EyenfingerOcrEngine(OcrEngine):
         engineDefaults["pagesegmodes"] = engineDefaults.get("pagesegmodes", _OCRPAGESEGMODES)
         engineDefaults["preprocess"] = engineDefaults.get("preprocess", _OCRPREPROCESS)
         engineDefaults["configfile"] = engineDefaults.get("configfile", None)
+        engineDefaults["ocrMode"] = engineDefaults.get("ocrMode", "full")
+        engineDefaults["ocrRegions"] = engineDefaults.get("ocrRegions", None)
         super(_EyenfingerOcrEngine, self).__init__(*args, **engineDefaults)
         self._ss = {} # OCR results for screenshots
 
+    def ocrCacheStats(self):
+        """
+        Returns statistics of the OCR result cache in a dictionary
+        with keys "hits", "diskHits", "misses", "results", "usage",
+        "size", "directory" and "directorySize".
+
+        OCR results are cached by the hash of preprocessed pixels and
+        OCR parameters, therefore identical screens are read only
+        once even if they are captured at different times.
+        """
+        return eyenfinger.ocrCacheStats()
+
+    def setOcrCacheSize(self, cacheSize):
+        """
+        Set the memory budget of the OCR result cache.
+
+        Parameters:
+          cacheSize (integer):
+                  estimated maximum memory usage in bytes of cached
+                  OCR results. 0 disables the memory cache. The
+                  default is 16 MB.
+        """
+        eyenfinger.setOcrCacheSize(cacheSize)
+
+    def setOcrCacheDir(self, directory, cacheSize=eyenfinger._g_ocrCacheDirSize):
+        """
+        Store OCR results in a directory that can be shared by many
+        processes and test runs.
+
+        Parameters:
+          directory (string):
+                  cache directory. None disables the disk cache,
+                  which is the default.
+
+          cacheSize (integer, optional):
+                  maximum disk usage in bytes. The default is 256 MB.
+        """
+        eyenfinger.setOcrCacheDir(directory, cacheSize)
+
+    def clearOcrCache(self):
+        """
+        Remove all cached OCR results and reset cache statistics.
+        """
+        eyenfinger.clearOcrCache()
+
+    def tesseractWorkers(self):
+        """
+        Returns the maximum number of resident tesseract instances
+        used for OCR, or 0 if tesseract executable is run instead.
+        """
+        return eyenfinger.tesseractWorkers()
+
+    def setTesseractWorkers(self, maxWorkers):
+        """
+        Set the maximum number of resident tesseract instances.
+
+        Parameters:
+          maxWorkers (integer):
+                  max number of tesseract instances kept loaded
+                  through libtesseract. pagesegmodes are read in
+                  parallel by separate instances. 0 runs tesseract
+                  executable for every OCR. The default is 4.
+
+        Resident instances are used only if libtesseract is found.
+        """
+        eyenfinger.setTesseractWorkers(maxWorkers)
+
     def _addScreenshot(self, screenshot, **findTextDefaults):
         ssId = id(screenshot)
         self._ss[ssId] = _EyenfingerOcrEngine._OcrResults(screenshot.filename(), screenshot.size())
@@ -757,31 +1159,77 @@ class _EyenfingerOcrEngine(OcrEngine):
         if ssId in self._ss:
             del self._ss[ssId]
 
-    def _findText(self, screenshot, text, match=None, preprocess=None, area=None, pagesegmodes=None, lang=None, configfile=None):
+    def _ocrPassKey(self, screenshot, ocrArgs):
+        # match only filters found texts, other arguments define the
+        # OCR pass.
+        return repr(self._ocrPassArgs(
+            screenshot, ocrArgs.get("preprocess", None),
+            ocrArgs.get("area", None), ocrArgs.get("pagesegmodes", None),
+            ocrArgs.get("lang", None), ocrArgs.get("configfile", None),
+            ocrArgs.get("ocrMode", "full"), ocrArgs.get("ocrRegions", None)))
+
+    def _ocrPassArgs(self, screenshot, preprocess, area, pagesegmodes, lang, configfile, ocrMode, ocrRegions):
+        """
+        Returns normalized arguments of an OCR pass: tuple
+        (preprocess, area, pagesegmodes, lang, configfile, ocrMode,
+        ocrRegions). Equal tuples are served by the same OCR results.
+        """
+        if not type(preprocess) in (list, tuple):
+            preprocess = [preprocess]
+        if area != None:
+            area = tuple(area)
+        if pagesegmodes != None:
+            pagesegmodes = tuple(pagesegmodes)
+        if type(configfile) == list:
+            configfile = tuple(configfile)
+        if ocrMode == "tiled":
+            ocrRegions = self._ocrRegions(screenshot, area, ocrRegions)
+        elif ocrMode == "full":
+            ocrRegions = None
+        else:
+            raise ValueError('Invalid ocrMode "%s", expected "full" or "tiled".' % (ocrMode,))
+        return (tuple(preprocess), area, pagesegmodes, lang, configfile,
+                ocrMode, ocrRegions)
+
+    def _findText(self, screenshot, text, match=None, preprocess=None, area=None, pagesegmodes=None, lang=None, configfile=None, ocrMode=None, ocrRegions=None):
+        return self._findTexts(screenshot, [text], match=match,
+                               preprocess=preprocess, area=area,
+                               pagesegmodes=pagesegmodes, lang=lang,
+                               configfile=configfile, ocrMode=ocrMode,
+                               ocrRegions=ocrRegions)[0]
+
+    def _findTexts(self, screenshot, listOfTexts, match=None, preprocess=None, area=None, pagesegmodes=None, lang=None, configfile=None, ocrMode=None, ocrRegions=None):
         ssId = id(screenshot)
-        self._assumeOcrResults(screenshot, preprocess, area, pagesegmodes, lang, configfile)
+        self._assumeOcrResults(screenshot, preprocess, area, pagesegmodes, lang, configfile, ocrMode, ocrRegions)
 
+        # Search for each text from results of preprocess filters in
+        # order, use the first filter that finds the text.
+        retval = [[] for text in listOfTexts]
+        unfound = range(len(listOfTexts))
         for ppfilter in self._ss[ssId].words.keys():
+            if not unfound:
+                break
             try:
-                score_text_bbox_list = eyenfinger.findText(
-                    text, self._ss[ssId].words[ppfilter], match=match)
-                if not score_text_bbox_list:
-                    continue
-                else:
-                    break
+                results = eyenfinger.findTexts(
+                    [listOfTexts[i] for i in unfound],
+                    self._ss[ssId].words[ppfilter], match=match)
             except eyenfinger.BadMatch:
                 continue
-        else:
-            return []
-        retval = [GUIItem("OCR text (match %.2f)" % (score,),
-                          bbox, self._ss[ssId].filename,
-                          ocrFind=text, ocrFound=matching_text)
-                  for score, matching_text, bbox in score_text_bbox_list]
+            stillUnfound = []
+            for i, score_text_bbox_list in zip(unfound, results):
+                if not score_text_bbox_list:
+                    stillUnfound.append(i)
+                    continue
+                retval[i] = [GUIItem("OCR text (match %.2f)" % (score,),
+                                     bbox, self._ss[ssId].filename,
+                                     ocrFind=listOfTexts[i], ocrFound=matching_text)
+                             for score, matching_text, bbox in score_text_bbox_list]
+            unfound = stillUnfound
         return retval
 
-    def _dumpOcr(self, screenshot, match=None, preprocess=None, area=None, pagesegmodes=None, lang=None, configfile=None):
+    def _dumpOcr(self, screenshot, match=None, preprocess=None, area=None, pagesegmodes=None, lang=None, configfile=None, ocrMode=None, ocrRegions=None):
         ssId = id(screenshot)
-        self._assumeOcrResults(screenshot, preprocess, area, pagesegmodes, lang, configfile)
+        self._assumeOcrResults(screenshot, preprocess, area, pagesegmodes, lang, configfile, ocrMode, ocrRegions)
         w = []
         for ppfilter in self._ss[ssId].preprocess:
             for word in self._ss[ssId].words[ppfilter]:
@@ -790,29 +1238,63 @@ class _EyenfingerOcrEngine(OcrEngine):
                     w.append((word, (x1, y1, x2, y2)))
         return sorted(set(w), key=lambda i:(i[1][1]/8, i[1][0]))
 
-    def _assumeOcrResults(self, screenshot, preprocess, area, pagesegmodes, lang, configfile):
+    def _ocrRegions(self, screenshot, area, ocrRegions):
+        """
+        Returns tuple of regions to be read in tiled mode in
+        screenshot pixel coordinates.
+        """
+        if id(screenshot) in self._ss:
+            screenSize = self._ss[id(screenshot)].screenSize
+        else:
+            screenSize = screenshot.size()
+        if not ocrRegions:
+            ocrRegions = [area]
+        regions = []
+        for region in ocrRegions:
+            if hasattr(region, "bbox"):
+                region = region.bbox()
+            left, top = _intCoords(region[:2], screenSize)
+            right, bottom = _intCoords(region[2:], screenSize)
+            left, top = max(0, left), max(0, top)
+            right = min(screenSize[0], right)
+            bottom = min(screenSize[1], bottom)
+            if left < right and top < bottom:
+                regions.append((left, top, right, bottom))
+        if not regions:
+            raise ValueError("No ocrRegions on the screenshot: %s" % (ocrRegions,))
+        return tuple(regions)
+
+    def _assumeOcrResults(self, screenshot, preprocess, area, pagesegmodes, lang, configfile, ocrMode="full", ocrRegions=None):
         ssId = id(screenshot)
-        if not type(preprocess) in (list, tuple):
-            preprocess = [preprocess]
+        passArgs = self._ocrPassArgs(screenshot, preprocess, area, pagesegmodes, lang, configfile, ocrMode, ocrRegions)
+        preprocess, area, pagesegmodes, lang, configfile, ocrMode, ocrRegions = passArgs
 
         if (self._ss[ssId].words == None
-            or self._ss[ssId].preprocess != preprocess
-            or self._ss[ssId].area != area
-            or self._ss[ssId].lang != lang
-            or self._ss[ssId].configfile != configfile):
+            or self._ss[ssId].passArgs != passArgs):
             self._ss[ssId].words = {}
+            self._ss[ssId].passArgs = passArgs
             self._ss[ssId].preprocess = preprocess
+            self._ss[ssId].pagesegmodes = pagesegmodes
             self._ss[ssId].area = area
             self._ss[ssId].lang = lang
             self._ss[ssId].configfile = configfile
+            self._ss[ssId].ocrMode = ocrMode
+            self._ss[ssId].ocrRegions = ocrRegions
             for ppfilter in preprocess:
                 pp = ppfilter % { "zoom": "-resize %sx" % (self._ss[ssId].screenSize[0] * 2) }
                 try:
-                    eyenfinger.iRead(source=self._ss[ssId].filename, ocr=True, preprocess=pp, ocrArea=area, ocrPageSegModes=pagesegmodes, lang=lang, configfile=configfile)
+                    if ocrMode == "tiled":
+                        words = eyenfinger.iReadTiles(
+                            self._ss[ssId].filename, areas=ocrRegions,
+                            preprocess=pp, ocrPageSegModes=pagesegmodes,
+                            lang=lang, configfile=configfile)
+                    else:
+                        eyenfinger.iRead(source=self._ss[ssId].filename, ocr=True, preprocess=pp, ocrArea=area, ocrPageSegModes=pagesegmodes, lang=lang, configfile=configfile)
+                        words = eyenfinger._g_words
                 except Exception:
                     self._ss[ssId].words = None
                     raise
-                self._ss[ssId].words[ppfilter] = eyenfinger._g_words
+                self._ss[ssId].words[ppfilter] = words
 
 def _defaultOcrEngine():
     if _g_defaultOcrEngine:
@@ -866,6 +1348,7 @@ class OirEngine(OrEngine):
         super(OirEngine, self).__init__(*args, **kwargs)
         self._ssFindBitmapDefaults = {}
         self._findBitmapDefaults = {}
+        self._findThreads = 1
         oirArgs, _ = _takeOirArgs(self, kwargs)
         self._setFindBitmapDefaults(oirArgs)
 
@@ -900,7 +1383,7 @@ class OirEngine(OrEngine):
         except KeyError:
             raise KeyError('screenshot "%s" does not have findBitmapDefaults. '
                            'If OirEngine.addScreenshot() is overridden, it '
-                           '*must* call parent\'s addScreenshot.' % (screenshot.filename(),))
+                           '*must* call parent\'s addScreenshot.' % (screenshot.filename(save=False),))
 
     def _removeScreenshot(self, screenshot):
         pass
@@ -975,13 +1458,57 @@ class OirEngine(OrEngine):
                     x2, y2 = _intCoords((right, bottom), screenshot.size())
                     foundItems.append(
                         GUIItem("bitmap location", (x1, y1, x2, y2),
-                                screenshot.filename(), bitmap=bitmapLocsFilename))
+                                screenshot.filename(save=False), bitmap=bitmapLocsFilename))
                 return foundItems
             except Exception, e:
                 raise ValueError('Error reading bounding box list from %s: %s' %
                                  repr(bitmapLocsFilename), e)
         return self._findBitmap(screenshot, bitmap, **oirArgs)
 
+    def inheritFindResults(self, screenshot, previousScreenshot):
+        """
+        Reuse results of findBitmap on previousScreenshot for
+        screenshot where possible. Both screenshots have been added
+        to the engine. Engines that do not support reusing results
+        ignore this call.
+
+        Called by GUITestInterface.refreshScreenshot if screenshot
+        damage tracking is enabled.
+        """
+        pass
+
+    def findBitmaps(self, screenshot, listOfBitmaps, **kwargs):
+        """
+        Return list of lists of fmbtgti.GUIItems, one list for each
+        bitmap in listOfBitmaps. Bitmaps are searched for in
+        findThreads() parallel threads.
+        """
+        return _parallelMap(
+            lambda bitmap: self.findBitmap(screenshot, bitmap, **kwargs),
+            list(listOfBitmaps), self.findThreads())
+
+    def findThreads(self):
+        """
+        Returns the number of threads used for searching bitmaps in
+        parallel.
+        """
+        return self._findThreads
+
+    def setFindThreads(self, threads):
+        """
+        Set the number of threads used for searching bitmaps in
+        parallel, see findBitmaps().
+
+        Parameters:
+
+          threads (integer):
+                  maximum number of parallel searches. 1 searches
+                  bitmaps one by one. Engines whose _findBitmap is
+                  not thread-safe must use 1, that is the default in
+                  this class.
+        """
+        self._findThreads = max(1, int(threads))
+
     def _findBitmap(self, screenshot, bitmap, **kwargs):
         """
         Find appearances of bitmap from the screenshot.
@@ -1047,6 +1574,17 @@ class _Eye4GraphicsOirEngine(OirEngine):
               contains only non-overlapping bounding boxes. The
               default is False.
 
+      searchMode (string, optional):
+              "exhaustive" compares the bitmap to every location in
+              the search area. "pyramid" searches for candidates on
+              downscaled screenshot and bitmap first, and compares
+              the full scale bitmap only to the candidate locations.
+              Pyramid search is much faster on large screenshots and
+              with scale != 1.0, but it may miss small bitmaps and
+              bitmaps with thin details. Bitmaps too small to be
+              downscaled are searched exhaustively. The default is
+              "exhaustive".
+
       scale (float or pair of floats, optional):
               scale to be applied to the bitmap before
               matching. Single float is a factor for both X and Y
@@ -1079,6 +1617,11 @@ class _Eye4GraphicsOirEngine(OirEngine):
     If unsure about parameters, but you have a bitmap that should be
     detected in a screenshot, try obj.oirEngine().adjustParameters().
 
+    Decoded reference bitmaps are kept in a least-recently-used cache
+    so that repeated searches for the same bitmaps do not read them
+    from disk again. A bitmap is read again if its file is modified.
+    See setBitmapCacheSize() and bitmapCacheStats().
+
     Example:
 
     d.enableVisualLog("params.html")
@@ -1103,6 +1646,7 @@ class _Eye4GraphicsOirEngine(OirEngine):
         engineDefaults["bitmapPixelSize"] = engineDefaults.get("bitmapPixelSize", 0)
         engineDefaults["screenshotPixelSize"] = engineDefaults.get("screenshotPixelSize", 0)
         engineDefaults["preprocess"] = engineDefaults.get("preprocess", "")
+        engineDefaults["searchMode"] = engineDefaults.get("searchMode", "exhaustive")
         OirEngine.__init__(self, *args, **engineDefaults)
         self._openedImages = {}
         # openedRelatedScreenshots maps a screenshot filename to
@@ -1110,25 +1654,197 @@ class _Eye4GraphicsOirEngine(OirEngine):
         # must be closed when the screenshot is removed.
         self._openedRelatedScreenshots = {}
         self._findBitmapCache = {}
+        # pyramidImages maps (screenshot filename, factor) to
+        # downscaled screenshot.
+        self._pyramidImages = {}
+        # inheritedResults maps screenshot filename to (changed
+        # regions, findBitmapCache of the previous screenshot).
+        self._inheritedResults = {}
+        # bitmapCache maps (bitmap filename, mtime) to
+        # (opened image, estimated memory usage), least recently
+        # used first.
+        self._bitmapCache = collections.OrderedDict()
+        self._bitmapCacheSize = _g_bitmapCacheSize
+        self._bitmapCacheUsage = 0
+        self._bitmapCacheHits = 0
+        self._bitmapCacheMisses = 0
+        # bitmapCachePins maps cacheKey to the number of searches
+        # using the bitmap, pinned bitmaps are not closed.
+        self._bitmapCachePins = {}
+        # lock protects the bookkeeping above, searches on opened
+        # images run in parallel.
+        self._lock = threading.RLock()
+        self._partialAreaLock = threading.Lock()
+        self._findThreads = _g_oirThreads
+
+    def bitmapCacheSize(self):
+        """
+        Returns the memory budget (in bytes) of the decoded bitmap cache.
+        """
+        return self._bitmapCacheSize
+
+    def setBitmapCacheSize(self, cacheSize):
+        """
+        Set the memory budget of the decoded bitmap cache.
+
+        Parameters:
+          cacheSize (integer):
+                  estimated maximum memory usage in bytes of
+                  decoded reference bitmaps. Least recently used
+                  bitmaps are closed when the budget is
+                  exceeded. 0 disables the cache. The default is 64 MB.
+        """
+        with self._lock:
+            self._bitmapCacheSize = int(cacheSize)
+            self._bitmapCacheShrink(self._bitmapCacheSize)
+
+    def bitmapCacheStats(self):
+        """
+        Returns statistics of the decoded bitmap cache in a dictionary
+        with keys "hits", "misses", "bitmaps", "usage" and "size".
+        """
+        return {"hits": self._bitmapCacheHits,
+                "misses": self._bitmapCacheMisses,
+                "bitmaps": len(self._bitmapCache),
+                "usage": self._bitmapCacheUsage,
+                "size": self._bitmapCacheSize}
+
+    def clearBitmapCache(self):
+        """
+        Close all cached bitmaps and reset cache statistics.
+        """
+        with self._lock:
+            self._bitmapCacheShrink(0)
+            self._bitmapCacheHits = 0
+            self._bitmapCacheMisses = 0
+
+    def _bitmapCacheShrink(self, cacheSize):
+        for cacheKey in list(self._bitmapCache):
+            if self._bitmapCacheUsage <= cacheSize:
+                break
+            if self._bitmapCachePins.get(cacheKey, 0) > 0:
+                continue # in use, close later
+            e4gImage, usage = self._bitmapCache.pop(cacheKey)
+            eye4graphics.closeImage(e4gImage)
+            self._bitmapCacheUsage -= usage
+
+    def _openBitmap(self, bitmap):
+        """
+        Returns pair (cacheKey, opened bitmap). The bitmap must be
+        released with _closeBitmap(cacheKey, opened bitmap). Must be
+        called with self._lock held.
+        """
+        try:
+            mtime = os.stat(bitmap).st_mtime
+        except OSError:
+            mtime = None
+        cacheKey = (bitmap, mtime)
+        if cacheKey in self._bitmapCache:
+            self._bitmapCacheHits += 1
+            # move to the most recently used end
+            cached = self._bitmapCache.pop(cacheKey)
+            self._bitmapCache[cacheKey] = cached
+            self._bitmapCachePins[cacheKey] = self._bitmapCachePins.get(cacheKey, 0) + 1
+            return cacheKey, cached[0]
+        self._bitmapCacheMisses += 1
+        # drop stale versions of the same bitmap file
+        for staleKey in [k for k in self._bitmapCache if k[0] == bitmap]:
+            if self._bitmapCachePins.get(staleKey, 0) > 0:
+                continue
+            e4gImage, usage = self._bitmapCache.pop(staleKey)
+            eye4graphics.closeImage(e4gImage)
+            self._bitmapCacheUsage -= usage
+        e4gImage = _e4gOpenImage(bitmap)
+        width, height = _e4gImageDimensions(e4gImage)
+        # MagickCore (Q16) uses 8 bytes per pixel
+        usage = width * height * 8
+        if mtime == None or usage > self._bitmapCacheSize:
+            return None, e4gImage # not cached
+        self._bitmapCacheShrink(self._bitmapCacheSize - usage)
+        self._bitmapCache[cacheKey] = (e4gImage, usage)
+        self._bitmapCacheUsage += usage
+        self._bitmapCachePins[cacheKey] = 1
+        return cacheKey, e4gImage
+
+    def _closeBitmap(self, cacheKey, e4gImage):
+        """
+        Release bitmap opened with _openBitmap. Must be called with
+        self._lock held.
+        """
+        if cacheKey == None:
+            eye4graphics.closeImage(e4gImage)
+            return
+        self._bitmapCachePins[cacheKey] -= 1
+        if self._bitmapCachePins[cacheKey] == 0:
+            del self._bitmapCachePins[cacheKey]
+            if not cacheKey in self._bitmapCache:
+                # evicted while in use
+                eye4graphics.closeImage(e4gImage)
+            else:
+                self._bitmapCacheShrink(self._bitmapCacheSize)
 
     def _addScreenshot(self, screenshot, **findBitmapDefaults):
-        filename = screenshot.filename()
-        self._openedImages[filename] = _e4gOpenImage(filename)
-        # make sure size() is available, this can save an extra
-        # opening of the screenshot file.
-        if screenshot.size(allowReadingFile=False) == None:
-            screenshot.setSize(_e4gImageDimensions(self._openedImages[filename]))
-        self._findBitmapCache[filename] = {}
+        filename = screenshot.filename(save=False)
+        if screenshot.rawImage() != None:
+            # in-memory screenshot, do not encode and decode a file
+            e4gImage = _e4gOpenBlob(screenshot.rawImage())
+        else:
+            e4gImage = _e4gOpenImage(filename)
+        with self._lock:
+            self._openedImages[filename] = e4gImage
+            # make sure size() is available, this can save an extra
+            # opening of the screenshot file.
+            if screenshot.size(allowReadingFile=False) == None:
+                screenshot.setSize(_e4gImageDimensions(e4gImage))
+            self._findBitmapCache[filename] = {}
 
     def _removeScreenshot(self, screenshot):
-        filename = screenshot.filename()
-        if filename in self._openedRelatedScreenshots:
-            for screenshotPP in self._openedRelatedScreenshots[filename]:
-                self._removeScreenshot(screenshotPP)
-            del self._openedRelatedScreenshots[filename]
-        eye4graphics.closeImage(self._openedImages[filename])
-        del self._openedImages[filename]
-        del self._findBitmapCache[filename]
+        filename = screenshot.filename(save=False)
+        with self._lock:
+            if filename in self._openedRelatedScreenshots:
+                for screenshotPP in self._openedRelatedScreenshots[filename]:
+                    self._removeScreenshot(screenshotPP)
+                del self._openedRelatedScreenshots[filename]
+            for pyramidKey in [k for k in self._pyramidImages if k[0] == filename]:
+                eye4graphics.closeImage(self._pyramidImages.pop(pyramidKey))
+            if filename in self._inheritedResults:
+                del self._inheritedResults[filename]
+            eye4graphics.closeImage(self._openedImages[filename])
+            del self._openedImages[filename]
+            del self._findBitmapCache[filename]
+
+    def inheritFindResults(self, screenshot, previousScreenshot):
+        """
+        Compare screenshot to previousScreenshot. Bitmaps that were
+        searched for in the previous screenshot will be searched for
+        only near the changed regions of the screenshot.
+        """
+        filename = screenshot.filename(save=False)
+        prevFilename = previousScreenshot.filename(save=False)
+        with self._lock:
+            if (not filename in self._openedImages or
+                not prevFilename in self._openedImages or
+                not self._findBitmapCache.get(prevFilename, None)):
+                return
+            changedRegions = _e4gChangedRegions(
+                self._openedImages[prevFilename],
+                self._openedImages[filename],
+                _g_damageBlockSize, _g_damageMaxBlocks)
+            if changedRegions == None:
+                return
+            self._inheritedResults[filename] = (
+                changedRegions, dict(self._findBitmapCache[prevFilename]))
+
+    def _pyramidImage(self, ssFilename, factor):
+        """
+        Returns screenshot downscaled by factor. Must be called with
+        self._lock held.
+        """
+        pyramidKey = (ssFilename, factor)
+        if not pyramidKey in self._pyramidImages:
+            self._pyramidImages[pyramidKey] = _e4gDownscale(
+                self._openedImages[ssFilename], factor)
+        return self._pyramidImages[pyramidKey]
 
     def adjustParameters(self, screenshot, bitmap,
                          scaleRange = [p/100.0 for p in range(110,210,10)],
@@ -1170,7 +1886,7 @@ class _Eye4GraphicsOirEngine(OirEngine):
         GUIItem is the detected item (GUIItem.bbox() is the box around it),
         and findParams is a dictionary containing the parameters.
         """
-        if not screenshot.filename() in self._findBitmapCache:
+        if not screenshot.filename(save=False) in self._findBitmapCache:
             self.addScreenshot(screenshot)
             ssAdded = True
         else:
@@ -1199,80 +1915,227 @@ class _Eye4GraphicsOirEngine(OirEngine):
                     opacityLimit=None, area=None, limit=None,
                     allowOverlap=None, scale=None,
                     bitmapPixelSize=None, screenshotPixelSize=None,
-                    preprocess=None):
+                    preprocess=None, searchMode=None):
         """
         Find items on the screenshot that match to bitmap.
         """
-        ssFilename = screenshot.filename()
+        if not searchMode in ["exhaustive", "pyramid"]:
+            raise ValueError('invalid searchMode "%s", expected "exhaustive" or "pyramid"' % (searchMode,))
+        ssFilename = screenshot.filename(save=False)
         ssSize = screenshot.size()
         cacheKey = (bitmap, colorMatch, opacityLimit, area, limit,
-                    scale, bitmapPixelSize, screenshotPixelSize, preprocess)
-        if cacheKey in self._findBitmapCache[ssFilename]:
-            return self._findBitmapCache[ssFilename][cacheKey]
-        self._findBitmapCache[ssFilename][cacheKey] = []
-
-        if preprocess:
-            ssFilenamePP = _ppFilename(ssFilename, preprocess)
-            bitmapPP = _ppFilename(bitmap, preprocess)
-            if not ssFilenamePP in self._openedImages:
-                _convert(ssFilename, preprocess, ssFilenamePP)
-                screenshotPP = Screenshot(ssFilenamePP)
-                self.addScreenshot(screenshotPP)
-                if not ssFilename in self._openedRelatedScreenshots:
-                    self._openedRelatedScreenshots[ssFilename] = []
-                self._openedRelatedScreenshots[ssFilename].append(screenshotPP)
-            _convert(bitmap, preprocess, bitmapPP)
-            ssFilename = ssFilenamePP
-            bitmap = bitmapPP
-            self._findBitmapCache[ssFilename][cacheKey] = []
-
-        e4gIcon = _e4gOpenImage(bitmap)
-        matchCount = 0
-        leftTopRightBottomZero = (_intCoords((area[0], area[1]), ssSize) +
-                                  _intCoords((area[2], area[3]), ssSize) +
-                                  (0,))
-        struct_area_bbox = _Bbox(*leftTopRightBottomZero)
-        struct_bbox = _Bbox(0, 0, 0, 0, 0)
-        contOpts = 0 # search for the first hit
+                    scale, bitmapPixelSize, screenshotPixelSize, preprocess,
+                    searchMode)
+        with self._lock:
+            if cacheKey in self._findBitmapCache[ssFilename]:
+                return self._findBitmapCache[ssFilename][cacheKey]
+            origSsFilename = ssFilename
+            if preprocess:
+                ssFilenamePP = _ppFilename(ssFilename, preprocess)
+                bitmapPP = _ppFilename(bitmap, preprocess)
+                if not ssFilenamePP in self._openedImages:
+                    _convert(screenshot.filename(), preprocess, ssFilenamePP)
+                    screenshotPP = Screenshot(ssFilenamePP)
+                    self.addScreenshot(screenshotPP)
+                    if not ssFilename in self._openedRelatedScreenshots:
+                        self._openedRelatedScreenshots[ssFilename] = []
+                    self._openedRelatedScreenshots[ssFilename].append(screenshotPP)
+                _convert(bitmap, preprocess, bitmapPP)
+                ssFilename = ssFilenamePP
+                bitmap = bitmapPP
+            e4gScreenshot = self._openedImages[ssFilename]
+            iconCacheKey, e4gIcon = self._openBitmap(bitmap)
+            inherited = None
+            if not preprocess and origSsFilename in self._inheritedResults:
+                changedRegions, prevResults = self._inheritedResults[origSsFilename]
+                prevItems = prevResults.get(cacheKey, None)
+                # If previous results were cut by the limit, matches
+                # preceding them could appear anywhere.
+                if prevItems != None and (limit < 0 or len(prevItems) < limit):
+                    inherited = (changedRegions, [i.bbox() for i in prevItems])
+
+        searchArea = (_intCoords((area[0], area[1]), ssSize) +
+                      _intCoords((area[2], area[3]), ssSize))
         try:
             xscale, yscale = scale
         except TypeError:
             xscale = yscale = float(scale)
-        while True:
-            if matchCount == limit: break
-            result = eye4graphics.findNextIcon(
-                ctypes.byref(struct_bbox),
-                ctypes.c_void_p(self._openedImages[ssFilename]),
-                ctypes.c_void_p(e4gIcon),
-                0, # no fuzzy matching
-                ctypes.c_double(colorMatch),
-                ctypes.c_double(opacityLimit),
-                ctypes.byref(struct_area_bbox),
-                ctypes.c_int(contOpts),
-                ctypes.c_float(xscale),
-                ctypes.c_float(yscale),
-                ctypes.c_int(bitmapPixelSize),
-                ctypes.c_int(screenshotPixelSize))
-            contOpts = 1 # search for the next hit
-            if result < 0: break
-            bbox = (int(struct_bbox.left), int(struct_bbox.top),
-                    int(struct_bbox.right), int(struct_bbox.bottom))
-            addToFoundItems = True
-            if allowOverlap == False:
-                for guiItem in self._findBitmapCache[ssFilename][cacheKey]:
-                    itemLeft, itemTop, itemRight, itemBottom = guiItem.bbox()
-                    if ((itemLeft <= bbox[0] <= itemRight or itemLeft <= bbox[2] <= itemRight) and
-                        (itemTop <= bbox[1] <= itemBottom or itemTop <= bbox[3] <= itemBottom)):
-                        if ((itemLeft < bbox[0] < itemRight or itemLeft < bbox[2] < itemRight) or
-                            (itemTop < bbox[1] < itemBottom or itemTop < bbox[3] < itemBottom)):
-                            addToFoundItems = False
-                            break
-            if addToFoundItems:
-                self._findBitmapCache[ssFilename][cacheKey].append(
-                    GUIItem("bitmap", bbox, ssFilename, bitmap=bitmap))
-                matchCount += 1
-        eye4graphics.closeImage(e4gIcon)
-        return self._findBitmapCache[ssFilename][cacheKey]
+        searchArgs = (colorMatch, opacityLimit, xscale, yscale,
+                      bitmapPixelSize, screenshotPixelSize)
+        foundBboxes = []
+        try:
+            if inherited != None:
+                self._findIconChanged(e4gScreenshot, e4gIcon, inherited,
+                                      searchArea, ssSize, limit,
+                                      allowOverlap, foundBboxes, searchArgs)
+            else:
+                if searchMode == "pyramid":
+                    factor = self._pyramidFactor(e4gIcon, xscale, yscale)
+                else:
+                    factor = 1
+                if factor > 1:
+                    self._findIconPyramid(ssFilename, e4gScreenshot, e4gIcon,
+                                          factor, searchArea, ssSize, limit,
+                                          allowOverlap, foundBboxes, searchArgs)
+                else:
+                    self._findIcon(e4gScreenshot, e4gIcon, searchArea, ssSize,
+                                   limit, allowOverlap, foundBboxes, searchArgs)
+        finally:
+            with self._lock:
+                self._closeBitmap(iconCacheKey, e4gIcon)
+        foundItems = [GUIItem("bitmap", bbox, ssFilename, bitmap=bitmap)
+                      for bbox in foundBboxes]
+        with self._lock:
+            if origSsFilename in self._findBitmapCache:
+                self._findBitmapCache[origSsFilename][cacheKey] = foundItems
+            if ssFilename in self._findBitmapCache:
+                self._findBitmapCache[ssFilename][cacheKey] = foundItems
+        return foundItems
+
+    def _pyramidFactor(self, e4gIcon, xscale, yscale):
+        """
+        Returns largest downscaling factor that keeps the scaled icon
+        at least _g_pyramidMinBitmapSize pixels wide and high.
+        """
+        width, height = _e4gImageDimensions(e4gIcon)
+        minSide = min(width * xscale, height * yscale)
+        for factor in (8, 4, 2):
+            if minSide / factor >= _g_pyramidMinBitmapSize:
+                return factor
+        return 1
+
+    def _findIconPyramid(self, ssFilename, e4gScreenshot, e4gIcon, factor,
+                         searchArea, ssSize, limit, allowOverlap,
+                         foundBboxes, searchArgs):
+        """
+        Find icon candidates on screenshot and icon downscaled by
+        factor, then verify candidates on full scale images.
+        """
+        (colorMatch, opacityLimit, xscale, yscale,
+         bitmapPixelSize, screenshotPixelSize) = searchArgs
+        with self._lock:
+            e4gScreenshotLow = self._pyramidImage(ssFilename, factor)
+        lowSize = _e4gImageDimensions(e4gScreenshotLow)
+        lowArea = tuple([c / factor for c in searchArea])
+        # Averaged pixels on borders of the icon may differ, compare
+        # each icon pixel to a 2x2 area on the screenshot.
+        lowSearchArgs = (max(0.0, colorMatch - _g_pyramidColorMatchSlack),
+                         opacityLimit, xscale, yscale, 1, 2)
+        candidates = []
+        e4gIconLow = _e4gDownscale(e4gIcon, factor)
+        try:
+            self._findIcon(e4gScreenshotLow, e4gIconLow, lowArea, lowSize,
+                           -1, False, candidates, lowSearchArgs)
+        finally:
+            eye4graphics.closeImage(e4gIconLow)
+        margin = 2 * factor + max(bitmapPixelSize, screenshotPixelSize)
+        for left, top, right, bottom in candidates:
+            if len(foundBboxes) == limit:
+                break
+            verifyArea = (max(searchArea[0], left * factor - margin),
+                          max(searchArea[1], top * factor - margin),
+                          min(searchArea[2], right * factor + margin),
+                          min(searchArea[3], bottom * factor + margin))
+            self._findIcon(e4gScreenshot, e4gIcon, verifyArea, ssSize,
+                           limit, allowOverlap, foundBboxes, searchArgs)
+
+    def _findIconChanged(self, e4gScreenshot, e4gIcon, inherited,
+                         searchArea, ssSize, limit, allowOverlap,
+                         foundBboxes, searchArgs):
+        """
+        Find icon near changed regions only. Matches in the previous
+        screenshot that do not touch changed regions are kept.
+        """
+        changedRegions, prevBboxes = inherited
+        (colorMatch, opacityLimit, xscale, yscale,
+         bitmapPixelSize, screenshotPixelSize) = searchArgs
+        keptBboxes = []
+        lostBboxes = []
+        for bbox in prevBboxes:
+            if [r for r in changedRegions if _boxesIntersect(bbox, r)]:
+                lostBboxes.append(bbox)
+            else:
+                keptBboxes.append(bbox)
+        # A new match overlaps a changed region, or a lost match
+        # that may have hidden an overlapping match.
+        dirtyRegions = list(changedRegions)
+        if allowOverlap == False:
+            dirtyRegions.extend(lostBboxes)
+        iconWidth, iconHeight = _e4gImageDimensions(e4gIcon)
+        pixelSize = max(bitmapPixelSize, screenshotPixelSize, 2)
+        marginX = int(iconWidth * xscale) + pixelSize
+        marginY = int(iconHeight * yscale) + pixelSize
+        newBboxes = []
+        for left, top, right, bottom in dirtyRegions:
+            subArea = (max(searchArea[0], left - marginX),
+                       max(searchArea[1], top - marginY),
+                       min(searchArea[2], right + marginX),
+                       min(searchArea[3], bottom + marginY))
+            if subArea[0] >= subArea[2] or subArea[1] >= subArea[3]:
+                continue
+            self._findIcon(e4gScreenshot, e4gIcon, subArea, ssSize,
+                           -1, True, newBboxes, searchArgs)
+        newBboxes = [bbox for bbox in newBboxes
+                     if [r for r in dirtyRegions if _boxesIntersect(bbox, r)]]
+        # Merge in the order of exhaustive search
+        for bbox in sorted(set(keptBboxes + newBboxes),
+                           key=lambda b: (b[1], b[0])):
+            if len(foundBboxes) == limit:
+                break
+            if allowOverlap == False and [
+                    b for b in foundBboxes if _boxesOverlap(bbox, b)]:
+                continue
+            foundBboxes.append(bbox)
+
+    def _findIcon(self, e4gScreenshot, e4gIcon, searchArea, ssSize,
+                  limit, allowOverlap, foundBboxes, searchArgs):
+        """
+        Append bounding boxes of icon found in searchArea (left, top,
+        right, bottom) of opened screenshot to foundBboxes until
+        there are limit bounding boxes.
+        """
+        (colorMatch, opacityLimit, xscale, yscale,
+         bitmapPixelSize, screenshotPixelSize) = searchArgs
+        struct_area_bbox = _Bbox(*(tuple(searchArea) + (0,)))
+        struct_bbox = _Bbox(0, 0, 0, 0, 0)
+        contOpts = 0 # search for the first hit
+        # eye4graphics reads pixels of a partial search area through
+        # a buffer that is shared by all threads, serialize those
+        # searches. Whole screen searches run in parallel.
+        if tuple(searchArea) == (0, 0) + tuple(ssSize):
+            searchLock = None
+        else:
+            searchLock = self._partialAreaLock
+            searchLock.acquire()
+        try:
+            while True:
+                if len(foundBboxes) == limit: break
+                result = eye4graphics.findNextIcon(
+                    ctypes.byref(struct_bbox),
+                    ctypes.c_void_p(e4gScreenshot),
+                    ctypes.c_void_p(e4gIcon),
+                    0, # no fuzzy matching
+                    ctypes.c_double(colorMatch),
+                    ctypes.c_double(opacityLimit),
+                    ctypes.byref(struct_area_bbox),
+                    ctypes.c_int(contOpts),
+                    ctypes.c_float(xscale),
+                    ctypes.c_float(yscale),
+                    ctypes.c_int(bitmapPixelSize),
+                    ctypes.c_int(screenshotPixelSize))
+                contOpts = 1 # search for the next hit
+                if result < 0: break
+                bbox = (int(struct_bbox.left), int(struct_bbox.top),
+                        int(struct_bbox.right), int(struct_bbox.bottom))
+                if bbox in foundBboxes:
+                    continue # found already in overlapping search area
+                if allowOverlap == False and [
+                        b for b in foundBboxes if _boxesOverlap(bbox, b)]:
+                    continue
+                foundBboxes.append(bbox)
+        finally:
+            if searchLock:
+                searchLock.release()
 
 def _defaultOirEngine():
     if _g_defaultOirEngine:
@@ -1410,6 +2273,100 @@ class _Paths(object):
                 return None
 
 
+class _ScreenshotCapturer(object):
+    """
+    Captures screenshots continuously in a background thread and
+    keeps the latest frames in a ring buffer.
+    """
+    def __init__(self, captureFunc, frames, captureDelay):
+        self._captureFunc = captureFunc
+        self._captureDelay = captureDelay
+        # (frameNumber, captureTime, screenshot), frames are numbered
+        # in the order their capturing started
+        self._frames = collections.deque(maxlen=frames)
+        self._framesStarted = 0
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._captureLoop,
+                                        name="fmbtgti-screenshot-capturer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _captureLoop(self):
+        while self._running:
+            # A frame shows the screen at the earliest when its
+            # capturing started.
+            with self._cond:
+                self._framesStarted += 1
+                frameNumber = self._framesStarted
+                captureTime = time.time()
+            try:
+                screenshot = self._captureFunc()
+            except Exception, e:
+                _fmbtLog("background screenshot capture failed: %s" % (e,))
+                with self._cond:
+                    self._running = False
+                    self._cond.notifyAll()
+                return
+            if screenshot != None:
+                screenshot._frameNumber = frameNumber
+                with self._cond:
+                    self._frames.append((frameNumber, captureTime, screenshot))
+                    self._cond.notifyAll()
+                screenshot = None
+                delay = self._captureDelay
+            else:
+                delay = max(self._captureDelay, _g_captureRetryDelay)
+            if delay > 0:
+                time.sleep(delay)
+
+    def frame(self, maxAge, timeout, newerThan=None):
+        """
+        Returns the newest (frameNumber, captureTime, screenshot).
+        If newerThan is None, capturing the frame must have started
+        after this call if maxAge is None, otherwise at most maxAge
+        seconds ago. If newerThan is given, frameNumber must be
+        greater than newerThan. Waits for a new frame if needed.
+        Returns None if there is no such frame within timeout
+        seconds, or if capturing has stopped.
+        """
+        now = time.time()
+        endTime = now + timeout
+        with self._cond:
+            minFrameNumber = 0
+            oldest = None
+            if newerThan != None:
+                minFrameNumber = newerThan + 1
+            elif maxAge == None:
+                # frames started so far were started before this call
+                minFrameNumber = self._framesStarted + 1
+            else:
+                oldest = now - maxAge
+            while (not self._frames or
+                   self._frames[-1][0] < minFrameNumber or
+                   (oldest != None and self._frames[-1][1] < oldest)):
+                timeLeft = endTime - time.time()
+                if not self._running or timeLeft <= 0:
+                    return None
+                self._cond.wait(timeLeft)
+            return self._frames[-1]
+
+    def frames(self):
+        with self._cond:
+            return [(captureTime, screenshot)
+                    for (_, captureTime, screenshot) in self._frames]
+
+    def running(self):
+        return self._running
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._frames.clear()
+            self._cond.notifyAll()
+        if self._thread != threading.current_thread():
+            self._thread.join()
+
 class GUITestInterface(object):
     def __init__(self, ocrEngine=None, oirEngine=None, rotateScreenshot=None):
         self._paths = _Paths("", "")
@@ -1423,12 +2380,18 @@ class GUITestInterface(object):
         self._screenshotLimit = None
         self._screenshotRefCount = {} # filename -> Screenshot object ref count
         self._screenshotArchiveMethod = "resize"
+        self._screenshotInMemory = False
+        self._screenshotDamageTracking = False
+        self._screenshotCapturer = None
+        # serializes _captureScreenshot calls from the background
+        # capturer and refreshScreenshot
+        self._screenshotCaptureLock = threading.Lock()
 
         if ocrEngine == None:
             self.setOcrEngine(_defaultOcrEngine())
         else:
             if type(ocrEngine) == int:
-                self.setOcrEngine(_g_ocrEngines[ocrEngine])
+                self.setOcrEngine(_registeredEngine(_g_ocrEngines, ocrEngine))
             else:
                 self.setOcrEngine(ocrEngine)
 
@@ -1436,7 +2399,7 @@ class GUITestInterface(object):
             self.setOirEngine(_defaultOirEngine())
         else:
             if type(oirEngine) == int:
-                self.setOirEngine(_g_oirEngines[oirEngine])
+                self.setOirEngine(_registeredEngine(_g_oirEngines, oirEngine))
             else:
                 self.setOirEngine(oirEngine)
 
@@ -1464,6 +2427,7 @@ class GUITestInterface(object):
         return self._paths.relativeRoot
 
     def close(self):
+        self.setScreenshotCapture(False)
         self._lastScreenshot = None
         if self._visualLog:
             if (hasattr(self._visualLog._outFileObj, "name") and
@@ -1738,6 +2702,8 @@ class GUITestInterface(object):
         return filepath
 
     def _archiveScreenshot(self, filepath):
+        if not os.access(filepath, os.F_OK):
+            return # in-memory screenshot that was never saved
         if self._screenshotArchiveMethod == "remove":
             try:
                 os.remove(filepath)
@@ -1750,14 +2716,15 @@ class GUITestInterface(object):
             else:
                 widthHeight = self._screenshotArchiveMethod.split()[1]
                 convertArgs = ["-resize", widthHeight]
-            subprocess.call([fmbt_config.imagemagick_convert, filepath] + convertArgs + [filepath])
+            _convert(filepath, convertArgs, filepath)
 
     def _archiveScreenshots(self):
         """
         Archive screenshot files if screenshotLimit has been exceeded.
         """
+        # items() copies, the background capturer may add screenshots
         freeScreenshots = [filename
-                           for (filename, refCount) in self._screenshotRefCount.iteritems()
+                           for (filename, refCount) in self._screenshotRefCount.items()
                            if refCount == 0]
         archiveCount = len(freeScreenshots) - self._screenshotLimit
         if archiveCount > 0:
@@ -1771,7 +2738,51 @@ class GUITestInterface(object):
                 del self._screenshotRefCount[toBeArchived]
                 archiveCount -= 1
 
-    def refreshScreenshot(self, forcedScreenshot=None, rotate=None):
+    def _captureScreenshot(self, rotate=None):
+        """
+        Returns new Screenshot from the connection, or None if
+        screenshot cannot be taken.
+        """
+        with self._screenshotCaptureLock:
+            return self._captureScreenshotLocked(rotate)
+
+    def _captureScreenshotLocked(self, rotate):
+        if self.screenshotDir() == None:
+            self.setScreenshotDir(self._screenshotDirDefault)
+        if self.screenshotSubdir() == None:
+            self.setScreenshotSubdir(self._screenshotSubdirDefault)
+        screenshotFile = self._newScreenshotFilepath()
+        if rotate == None:
+            rotate = self._rotateScreenshot
+        if self._screenshotInMemory and not rotate:
+            rawImage = self.existingConnection().recvScreenshotRaw()
+        else:
+            rawImage = None
+        if rawImage != None:
+            # Keep new screenshot in memory, the file is written
+            # only if someone needs it.
+            return Screenshot(
+                screenshotFile=screenshotFile,
+                paths = self._paths,
+                ocrEngine=self._ocrEngine,
+                oirEngine=self._oirEngine,
+                screenshotRefCount=self._screenshotRefCount,
+                rawImage=rawImage)
+        elif self.existingConnection().recvScreenshot(screenshotFile):
+            # New screenshot successfully received from device
+            if rotate != None and rotate != 0:
+                _convert(screenshotFile, ["-rotate", str(rotate)], screenshotFile)
+            return Screenshot(
+                screenshotFile=screenshotFile,
+                paths = self._paths,
+                ocrEngine=self._ocrEngine,
+                oirEngine=self._oirEngine,
+                screenshotRefCount=self._screenshotRefCount)
+        else:
+            return None
+
+    def refreshScreenshot(self, forcedScreenshot=None, rotate=None, maxAge=None,
+                          newerThan=None, timeout=None):
         """
         Takes new screenshot and updates the latest screenshot object.
 
@@ -1786,6 +2797,25 @@ class GUITestInterface(object):
                   overrides constructor rotateScreenshot parameter
                   value. The default is None (no override).
 
+          maxAge (float, optional):
+                  if background screenshot capture is enabled, use the
+                  newest captured frame whose capturing started at
+                  most maxAge seconds ago. Waits for a new frame if
+                  there is no such frame yet. The default is None,
+                  that is, the frame must have been started after
+                  this call. See setScreenshotCapture().
+
+          newerThan (Screenshot, optional):
+                  if background screenshot capture is enabled and
+                  newerThan is a captured frame, use the newest frame
+                  captured after it, ignoring maxAge. The default is
+                  None.
+
+          timeout (float, optional):
+                  max. time in seconds to wait for a captured frame
+                  before taking a screenshot without the background
+                  capturer. The default is 60.0.
+
         Returns Screenshot object, and makes the same object "the
         latest screenshot" that is used by all *Bitmap and *OcrText
         methods. Returns None if screenshot cannot be taken.
@@ -1801,46 +2831,31 @@ class GUITestInterface(object):
             else:
                 self._lastScreenshot = forcedScreenshot
         elif self._conn: # There is a connection, get new screenshot
-            if self.screenshotDir() == None:
-                self.setScreenshotDir(self._screenshotDirDefault)
-            if self.screenshotSubdir() == None:
-                self.setScreenshotSubdir(self._screenshotSubdirDefault)
-            screenshotFile = self._newScreenshotFilepath()
-            if self.existingConnection().recvScreenshot(screenshotFile):
-                # New screenshot successfully received from device
-                if rotate == None:
-                    rotate = self._rotateScreenshot
-                if rotate != None and rotate != 0:
-                    subprocess.call([fmbt_config.imagemagick_convert, screenshotFile, "-rotate", str(rotate), screenshotFile])
-                self._lastScreenshot = Screenshot(
-                    screenshotFile=screenshotFile,
-                    paths = self._paths,
-                    ocrEngine=self._ocrEngine,
-                    oirEngine=self._oirEngine,
-                    screenshotRefCount=self._screenshotRefCount)
+            previousScreenshot = self._lastScreenshot
+            frame = None
+            capturer = self._screenshotCapturer
+            if (capturer != None and capturer.running() and
+                (rotate or 0) == (self._rotateScreenshot or 0)):
+                if timeout == None:
+                    timeout = _g_captureFrameTimeout
+                frame = capturer.frame(
+                    maxAge, timeout,
+                    getattr(newerThan, "_frameNumber", None))
+            if frame != None:
+                self._lastScreenshot = frame[2]
             else:
-                self._lastScreenshot = None
+                self._lastScreenshot = self._captureScreenshot(rotate)
+            frame = None
+            if (self._screenshotDamageTracking and
+                self._lastScreenshot != None and previousScreenshot != None and
+                self._lastScreenshot is not previousScreenshot):
+                self._lastScreenshot._inheritOirResults(previousScreenshot)
+            previousScreenshot = None
         else: # No connection, cannot get a screenshot
             self._lastScreenshot = None
-        # Make sure unreachable Screenshot instances are released from
-        # memory.
-        gc.collect()
-        for obj in gc.garbage:
-            if isinstance(obj, Screenshot):
-                if hasattr(obj, "_logCallReturnValue"):
-                    # Some methods have been wrapped by visual
-                    # log. Break reference cycles to let gc collect
-                    # them.
-                    try:
-                        del obj.findItemsByBitmap
-                    except:
-                        pass
-                    try:
-                        del obj.findItemsByOcr
-                    except:
-                        pass
-        del gc.garbage[:]
-        gc.collect()
+        # Screenshots are not part of reference cycles, the previous
+        # screenshot is released as soon as it is not referenced
+        # anymore. See Screenshot.release().
 
         # If screenshotLimit has been set, archive old screenshot
         # stored on the disk.
@@ -1869,6 +2884,37 @@ class GUITestInterface(object):
         """
         return self._screenshotDir
 
+    def screenshotDamageTracking(self):
+        """
+        Returns True if bitmap search results are carried over from
+        previous to new screenshots, otherwise False.
+
+        See also setScreenshotDamageTracking().
+        """
+        return self._screenshotDamageTracking
+
+    def screenshotFrames(self):
+        """
+        Returns list of (captureTime, Screenshot) pairs in the frame
+        buffer of the background screenshot capturer, oldest first.
+        captureTime is the time.time() when capturing the frame was
+        started. Returns empty list if capturing is not enabled.
+
+        See also setScreenshotCapture().
+        """
+        if self._screenshotCapturer == None:
+            return []
+        return self._screenshotCapturer.frames()
+
+    def screenshotInMemory(self):
+        """
+        Returns True if new screenshots are kept in memory when
+        possible, otherwise False.
+
+        See also setScreenshotInMemory().
+        """
+        return self._screenshotInMemory
+
     def screenshotLimit(self):
         """
         Returns the limit after which unused screenshots are archived.
@@ -1992,10 +3038,94 @@ class GUITestInterface(object):
                              (screenshotArchiveMethod,))
         self._screenshotArchiveMethod = screenshotArchiveMethod
 
+    def setScreenshotCapture(self, capture, frames=4, captureDelay=0.0):
+        """
+        Capture screenshots continuously in background.
+
+        Parameters:
+          capture (boolean)
+                  If True, a background thread captures screenshots
+                  from the connection one after another, and
+                  refreshScreenshot returns the newest frame instead
+                  of waiting for a screenshot of its own. The wait*
+                  methods check new frames as they arrive instead of
+                  sleeping pollDelay. If False, capturing is stopped.
+                  The default is False.
+
+          frames (integer, optional)
+                  number of latest frames to keep in the ring
+                  buffer. The default is 4.
+
+          captureDelay (float, optional)
+                  seconds to sleep between captures. The default is
+                  0.0.
+
+        The connection must allow capturing screenshots while other
+        methods are being called. Capturing works best with in-memory
+        screenshots (see setScreenshotInMemory), otherwise every frame
+        is saved to a file. Screenshots that need rotation other than
+        rotateScreenshot are still taken synchronously.
+
+        Example: do not wait for a new screenshot if the latest frame
+        is at most 0.2 seconds old.
+            sut.setScreenshotInMemory(True)
+            sut.setScreenshotCapture(True)
+            sut.refreshScreenshot(maxAge=0.2)
+
+        See also screenshotFrames().
+        """
+        if self._screenshotCapturer != None:
+            self._screenshotCapturer.stop()
+            self._screenshotCapturer = None
+        if capture:
+            self._screenshotCapturer = _ScreenshotCapturer(
+                self._captureScreenshot, frames, captureDelay)
+
     def setScreenshotDir(self, screenshotDir):
         self._screenshotDir = screenshotDir
         self._newScreenshotFilepath() # make directories
 
+    def setScreenshotDamageTracking(self, tracking):
+        """
+        Search bitmaps only near changed regions of new screenshots.
+
+        Parameters:
+          tracking (boolean)
+                  If True, refreshScreenshot compares the new
+                  screenshot to the previous one. Results of bitmap
+                  searches in the previous screenshot are reused
+                  where pixels have not changed, and bitmaps are
+                  searched for only near the changed regions. This
+                  makes polling in wait methods cheap when only small
+                  parts of the screen change. The default is False.
+
+        Bitmaps are searched for again from the whole screenshot
+        if the screen size has changed, large part of the screen
+        has changed, or if the number of previous results was
+        limited by the limit parameter.
+        """
+        self._screenshotDamageTracking = tracking
+
+    def setScreenshotInMemory(self, inMemory):
+        """
+        Keep new screenshots in memory instead of saving them to files.
+
+        Parameters:
+          inMemory (boolean)
+                  If True, refreshScreenshot asks the connection for
+                  raw pixel data (recvScreenshotRaw), and bitmaps are
+                  searched directly from the data. PNG file is written
+                  to screenshotDir only when needed, for instance by
+                  visual log, Screenshot.save() or OCR. The default is
+                  False.
+
+        Connections that do not provide raw pixel data, and
+        screenshots that need rotation, are saved to files as before.
+        """
+        if inMemory:
+            import fmbtpng # needed for lazy PNG encoding
+        self._screenshotInMemory = inMemory
+
     def setScreenshotLimit(self, screenshotLimit):
         """
         Set maximum number for unarchived screenshots.
@@ -2449,6 +3579,43 @@ class GUITestInterface(object):
         ocrArgs, _ = _takeOcrArgs(self._lastScreenshot, ocrArgs, thatsAll=True)
         return self._lastScreenshot.findItemsByOcr(text, **ocrArgs) != []
 
+    def verifyOcrTexts(self, texts, **ocrArgs):
+        """
+        Verify using OCR that the last screenshot contains texts.
+        Each OCR pass needed by the texts is run only once.
+
+        Parameters:
+
+          texts (list):
+                  texts to be verified. Items are either strings, or
+                  (text, ocrArgs) pairs where ocrArgs is a dictionary
+                  of OCR engine arguments for that text only.
+
+          OCR engine specific arguments
+                  common for all texts, refer to help(obj.ocrEngine())
+
+          Returns dictionary text -> True if the text was found,
+          otherwise False.
+
+        Example:
+
+          sut.verifyOcrTexts(["OK", "Cancel",
+                              ("Settings", {"area": (0, 0, 1.0, 0.2)})],
+                             match=0.8)
+        """
+        assert self._lastScreenshot != None, "Screenshot required."
+        ocrArgs, _ = _takeOcrArgs(self._lastScreenshot, ocrArgs, thatsAll=True)
+        queries = []
+        for text in texts:
+            if not isinstance(text, basestring):
+                text, textArgs = text
+                textArgs, _ = _takeOcrArgs(self._lastScreenshot,
+                                           dict(textArgs), thatsAll=True)
+                text = (text, textArgs)
+            queries.append(text)
+        results = self._lastScreenshot.findItemsByOcrMany(queries, **ocrArgs)
+        return dict((text, items != []) for text, items in results.iteritems())
+
     def verifyBitmap(self, bitmap, **oirArgs):
         """
         Verify that bitmap is present in the last screenshot.
@@ -2504,17 +3671,30 @@ class GUITestInterface(object):
 
         refreshFunc will not be called if waitFunc returns immediately
         True.
+
+        If refreshFunc is refreshScreenshot and background screenshot
+        capture is enabled, pollDelay is not slept. Instead, waitFunc
+        is evaluated on every new frame as soon as it is available.
         """
         if waitFunc(*waitFuncArgs, **waitFuncKwargs):
             return True
         startTime = time.time()
         endTime = startTime + waitTime
         now = startTime
+        refreshesScreenshot = (refreshFunc == self.refreshScreenshot)
         while now < endTime:
-            time.sleep(min(pollDelay, (endTime - now)))
+            if (refreshesScreenshot and
+                self._screenshotCapturer != None and
+                self._screenshotCapturer.running()):
+                # any frame newer than the one that was evaluated
+                refreshArgs = {"newerThan": self._lastScreenshot,
+                               "timeout": endTime - now}
+            else:
+                refreshArgs = {}
+                time.sleep(min(pollDelay, (endTime - now)))
             now = time.time()
             beforeRefresh()
-            refreshFunc()
+            refreshFunc(**refreshArgs)
             afterRefresh()
             if waitFunc(*waitFuncArgs, **waitFuncKwargs):
                 return True
@@ -2604,8 +3784,10 @@ class GUITestInterface(object):
         oirArgs, _ = _takeOirArgs(self._lastScreenshot, rest, thatsAll=True)
         foundBitmaps = []
         def observe():
-            for bitmap in listOfBitmaps:
-                if self._lastScreenshot.findItemsByBitmap(bitmap, **oirArgs):
+            results = self._lastScreenshot.findItemsByBitmaps(
+                listOfBitmaps, **oirArgs)
+            for bitmap, items in zip(listOfBitmaps, results):
+                if items:
                     foundBitmaps.append(bitmap)
             return foundBitmaps != []
         self.wait(self.refreshScreenshot, observe, **waitArgs)
@@ -2639,8 +3821,13 @@ class GUITestInterface(object):
         ocrArgs, _ = _takeOcrArgs(self._lastScreenshot, rest, thatsAll=True)
         foundTexts = []
         def observe():
-            for text in listOfTexts:
-                if self.verifyOcrText(text, **ocrArgs):
+            # search for all texts at once, OCR results are indexed
+            # only once per screenshot
+            assert self._lastScreenshot != None, "Screenshot required."
+            results = self._lastScreenshot._findItemsByOcrTexts(
+                listOfTexts, **ocrArgs)
+            for text, items in zip(listOfTexts, results):
+                if items:
                     foundTexts.append(text)
             return foundTexts != []
         self.wait(self.refreshScreenshot, observe, **waitArgs)
@@ -2727,7 +3914,7 @@ class GUITestInterface(object):
             afterRefresh()
             return self.wait(
                 self.refreshScreenshot,
-                lambda: not self.verifyBitmap(previousScreenshot.filename()),
+                lambda: self.screenshot()._differsFrom(previousScreenshot),
                 **waitArgs)
         elif updated == True:
             self.refreshScreenshot()
@@ -2743,33 +3930,75 @@ class Screenshot(object):
     display, or a forced bitmap file if device connection is not given.
     """
     def __init__(self, screenshotFile=None, paths=None,
-                 ocrEngine=None, oirEngine=None, screenshotRefCount=None):
+                 ocrEngine=None, oirEngine=None, screenshotRefCount=None,
+                 rawImage=None):
         self._filename = screenshotFile
+        # rawImage: (width, height, format, data) of in-memory
+        # screenshot, see GUITestConnection.recvScreenshotRaw.
+        self._rawImage = rawImage
+        self._rawImageSaved = False
         self._ocrEngine = ocrEngine
         self._ocrEngineNotified = False
         self._oirEngine = oirEngine
         self._oirEngineNotified = False
         self._screenshotRefCount = screenshotRefCount
+        self._refCounted = False
         if (type(self._screenshotRefCount) == dict and self._filename):
             self._screenshotRefCount[self._filename] = (1 +
                 self._screenshotRefCount.get(self._filename, 0))
+            self._refCounted = True
         self._screenSize = None
+        if rawImage != None:
+            self._screenSize = (rawImage[0], rawImage[1])
         self._paths = paths
 
     def __del__(self):
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.release()
+
+    def release(self):
+        """
+        Release images and results held by OCR and OIR engines for
+        this screenshot, and allow archiving the screenshot file (see
+        GUITestInterface.setScreenshotLimit).
+
+        Screenshots are released automatically when they are not
+        referenced anymore. Call release() or use the screenshot as a
+        context manager to release them earlier:
+
+          with sut.refreshScreenshot() as s:
+              s.findItemsByBitmap("icon.png")
+
+        Searching a released screenshot makes engines load it again.
+        """
         if self._ocrEngine and self._ocrEngineNotified:
             self._ocrEngine.removeScreenshot(self)
         if self._oirEngine and self._oirEngineNotified:
             if (self._ocrEngineNotified == False or
                 id(self._oirEngine) != id(self._ocrEngine)):
                 self._oirEngine.removeScreenshot(self)
-        if (type(self._screenshotRefCount) == dict and self._filename):
+        self._ocrEngineNotified = False
+        self._oirEngineNotified = False
+        if self._refCounted:
             self._screenshotRefCount[self._filename] -= 1
+            self._refCounted = False
 
     def isBlank(self):
         """
         Returns True if screenshot is blank, otherwise False.
         """
+        if self._rawImage != None:
+            image, closeImage = self._openedE4gImage()
+            try:
+                return eye4graphics.openedImageIsBlank(image) == 1
+            finally:
+                if closeImage:
+                    eye4graphics.closeImage(image)
         return _e4gImageIsBlank(self._filename)
 
     def setSize(self, screenSize):
@@ -2785,6 +4014,56 @@ class Screenshot(object):
             eye4graphics.closeImage(e4gImage)
         return self._screenSize
 
+    def _openedE4gImage(self):
+        """
+        Returns pair (eye4graphics image, closeImage). If closeImage
+        is True, the caller must close the image after use.
+        """
+        self._notifyOirEngine()
+        openedImages = getattr(self._oirEngine, "_openedImages", {})
+        if self._filename in openedImages:
+            # if possible, use already opened image object
+            return openedImages[self._filename], False
+        elif self._rawImage != None:
+            return _e4gOpenBlob(self._rawImage), True
+        else:
+            return _e4gOpenImage(self._filename), True
+
+    def _differsFrom(self, otherScreenshot):
+        """
+        Returns True if any pixel differs from otherScreenshot. Stops
+        comparing at the first difference.
+        """
+        imageA, closeA = self._openedE4gImage()
+        try:
+            imageB, closeB = otherScreenshot._openedE4gImage()
+            try:
+                if (_e4gImageDimensions(imageA) !=
+                    _e4gImageDimensions(imageB)):
+                    return True
+                bbox = _Bbox(-1, 0, 0, 0, 0)
+                return eye4graphics.findNextDiff(
+                    ctypes.byref(bbox),
+                    ctypes.c_void_p(imageA),
+                    ctypes.c_void_p(imageB),
+                    ctypes.c_double(1.0), # colorMatch
+                    ctypes.c_double(1.0), # opacityLimit
+                    None, None, 1) == 1
+            finally:
+                if closeB:
+                    eye4graphics.closeImage(imageB)
+        finally:
+            if closeA:
+                eye4graphics.closeImage(imageA)
+
+    def _inheritOirResults(self, previousScreenshot):
+        if (self._oirEngine == None or
+            previousScreenshot._oirEngine is not self._oirEngine or
+            not previousScreenshot._oirEngineNotified):
+            return
+        self._notifyOirEngine()
+        self._oirEngine.inheritFindResults(self, previousScreenshot)
+
     def _notifyOcrEngine(self):
         if self._ocrEngine and not self._ocrEngineNotified:
             self._ocrEngine.addScreenshot(self)
@@ -2823,9 +4102,35 @@ class Screenshot(object):
         """
         return self.dumpOcr(**kwargs)
 
-    def filename(self):
+    def filename(self, save=True):
+        """
+        Returns the name of the screenshot file.
+
+        Parameters:
+
+          save (boolean, optional):
+                  if True and the screenshot is kept in memory, the
+                  image is written to the file first. If False, the
+                  returned file may not exist. The default is True.
+        """
+        if save and self._rawImage != None and not self._rawImageSaved:
+            self._saveRawImage()
         return self._filename
 
+    def rawImage(self):
+        """
+        Returns (width, height, format, data) of in-memory screenshot,
+        or None if the screenshot has been read from a file.
+        """
+        return self._rawImage
+
+    def _saveRawImage(self):
+        import fmbtpng
+        width, height, fmt, data = self._rawImage
+        file(self._filename, "wb").write(
+            fmbtpng.raw2png(data, width, height, 8, fmt))
+        self._rawImageSaved = True
+
     def _findFirstMatchingBitmapCandidate(self, bitmap, **oirArgs):
         for candidate in self._paths.abspaths(bitmap):
             found = self._oirEngine.findBitmap(self, candidate, **oirArgs)
@@ -2852,7 +4157,39 @@ class Screenshot(object):
             return results
 
         else:
-            raise RuntimeError('Trying to use OIR on "%s" without OIR engine.' % (self.filename(),))
+            raise RuntimeError('Trying to use OIR on "%s" without OIR engine.' % (self.filename(save=False),))
+
+    def findItemsByBitmaps(self, listOfBitmaps, **oirFindArgs):
+        """
+        Find items matching to any of given bitmaps.
+
+        Parameters:
+
+          listOfBitmaps (list of strings):
+                  bitmaps (filenames) to be searched for.
+
+          optical image recognition arguments (optional)
+                  refer to help(obj.oirEngine()).
+
+        Returns list of lists of GUIItems: the first list contains
+        items matching to the first bitmap in listOfBitmaps, and so
+        on. Bitmaps are searched for in parallel threads, see
+        OirEngine.setFindThreads().
+        """
+        if self._oirEngine == None:
+            raise RuntimeError('Trying to use OIR on "%s" without OIR engine.' % (self.filename(save=False),))
+        self._notifyOirEngine()
+        uniqueBitmaps = []
+        for bitmap in listOfBitmaps:
+            if not bitmap in uniqueBitmaps:
+                uniqueBitmaps.append(bitmap)
+        # Call findItemsByBitmap of the class, visual log wraps
+        # instance methods and it does not log parallel calls.
+        results = _parallelMap(
+            lambda bitmap: Screenshot.findItemsByBitmap(self, bitmap, **oirFindArgs),
+            uniqueBitmaps, self._oirEngine.findThreads())
+        bitmapResults = dict(zip(uniqueBitmaps, results))
+        return [bitmapResults[bitmap] for bitmap in listOfBitmaps]
 
     def findItemsByDiff(self, image, colorMatch=1.0, limit=1, area=None):
         """
@@ -2874,15 +4211,9 @@ class Screenshot(object):
         foundItems = []
         closeImageA = False
         closeImageB = False
-        self._notifyOirEngine()
         try:
             # Open imageA and imageB for comparison
-            if (self.filename() in getattr(self._oirEngine, "_openedImages", {})):
-                # if possible, use already opened image object
-                imageA = self._oirEngine._openedImages[self.filename()]
-            else:
-                imageA = _e4gOpenImage(self.filename())
-                closeImageA = True
+            imageA, closeImageA = self._openedE4gImage()
             imageB = _e4gOpenImage(image)
             closeImageB = True
 
@@ -2948,14 +4279,9 @@ class Screenshot(object):
                   values are "adjacent" (group pixels that are next to
                   each other) and "" (no grouping). The default is "".
         """
-        self._notifyOirEngine()
-        if (self.filename() in getattr(self._oirEngine, "_openedImages", {})):
-            # if possible, use already opened image object
-            image = self._oirEngine._openedImages[self.filename()]
-            closeImage = False
-        else:
-            image = _e4gOpenImage(self.filename())
-            closeImage = True
+        if group not in ["", "adjacent"]:
+            raise ValueError('Invalid group "%s", expected "" or "adjacent".' % (group,))
+        image, closeImage = self._openedE4gImage()
         bbox = _Bbox(-1, 0, 0, 0, 0)
         color = _Rgb888(*rgb888)
         ssSize = self.size()
@@ -2965,10 +4291,59 @@ class Screenshot(object):
                                   _intCoords((area[2], area[3]), ssSize) +
                                   (0,))
         areaBbox = _Bbox(*leftTopRightBottomZero)
+        if invertMatch:
+            comp = "!="
+        else:
+            comp = "=="
+        def newItem(bbox):
+            foundColor = int(bbox.error)
+            foundRgb = (foundColor >> 16 & 0xff,
+                        foundColor >> 8 & 0xff,
+                        foundColor & 0xff)
+            return GUIItem("RGB#%.2x%.2x%.2x%s%.2x%.2x%.2x (%s)" %
+                           (rgb888 + (comp,) + foundRgb + (colorMatch,)),
+                           (bbox.left, bbox.top, bbox.right, bbox.bottom),
+                           self)
         foundItems = []
-        coord2item = {} # (x, y) -> viewItem
+        # An image opened by the OIR engine is shared with its icon
+        # searches. Reading its pixels moves the pixel buffer that
+        # partial area searches use, serialize like those searches.
+        if closeImage:
+            pixelsLock = None
+        else:
+            pixelsLock = getattr(self._oirEngine, "_partialAreaLock", None)
+        if pixelsLock:
+            pixelsLock.acquire()
         try:
-            while limit != 0:
+            if group == "adjacent":
+                # Label groups of adjacent matching pixels in a single
+                # pass over the image.
+                if limit < 0:
+                    bboxCount = _g_colorGroupBboxes
+                else:
+                    bboxCount = limit
+                while True:
+                    bboxes = (_Bbox * bboxCount)()
+                    groupCount = eye4graphics.findColorGroups(
+                        bboxes,
+                        ctypes.c_int(bboxCount),
+                        ctypes.c_void_p(image),
+                        ctypes.byref(color),
+                        ctypes.c_double(colorMatch),
+                        ctypes.c_double(1.0), # opacityLimit
+                        ctypes.c_int(invertMatch),
+                        ctypes.byref(areaBbox))
+                    if groupCount < 0:
+                        raise RuntimeError(
+                            'Reading pixels of "%s" failed.' %
+                            (self.filename(save=False),))
+                    if limit < 0 and groupCount > bboxCount:
+                        bboxCount = groupCount
+                        continue
+                    break
+                foundItems = [newItem(bbox)
+                              for bbox in bboxes[:min(groupCount, bboxCount)]]
+            while limit != 0 and not group:
                 found = eye4graphics.findNextColor(
                     ctypes.byref(bbox),
                     ctypes.c_void_p(image),
@@ -2979,62 +4354,11 @@ class Screenshot(object):
                     ctypes.byref(areaBbox))
                 if found != 1:
                     break
-                foundColor = int(bbox.error)
-                foundRgb = (foundColor >> 16 & 0xff,
-                            foundColor >> 8 & 0xff,
-                            foundColor & 0xff)
-                if invertMatch:
-                    comp = "!="
-                else:
-                    comp = "=="
-                if not group:
-                    foundItems.append(
-                        GUIItem("RGB#%.2x%.2x%.2x%s%.2x%.2x%.2x (%s)" %
-                                (rgb888 + (comp,) + foundRgb + (colorMatch,)),
-                                (bbox.left, bbox.top, bbox.right, bbox.bottom),
-                                self))
-                    limit -= 1
-                elif group == "adjacent":
-                    x = bbox.left
-                    y = bbox.top
-                    itemA = None
-                    itemB = None
-                    if (x-1, y) in coord2item:
-                        # AAAx
-                        itemA = coord2item[(x-1, y)]
-                        if itemA._bbox[2] < x: # right < x
-                            itemA._bbox = (itemA._bbox[0], itemA._bbox[1], x, itemA._bbox[3])
-                        coord2item[(x, y)] = itemA
-                    if (x, y-1) in coord2item:
-                        # BBB
-                        # x
-                        itemB = coord2item[(x, y-1)]
-                        if itemB._bbox[3] < y: # bottom < y
-                            itemB._bbox = (itemB._bbox[0], itemB._bbox[1], itemB._bbox[2], y)
-                        coord2item[(x, y)] = itemB
-                        if itemA:
-                            #    BBB
-                            # AAAx
-                            if itemB != itemA:
-                                itemB._bbox = (min(itemA._bbox[0], itemB._bbox[0]),
-                                               min(itemA._bbox[1], itemB._bbox[1]),
-                                               max(itemA._bbox[2], itemB._bbox[2]),
-                                               max(itemA._bbox[3], itemB._bbox[3]))
-                                for ax in xrange(itemA._bbox[0], itemA._bbox[2]+1):
-                                    for ay in xrange(itemA._bbox[1], itemA._bbox[3]+1):
-                                        if coord2item.get((ax, ay), None) == itemA:
-                                            coord2item[(ax, ay)] = itemB
-                                foundItems.remove(itemA)
-                                limit += 1
-                    if not itemA and not itemB:
-                        itemA = GUIItem("RGB#%.2x%.2x%.2x%s%.2x%.2x%.2x (%s)" %
-                                (rgb888 + (comp,) + foundRgb + (colorMatch,)),
-                                (bbox.left, bbox.top, bbox.right, bbox.bottom),
-                                self)
-                        limit -= 1
-                        foundItems.append(itemA)
-                        coord2item[(x, y)] = itemA
+                foundItems.append(newItem(bbox))
+                limit -= 1
         finally:
+            if pixelsLock:
+                pixelsLock.release()
             if closeImage:
                 eye4graphics.closeImage(image)
         return foundItems
@@ -3044,7 +4368,49 @@ class Screenshot(object):
             self._notifyOcrEngine()
             return self._ocrEngine.findText(self, text, **ocrEngineArgs)
         else:
-            raise RuntimeError('Trying to use OCR on "%s" without OCR engine.' % (self.filename(),))
+            raise RuntimeError('Trying to use OCR on "%s" without OCR engine.' % (self.filename(save=False),))
+
+    def _findItemsByOcrTexts(self, listOfTexts, **ocrEngineArgs):
+        if self._ocrEngine != None:
+            self._notifyOcrEngine()
+            return self._ocrEngine.findTexts(self, listOfTexts, **ocrEngineArgs)
+        else:
+            raise RuntimeError('Trying to use OCR on "%s" without OCR engine.' % (self.filename(save=False),))
+
+    def findItemsByOcrMany(self, texts, **ocrEngineArgs):
+        """
+        Find many texts using OCR. Texts that need the same OCR pass
+        are searched for from the same OCR results, each pass is run
+        only once.
+
+        Parameters:
+
+          texts (list):
+                  texts to be searched for. Items are either strings,
+                  or (text, ocrArgs) pairs where ocrArgs is a
+                  dictionary of OCR engine arguments for that text
+                  only.
+
+          OCR engine specific arguments
+                  common for all texts, refer to help(obj.ocrEngine())
+
+        Returns dictionary text -> list of GUIItems. If the same
+        text is given more than once, the last query determines the
+        result.
+        """
+        if self._ocrEngine == None:
+            raise RuntimeError('Trying to use OCR on "%s" without OCR engine.' % (self.filename(save=False),))
+        queries = []
+        for text in texts:
+            if isinstance(text, basestring):
+                textArgs = {}
+            else:
+                text, textArgs = text
+            ocrArgs = dict(ocrEngineArgs)
+            ocrArgs.update(textArgs)
+            queries.append((text, text, ocrArgs))
+        self._notifyOcrEngine()
+        return self._ocrEngine.findTextsMany(self, queries)
 
     def findItemsByHcr(self, xRes=24, yRes=24, threshold=0.1):
         """
@@ -3053,14 +4419,15 @@ class Screenshot(object):
         Experimental. See if it finds regions that could be
         interacted with.
         """
-        ppFilename = "%s-hcrpp.png" % (self.filename(),)
-        _convert(self.filename(),
-                 ["-colorspace", "gray", "-depth", "3"],
-                 ppFilename)
+        if self._rawImage != None:
+            image = _e4gOpenBlob(self._rawImage)
+        else:
+            image = _e4gOpenImage(self.filename())
+        image = eyenfinger._applyImageOps(
+            image, [("grayscale",), ("depth", 3)])
         bbox = _Bbox(0, 0, 0, 0, 0)
         foundItems = []
         try:
-            image = _e4gOpenImage(ppFilename)
             while True:
                 if eye4graphics.findNextHighErrorBlock(ctypes.byref(bbox), image, xRes, yRes, threshold, 0) == 0:
                     break
@@ -3083,18 +4450,11 @@ class Screenshot(object):
 
         Returns tuple of integers: (red, green, blue).
         """
-        self._notifyOirEngine()
         xsize, ysize = self.size()
         x, y = _intCoords((x, y), (xsize, ysize))
         if not (0 <= x < xsize and 0 <= y < ysize):
             raise ValueError("invalid coordinates (%s, %s)" % (x, y))
-        if (self.filename() in getattr(self._oirEngine, "_openedImages", {})):
-            # if possible, use already opened image object
-            image = self._oirEngine._openedImages[self.filename()]
-            closeImage = False
-        else:
-            image = _e4gOpenImage(self.filename())
-            closeImage = True
+        image, closeImage = self._openedE4gImage()
         try:
             color = _Rgb888(0, 0, 0)
             v = eye4graphics.rgb888at(ctypes.byref(color),
@@ -3135,7 +4495,7 @@ class Screenshot(object):
           fileOrDirName (string):
                   name of the destination file or directory.
         """
-        shutil.copy(self._filename, fileOrDirName)
+        shutil.copy(self.filename(), fileOrDirName)
 
     def crop(self, area):
         """
@@ -3156,7 +4516,7 @@ class Screenshot(object):
         x2, y2 = _intCoords((right, bottom), self.size())
         cropCoords = "%sx%s+%s+%s" % (x2-x1, y2-y1, x1, y1)
         croppedFilename = self._filename + "-crop_%s.png" % (cropCoords,)
-        _convert(self._filename, ["-crop", cropCoords], croppedFilename)
+        _convert(self.filename(), ["-crop", cropCoords], croppedFilename)
         return Screenshot(croppedFilename, self._paths, self._ocrEngine,
                           self._oirEngine, self._screenshotRefCount)
 
@@ -3165,7 +4525,7 @@ class Screenshot(object):
         Return horizontally flopped copy of the screenshot.
         """
         resultFilename = self._filename + "-flop.png"
-        _convert(self._filename, ["-flop"], resultFilename)
+        _convert(self.filename(), ["-flop"], resultFilename)
         return Screenshot(resultFilename, self._paths, self._ocrEngine,
                           self._oirEngine, self._screenshotRefCount)
 
@@ -3174,7 +4534,7 @@ class Screenshot(object):
         Return vertically flipped copy of the screenshot.
         """
         resultFilename = self._filename + "-flip.png"
-        _convert(self._filename, ["-flip"], resultFilename)
+        _convert(self.filename(), ["-flip"], resultFilename)
         return Screenshot(resultFilename, self._paths, self._ocrEngine,
                           self._oirEngine, self._screenshotRefCount)
 
@@ -3191,6 +4551,8 @@ class GUIItem(object):
     """
     GUIItem holds the information of a single GUI item.
     """
+    __slots__ = ("_name", "_bbox", "_bitmap", "_screenshot",
+                 "_ocrFind", "_ocrFound")
     def __init__(self, name, bbox, screenshot, bitmap=None, ocrFind=None, ocrFound=None):
         self._name = name
         if screenshot and hasattr(screenshot, "size"):
@@ -3203,6 +4565,17 @@ class GUIItem(object):
         self._screenshot = screenshot
         self._ocrFind = ocrFind
         self._ocrFound = ocrFound
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for attr in getattr(cls, "__slots__", ()):
+                if hasattr(self, attr):
+                    state[attr] = getattr(self, attr)
+        state.update(getattr(self, "__dict__", {}))
+        return state
+    def __setstate__(self, state):
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
     def bbox(self): return self._bbox
     def name(self): return self._name
     def coords(self):
@@ -3222,6 +4595,141 @@ class GUIItem(object):
         return ('GUIItem("%s", bbox=%s%s)'  % (
                 self.name(), self.bbox(), extras))
 
+class ViewIndex(object):
+    """
+    ViewIndex speeds up searching for items in a View. Lookup tables
+    are built when they are needed for the first time:
+
+    - find(keyName, value) looks up items by exact value of a key,
+      for instance text, id or class name.
+
+    - findMatching(keyName, predicate) tests every distinct value
+      of a key only once.
+
+    - findByPos and findInRegion search items from grid cells.
+
+    All methods return items in the order they were given to the
+    index.
+    """
+    def __init__(self, items, keys, cellSize=None):
+        """
+        Parameters:
+
+          items (list of GUIItems):
+                  items to be indexed, in view order.
+
+          keys (dictionary):
+                  key name -> function that returns the hashable
+                  value of the key for an item.
+
+          cellSize (integer, optional):
+                  width and height of grid cells in pixels. The
+                  default is 64.
+        """
+        self._items = list(items)
+        self._keys = keys
+        if cellSize == None:
+            cellSize = _g_viewIndexCellSize
+        self._cellSize = cellSize
+        self._order = None # id(item) -> position in self._items
+        self._tables = {} # key name -> {value -> [item, ...]}
+        self._grid = None # (column, row) -> [item, ...]
+        self._largeItems = None # items that cover too many cells
+
+    def _ordered(self, items):
+        if self._order == None:
+            self._order = dict((id(item), index)
+                               for index, item in enumerate(self._items))
+        order = self._order
+        return sorted(items, key=lambda item: order[id(item)])
+
+    def _table(self, keyName):
+        if not keyName in self._tables:
+            keyFunc = self._keys[keyName]
+            table = {}
+            for item in self._items:
+                value = keyFunc(item)
+                if value in table:
+                    table[value].append(item)
+                else:
+                    table[value] = [item]
+            self._tables[keyName] = table
+        return self._tables[keyName]
+
+    def find(self, keyName, value):
+        """
+        Returns items whose keyName value equals value. keyName can
+        be a tuple of key names, then items that match any of them
+        are returned.
+        """
+        if isinstance(keyName, tuple):
+            found = {}
+            for k in keyName:
+                for item in self._table(k).get(value, ()):
+                    found[id(item)] = item
+            return self._ordered(found.values())
+        return list(self._table(keyName).get(value, ()))
+
+    def findMatching(self, keyName, predicate):
+        """
+        Returns items whose keyName value satisfies predicate.
+        """
+        found = []
+        for value, items in self._table(keyName).iteritems():
+            if predicate(value):
+                found.extend(items)
+        return self._ordered(found)
+
+    def _buildGrid(self):
+        self._grid = {}
+        self._largeItems = []
+        cellSize = self._cellSize
+        for item in self._items:
+            left, top, right, bottom = item.bbox()
+            columns = xrange(int(left) // cellSize, int(right) // cellSize + 1)
+            rows = xrange(int(top) // cellSize, int(bottom) // cellSize + 1)
+            if len(columns) * len(rows) > _g_viewIndexMaxCells:
+                self._largeItems.append(item)
+                continue
+            for column in columns:
+                for row in rows:
+                    self._grid.setdefault((column, row), []).append(item)
+
+    def findByPos(self, pos):
+        """
+        Returns items whose bounding box contains pos (x, y).
+        """
+        if self._grid == None:
+            self._buildGrid()
+        x, y = pos
+        candidates = self._grid.get(
+            (int(x) // self._cellSize, int(y) // self._cellSize), [])
+        return self._ordered(
+            [item for item in candidates + self._largeItems
+             if (item.bbox()[0] <= x <= item.bbox()[2] and
+                 item.bbox()[1] <= y <= item.bbox()[3])])
+
+    def findInRegion(self, bbox):
+        """
+        Returns items whose bounding box is within bbox (left, top,
+        right, bottom).
+        """
+        if self._grid == None:
+            self._buildGrid()
+        left, top, right, bottom = bbox
+        cellSize = self._cellSize
+        found = {}
+        for column in xrange(int(left) // cellSize, int(right) // cellSize + 1):
+            for row in xrange(int(top) // cellSize, int(bottom) // cellSize + 1):
+                for item in self._grid.get((column, row), ()):
+                    found[id(item)] = item
+        for item in self._largeItems:
+            found[id(item)] = item
+        return self._ordered(
+            [item for item in found.itervalues()
+             if (left <= item.bbox()[0] <= item.bbox()[2] <= right and
+                 top <= item.bbox()[1] <= item.bbox()[3] <= bottom)])
+
 class _VisualLog:
     def __init__(self, device, outFileObj,
                  screenshotWidth, thumbnailWidth,
@@ -3266,7 +4774,7 @@ class _VisualLog:
                  'tapBitmap', 'tapId', 'tapItem', 'tapOcrText',
                  'tapText', 'topApp', 'topWindow', 'type',
                  'uninstall',
-                 'verifyOcrText', 'verifyText', 'verifyBitmap',
+                 'verifyOcrText', 'verifyOcrTexts', 'verifyText', 'verifyBitmap',
                  'waitAnyBitmap', 'waitBitmap', 'waitOcrText',
                  'waitScreenUpdated', 'waitText']
 
@@ -3679,8 +5187,11 @@ initializejQuery(function() {
             if retval != None:
                 retval._logCallReturnValue = logCallReturnValue
                 loggerSelf.logReturn(retval, img=retval, tip=origMethod.func_name)
-                retval.findItemsByBitmap = loggerSelf.findItemsByBitmapLogger(retval.findItemsByBitmap, retval)
-                retval.findItemsByOcr = loggerSelf.findItemsByOcrLogger(retval.findItemsByOcr, retval)
+                # Wrappers refer to the screenshot weakly, otherwise
+                # the screenshot would be released only by gc.
+                screenshotRef = weakref.ref(retval)
+                retval.findItemsByBitmap = loggerSelf.findItemsByBitmapLogger(retval.findItemsByBitmap.im_func, screenshotRef)
+                retval.findItemsByOcr = loggerSelf.findItemsByOcrLogger(retval.findItemsByOcr.im_func, screenshotRef)
             else:
                 loggerSelf.logReturn(retval, tip=origMethod.func_name)
             return retval
@@ -3700,8 +5211,9 @@ initializejQuery(function() {
             return retval
         return tapWRAP
 
-    def findItemsByBitmapLogger(loggerSelf, origMethod, screenshotObj):
+    def findItemsByBitmapLogger(loggerSelf, origMethod, screenshotRef):
         def findItemsByBitmapWRAP(*args, **kwargs):
+            screenshotObj = screenshotRef()
             bitmap = args[0]
             absPathBitmap = screenshotObj._paths.abspaths(bitmap)[0]
             if loggerSelf._copyBitmapsToScreenshotDir:
@@ -3727,7 +5239,7 @@ initializejQuery(function() {
                     absPathBitmap = screenshotDirBitmap
 
             loggerSelf.logCall(img=absPathBitmap)
-            retval = loggerSelf.doCallLogException(origMethod, args, kwargs)
+            retval = loggerSelf.doCallLogException(origMethod, (screenshotObj,) + args, kwargs)
             if len(retval) == 0:
                 loggerSelf.logReturn("not found in", img=screenshotObj, tip=origMethod.func_name)
             else:
@@ -3739,10 +5251,11 @@ initializejQuery(function() {
             return retval
         return findItemsByBitmapWRAP
 
-    def findItemsByOcrLogger(loggerSelf, origMethod, screenshotObj):
+    def findItemsByOcrLogger(loggerSelf, origMethod, screenshotRef):
         def findItemsByOcrWRAP(*args, **kwargs):
+            screenshotObj = screenshotRef()
             loggerSelf.logCall()
-            retval = loggerSelf.doCallLogException(origMethod, args, kwargs)
+            retval = loggerSelf.doCallLogException(origMethod, (screenshotObj,) + args, kwargs)
             if len(retval) == 0:
                 loggerSelf.logReturn("not found in words " + str(screenshotObj.dumpOcrWords()),
                                      img=screenshotObj, tip=origMethod.func_name)
@@ -21,6 +21,7 @@ This is library implements fMBT GUITestInterface for VNC.
 import fmbt
 import fmbtgti
 
+import threading
 import time
 
 import twisted.python.log
@@ -89,6 +90,11 @@ class VNCConnection(fmbtgti.GUITestConnection):
         fmbtgti.GUITestConnection.__init__(self)
         self._updatedImage = None
         self._firstScreenshot = True
+        self._autoUpdate = autoUpdate
+        # screenUpdated is set when the VNC server sends updated
+        # graphics after the latest screenshot
+        self._screenUpdated = threading.Event()
+        self._screenUpdated.set()
         if ":" in hostspec: # host:vncdisplay
             self._host, display = hostspec.split(":",1)
             try: self._port = 5900 + int(display)
@@ -111,7 +117,6 @@ class VNCConnection(fmbtgti.GUITestConnection):
         if hasattr(self.client, "start"):
             self.client.start()
         else:
-            import threading
             self.client.thread = threading.Thread(
                 target=reactor.run, name='Twisted',
                 kwargs={'installSignalHandlers': False})
@@ -162,6 +167,7 @@ class VNCConnection(fmbtgti.GUITestConnection):
         return True
 
     def recvScreenshot(self, filename, retry=3):
+        self._screenUpdated.clear()
         if self._updatedImage:
             self._updatedImage.save(filename)
         else:
@@ -175,6 +181,13 @@ class VNCConnection(fmbtgti.GUITestConnection):
         self._firstScreenshot = False
         return True
 
+    def recvScreenUpdated(self, waitTime, pollDelay):
+        if not self._autoUpdate:
+            return None # no incremental updates from the server
+        # Event.wait returns None instead of the flag in Python 2.6
+        self._screenUpdated.wait(waitTime)
+        return self._screenUpdated.isSet()
+
     def target(self):
         return "VNC-" + self._host + "-" + str(self._port)
 
@@ -185,6 +198,7 @@ def _continuousIncrementalUpdateWatch(client, conn):
     client.continuousIncrementalUpdateRequest(conn)
 
 def _continuousIncrementalUpdateRequest(self, conn):
+    self._fmbtConn = conn
     self.framebufferUpdateRequest(incremental=1)
     self.deferred = Deferred()
     self.deferred.addCallback(self.continuousIncrementalUpdateSave, conn)
@@ -199,3 +213,18 @@ vncdotool.client.VNCDoToolClient.continuousIncrementalUpdateRequest = \
   _continuousIncrementalUpdateRequest
 vncdotool.client.VNCDoToolClient.continuousIncrementalUpdateSave = \
   _continuousIncrementalUpdateSave
+
+def _notifyScreenUpdated(origMethod):
+    def notifyingMethod(self, *args, **kwargs):
+        rv = origMethod(self, *args, **kwargs)
+        conn = getattr(self, "_fmbtConn", None)
+        if conn != None:
+            conn._screenUpdated.set()
+        return rv
+    return notifyingMethod
+
+# Every rectangle in incremental updates means that screen has changed
+for _methodName in ["updateRectangle", "copyRectangle", "fillRectangle"]:
+    if hasattr(vncdotool.client.VNCDoToolClient, _methodName):
+        setattr(vncdotool.client.VNCDoToolClient, _methodName,
+                _notifyScreenUpdated(getattr(vncdotool.client.VNCDoToolClient, _methodName)))
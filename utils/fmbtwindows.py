@@ -460,6 +460,7 @@ class View(object):
         self._rootItem = None
         self._rootItems = []
         self._viewItems = {}
+        self._index = None # fmbtgti.ViewIndex, built when first needed
         self._device = device
         self._freeDumps = freeDumps
         if itemOnScreen == None:
@@ -504,6 +505,7 @@ class View(object):
             self._dumpFilename,
             elt)
         self._viewItems[int(elt["hash"])] = vi
+        self._index = None
         if not vi.parent():
             self._rootItem = vi
             self._rootItems.append(vi)
@@ -531,6 +533,33 @@ class View(object):
     def filename(self):
         return self._dumpFilename
 
+    def index(self):
+        """
+        Returns fmbtgti.ViewIndex of all items in the view. Searches
+        from all items (no searchRootItem or searchItems) use the
+        index.
+        """
+        if self._index == None:
+            self._index = fmbtgti.ViewIndex(self._viewItems.values(), {
+                "text": lambda item: item._text,
+                "id": lambda item: item._itemId,
+                "automationId": lambda item: item.properties().get("AutomationId", None),
+                "class": lambda item: item._className})
+        return self._index
+
+    def _findIndexedItems(self, items, count, onScreen):
+        """
+        Returns items found from the index, limited like in findItems.
+        """
+        foundItems = []
+        if count == 0: return foundItems
+        for i in items:
+            if not onScreen or self._itemOnScreen(i):
+                foundItems.append(i)
+                if count > 0 and len(foundItems) >= count:
+                    break
+        return foundItems
+
     def rootItem(self):
         return self._rootItem
 
@@ -579,6 +608,12 @@ class View(object):
         return foundItems
 
     def findItemsByText(self, text, partial=False, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems:
+            if partial:
+                items = self.index().findMatching("text", lambda t: text in t)
+            else:
+                items = self.index().find("text", text)
+            return self._findIndexedItems(items, count, onScreen)
         if partial:
             c = lambda item: (text in item._text)
         else:
@@ -586,6 +621,13 @@ class View(object):
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
     def findItemsByClass(self, className, partial=False, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems:
+            if partial:
+                items = self.index().findMatching(
+                    "class", lambda c: className in c)
+            else:
+                items = self.index().find("class", className)
+            return self._findIndexedItems(items, count, onScreen)
         if partial:
             c = lambda item: (className in item._className)
         else:
@@ -593,6 +635,10 @@ class View(object):
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
     def findItemsById(self, itemId, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems:
+            return self._findIndexedItems(
+                self.index().find(("id", "automationId"), itemId),
+                count, onScreen)
         c = lambda item: (itemId == item._itemId or itemId == item.properties().get("AutomationId", None))
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
@@ -632,12 +678,44 @@ class View(object):
         or may not be from the same branch in the widget hierarchy.
         """
         x, y = self._intCoords(pos)
-        c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
-        items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
+        if searchRootItem == None and not searchItems:
+            items = self._findIndexedItems(
+                self.index().findByPos((x, y)), count, onScreen)
+        else:
+            c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
         # sort from smallest to greatest area
         area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
         return [i for _, i in sorted(area_items)]
 
+    def findItemsInRegion(self, bbox, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        """
+        Returns list of ViewItems whose bounding box is within the region.
+
+        Parameters:
+
+          bbox (four-tuple of integers):
+                  bounding box that specifies search region
+                  (left, top, right, bottom).
+
+          other parameters: refer to findItems documentation.
+
+        Returned items are listed in ascending order based on area.
+        """
+        left, top = self._intCoords((bbox[0], bbox[1]))
+        right, bottom = self._intCoords((bbox[2], bbox[3]))
+        if searchRootItem == None and not searchItems:
+            items = self._findIndexedItems(
+                self.index().findInRegion((left, top, right, bottom)),
+                count, onScreen)
+        else:
+            c = lambda item: (left <= item.bbox()[0] <= item.bbox()[2] <= right and
+                              top <= item.bbox()[1] <= item.bbox()[3] <= bottom)
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem,
+                                   searchItems=searchItems, onScreen=onScreen)
+        area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
+        return [i for _, i in sorted(area_items)]
+
     def items(self):
         """
         Returns list of all items in the view
@@ -1989,9 +2067,7 @@ class WindowsConnection(fmbtgti.GUITestConnection):
             # use glob output as it is
             return filepaths
 
-    def recvScreenshot(self, filename, screenshotSize=(None, None)):
-        ppmfilename = filename + ".ppm"
-
+    def _recvScreenshotRGB(self, screenshotSize):
         if screenshotSize == (None, None):
             screenshotSize = self._screenshotSize
 
@@ -2001,6 +2077,16 @@ class WindowsConnection(fmbtgti.GUITestConnection):
         data = zlib.decompress(zdata)
 
         fmbtgti.eye4graphics.wbgr2rgb(data, width, height)
+        return width, height, data
+
+    def recvScreenshotRaw(self, screenshotSize=(None, None)):
+        width, height, data = self._recvScreenshotRGB(screenshotSize)
+        return (width, height, "RGB", data[:width * height * 3])
+
+    def recvScreenshot(self, filename, screenshotSize=(None, None)):
+        ppmfilename = filename + ".ppm"
+
+        width, height, data = self._recvScreenshotRGB(screenshotSize)
         if fmbtpng != None:
             file(filename, "wb").write(
                 fmbtpng.raw2png(data, width, height, 8, "RGB"))
@@ -117,6 +117,7 @@ class View(object):
         self._itemTree = itemTree
         self._rootItem = None
         self._viewItems = {}
+        self._index = None # fmbtgti.ViewIndex, built when first needed
         if itemOnScreen == None:
             self._itemOnScreen = lambda item: True
         else:
@@ -149,6 +150,33 @@ class View(object):
     def filename(self):
         return self._dumpFilename
 
+    def index(self):
+        """
+        Returns fmbtgti.ViewIndex of all items in the view. Searches
+        from all items (no searchRootItem or searchItems) use the
+        index.
+        """
+        if self._index == None:
+            self._index = fmbtgti.ViewIndex(self._viewItems.values(), {
+                "text": lambda item: item._text,
+                "id": lambda item: item._itemId,
+                "automationId": lambda item: item.properties().get("AutomationId", None),
+                "class": lambda item: item._className})
+        return self._index
+
+    def _findIndexedItems(self, items, count, onScreen):
+        """
+        Returns items found from the index, limited like in findItems.
+        """
+        foundItems = []
+        if count == 0: return foundItems
+        for i in items:
+            if not onScreen or self._itemOnScreen(i):
+                foundItems.append(i)
+                if count > 0 and len(foundItems) >= count:
+                    break
+        return foundItems
+
     def rootItem(self):
         return self._rootItem
 
@@ -196,6 +224,9 @@ class View(object):
         return foundItems
 
     def findItemsByText(self, text, partial=False, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems and not partial:
+            return self._findIndexedItems(
+                self.index().find("text", text), count, onScreen)
         if partial:
             c = lambda item: (text in item._text or text in item.properties()["name"])
         else:
@@ -203,6 +234,13 @@ class View(object):
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
     def findItemsByClass(self, className, partial=False, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems:
+            if partial:
+                items = self.index().findMatching(
+                    "class", lambda c: className in c)
+            else:
+                items = self.index().find("class", className)
+            return self._findIndexedItems(items, count, onScreen)
         if partial:
             c = lambda item: (className in item._className)
         else:
@@ -210,6 +248,10 @@ class View(object):
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
     def findItemsById(self, itemId, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        if searchRootItem == None and not searchItems:
+            return self._findIndexedItems(
+                self.index().find(("id", "automationId"), itemId),
+                count, onScreen)
         c = lambda item: (itemId == item._itemId or itemId == item.properties().get("AutomationId", None))
         return self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
 
@@ -245,12 +287,44 @@ class View(object):
         or may not be from the same branch in the widget hierarchy.
         """
         x, y = self._intCoords(pos)
-        c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
-        items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
+        if searchRootItem == None and not searchItems:
+            items = self._findIndexedItems(
+                self.index().findByPos((x, y)), count, onScreen)
+        else:
+            c = lambda item: (item.bbox()[0] <= x <= item.bbox()[2] and item.bbox()[1] <= y <= item.bbox()[3])
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem, searchItems=searchItems, onScreen=onScreen)
         # sort from smallest to greatest area
         area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
         return [i for _, i in sorted(area_items)]
 
+    def findItemsInRegion(self, bbox, count=-1, searchRootItem=None, searchItems=None, onScreen=False):
+        """
+        Returns list of ViewItems whose bounding box is within the region.
+
+        Parameters:
+
+          bbox (four-tuple of integers):
+                  bounding box that specifies search region
+                  (left, top, right, bottom).
+
+          other parameters: refer to findItems documentation.
+
+        Returned items are listed in ascending order based on area.
+        """
+        left, top = self._intCoords((bbox[0], bbox[1]))
+        right, bottom = self._intCoords((bbox[2], bbox[3]))
+        if searchRootItem == None and not searchItems:
+            items = self._findIndexedItems(
+                self.index().findInRegion((left, top, right, bottom)),
+                count, onScreen)
+        else:
+            c = lambda item: (left <= item.bbox()[0] <= item.bbox()[2] <= right and
+                              top <= item.bbox()[1] <= item.bbox()[3] <= bottom)
+            items = self.findItems(c, count=count, searchRootItem=searchRootItem,
+                                   searchItems=searchItems, onScreen=onScreen)
+        area_items = [((i.bbox()[2] - i.bbox()[0]) * (i.bbox()[3] - i.bbox()[1]), i) for i in items]
+        return [i for _, i in sorted(area_items)]
+
     def items(self):
         """
         Returns list of all items in the view
@@ -403,21 +477,34 @@ class X11Connection(fmbtx11_conn.Display):
     def recvAtspiViewData(self, window):
         return fmbtx11_conn.atspiViewData(window)
 
+    def _parseRawX11Screenshot(self, data):
+        try:
+            header, zdata = data.split('\n', 1)
+            width, height, depth, bpp = [int(n) for n in header.split()[1:]]
+            data = zlib.decompress(zdata)
+        except Exception, e:
+            raise FMBTX11Error("Corrupted screenshot data: %s" % (e,))
+
+        if len(data) != width * height * 4:
+            raise FMBTX11Error("Image data size mismatch.")
+        return width, height, data
+
+    def recvScreenshotRaw(self):
+        data = fmbtx11_conn.Display.recvScreenshot(self, "FMBTRAWX11")
+        if data and data.startswith("FMBTRAWX11 "):
+            if data.split(" ", 5)[4].split("\n", 1)[0] != "32":
+                return None # only 32 bits per pixel is supported
+            width, height, data = self._parseRawX11Screenshot(data)
+            return (width, height, "BGR_", data)
+        return None
+
     def recvScreenshot(self, filename):
         # This is a hack to get this stack quickly testable,
         # let's replace this with Xlib/libMagick functions, too...
         data = fmbtx11_conn.Display.recvScreenshot(self, "PNG")
         if data:
             if data.startswith("FMBTRAWX11"):
-                try:
-                    header, zdata = data.split('\n', 1)
-                    width, height, depth, bpp = [int(n) for n in header.split()[1:]]
-                    data = zlib.decompress(zdata)
-                except Exception, e:
-                    raise FMBTX11Error("Corrupted screenshot data: %s" % (e,))
-
-                if len(data) != width * height * 4:
-                    raise FMBTX11Error("Image data size mismatch.")
+                width, height, data = self._parseRawX11Screenshot(data)
 
                 fmbtgti.eye4graphics.bgrx2rgb(data, width, height)
                 ppm_header = "P6\n%d %d\n%d\n" % (width, height, 255)
@@ -23,7 +23,9 @@ Xtst and taking screenshots with XGetImage.
 import ctypes
 import getpass
 import os
+import select
 import subprocess
+import time
 import zlib
 
 try:
@@ -42,6 +44,11 @@ _g_current_user = getpass.getuser()
 
 libX11 = ctypes.CDLL("libX11.so.6")
 libXtst = ctypes.CDLL("libXtst.so.6")
+try:
+    # XDamage is optional, it is used for detecting screen updates
+    libXdamage = ctypes.CDLL("libXdamage.so.1")
+except OSError:
+    libXdamage = None
 
 class XImage(ctypes.Structure):
     _fields_ = [
@@ -117,6 +124,25 @@ libX11.XFetchName.argtypes = [
     ctypes.c_void_p] # window_name_return
 libX11.XFetchName.restype = ctypes.c_int
 
+libX11.XConnectionNumber.argtypes = [ctypes.c_void_p]
+libX11.XConnectionNumber.restype = ctypes.c_int
+
+libX11.XPending.argtypes = [ctypes.c_void_p]
+libX11.XPending.restype = ctypes.c_int
+
+libX11.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+
+libX11.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+
+if libXdamage:
+    libXdamage.XDamageQueryExtension.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]
+    libXdamage.XDamageQueryExtension.restype = ctypes.c_int
+    libXdamage.XDamageCreate.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int]
+    libXdamage.XDamageCreate.restype = ctypes.c_ulong
+    libXdamage.XDamageDestroy.argtypes = [ctypes.c_void_p, ctypes.c_ulong]
+
 libXtst.XTestFakeKeyEvent.argtypes = [
     ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_ulong]
 libXtst.XTestFakeButtonEvent.argtypes = [
@@ -131,6 +157,11 @@ _X_CurrentTime  = ctypes.c_ulong(0)
 _X_False        = ctypes.c_int(0)
 _X_True         = ctypes.c_int(1)
 _X_ZPixmap      = ctypes.c_int(2)
+_XDamageNotify  = 0 # added to damage event base
+_XDamageReportRawRectangles = 0
+
+# XEvent is a union padded to 24 longs
+_XEvent = ctypes.c_long * 24
 
 class Display(object):
     def __init__(self, display=""):
@@ -200,10 +231,37 @@ class Display(object):
             u'å': "aring", u'ä': "adiaeresis", u'ö': "odiaeresis",
             u'Å': "Aring", u'Ä': "Adiaeresis", u'Ö': "Odiaeresis"}
 
+        # Screen updates are tracked with XDamage, if available.
+        self._damage = None
+        self._damageEvent = None
+        self._damaged = True
+        if libXdamage:
+            eventBase = ctypes.c_int(0)
+            errorBase = ctypes.c_int(0)
+            if libXdamage.XDamageQueryExtension(self._display,
+                                                ctypes.byref(eventBase),
+                                                ctypes.byref(errorBase)):
+                self._damageEvent = eventBase.value + _XDamageNotify
+                self._damage = libXdamage.XDamageCreate(
+                    self._display, self._root_window,
+                    _XDamageReportRawRectangles)
+                libX11.XFlush(self._display)
+
     def __del__(self):
         if self._display:
+            if self._damage:
+                libXdamage.XDamageDestroy(self._display, self._damage)
             libX11.XCloseDisplay(self._display)
 
+    def _readDamageEvents(self):
+        """Read pending events, return True if the screen is damaged"""
+        event = _XEvent()
+        while libX11.XPending(self._display) > 0:
+            libX11.XNextEvent(self._display, ctypes.byref(event))
+            if ctypes.cast(event, ctypes.POINTER(ctypes.c_int))[0] == self._damageEvent:
+                self._damaged = True
+        return self._damaged
+
     def _typeChar(self, origChar, press=True, release=True, modifiers=[]):
         _modifiers = [libX11.XKeysymToKeycode(
             self._display, libX11.XStringToKeysym(c)) for c in modifiers]
@@ -364,6 +422,12 @@ class Display(object):
         return windows
 
     def recvScreenshot(self, fmt="FMBTRAWX11"):
+        if self._damage:
+            # Forget damage before the screenshot, later events tell
+            # that the screen differs from this screenshot.
+            libX11.XSync(self._display, _X_False)
+            self._readDamageEvents()
+            self._damaged = False
         image_p = libX11.XGetImage(self._display, self._root_window,
                                    0, 0, self._width, self._height,
                                    _X_AllPlanes, _X_ZPixmap)
@@ -389,7 +453,23 @@ class Display(object):
         return compressed_image
 
     def recvScreenUpdated(self, waitTime, pollDelay):
-        return None # optimization not implemented
+        """Wait for XDamage events on the root window.
+
+        Returns True if the screen has been updated after the latest
+        screenshot, False if not updated within waitTime, and None if
+        XDamage is not available.
+        """
+        if not self._damage:
+            return None # optimization not available
+        endTime = time.time() + waitTime
+        fd = libX11.XConnectionNumber(self._display)
+        libX11.XFlush(self._display)
+        while not self._readDamageEvents():
+            timeLeft = endTime - time.time()
+            if timeLeft <= 0:
+                return False
+            select.select([fd], [], [], timeLeft)
+        return True
 
 def shellSOE(command, username, asyncStatus, asyncOut, asyncError, usePty):
     """run command as user, return (success, (exit status, output, error))"""
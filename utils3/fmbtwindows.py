@@ -1917,22 +1917,32 @@ class WindowsConnection(fmbtgti.GUITestConnection):
     def evalPython(self, code):
         return self._agent.eval_in(self._agent_ns, code)
 
+    def _agentSendsRawBytes(self):
+        # python3share "raw" codec sends bytes return values as they
+        # are. Without it they would be pickled with protocol 2 that
+        # inflates binary data more than base64.
+        codecs = getattr(self._agent, "codecs", None)
+        return codecs == None or "raw" in codecs()
+
     def recvFile(self, remoteFilename, localFilename=None, compress=False):
+        if self._agentSendsRawBytes():
+            encode, decode = "%s", lambda data: data
+        else:
+            encode, decode = "base64.b64encode(%s)", base64.b64decode
         if compress:
             if isinstance(compress, int):
                 compressLevel = compress
             else:
                 compressLevel = 3
-            data_b64_z = self._agent.eval_in(
+            data_z = self._agent.eval_in(
                 self._agent_ns,
-                "base64.b64encode(zlib.compress(open(%s, 'rb').read(), %s))" % (
-                    repr(remoteFilename), compressLevel))
-            data = zlib.decompress(base64.b64decode(data_b64_z))
+                encode % ("zlib.compress(open(%s, 'rb').read(), %s)" % (
+                    repr(remoteFilename), compressLevel),))
+            data = zlib.decompress(decode(data_z))
         else:
-            data_b64 = self._agent.eval_in(
+            data = decode(self._agent.eval_in(
                 self._agent_ns,
-                "base64.b64encode(open(%s, 'rb').read())" % (repr(remoteFilename),))
-            data = base64.b64decode(data_b64)
+                encode % ("open(%s, 'rb').read()" % (repr(remoteFilename),),)))
         if localFilename:
             open(localFilename, "wb").write(data)
             return True